@@ -5,20 +5,26 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_attitude_controller.py
-Functions      imu_callback,drone_command_callback,setpoint_callback,gps_callback,reset,pid
+Functions      imu_callback,state_callback,drone_command_callback,setpoint_callback,gps_callback,control_step,publish_loop_stats,reset,pid
 Global Variables None
 
 
 PID attitude controller of the drone
 
 This python file runs a ROS-node of name attitude_control which controls the roll pitch and yaw angles of the eDrone.
+The pid runs when a new IMU message arrives (~control_mode:=imu, default) or on a timer (~control_mode:=timer),
+in both cases at most ~control_rate times a second (default 50 Hz, 0 runs on every IMU message in imu mode) and
+never twice on the same IMU data. Loop timing is published on /edrone/attitude_controller/loop_stats every
+~stats_period seconds.
+With /state_source:=estimator the attitude comes from /edrone/state (Task_6_VD_2373_state_estimator), already
+as roll, pitch & yaw, instead of /edrone/imu/data; ~control_mode:=imu then runs the pid on its messages.
 This node publishes and subsribes the following topics:
-        PUBLICATIONS            SUBSCRIPTIONS
-        /roll_error             /pid_tuning_altitude
-        /pitch_error            /pid_tuning_pitch
-        /yaw_error              /pid_tuning_roll
-        /edrone/pwm             /edrone/imu/data
-                                /edrone/drone_command
+        PUBLICATIONS                                SUBSCRIPTIONS
+        /roll_error                                 /pid_tuning_altitude
+        /pitch_error                                /pid_tuning_pitch
+        /yaw_error                                  /pid_tuning_roll
+        /edrone/pwm                                 /edrone/imu/data (or /edrone/state)
+        /edrone/attitude_controller/loop_stats      /edrone/drone_command
 
 
 """
@@ -32,6 +38,9 @@ import tf
 
 # util functions
 from Task_6_VD_2373_utils import *
+from Task_6_VD_2373_pid import PID
+from Task_6_VD_2373_loop_stats import LoopStats
+from Task_6_VD_2373_state_estimator import STATE_TOPIC, state_source
 
 
 # from pid_tune.msg import PidTune
@@ -76,27 +85,36 @@ class Edrone:
 
         # initial setting of Kp, Kd and ki for [roll, pitch, yaw]. eg: self.Kp[2] corresponds to Kp value in yaw axis
         # after tuning and computing corresponding PID parameters, change the parameters
+        # Gains are for the real dt of the PID. The old pid summed errors without dt and divided by a 0.060 s
+        # sample time while running at 50 Hz, so to keep the same response Ki is the old value * 50 and Kd / 3.
         self.Kp = [4.2, 4.2, 400]
-        self.Ki = [0.2, 0.2, 0]
-        self.Kd = [4.5, 4.5, 0]
+        self.Ki = [10, 10, 0]
+        self.Kd = [1.5, 1.5, 0]
         self.drone_position=[0,0,0]
         self.subs_setpoint=[0,0,0]
 
         self.throttle = 0
-        self.prev_values = [0.0, 0.0, 0.0]
-        self.error = [0.0, 0.0, 0.0]
-        self.error_sum = [0.0, 0.0, 0.0]
         self.min_values = [0, 0, 0, 0]
         self.max_values = [1024, 1024, 1024, 1024]
         self.out_roll = 0
         self.out_pitch = 0
         self.out_yaw = 0
        
-        # # This is the sample time in which you need to run pid. Choose any time which you seem fit. Remember the stimulation step time is 50 ms
-        self.sample_time = 0.060  # in seconds
+        # errors are in degrees, dt is measured in sim time. The integral is limited to 100 pwm per axis
+        self.attitude_pid = PID(self.Kp, self.Ki, self.Kd, integral_limit=[100, 100, 0], clock=rospy.get_time)
+
+        # control rate (Hz) & whether the pid is driven by IMU messages or by a timer
+        self.control_rate = rospy.get_param("~control_rate", 50.0)
+        self.control_mode = rospy.get_param("~control_mode", "imu")
+        self.control_period = 1.0 / self.control_rate if self.control_rate > 0 else 0.0
+        self.next_control_time = None
+        self.new_imu = False
 
         # Publishing /edrone/pwm, /roll_error, /pitch_error, /yaw_error
         self.pwm_pub = rospy.Publisher("/edrone/pwm", prop_speed, queue_size=1)
+        self.loop_stats = LoopStats(rospy.get_name(), clock=rospy.get_time)
+        self.loop_stats_msg = loop_stats()
+        self.loop_stats_pub = rospy.Publisher("/edrone/attitude_controller/loop_stats", loop_stats, queue_size=1)
         
         # ------------------------ Other ROS Publishers here-----------------------------------------------------
         # self.roll_pub = rospy.Publisher('/roll_error', Float32, queue_size=1)
@@ -106,7 +124,11 @@ class Edrone:
 
         # Subscribing to /drone_command, imu/data, /pid_tuning_roll, /pid_tuning_pitch, /pid_tuning_yaw
         rospy.Subscriber("/drone_command", edrone_cmd, self.drone_command_callback)
-        rospy.Subscriber("/edrone/imu/data", Imu, self.imu_callback)
+        self.state_source = state_source()
+        if self.state_source == "estimator":
+            rospy.Subscriber(STATE_TOPIC, drone_state, self.state_callback)
+        else:
+            rospy.Subscriber("/edrone/imu/data", Imu, self.imu_callback)
         rospy.Subscriber("/edrone/setpoint",destination,self.setpoint_callback)
         # ------------------------- Other ROS Subscribers here----------------------------------------------------
         # rospy.Subscriber('/pid_tuning_roll', PidTune, self.roll_set_pid)
@@ -114,6 +136,12 @@ class Edrone:
         # rospy.Subscriber('/pid_tuning_yaw', PidTune, self.yaw_set_pid)
         # ------------------------------------------------------------------------------------------------------------
 
+        if self.control_mode == "timer" and self.control_rate > 0:
+            rospy.Timer(rospy.Duration(1.0 / self.control_rate), self.control_step)
+        elif self.control_mode != "imu":
+            raise ValueError("~control_mode must be imu, or timer with a ~control_rate > 0, got {} at {} Hz".format(self.control_mode, self.control_rate))
+        rospy.Timer(rospy.Duration(rospy.get_param("~stats_period", 1.0)), self.publish_loop_stats)
+
     # Imu callback function
     # The function gets executed each time when imu publishes /edrone/imu/data
     def imu_callback(self, msg):
@@ -122,6 +150,18 @@ class Edrone:
         self.drone_orientation_quaternion[1] = msg.orientation.y
         self.drone_orientation_quaternion[2] = msg.orientation.z
         self.drone_orientation_quaternion[3] = msg.orientation.w
+        self.new_imu = True
+        if self.control_mode == "imu":
+            self.control_step()
+
+    # the estimator's attitude, in the order the pid takes it (rotation about y first)
+    def state_callback(self, msg):
+        self.drone_orientation_euler[0] = msg.pitch
+        self.drone_orientation_euler[1] = msg.roll
+        self.drone_orientation_euler[2] = msg.yaw
+        self.new_imu = True
+        if self.control_mode == "imu":
+            self.control_step()
 
     # --------------------Set the remaining co-ordinates of the drone from msg----------------------------------------------
     def drone_command_callback(self, msg):
@@ -156,6 +196,29 @@ class Edrone:
     
     # ----------------------------------------------------------------------------------------------------------------------
 
+    # Runs the pid on the latest IMU data, unless it was already used or the last run was too recent
+    def control_step(self, event=None):
+        now = rospy.get_time()
+        if not self.new_imu:
+            self.loop_stats.skipped()
+            return
+        if self.next_control_time is not None and now < self.next_control_time:
+            self.loop_stats.skipped()
+            return
+
+        # next run one period after this one was due, so ticks average control_rate even on IMU arrival times
+        if self.next_control_time is None or now - self.next_control_time > self.control_period:
+            self.next_control_time = now
+        self.next_control_time += self.control_period
+        self.new_imu = False
+
+        self.loop_stats.tick_start()
+        self.pid()
+        self.loop_stats.tick_end()
+
+    def publish_loop_stats(self, event=None):
+        self.loop_stats_pub.publish(self.loop_stats.report(self.loop_stats_msg))
+
     def reset(self):
         pwm=prop_speed()
         pwm.prop1=0
@@ -174,25 +237,26 @@ class Edrone:
         #   4. Compute the error (for proportional), change in error (for derivative) and sum of errors (for integral) in each axis. Refer "Understanding PID.pdf" to understand PID equation.
         #   5. Calculate the pid output required for each axis. For eg: calcuate self.out_roll, self.out_pitch, etc.
         #   6. Use this computed output value in the equations to compute the pwm for each propeller. LOOK OUT FOR SIGN (+ or -). EXPERIMENT AND FIND THE CORRECT SIGN
-        #   7. Don't run the pid continously. Run the pid only at the a sample time. self.sampletime defined above is for this purpose. THIS IS VERY IMPORTANT.
+        #   7. Don't run the pid continously. Run the pid only at the a sample time. The PID measures the time since its last update for this purpose. THIS IS VERY IMPORTANT.
         #   8. Limit the output value and the final command value between the maximum(0) and minimum(1024)range before publishing. For eg : if self.pwm_cmd.prop1 > self.max_values[1]:
         #                                                                                                                                      self.pwm_cmd.prop1 = self.max_values[1]
         #   8. Update previous errors.eg: self.prev_error[1] = error[1] where index 1 corresponds to that of pitch (eg)
         #   9. Add error_sum to use for integral component
 
-        # Converting quaternion to euler angles
-        (
-            self.drone_orientation_euler[1],
-            self.drone_orientation_euler[0],
-            self.drone_orientation_euler[2],
-        ) = tf.transformations.euler_from_quaternion(
-            [
-                self.drone_orientation_quaternion[0],
-                self.drone_orientation_quaternion[1],
-                self.drone_orientation_quaternion[2],
-                self.drone_orientation_quaternion[3],
-            ]
-        )
+        # Converting quaternion to euler angles, the estimator's state already has them
+        if self.state_source == "sensors":
+            (
+                self.drone_orientation_euler[1],
+                self.drone_orientation_euler[0],
+                self.drone_orientation_euler[2],
+            ) = tf.transformations.euler_from_quaternion(
+                [
+                    self.drone_orientation_quaternion[0],
+                    self.drone_orientation_quaternion[1],
+                    self.drone_orientation_quaternion[2],
+                    self.drone_orientation_quaternion[3],
+                ]
+            )
 
         # Convertng the range from 1000 to 2000 in the range of -10 degree to 10 degree for axes
         self.setpoint_euler[0] = (self.setpoint_cmd[0] * 0.02) - 30
@@ -202,41 +266,12 @@ class Edrone:
         # Also convert the range of 1000 to 2000 to 0 to 1024 for throttle here itself
         self.throttle = (self.setpoint_cmd[3] * 1.024) - 1024
 
-        # Calculating the error
-        self.error[0] = self.setpoint_euler[0] - (
-            self.drone_orientation_euler[0] * (180 / math.pi)
-        )
-        self.error[1] = self.setpoint_euler[1] - (
-            self.drone_orientation_euler[1] * (180 / math.pi)
-        )
-        self.error[2] = self.setpoint_euler[2] - (
-            self.drone_orientation_euler[2] * (180 / math.pi)
-        )
-        self.error_sum[0] = self.error_sum[0] + self.error[0]
-        self.error_sum[1] = self.error_sum[1] + self.error[1]
-        self.error_sum[2] = self.error_sum[2] + self.error[2]
-
         # Calculating pid values
-        self.out_roll = (
-            (self.Kp[0] * self.error[0])
-            + (self.Ki[0] * self.error_sum[0])
-            + ((self.Kd[0] * (self.error[0] - self.prev_values[0])) / self.sample_time)
-        )
-        self.out_pitch = (
-            (self.Kp[1] * self.error[1])
-            + (self.Ki[1] * self.error_sum[1])
-            + ((self.Kd[1] * (self.error[1] - self.prev_values[1])) / self.sample_time)
-        )
-        self.out_yaw = (
-            (self.Kp[2] * self.error[2])
-            + (self.Ki[2] * self.error_sum[2])
-            + ((self.Kd[2] * (self.error[2] - self.prev_values[2])) / self.sample_time)
+        self.out_roll, self.out_pitch, self.out_yaw = self.attitude_pid.update(
+            self.setpoint_euler,
+            [math.degrees(angle) for angle in self.drone_orientation_euler],
         )
 
-        # Changing the previous sum value
-        self.prev_values[0] = self.error[0]
-        self.prev_values[1] = self.error[1]
-        self.prev_values[2] = self.error[2]
         # print("YAW err:",self.error[2])
         # Giving pwm values
         self.pwm_cmd.prop1 = (
@@ -266,15 +301,13 @@ class Edrone:
         )
 
         self.pwm_pub.publish(self.pwm_cmd)
+        self.loop_stats.published()
 
 
 if __name__ == "__main__":
 
     e_drone = Edrone()
 
-    r = rospy.Rate(50)  # specify rate in Hz based upon your desired PID sampling time, i.e. if desired sample time is 33ms specify rate as 30Hz
+    # the pid is run from the IMU callback or the control timer, see ~control_mode
     rospy.on_shutdown(e_drone.reset)
-    while not rospy.is_shutdown():
-        e_drone.set_yaw()
-        e_drone.pid()
-        r.sleep()
\ No newline at end of file
+    rospy.spin()
@@ -0,0 +1,294 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_bag_reader.py
+Functions      BagReader,Connection,message_classes,deserializer
+Global Variables None
+
+
+Pure-Python reader for ROS bag v2.0 files (bag_files/*.bag), so recorded runs can be replayed without
+rosbag or a ROS master (see Task_6_VD_2373_bag_replay.py).
+
+The message classes are generated from the definitions stored in the bag's connection records, with the
+same generator as the ros_stand_in messages, so a replayed message has every recorded field and can be
+handed to the nodes' callbacks as it is. Chunks may be uncompressed or bz2, lz4 chunks need the lz4
+package.
+
+'''
+
+import bz2
+import heapq
+import struct
+
+from Task_6_VD_2373_ros_stand_in import Time,make_message_class
+
+BAG_MAGIC = b'#ROSBAG V2.0\n'
+
+# record op codes
+OP_MESSAGE_DATA = 0x02
+OP_CHUNK = 0x05
+OP_CONNECTION = 0x07
+
+PRIMITIVE_FORMATS = {
+    'bool':'?','byte':'b','char':'B','int8':'b','uint8':'B','int16':'h','uint16':'H','int32':'i','uint32':'I',
+    'int64':'q','uint64':'Q','float32':'f','float64':'d',
+}
+
+_uint32 = struct.Struct('<I')
+_time = struct.Struct('<II')
+
+
+def _read_header(data,offset,length):
+    # {field: bytes} of a record header
+    fields={}
+    end=offset+length
+    while offset<end:
+        size,=_uint32.unpack_from(data,offset)
+        name,value=data[offset+4:offset+4+size].split(b'=',1)
+        fields[name.decode()]=value
+        offset+=4+size
+    return fields
+
+
+def _records(data,offset=0,end=None):
+    # (header fields, data offset, data length) of each record in data[offset:end]
+    end=len(data) if end is None else end
+    while offset<end:
+        header_length,=_uint32.unpack_from(data,offset)
+        header=_read_header(data,offset+4,header_length)
+        offset+=4+header_length
+        data_length,=_uint32.unpack_from(data,offset)
+        yield header,offset+4,data_length
+        offset+=4+data_length
+
+
+def _split_definition(msg_type,definition):
+    # [(type, definition)] of the main type & the types it depends on, as written by genmsg
+    sections=[]
+    current_type=msg_type
+    lines=[]
+    for line in definition.splitlines():
+        if line.startswith('=====') and set(line.strip())=={'='}:
+            sections.append((current_type,'\n'.join(lines)))
+            current_type,lines=None,[]
+        elif current_type is None and line.startswith('MSG: '):
+            current_type=line[5:].strip()
+        else:
+            lines.append(line)
+    sections.append((current_type,'\n'.join(lines)))
+    return sections
+
+
+def message_classes(msg_type,definition,classes=None):
+    # Message class of msg_type, generated from the full definition stored in a bag; classes caches them
+    classes={} if classes is None else classes
+    if msg_type in classes:
+        return classes[msg_type]
+    sections=_split_definition(msg_type,definition)
+    # genmsg writes dependencies after their users, the leaves last
+    for section_type,text in reversed(sections):
+        if section_type not in classes:
+            package,name=section_type.split('/')
+            make_message_class(package,name,text,classes)
+    return classes[msg_type]
+
+
+def _field_reader(field_type,package,classes,readers):
+    base=field_type.split('[')[0]
+    if base=='Header':
+        base='std_msgs/Header'
+    elif base not in PRIMITIVE_FORMATS and base not in ('string','time','duration') and '/' not in base:
+        base=package+'/'+base
+
+    if '[' in field_type:
+        size=field_type.split('[')[1].rstrip(']')
+        size=int(size) if size else None
+        if base in ('uint8','char'):
+            # byte arrays stay bytes, as genpy leaves them
+            def read(data,offset):
+                if size is None:
+                    length,=_uint32.unpack_from(data,offset)
+                    offset+=4
+                else:
+                    length=size
+                return bytes(data[offset:offset+length]),offset+length
+            return read
+        if base in PRIMITIVE_FORMATS:
+            code=PRIMITIVE_FORMATS[base]
+            item_size=struct.calcsize('<'+code)
+
+            def read(data,offset):
+                if size is None:
+                    length,=_uint32.unpack_from(data,offset)
+                    offset+=4
+                else:
+                    length=size
+                values=list(struct.unpack_from('<{}{}'.format(length,code),data,offset))
+                return values,offset+length*item_size
+            return read
+        element=_field_reader(base,package,classes,readers)
+
+        def read(data,offset):
+            if size is None:
+                length,=_uint32.unpack_from(data,offset)
+                offset+=4
+            else:
+                length=size
+            values=[]
+            for _ in range(length):
+                value,offset=element(data,offset)
+                values.append(value)
+            return values,offset
+        return read
+
+    if base in PRIMITIVE_FORMATS:
+        item=struct.Struct('<'+PRIMITIVE_FORMATS[base])
+
+        def read(data,offset):
+            return item.unpack_from(data,offset)[0],offset+item.size
+        return read
+    if base=='string':
+        def read(data,offset):
+            length,=_uint32.unpack_from(data,offset)
+            return bytes(data[offset+4:offset+4+length]).decode('utf-8','replace'),offset+4+length
+        return read
+    if base in ('time','duration'):
+        def read(data,offset):
+            secs,nsecs=_time.unpack_from(data,offset)
+            return Time(secs,nsecs),offset+8
+        return read
+    return deserializer(classes[base],classes,readers)
+
+
+def deserializer(cls,classes,readers=None):
+    # read(data, offset) -> (message, offset) for a generated message class
+    readers={} if readers is None else readers
+    if cls._type in readers:
+        return readers[cls._type]
+    package=cls._type.split('/')[0]
+    fields=[]
+
+    def read(data,offset):
+        msg=object.__new__(cls)
+        for name,field_reader in fields:
+            value,offset=field_reader(data,offset)
+            setattr(msg,name,value)
+        return msg,offset
+    # registered before the fields are resolved, in case a type refers to itself
+    readers[cls._type]=read
+    fields.extend((name,_field_reader(field_type,package,classes,readers)) for name,field_type in zip(cls._fields,cls._slot_types))
+    return read
+
+
+class Connection():
+
+    def __init__(self,conn_id,topic,fields,classes,readers):
+        self.id=conn_id
+        self.topic=topic
+        self.type=fields['type'].decode()
+        self.md5sum=fields['md5sum'].decode()
+        self.definition=fields['message_definition'].decode()
+        self.callerid=fields['callerid'].decode() if 'callerid' in fields else ''
+        self.msg_class=message_classes(self.type,self.definition,classes)
+        self.read=deserializer(self.msg_class,classes,readers)
+
+    def deserialize(self,data,offset=0):
+        return self.read(data,offset)[0]
+
+
+class BagReader():
+
+    def __init__(self,path):
+        self.path=path
+        with open(path,'rb') as fhand:
+            self.data=fhand.read()
+        if not self.data.startswith(BAG_MAGIC):
+            raise ValueError('{} is not a ROS bag v2.0 file'.format(path))
+
+        self.connections={}
+        # record data of the chunks, decompressed
+        self.chunks=[]
+        self._classes={}
+        self._readers={}
+
+        for header,offset,length in _records(self.data,len(BAG_MAGIC)):
+            op=header['op'][0]
+            if op==OP_CHUNK:
+                self.chunks.append(self._chunk_data(header,offset,length))
+            elif op==OP_CONNECTION:
+                self._add_connection(header,offset,length,self.data)
+        for chunk in self.chunks:
+            # connection records are repeated inside the chunks, the index ones are enough but a bag cut short only has these
+            for header,offset,length in _records(chunk):
+                if header['op'][0]==OP_CONNECTION:
+                    self._add_connection(header,offset,length,chunk)
+
+    def _chunk_data(self,header,offset,length):
+        compression=header['compression'].decode()
+        raw=self.data[offset:offset+length]
+        if compression=='none':
+            return raw
+        if compression=='bz2':
+            return bz2.decompress(raw)
+        if compression=='lz4':
+            try:
+                import roslz4
+                return roslz4.decompress(raw)
+            except ImportError:
+                pass
+            import lz4.frame
+            return lz4.frame.decompress(raw)
+        raise ValueError('unknown chunk compression {} in {}'.format(compression,self.path))
+
+    def _add_connection(self,header,offset,length,data):
+        conn_id,=_uint32.unpack(header['conn'])
+        if conn_id in self.connections:
+            return
+        fields=_read_header(data,offset,length)
+        self.connections[conn_id]=Connection(conn_id,header['topic'].decode(),fields,self._classes,self._readers)
+
+    @property
+    def topics(self):
+        return sorted(set(connection.topic for connection in self.connections.values()))
+
+    def _chunk_messages(self,index,conn_ids):
+        # (time, chunk index, offset, connection, length) of the chunk's messages, sortable across chunks
+        for header,offset,length in _records(self.chunks[index]):
+            if header['op'][0]!=OP_MESSAGE_DATA:
+                continue
+            conn_id,=_uint32.unpack(header['conn'])
+            if conn_id in conn_ids:
+                secs,nsecs=_time.unpack(header['time'])
+                yield secs+nsecs*1e-9,index,offset,conn_id,length
+
+    def read_messages(self,topics=None,raw=False):
+        # (topic, message, time in s) in time order; raw gives (type, bytes) instead of the message
+        conn_ids=set(conn_id for conn_id,connection in self.connections.items() if topics is None or connection.topic in topics)
+        streams=[self._chunk_messages(index,conn_ids) for index in range(len(self.chunks))]
+        for t,index,offset,conn_id,length in heapq.merge(*streams):
+            connection=self.connections[conn_id]
+            chunk=self.chunks[index]
+            if raw:
+                yield connection.topic,(connection.type,chunk[offset:offset+length]),t
+            else:
+                yield connection.topic,connection.deserialize(chunk,offset),t
+
+    def message_count(self,topic=None):
+        count=0
+        for chunk in self.chunks:
+            for header,offset,length in _records(chunk):
+                if header['op'][0]==OP_MESSAGE_DATA:
+                    if topic is None or self.connections[_uint32.unpack(header['conn'])[0]].topic==topic:
+                        count+=1
+        return count
+
+
+if __name__ == "__main__":
+    import sys
+    for path in sys.argv[1:]:
+        bag=BagReader(path)
+        print(path)
+        for connection in sorted(bag.connections.values(),key=lambda c: c.topic):
+            times=[t for _,_,t in bag.read_messages([connection.topic],raw=True)]
+            print('  {:40} {:28} {:6} msgs  {:8.3f} - {:8.3f} s'.format(connection.topic,connection.type,len(times),times[0] if times else 0,times[-1] if times else 0))
@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_bag_replay.py
+Functions      world_from_model_states,hold_points,render_frame,Replay,replay,save_result,load_result,compare,print_report,main
+Global Variables None
+
+
+Replays the recorded flights in bag_files/ through the node classes, as fast as they can take it, and
+reports the latency of every callback and the streams the nodes publish. Nothing in a replay depends on
+the wall clock, so the streams of a run are the same on every machine and a saved run (--output) can be
+used as the reference (--reference) of later ones: a change in a stream is a change in behaviour, a
+slower percentile a performance regression.
+
+The bags are read with Task_6_VD_2373_bag_reader (no ROS needed) and the nodes run against the rospy
+stand-in (Task_6_VD_2373_ros_stand_in). The bags only hold /gazebo/model_states_throttle and either
+/edrone/gps_throttle (Task_2_VD.bag) or /edrone/marker_data (Task_3_VD.bag), all at ~10 Hz, so the rest
+of the inputs are derived from the recorded drone pose:
+
+- /edrone/gps from the pose when the bag has no GPS (Gazebo's x & y are the local north & west axes)
+- /edrone/imu/data with the recorded orientation & angular velocity
+- /edrone/range_finder_top & _bottom ray cast against a 6 x 6 m building under every landing station
+  in the model states (the rest of the city is not in the bags)
+- /edrone/camera/image_raw, a 400 x 400 frame rendered from the pose with the buildings & markers (with
+  the landing station's texture, so marker_detect's cascade finds them)
+- /edrone/setpoint, the next point the recorded flight holds still at (for more than HOLD_TIME)
+
+The position & attitude controllers, the obstacle node and marker_detect subscribe to these; their
+main loop bodies run at 50 Hz (marker_detect's at 1 Hz) of bag time. The flight is recorded, so the
+nodes' commands do not move the drone. /edrone/marker_data of Task_3_VD.bag, which the setpoint control
+published in the recorded run, is kept as a reference stream.
+
+    python Task_6_VD_2373_bag_replay.py ../bag_files/Task_3_VD.bag --output replay.npz
+    python Task_6_VD_2373_bag_replay.py ../bag_files/Task_3_VD.bag --reference replay.npz
+
+'''
+
+import argparse
+import collections
+import contextlib
+import glob
+import math
+import os
+import sys
+import time
+import numpy as np
+
+import Task_6_VD_2373_ros_stand_in as ros_stand_in
+
+# the stand-in has to be in sys.modules before the nodes (& rospy) are imported
+ros_stand_in.install()
+
+import cv2
+
+import rospy
+from cv_bridge import CvBridge
+from sensor_msgs.msg import Image, Imu, LaserScan, NavSatFix
+from vitarana_drone.msg import destination
+
+from Task_6_VD_2373_bag_reader import BagReader
+from Task_6_VD_2373_geodesy import x_to_lat,y_to_long
+from Task_6_VD_2373_simulator import (World,BUILDING_SIZE,DRONE_HEIGHT,FOCAL_LENGTH,IMG_WIDTH,MARKER_SIZE,
+                                      RANGE_MAX,RANGE_MIN,TOP_BEAMS)
+
+BAG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'bag_files')
+MARKER_TEXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'models','landing_station','materials','textures','marker.jpg')
+
+GPS_TOPIC = '/edrone/gps_throttle'
+MODEL_STATES_TOPIC = '/gazebo/model_states_throttle'
+MARKER_DATA_TOPIC = '/edrone/marker_data'
+DRONE_MODEL = 'edrone'
+
+HOLD_SPEED = 0.3            # below this the recorded drone counts as holding still (m/s)
+HOLD_TIME = 1.0             # for at least this long (s)
+NODE_RATE = 50.0            # main loops of the position controller & the obstacle node (Hz)
+DETECT_RATE = 1.0           # marker_detect's main loop (Hz)
+
+# streams published by the nodes (& recorded in the bag), as topic: fields
+STREAMS = collections.OrderedDict([
+    ('/edrone/setpoint',('lat','long','alt')),
+    ('/drone_command',('rcRoll','rcPitch','rcYaw','rcThrottle')),
+    ('/edrone/pwm',('prop1','prop2','prop3','prop4')),
+    ('/edrone/obstacle_setpoint',('lat','long','alt','obstacle_detected')),
+    ('/edrone/center_lat_long',('x','y','square_size')),
+    (MARKER_DATA_TOPIC,('marker_id','err_x_m','err_y_m')),
+])
+
+PERCENTILES = (50,90,99)
+
+
+def _is_station(name):
+    name=name.strip('"')
+    return name=='landing_station' or name.startswith('LS_')
+
+
+def world_from_model_states(msg):
+    # World with a building under (and a marker on) every landing station of a gazebo_msgs/ModelStates
+    world=World()
+    for name,pose in zip(msg.name,msg.pose):
+        if _is_station(name):
+            x,y,z=pose.position.x,pose.position.y,pose.position.z
+            world.add_box(x,y,BUILDING_SIZE,z,name.strip('"'))
+            world.markers.append([x,y,z])
+    return world
+
+
+def hold_points(times,positions,speeds,hold_speed=HOLD_SPEED,hold_time=HOLD_TIME):
+    # [(end time, local [x, y, z])] of the stretches the drone holds still, z as GPS altitude
+    holds=[]
+    start=None
+    for i in range(len(times)+1):
+        still=i<len(times) and speeds[i]<hold_speed
+        if still and start is None:
+            start=i
+        elif not still and start is not None:
+            if times[i-1]-times[start]>=hold_time:
+                holds.append((times[i-1],positions[start:i].mean(axis=0)))
+            start=None
+    return holds
+
+
+def render_frame(world,position,width=IMG_WIDTH):
+    # BGR frame of the downward camera at the local position: ground, building roofs & markers
+    x,y,z=position
+    frame=np.full((width,width,3),60,np.uint8)
+
+    def corners(cx,cy,half,height):
+        # image x is north & image y is east, as in the simulator's marker camera
+        scale=FOCAL_LENGTH/height
+        return np.array([[width/2+(cx+dx-x)*scale,width/2-(cy+dy-y)*scale] for dx,dy in ((-half,-half),(half,-half),(half,half),(-half,half))],np.int32)
+
+    for box in world.boxes[np.argsort(world.boxes[:,4])]:
+        if box[4]<z-0.1:
+            shade=int(100+min(box[4],40)*2)
+            cv2.fillConvexPoly(frame,corners((box[0]+box[1])/2,(box[2]+box[3])/2,(box[1]-box[0])/2,z-box[4]),(shade,shade,shade))
+    texture=_marker_texture()
+    side=texture.shape[0]
+    texture_corners=np.float32([[0,0],[side,0],[side,side],[0,side]])
+    for mx,my,mz in world.markers:
+        if mz<z-0.1:
+            transform=cv2.getPerspectiveTransform(texture_corners,np.float32(corners(mx,my,MARKER_SIZE/2,z-mz)))
+            cv2.warpPerspective(texture,transform,(width,width),dst=frame,flags=cv2.INTER_AREA,borderMode=cv2.BORDER_TRANSPARENT)
+    return frame
+
+
+_texture = []
+
+
+def _marker_texture():
+    if not _texture:
+        _texture.append(cv2.imread(MARKER_TEXTURE))
+    return _texture[0]
+
+
+def _node_name(callback):
+    # "obstacle.range_finder_top_callback" for a bound method of a node class
+    module=type(callback.__self__).__module__.replace('Task_6_VD_2373_','')
+    return '{}.{}'.format(module,callback.__name__)
+
+
+class Replay():
+
+    def __init__(self,bag_path,camera=True,verbose=False):
+        self.bag_path=bag_path
+        self.camera=camera
+        self.bridge=CvBridge()
+        self.verbose=verbose
+        self.bag=BagReader(bag_path)
+        self.messages=list(self.bag.read_messages([GPS_TOPIC,MODEL_STATES_TOPIC,MARKER_DATA_TOPIC]))
+        self.has_gps=GPS_TOPIC in self.bag.topics
+        states=[(t,msg) for topic,msg,t in self.messages if topic==MODEL_STATES_TOPIC and DRONE_MODEL in msg.name]
+        if not states:
+            raise ValueError('{} has no {} with the {} model, nothing to replay'.format(bag_path,MODEL_STATES_TOPIC,DRONE_MODEL))
+        self.world=world_from_model_states(states[0][1])
+
+        times=np.array([t for t,_ in states])
+        positions=np.array([self._drone_position(msg) for _,msg in states])
+        speeds=np.array([math.sqrt(twist.linear.x**2+twist.linear.y**2+twist.linear.z**2)
+                         for twist in (msg.twist[msg.name.index(DRONE_MODEL)] for _,msg in states)])
+        self.holds=hold_points(times,positions,speeds) or [(times[-1],positions[-1])]
+
+        self.latencies=collections.defaultdict(list)
+        self.streams=collections.defaultdict(list)
+        self.wall_time=0.0
+        self.duration=times[-1]-self.messages[0][2]
+
+        self.bus=ros_stand_in.activate(ros_stand_in.Bus(log=self._log if verbose else None))
+        with self._output():
+            self._start_nodes()
+
+    def _log(self,level,node,msg):
+        sys.stderr.write('[{}] [{:.3f}] {}: {}\n'.format(level,self.bus.time,node,msg))
+
+    @contextlib.contextmanager
+    def _output(self):
+        # the nodes print on every callback, which is only wanted in verbose runs
+        if self.verbose:
+            yield
+            return
+        with open(os.devnull,'w') as devnull,contextlib.redirect_stdout(devnull):
+            yield
+
+    def _drone_position(self,msg):
+        # local [x, y, GPS altitude] of the drone in a model states message
+        pose=msg.pose[msg.name.index(DRONE_MODEL)]
+        return [pose.position.x,pose.position.y,pose.position.z+DRONE_HEIGHT]
+
+    def _start_nodes(self):
+        rospy.init_node('bag_replay')
+        self.gps_pub=rospy.Publisher('/edrone/gps',NavSatFix,queue_size=1)
+        self.imu_pub=rospy.Publisher('/edrone/imu/data',Imu,queue_size=1)
+        self.top_pub=rospy.Publisher('/edrone/range_finder_top',LaserScan,queue_size=1)
+        self.bottom_pub=rospy.Publisher('/edrone/range_finder_bottom',LaserScan,queue_size=1)
+        self.image_pub=rospy.Publisher('/edrone/camera/image_raw',Image,queue_size=1)
+        self.setpoint_pub=rospy.Publisher('/edrone/setpoint',destination,queue_size=1)
+
+        # nodes are imported here, so they pick up the stand-in
+        from Task_6_VD_2373_attitude_controller import Edrone as AttitudeController
+        from Task_6_VD_2373_position_controller import Edrone as PositionController
+        from Task_6_VD_2373_obstacle import Obstacle
+        from Task_6_VD_2373_marker_detect import MarkerDetect
+
+        self.attitude=AttitudeController()
+        self.position=PositionController()
+        self.obstacle=Obstacle()
+        self.marker_detect=MarkerDetect()
+
+        # every subscriber so far is a node's, time them
+        for topic,entries in self.bus.subscribers.items():
+            entries[:]=[(self._timed(_node_name(callback),callback),args) for callback,args in entries]
+        self.position_pid=self._timed('position_controller.pid',self.position.pid)
+        self.obs_avoid=self._timed('obstacle.obs_avoid',self.obstacle.obs_avoid)
+        self.detect=self._timed('marker_detect.detect',self.marker_detect.detect)
+
+        for topic,fields in STREAMS.items():
+            if topic!=MARKER_DATA_TOPIC:
+                rospy.Subscriber(topic,None,self._recorder(topic,fields))
+
+        self.gps_msg=NavSatFix()
+        self.imu_msg=Imu()
+        self.top_scan=self._laser_scan(-math.pi,math.pi,5)
+        self.bottom_scan=self._laser_scan(0.0,0.0,1)
+        self.setpoint_msg=destination()
+
+    def _laser_scan(self,angle_min,angle_max,beams):
+        scan=LaserScan()
+        scan.angle_min=angle_min
+        scan.angle_max=angle_max
+        scan.angle_increment=(angle_max-angle_min)/max(beams-1,1)
+        scan.range_min=RANGE_MIN
+        scan.range_max=RANGE_MAX
+        scan.ranges=[float('inf')]*beams
+        return scan
+
+    def _timed(self,name,callback):
+        latencies=self.latencies[name]
+        clock=time.perf_counter
+
+        def timed(*args):
+            start=clock()
+            try:
+                return callback(*args)
+            finally:
+                latencies.append(clock()-start)
+        return timed
+
+    def _recorder(self,topic,fields):
+        stream=self.streams[topic]
+
+        def record(msg):
+            stream.append([self.bus.time]+[float(getattr(msg,field)) for field in fields])
+        return record
+
+    # ----------------------------------------- inputs ---------------------------------------------------------
+
+    def _range(self,distance):
+        return distance if RANGE_MIN<=distance<=RANGE_MAX else float('inf')
+
+    def model_states(self,msg):
+        if DRONE_MODEL not in msg.name:
+            return
+        index=msg.name.index(DRONE_MODEL)
+        pose,twist=msg.pose[index],msg.twist[index]
+        x,y,z=self._drone_position(msg)
+
+        if not self.has_gps:
+            self.gps_msg.header.stamp=self.bus.time
+            self.gps_msg.latitude,self.gps_msg.longitude,self.gps_msg.altitude=x_to_lat(x),y_to_long(y),z
+            self.gps_pub.publish(self.gps_msg)
+
+        imu=self.imu_msg
+        imu.header.stamp=self.bus.time
+        orientation=pose.orientation
+        imu.orientation.x,imu.orientation.y,imu.orientation.z,imu.orientation.w=orientation.x,orientation.y,orientation.z,orientation.w
+        imu.angular_velocity.x,imu.angular_velocity.y,imu.angular_velocity.z=twist.angular.x,twist.angular.y,twist.angular.z
+        self.imu_pub.publish(imu)
+
+        self.top_scan.header.stamp=self.bus.time
+        self.top_scan.ranges=[self._range(self.world.ray_cast(x,y,z,beam)) for beam in TOP_BEAMS]
+        self.top_pub.publish(self.top_scan)
+        self.bottom_scan.header.stamp=self.bus.time
+        self.bottom_scan.ranges=[self._range(z-self.world.surface_height(x,y))]
+        self.bottom_pub.publish(self.bottom_scan)
+
+        if self.camera:
+            image=self.bridge.cv2_to_imgmsg(render_frame(self.world,(x,y,z)),'bgr8')
+            image.header.stamp=self.bus.time
+            self.image_pub.publish(image)
+
+    def setpoint(self,now):
+        # the hold the recorded flight is at or flying to
+        for end,point in self.holds:
+            if end>=now:
+                break
+        self.setpoint_msg.lat,self.setpoint_msg.long,self.setpoint_msg.alt=x_to_lat(point[0]),y_to_long(point[1]),float(point[2])
+        self.setpoint_pub.publish(self.setpoint_msg)
+
+    # ----------------------------------------- run ------------------------------------------------------------
+
+    def tick_nodes(self,now):
+        # bodies of the 50 Hz main loops & the setpoint the selector would be publishing
+        bus=self.bus
+        self.setpoint(now)
+        bus.deliver()
+        obs=self.obstacle
+        if all(obs.drone_position):
+            self.obs_avoid()
+        obs.setpoint_pub.publish(obs.pub_msg)
+        bus.deliver()
+        if all(self.position.drone_position) and all(self.position.subscribed_target):
+            self.position_pid()
+        bus.deliver()
+
+    def run(self):
+        ros_stand_in.activate(self.bus)
+        bus=self.bus
+        start_time=self.messages[0][2]
+        tick_count=0
+        detect_count=0
+        wall_start=time.perf_counter()
+        with self._output():
+            for topic,msg,t in self.messages:
+                # main loops due before the message
+                while start_time+tick_count/NODE_RATE<=t:
+                    bus.time=start_time+tick_count/NODE_RATE
+                    bus.run_timers()
+                    self.tick_nodes(bus.time)
+                    tick_count+=1
+                    if bus.time>=start_time+detect_count/DETECT_RATE:
+                        self.detect()
+                        bus.deliver()
+                        detect_count+=1
+                bus.time=t
+                if topic==GPS_TOPIC:
+                    self.gps_pub.publish(msg)
+                elif topic==MODEL_STATES_TOPIC:
+                    self.model_states(msg)
+                elif topic==MARKER_DATA_TOPIC:
+                    self.streams[topic].append([t]+[float(getattr(msg,field)) for field in STREAMS[topic]])
+                bus.deliver()
+        self.wall_time=time.perf_counter()-wall_start
+        return self.result()
+
+    def result(self):
+        return {
+            'bag':os.path.basename(self.bag_path),
+            'duration':self.duration,
+            'wall_time':self.wall_time,
+            'messages':len(self.messages),
+            'holds':len(self.holds),
+            'callback_errors':sum(self.bus.callback_errors.values()),
+            'latencies':{name:np.array(values) for name,values in sorted(self.latencies.items())},
+            'streams':{topic:np.array(self.streams[topic],dtype=np.float64).reshape(-1,len(fields)+1) for topic,fields in STREAMS.items()},
+        }
+
+
+def replay(bag_path,camera=True,verbose=False):
+    return Replay(bag_path,camera,verbose).run()
+
+
+def _stream_key(topic):
+    return 'stream'+topic.replace('/','_')
+
+
+def save_result(result,path):
+    arrays={'meta_bag':np.array(result['bag']),'meta_duration':np.array(result['duration'])}
+    for name,values in result['latencies'].items():
+        arrays['latency_'+name]=values
+    for topic,values in result['streams'].items():
+        arrays[_stream_key(topic)]=values
+    np.savez_compressed(path,**arrays)
+
+
+def load_result(path):
+    with np.load(path) as data:
+        return {
+            'bag':str(data['meta_bag']),
+            'duration':float(data['meta_duration']),
+            'latencies':{key[len('latency_'):]:data[key] for key in data.files if key.startswith('latency_')},
+            'streams':{topic:data[_stream_key(topic)] for topic in STREAMS if _stream_key(topic) in data.files},
+        }
+
+
+def compare(result,reference,slowdown=1.5,tolerance=1e-9,min_slowdown=5e-6):
+    # [problem] of a run against a reference run of the same bag: differing streams & slower p90s (by more
+    # than min_slowdown s too, the microsecond callbacks are all timer noise)
+    problems=[]
+    for topic,values in reference['streams'].items():
+        current=result['streams'].get(topic)
+        if current is None or current.shape!=values.shape:
+            problems.append('{}: {} messages, {} in the reference'.format(topic,0 if current is None else len(current),len(values)))
+        elif len(values) and np.max(np.abs(current-values))>tolerance:
+            problems.append('{}: differs from the reference by up to {:.3g}'.format(topic,np.max(np.abs(current-values))))
+    for name,values in reference['latencies'].items():
+        current=result['latencies'].get(name)
+        if current is None or not len(current) or not len(values):
+            continue
+        now,before=np.percentile(current,90),np.percentile(values,90)
+        if now>before*slowdown and now-before>min_slowdown:
+            problems.append('{}: p90 {:.1f} us, {:.1f} us in the reference'.format(name,now*1e6,before*1e6))
+    return problems
+
+
+def print_report(result,out=sys.stdout):
+    out.write('{}: {:.1f} s of flight, {} messages replayed in {:.2f} s ({:.0f}x real time), {} holds, {} callback errors\n'.format(
+        result['bag'],result['duration'],result['messages'],result['wall_time'],result['duration']/max(result['wall_time'],1e-9),
+        result['holds'],result['callback_errors']))
+    out.write('  {:45} {:>7} {:>9} {}\n'.format('callback','calls','mean us',' '.join('{:>9}'.format('p{} us'.format(p)) for p in PERCENTILES+('max',)).replace('pmax','max')))
+    for name,values in result['latencies'].items():
+        if not len(values):
+            continue
+        values=values*1e6
+        out.write('  {:45} {:7d} {:9.1f} {} {:9.1f}\n'.format(name,len(values),values.mean(),
+                  ' '.join('{:9.1f}'.format(v) for v in np.percentile(values,PERCENTILES)),values.max()))
+    out.write('  {:45} {:>7}  first / last\n'.format('stream','msgs'))
+    for topic,values in result['streams'].items():
+        if len(values):
+            out.write('  {:45} {:7d}  {} / {}\n'.format(topic,len(values),_fmt(values[0,1:]),_fmt(values[-1,1:])))
+        else:
+            out.write('  {:45} {:7d}\n'.format(topic,0))
+
+
+def _fmt(values):
+    return '[{}]'.format(', '.join('{:.6g}'.format(v) for v in values))
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Replay the recorded bags through the nodes and report callback latencies & output streams.')
+    parser.add_argument('bags',nargs='*',help='bag files (default: all of bag_files/)')
+    parser.add_argument('--no-camera',action='store_true',help='do not render camera frames (skips marker_detect_callback)')
+    parser.add_argument('--output',help='save the run of the (single) bag as .npz, to be used as --reference')
+    parser.add_argument('--reference',help='.npz of an earlier run of the same bag to compare with')
+    parser.add_argument('--slowdown',type=float,default=1.5,help='p90 latency ratio to the reference that counts as a regression')
+    parser.add_argument('--verbose',action='store_true',help='show the nodes\' output')
+    args=parser.parse_args(argv)
+
+    bags=args.bags or sorted(glob.glob(os.path.join(BAG_DIR,'*.bag')))
+    if (args.output or args.reference) and len(bags)!=1:
+        parser.error('--output & --reference need exactly one bag')
+
+    problems=[]
+    for path in bags:
+        result=replay(path,camera=not args.no_camera,verbose=args.verbose)
+        print_report(result)
+        if args.output:
+            save_result(result,args.output)
+            print('saved to {}'.format(args.output))
+        if args.reference:
+            problems=compare(result,load_result(args.reference),args.slowdown)
+            print('against {}: {}'.format(args.reference,'; '.join(problems) if problems else 'same streams, no slower p90'))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
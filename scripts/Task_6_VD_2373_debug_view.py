@@ -0,0 +1,181 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_debug_view.py
+Functions      DebugView,benchmark,main
+Global Variables DEBUG_VIEW_MODES
+
+
+Optional annotated frames of the vision nodes, for debugging the detections.
+
+A node makes a DebugView and only calls show() when it is enabled, so with the default ~debug_view:=off
+nothing is drawn, copied or imported for it. The modes:
+
+    topic   the annotated frame is published as sensor_msgs/Image on the given topic (rqt_image_view)
+    disk    the last ~debug_frames annotated frames are kept as ~debug_dir/frame_NNNN.png, overwritten
+            in a ring, with ~debug_dir/latest.txt naming the newest
+
+Frames are annotated on a copy, the node's image is left as it is.
+
+Run this file for the cold start (import & construction) of marker_detect & the cost per frame of its
+callback, with the frame drawn & passed to pyplot as it used to be and with each debug view mode.
+
+'''
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+DEBUG_VIEW_MODES = ('off','topic','disk')
+
+
+class DebugView():
+
+    def __init__(self,topic):
+        import rospy
+        self.mode=rospy.get_param('~debug_view','off')
+        if self.mode not in DEBUG_VIEW_MODES:
+            raise ValueError('~debug_view must be one of {}, got {}'.format(', '.join(DEBUG_VIEW_MODES),self.mode))
+        self.enabled=self.mode!='off'
+        self.frames=0
+        if self.mode=='topic':
+            from cv_bridge import CvBridge
+            from sensor_msgs.msg import Image
+            self.bridge=CvBridge()
+            self.publisher=rospy.Publisher(topic,Image,queue_size=1)
+        elif self.mode=='disk':
+            self.directory=rospy.get_param('~debug_dir',os.path.join(tempfile.gettempdir(),rospy.get_name().strip('/').replace('/','_')+'_debug'))
+            self.ring_size=rospy.get_param('~debug_frames',100)
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+    def annotate(self,image,boxes=(),text=None):
+        # copy of a BGR frame with the (x, y, w, h) boxes & a line of text drawn on it
+        frame=image.copy()
+        for x,y,w,h in boxes:
+            cv2.rectangle(frame,(int(x),int(y)),(int(x+w),int(y+h)),(255,255,0),2)
+        if text:
+            cv2.putText(frame,text,(5,15),cv2.FONT_HERSHEY_SIMPLEX,0.45,(0,255,255),1)
+        return frame
+
+    def show(self,image,boxes=(),text=None):
+        frame=self.annotate(image,boxes,text)
+        if self.mode=='topic':
+            self.publisher.publish(self.bridge.cv2_to_imgmsg(frame,'bgr8'))
+        elif self.mode=='disk':
+            name='frame_{:04d}.png'.format(self.frames%self.ring_size)
+            cv2.imwrite(os.path.join(self.directory,name),frame)
+            with open(os.path.join(self.directory,'latest.txt'),'w') as latest:
+                latest.write(name+'\n')
+        self.frames+=1
+
+
+_COLD_START = '''
+import sys,time
+start=time.perf_counter()
+import Task_6_VD_2373_ros_stand_in as ros_stand_in
+ros_stand_in.install()
+ros_stand_in.activate(ros_stand_in.Bus())
+stand_in=time.perf_counter()
+{extra}
+import Task_6_VD_2373_marker_detect
+imported=time.perf_counter()
+Task_6_VD_2373_marker_detect.MarkerDetect()
+built=time.perf_counter()
+print(stand_in-start,imported-stand_in,built-imported)
+'''
+
+
+def _cold_start(extra,runs):
+    # (import, construction) seconds of marker_detect in fresh interpreters, the best of runs
+    times=[]
+    for _ in range(runs):
+        output=subprocess.check_output([sys.executable,'-c',_COLD_START.format(extra=extra)],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append([float(value) for value in output.split()[1:]])
+    return np.min(times,axis=0)
+
+
+def benchmark(frames=200,runs=5):
+    print('marker_detect cold start, best of {} (ms)       import  construct'.format(runs))
+    for name,extra in (('with pyplot (before)','from matplotlib import pyplot as plt'),('without',''),):
+        imported,built=_cold_start(extra,runs)*1e3
+        print('  {:40} {:9.1f} {:9.1f}'.format(name,imported,built))
+
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+    import Task_6_VD_2373_bag_replay as bag_replay
+    from Task_6_VD_2373_simulator import World,BUILDING_SIZE
+
+    world=World()
+    world.add_box(0.0,0.0,BUILDING_SIZE,10.0,'station')
+    world.markers.append([0.0,0.0,10.0])
+    rng=np.random.RandomState(0)
+    bridge=ros_stand_in.CvBridge()
+    images=[bag_replay.render_frame(world,(rng.uniform(-2,2),rng.uniform(-2,2),22.0)) for _ in range(20)]
+
+    import rospy
+    from vitarana_drone.msg import center_x_y
+    from Task_6_VD_2373_waypoint import WAYPOINT_KINDS
+
+    print('marker_detect_callback per frame ({} frames)  mean ms    p90 ms  detections'.format(frames))
+    directory=tempfile.mkdtemp()
+    for mode in ('before',)+DEBUG_VIEW_MODES:
+        params={'/marker_detect/debug_view':'off' if mode=='before' else mode,'/marker_detect/debug_dir':directory}
+        bus=ros_stand_in.Bus(params)
+        ros_stand_in.activate(bus)
+        from Task_6_VD_2373_marker_detect import MarkerDetect
+        node=MarkerDetect()
+        detections=[0]
+
+        def detected(msg):
+            detections[0]+=1
+        rospy.Subscriber('/edrone/center_lat_long',center_x_y,detected)
+        if mode=='before':
+            from matplotlib import pyplot as plt
+
+            def show(image,boxes=(),text=None):
+                # the stand-in's frames are read only, as cv_bridge's are from a bytes buffer
+                image=image if image.flags.writeable else image.copy()
+                for x,y,w,h in boxes:
+                    cv2.rectangle(image,(x,y),(x+w,y+h),(255,255,0),2)
+                plt.imshow(cv2.cvtColor(image,cv2.COLOR_BGR2RGB))
+            node.debug_view.enabled=True
+            node.debug_view.show=show
+        msgs=[bridge.cv2_to_imgmsg(image,'bgr8') for image in images]
+        node.bottom_sensor_dist=12.0
+        latencies=[]
+        for i in range(frames):
+            # the drone (at [0, 0, 0] as its setpoint) held there for the marker dwell & a frame at
+            # 30 Hz, so every frame is processed
+            node.frame_wanted()
+            bus.time+=WAYPOINT_KINDS['marker'][2]+1/30.0
+            start=time.perf_counter()
+            node.marker_detect_callback(msgs[i%len(msgs)])
+            latencies.append(time.perf_counter()-start)
+            bus.deliver()
+        assert detections[0],'no frame of {} was processed'.format(mode)
+        latencies=np.array(latencies)*1e3
+        print('  {:40} {:9.2f} {:9.2f} {:11d}'.format('drawn & plt.imshow (before)' if mode=='before' else 'debug_view '+mode,
+                                                      latencies.mean(),np.percentile(latencies,90),detections[0]))
+    shutil.rmtree(directory)
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Cold start & per frame cost of marker_detect with each debug view mode')
+    parser.add_argument('--frames',type=int,default=200)
+    parser.add_argument('--runs',type=int,default=5,help='fresh interpreters for the cold start')
+    args=parser.parse_args(argv)
+    benchmark(args.frames,args.runs)
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
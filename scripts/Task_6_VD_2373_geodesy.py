@@ -0,0 +1,221 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_geodesy.py
+Functions      set_origin,get_frame,load_origin_from_params,x_to_lat,y_to_long,lat_to_x,long_to_y,to_local,to_geodetic,get_dist,pairwise_dist,benchmark
+Global Variables None
+
+
+Conversions between GPS coordinates and the local metric frame.
+
+The local frame is a tangent plane at a configurable origin: x points north and y points west, in
+metres, and altitude is passed through. Metres per degree are the WGS84 meridional & east-west radii
+of curvature at the origin latitude, which is the same projection the gazebo_ros_gps plugin uses to
+produce /edrone/gps. At the default origin (19N, 72E) these are 110692.07 & 105292.01 m/deg.
+
+Every function accepts plain floats/lists or NumPy arrays. Coordinate arguments are [lat, long, alt]
+or arrays of shape (..., 3).
+
+'''
+
+import math
+import time
+import numpy as np
+
+EQUATORIAL_RADIUS = 6378137.0
+FLATTENING = 1.0/298.257223563
+ECCENTRICITY2 = 2*FLATTENING - FLATTENING*FLATTENING
+
+
+class LocalFrame(object):
+    __slots__ = ('origin_lat','origin_long','metres_per_deg_lat','metres_per_deg_long')
+
+    def __init__(self,origin_lat=19.0,origin_long=72.0):
+        self.origin_lat=float(origin_lat)
+        self.origin_long=float(origin_long)
+
+        sin_lat=math.sin(math.radians(self.origin_lat))
+        temp=1.0/(1.0-ECCENTRICITY2*sin_lat*sin_lat)
+        prime_vertical_radius=EQUATORIAL_RADIUS*math.sqrt(temp)
+        radius_north=prime_vertical_radius*(1-ECCENTRICITY2)*temp
+        radius_east=prime_vertical_radius*math.cos(math.radians(self.origin_lat))
+        self.metres_per_deg_lat=radius_north*math.pi/180.0
+        self.metres_per_deg_long=radius_east*math.pi/180.0
+
+    def __repr__(self):
+        return 'LocalFrame({}, {})'.format(self.origin_lat,self.origin_long)
+
+
+_frame=LocalFrame()
+# _frame's numbers as module globals, for the scalar conversions the nodes make every tick
+_origin_lat,_origin_long,_metres_per_deg_lat,_metres_per_deg_long=19.0,72.0,_frame.metres_per_deg_lat,_frame.metres_per_deg_long
+
+
+def set_origin(origin_lat,origin_long):
+    global _frame,_origin_lat,_origin_long,_metres_per_deg_lat,_metres_per_deg_long
+    _frame=LocalFrame(origin_lat,origin_long)
+    _origin_lat,_origin_long,_metres_per_deg_lat,_metres_per_deg_long=_frame.origin_lat,_frame.origin_long,_frame.metres_per_deg_lat,_frame.metres_per_deg_long
+    return _frame
+
+
+def get_frame():
+    return _frame
+
+
+def load_origin_from_params():
+    # Origin from the /origin_lat & /origin_long ROS params, to be called after rospy.init_node
+    import rospy
+    return set_origin(rospy.get_param('/origin_lat',_frame.origin_lat),rospy.get_param('/origin_long',_frame.origin_long))
+
+
+def _array(value):
+    return value if isinstance(value,(float,int,np.ndarray)) else np.asarray(value,dtype=float)
+
+
+# floats, ints & arrays go straight through the arithmetic, lists & tuples of values through _array
+
+
+def x_to_lat(input_x):
+    try:
+        return input_x/_metres_per_deg_lat + _origin_lat
+    except TypeError:
+        return _array(input_x)/_metres_per_deg_lat + _origin_lat
+
+
+def y_to_long(input_y):
+    try:
+        return -input_y/_metres_per_deg_long + _origin_long
+    except TypeError:
+        return -_array(input_y)/_metres_per_deg_long + _origin_long
+
+
+def lat_to_x(input_latitude):
+    try:
+        return _metres_per_deg_lat * (input_latitude - _origin_lat)
+    except TypeError:
+        return _metres_per_deg_lat * (_array(input_latitude) - _origin_lat)
+
+
+def long_to_y(input_longitude):
+    try:
+        return -_metres_per_deg_long * (input_longitude - _origin_long)
+    except TypeError:
+        return -_metres_per_deg_long * (_array(input_longitude) - _origin_long)
+
+
+def _scale():
+    return np.array([_frame.metres_per_deg_lat,-_frame.metres_per_deg_long,1.0])
+
+
+def _origin():
+    return np.array([_frame.origin_lat,_frame.origin_long,0.0])
+
+
+def to_local(coords):
+    # [lat, long, alt] (..., 3) -> [x, y, alt] (..., 3)
+    local=np.subtract(coords,_origin())
+    local*=_scale()
+    return local
+
+
+def to_geodetic(local):
+    # [x, y, alt] (..., 3) -> [lat, long, alt] (..., 3)
+    coords=np.divide(local,_scale())
+    coords+=_origin()
+    return coords
+
+
+def get_dist(coord1,coord2):
+    # Distance (m) between coordinates, element wise (with broadcasting) for arrays of coordinates
+    if not isinstance(coord1,np.ndarray) and not isinstance(coord2,np.ndarray) and len(coord1)==3 and not hasattr(coord1[0],'__len__'):
+        # single pair of points, skip the array overhead
+        dx=_frame.metres_per_deg_lat*(coord2[0]-coord1[0])
+        dy=_frame.metres_per_deg_long*(coord2[1]-coord1[1])
+        dz=coord2[2]-coord1[2]
+        return math.sqrt(dx*dx+dy*dy+dz*dz)
+
+    diff=np.subtract(coord2,coord1,dtype=float)
+    diff*=_scale()
+    return np.sqrt(np.einsum('...i,...i->...',diff,diff))
+
+
+def pairwise_dist(coords1,coords2):
+    # (n, m) matrix of distances (m) between every coordinate of coords1 (n, 3) & of coords2 (m, 3)
+    local1=to_local(np.asarray(coords1,dtype=float).reshape(-1,3))
+    local2=to_local(np.asarray(coords2,dtype=float).reshape(-1,3))
+    dist=np.zeros((len(local1),len(local2)))
+    for axis in range(3):
+        dist+=(local1[:,axis,np.newaxis]-local2[np.newaxis,:,axis])**2
+    return np.sqrt(dist,out=dist)
+
+
+def benchmark(n=10000,repeat=5):
+    # Batch (array) calls vs one point at a time loops over n points. The loops are timed both with
+    # the helpers as they used to be copy-pasted in utils/scheduler and with this module's scalar path.
+    rng=np.random.RandomState(0)
+    coords=np.column_stack((19+rng.uniform(-0.001,0.001,n),72+rng.uniform(-0.001,0.001,n),rng.uniform(5,25,n)))
+    other=coords[::-1].copy()
+    coords_list=coords.tolist()
+    other_list=other.tolist()
+
+    def old_lat_to_x(input_latitude):
+        return 110692.0702932625 * (input_latitude - 19)
+
+    def old_long_to_y(input_longitude):
+        return -105292.0089353767 * (input_longitude - 72)
+
+    def old_x_to_lat(input_x):
+        return input_x/110692.0702932625 + 19
+
+    def old_y_to_long(input_y):
+        return -input_y/(105292.0089353767 )+ 72
+
+    def old_get_dist(coord1,coord2):
+        x1=old_lat_to_x(coord1[0])
+        x2=old_lat_to_x(coord2[0])
+        y1=old_long_to_y(coord1[1])
+        y2=old_long_to_y(coord2[1])
+        z1=coord1[2]
+        z2=coord2[2]
+        return math.sqrt((x2-x1)**2+(y2-y1)**2+(z2-z1)**2)
+
+    def best_of(fn):
+        times=[]
+        for _ in range(repeat):
+            start=time.perf_counter()
+            fn()
+            times.append(time.perf_counter()-start)
+        return min(times)
+
+    m=int(math.sqrt(n))
+    cases=[
+        ('lat/long -> x/y',
+         lambda: [(old_lat_to_x(c[0]),old_long_to_y(c[1]),c[2]) for c in coords_list],
+         lambda: [(lat_to_x(c[0]),long_to_y(c[1]),c[2]) for c in coords_list],
+         lambda: to_local(coords)),
+        ('x/y -> lat/long',
+         lambda: [(old_x_to_lat(c[0]),old_y_to_long(c[1]),c[2]) for c in coords_list],
+         lambda: [(x_to_lat(c[0]),y_to_long(c[1]),c[2]) for c in coords_list],
+         lambda: to_geodetic(coords)),
+        ('get_dist',
+         lambda: [old_get_dist(a,b) for a,b in zip(coords_list,other_list)],
+         lambda: [get_dist(a,b) for a,b in zip(coords_list,other_list)],
+         lambda: get_dist(coords,other)),
+        ('pairwise {}x{}'.format(m,m),
+         lambda: [[old_get_dist(a,b) for b in other_list[:m]] for a in coords_list[:m]],
+         lambda: [[get_dist(a,b) for b in other_list[:m]] for a in coords_list[:m]],
+         lambda: pairwise_dist(coords[:m],other[:m])),
+    ]
+    print('{:<18} {:>14} {:>14} {:>11} {:>12} {:>12}'.format(
+        '{} points'.format(n),'old loop (ms)','new loop (ms)','batch (ms)','vs old loop','vs new loop'))
+    for name,old_loop,new_loop,batch in cases:
+        old_time=best_of(old_loop)
+        new_time=best_of(new_loop)
+        batch_time=best_of(batch)
+        print('{:<18} {:>14.2f} {:>14.2f} {:>11.3f} {:>11.0f}x {:>11.0f}x'.format(
+            name,1000*old_time,1000*new_time,1000*batch_time,old_time/batch_time,new_time/batch_time))
+
+
+if __name__=="__main__":
+    benchmark()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_height_map.py
+Functions      HeightMap,beam_directions,benchmark,main
+Global Variables LAYERS
+
+
+2.5D map of the highest surface in every cell of the local frame (x north, y west, m), from the range
+finders & the drone's pose, for setpoint_control to choose cruise altitudes with ahead of time.
+
+The cells are kept in square tiles of NumPy arrays, made as the drone flies over them, so a map of the
+whole city only holds the tiles seen. Each cell has two layers, altitudes as in the GPS (nan: not seen):
+
+    side        a beam of /edrone/range_finder_top hit something there at that altitude: the surface is at
+                least that high, how much higher is not known
+    surface     /edrone/range_finder_bottom measured the surface there from above
+
+height() of a cell is the higher of the two, in O(1). max_height() is the highest cell within a radius of
+a straight leg, and whether any of those is only known from the side. grid() is a window of both layers
+as arrays, for the path planner (Task_6_VD_2373_path_planner). save() & load() keep the map in a
+.npz file with the local frame's origin, so it is kept between sorties.
+
+Run with --benchmark for the lookup times and for two sorties of a mission through random towers, the
+first with an empty map & the second with the map the first left.
+'''
+
+import argparse
+import math
+import os
+import numpy as np
+
+LAYERS = ('side','surface')
+
+
+def beam_directions(count,angle_min,angle_increment):
+    # unit vectors of the top range finder's beams in the drone's frame (x forward, y left, z up)
+    angles=angle_min+angle_increment*np.arange(count)
+    return np.column_stack([-np.sin(angles),-np.cos(angles),np.zeros(count)])
+
+
+class HeightMap():
+
+    def __init__(self,cell=1.0,tile=32,origin=None):
+        self.cell=float(cell)
+        self.tile=int(tile)
+        # (lat, long) of the local frame the map is in
+        if origin is None:
+            from Task_6_VD_2373_geodesy import get_frame
+            frame=get_frame()
+            origin=(frame.origin_lat,frame.origin_long)
+        self.origin=tuple(origin)
+        # (tile x, tile y): [LAYERS, tile, tile] float32
+        self.tiles={}
+
+    def index(self,x,y):
+        return int(math.floor(x/self.cell)),int(math.floor(y/self.cell))
+
+    def _tile(self,ix,iy,create=False):
+        key=(ix//self.tile,iy//self.tile)
+        tile=self.tiles.get(key)
+        if tile is None and create:
+            tile=self.tiles[key]=np.full((len(LAYERS),self.tile,self.tile),np.nan,np.float32)
+        return tile
+
+    def height(self,x,y):
+        # highest surface known in the cell of (x, y), nan if none
+        ix,iy=self.index(x,y)
+        tile=self._tile(ix,iy)
+        if tile is None:
+            return float('nan')
+        side,surface=tile[:,ix%self.tile,iy%self.tile]
+        return float(np.fmax(side,surface))
+
+    def add(self,layer,x,y,altitude):
+        ix,iy=self.index(x,y)
+        cell=self._tile(ix,iy,True)[:,ix%self.tile,iy%self.tile]
+        cell[layer]=np.fmax(cell[layer],altitude)
+
+    def update_top(self,position,rotation,ranges,angle_min,angle_increment,range_min=0.06,range_max=25.0):
+        # the hits of a top scan, position [x, y, altitude] & rotation (drone to local) of the drone
+        ranges=np.asarray(ranges,dtype=float)
+        hits=(ranges>=range_min)&(ranges<=range_max)
+        if not hits.any():
+            return 0
+        points=np.asarray(position)+ranges[hits,None]*beam_directions(len(ranges),angle_min,angle_increment)[hits].dot(np.asarray(rotation).T)
+        for x,y,altitude in points:
+            self.add(0,x,y,altitude)
+        return len(points)
+
+    def update_bottom(self,position,rotation,distance,range_min=0.06,range_max=25.0):
+        # the surface under the drone, measured along its z axis
+        if not range_min<=distance<=range_max:
+            return False
+        x,y,altitude=np.asarray(position)-distance*np.asarray(rotation)[:,2]
+        self.add(1,x,y,altitude)
+        return True
+
+    def grid(self,ix,iy,nx,ny):
+        # (side, surface) [nx, ny] arrays of the cells from (ix, iy) on, nan where not seen
+        layers=np.full((len(LAYERS),nx,ny),np.nan,np.float32)
+        for tx in range(ix//self.tile,(ix+nx-1)//self.tile+1):
+            for ty in range(iy//self.tile,(iy+ny-1)//self.tile+1):
+                tile=self.tiles.get((tx,ty))
+                if tile is None:
+                    continue
+                x0,y0=max(ix,tx*self.tile),max(iy,ty*self.tile)
+                x1,y1=min(ix+nx,(tx+1)*self.tile),min(iy+ny,(ty+1)*self.tile)
+                layers[:,x0-ix:x1-ix,y0-iy:y1-iy]=tile[:,x0-tx*self.tile:x1-tx*self.tile,y0-ty*self.tile:y1-ty*self.tile]
+        return layers[0],layers[1]
+
+    def max_height(self,start,end,radius=2.0):
+        # (highest altitude known within radius of the leg from start to end [x, y], whether that is only
+        # a side hit), (nan, False) if nothing is known there
+        start,end=np.asarray(start[:2],dtype=float),np.asarray(end[:2],dtype=float)
+        steps=max(int(np.ceil(np.linalg.norm(end-start)/(self.cell/2))),1)
+        points=start+np.linspace(0.0,1.0,steps+1)[:,None]*(end-start)
+        reach=int(np.ceil(radius/self.cell))
+        offsets=np.arange(-reach,reach+1)
+        cells=np.floor(points/self.cell).astype(np.int64)
+        cells=(cells[:,None,None,:]+np.stack(np.meshgrid(offsets,offsets,indexing='ij'),-1)[None]).reshape(-1,2)
+        cells=np.unique(cells,axis=0)
+        best,side_only=float('nan'),False
+        keys=cells//self.tile
+        for key in set(map(tuple,keys)):
+            tile=self.tiles.get(key)
+            if tile is None:
+                continue
+            local=cells[(keys[:,0]==key[0])&(keys[:,1]==key[1])]%self.tile
+            side,surface=tile[:,local[:,0],local[:,1]]
+            heights=np.fmax(side,surface)
+            if np.all(np.isnan(heights)):
+                continue
+            i=int(np.nanargmax(heights))
+            if not heights[i]<=best:
+                best,side_only=float(heights[i]),bool(np.isnan(surface[i]) or surface[i]<side[i])
+        return best,side_only
+
+    def save(self,path):
+        keys=np.array(sorted(self.tiles),dtype=np.int64).reshape(-1,2)
+        tiles=np.array([self.tiles[tuple(key)] for key in keys],dtype=np.float32).reshape(-1,len(LAYERS),self.tile,self.tile)
+        directory=os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # written next to the old one first, so a map is never left half written
+        temporary=path+'.tmp.npz'
+        np.savez_compressed(temporary,keys=keys,tiles=tiles,cell=self.cell,origin=np.array(self.origin))
+        os.replace(temporary,path)
+
+    @classmethod
+    def load(cls,path,origin=None):
+        # the map saved in path, ValueError if it is of another origin than the given one
+        with np.load(path) as data:
+            height_map=cls(float(data['cell']),data['tiles'].shape[-1],tuple(data['origin']))
+            if origin is not None and not np.allclose(height_map.origin,origin,atol=1e-9):
+                raise ValueError('{} is a map around {}, not {}'.format(path,height_map.origin,tuple(origin)))
+            for key,tile in zip(data['keys'],data['tiles']):
+                height_map.tiles[tuple(int(i) for i in key)]=tile
+        return height_map
+
+    def __len__(self):
+        return len(self.tiles)
+
+
+def benchmark(missions=3,obstacles=6,seed=0):
+    import tempfile
+    import time
+    from Task_6_VD_2373_monte_carlo import random_manifest,random_obstacles
+    from Task_6_VD_2373_simulator import Simulator
+
+    height_map=HeightMap(origin=(19.0,72.0))
+    rng=np.random.RandomState(seed)
+    points=rng.uniform(-300,300,(20000,2))
+    for x,y in points:
+        height_map.add(1,x,y,rng.uniform(0,40))
+    start=time.perf_counter()
+    for x,y in points:
+        height_map.height(x,y)
+    lookup=(time.perf_counter()-start)/len(points)
+    start=time.perf_counter()
+    for i in range(100):
+        height_map.max_height(points[i],points[i+1])
+    leg=(time.perf_counter()-start)/100
+    print('{} tiles of {} cells, height() {:.2f} us, max_height() of a {:.0f} m leg {:.2f} ms'.format(
+        len(height_map),height_map.tile**2,lookup*1e6,np.mean(np.linalg.norm(points[1:101]-points[:100],axis=1)),leg*1e3))
+
+    print('{:8} {:8} {:>10} {:>8} {:>16} {:>10} {:>8}'.format('mission','sortie','status','sim s','obstacle events','handled','tiles'))
+    for mission in range(missions):
+        with tempfile.TemporaryDirectory() as directory:
+            mission_rng=np.random.RandomState(seed+mission)
+            manifest=random_manifest(os.path.join(directory,'manifest.csv'),mission_rng)
+            towers=random_obstacles(mission_rng,obstacles,manifest)
+            map_path=os.path.join(directory,'height_map.npz')
+            for sortie in (1,2):
+                sim=Simulator(manifest,seed=seed+mission,obstacles=towers,params={'/setpoint_control/map_path':map_path})
+                result=sim.run()
+                sim.setpoint_control.save_height_map()
+                print('{:8d} {:8d} {:>10} {:8.1f} {:16d} {:>10} {:8d}'.format(mission,sortie,result['status'],result['sim_time'],
+                      result['obstacle_events'],'{}/{}'.format(result['handled'],len(result['parcels'])),len(sim.setpoint_control.height_map)))
+
+
+def main():
+    parser=argparse.ArgumentParser(description='2.5D height map from the range finders')
+    parser.add_argument('--benchmark',action='store_true')
+    parser.add_argument('--missions',type=int,default=3)
+    parser.add_argument('--obstacles',type=int,default=6,help='random towers per mission')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--show',default=None,metavar='PATH',help='summary of a saved map')
+    args=parser.parse_args()
+    if args.show:
+        height_map=HeightMap.load(args.show)
+        heights=np.fmax(*np.stack(list(height_map.tiles.values()),1)) if len(height_map) else np.array([np.nan])
+        print('{} tiles around {}, {} cells known, highest {:.1f} m'.format(len(height_map),height_map.origin,
+              int(np.sum(~np.isnan(heights))),np.nanmax(heights) if np.any(~np.isnan(heights)) else float('nan')))
+    if args.benchmark:
+        benchmark(args.missions,args.obstacles,args.seed)
+
+
+if __name__=="__main__":
+    main()
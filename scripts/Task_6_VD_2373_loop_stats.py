@@ -0,0 +1,99 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_loop_stats.py
+Functions      LoopStats
+Global Variables None
+
+
+Timing statistics of a node's control loop, published as vitarana_drone/loop_stats.
+
+A node brackets the work of every tick with tick_start() & tick_end(), counts what it publishes with
+published() and counts inputs it dropped with skipped(). Every report() covers the ticks since the
+previous report:
+
+    period_*        time between tick starts on the node's clock (sim time for rospy.get_time), s
+    period_jitter   standard deviation of the period, s
+    compute_*       wall time spent between tick_start & tick_end, s
+    cpu_load        compute time / wall time of the window
+    published_rate  messages published per second of wall time
+
+Only running sums are kept, so recording a tick allocates nothing.
+
+'''
+
+import math
+import time
+
+
+class LoopStats():
+    __slots__ = ('node','clock','ticks','periods','skips','publishes','period_sum','period_sq_sum','period_max',
+                 'compute_sum','compute_max','last_start','tick_wall_start','window_start')
+
+    def __init__(self,node,clock=time.time):
+        self.node=node
+        self.clock=clock
+        self.last_start=None
+        self.reset()
+
+    def reset(self):
+        self.ticks=0
+        self.periods=0
+        self.skips=0
+        self.publishes=0
+        self.period_sum=0.0
+        self.period_sq_sum=0.0
+        self.period_max=0.0
+        self.compute_sum=0.0
+        self.compute_max=0.0
+        self.tick_wall_start=None
+        self.window_start=time.perf_counter()
+
+    def tick_start(self):
+        now=self.clock()
+        if self.last_start is not None:
+            period=now-self.last_start
+            self.periods+=1
+            self.period_sum+=period
+            self.period_sq_sum+=period*period
+            if period>self.period_max:
+                self.period_max=period
+        self.last_start=now
+        self.tick_wall_start=time.perf_counter()
+
+    def tick_end(self):
+        compute=time.perf_counter()-self.tick_wall_start
+        self.compute_sum+=compute
+        if compute>self.compute_max:
+            self.compute_max=compute
+        self.ticks+=1
+
+    def published(self,count=1):
+        self.publishes+=count
+
+    def skipped(self,count=1):
+        self.skips+=count
+
+    def report(self,msg):
+        # Fills msg (a loop_stats message, or anything with its fields) & starts a new window
+        window=time.perf_counter()-self.window_start
+        periods=self.periods
+        period_mean=self.period_sum/periods if periods else 0.0
+
+        msg.node=self.node
+        msg.ticks=self.ticks
+        msg.skipped=self.skips
+        msg.window=window
+        msg.rate=self.ticks/window if window>0 else 0.0
+        msg.period_mean=period_mean
+        msg.period_jitter=math.sqrt(max(0.0,self.period_sq_sum/periods-period_mean*period_mean)) if periods else 0.0
+        msg.period_max=self.period_max
+        msg.compute_mean=self.compute_sum/self.ticks if self.ticks else 0.0
+        msg.compute_max=self.compute_max
+        msg.cpu_load=self.compute_sum/window if window>0 else 0.0
+        msg.published_rate=self.publishes/window if window>0 else 0.0
+
+        # last_start is kept, the first tick of the next window measures its period from the last one of this
+        self.reset()
+        return msg
@@ -0,0 +1,190 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_manifest.py
+Functions      parse_row,iter_manifest,read_manifest,index_by_id,format_row,write_sequenced_manifest,get_manifest_paths,benchmark
+Global Variables DEFAULT_MANIFEST,DEFAULT_SEQUENCED_MANIFEST,STATION_SPACING
+
+
+Reading & writing of the parcel manifest.
+
+Manifest rows look like
+
+    DELIVERY,<pickup station>,<lat>;<long>;<alt>
+    RETURN,<lat>;<long>;<alt>,<drop station>
+
+where stations are grid codes such as A1 (pickup grid A/B/C) or X3 (return grid X/Y/Z), STATION_SPACING
+m apart north (letters) & east (numbers). Rows are
+streamed one at a time and validated into ManifestRecords. The id of a record is its 1-based line
+number in the manifest.
+
+'''
+
+import argparse
+import csv
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)),'original.csv')
+DEFAULT_SEQUENCED_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)),'sequenced_manifest.csv')
+
+STATION_PATTERN = re.compile(r'^[A-Z][0-9]+$')
+# m between neighbouring stations of a grid
+STATION_SPACING = 1.5
+
+
+class ManifestRecord(object):
+    # One parcel of the manifest. pickup & drop are [lat, long, alt]; the side given by a station code
+    # stays None until the station is resolved to coordinates.
+    __slots__ = ('id','type','pickup','drop','station')
+
+    def __init__(self,id,type,pickup,drop,station):
+        self.id=id
+        self.type=type
+        self.pickup=pickup
+        self.drop=drop
+        self.station=station
+
+    def __repr__(self):
+        return 'ManifestRecord({}, {}, {}, {}, {})'.format(self.id,self.type,self.pickup,self.drop,self.station)
+
+
+def _parse_coords(field,line_no):
+    coords=field.split(';')
+    if len(coords)!=3:
+        raise ValueError('manifest line {}: expected lat;long;alt, got {!r}'.format(line_no,field))
+    try:
+        coords=[float(coord) for coord in coords]
+    except ValueError:
+        raise ValueError('manifest line {}: non numeric coordinates {!r}'.format(line_no,field))
+    if not all(math.isfinite(coord) for coord in coords):
+        raise ValueError('manifest line {}: non finite coordinates {!r}'.format(line_no,field))
+    return coords
+
+
+def _parse_station(field,line_no):
+    station=field.strip()
+    if not STATION_PATTERN.match(station):
+        raise ValueError('manifest line {}: bad station code {!r}'.format(line_no,field))
+    return station
+
+
+def parse_row(row,line_no):
+    # Validates one csv row into a ManifestRecord, raising ValueError on malformed rows
+    if len(row)!=3:
+        raise ValueError('manifest line {}: expected 3 fields, got {}'.format(line_no,len(row)))
+    kind=row[0].strip()
+    if kind=='DELIVERY':
+        return ManifestRecord(line_no,kind,None,_parse_coords(row[2],line_no),_parse_station(row[1],line_no))
+    elif kind=='RETURN':
+        return ManifestRecord(line_no,kind,_parse_coords(row[1],line_no),None,_parse_station(row[2],line_no))
+    raise ValueError('manifest line {}: unknown parcel type {!r}'.format(line_no,row[0]))
+
+
+def iter_manifest(path):
+    # Generator over the ManifestRecords of the manifest at path, blank lines are skipped
+    with open(path) as csv_file:
+        for line_no,row in enumerate(csv.reader(csv_file,delimiter=','),1):
+            if not row or not ''.join(row).strip():
+                continue
+            yield parse_row(row,line_no)
+
+
+def read_manifest(path):
+    deliveries=[]
+    returns=[]
+    for record in iter_manifest(path):
+        if record.type=='DELIVERY':
+            deliveries.append(record)
+        else:
+            returns.append(record)
+    return deliveries,returns
+
+
+def index_by_id(records):
+    return {record.id:record for record in records}
+
+
+def format_row(record):
+    # csv row of a record, in the same form it is read
+    if record.type=='DELIVERY':
+        return [record.type,record.station,"{};{};{}".format(record.drop[0],record.drop[1],record.drop[2])]
+    return [record.type,"{};{};{}".format(record.pickup[0],record.pickup[1],record.pickup[2]),record.station]
+
+
+def write_sequenced_manifest(path,sequence,index):
+    # Writes the records whose ids are listed in sequence, in that order
+    with open(path,'w') as fhand:
+        writer=csv.writer(fhand)
+        for record_id in sequence:
+            writer.writerow(format_row(index[record_id]))
+
+
+def get_manifest_paths(argv=None):
+    # (manifest, sequenced manifest) paths. Command line arguments win over the node's private
+    # ~manifest & ~sequenced_manifest params, which win over the copies next to this script.
+    manifest=DEFAULT_MANIFEST
+    sequenced_manifest=DEFAULT_SEQUENCED_MANIFEST
+    if argv is None:
+        argv=sys.argv[1:]
+
+    try:
+        import rospy
+        if rospy.core.is_initialized():
+            manifest=rospy.get_param('~manifest',manifest)
+            sequenced_manifest=rospy.get_param('~sequenced_manifest',sequenced_manifest)
+            argv=rospy.myargv(argv)
+    except ImportError:
+        pass
+
+    parser=argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--manifest',default=manifest)
+    parser.add_argument('--sequenced-manifest',default=sequenced_manifest)
+    args,_=parser.parse_known_args(argv)
+    return args.manifest,args.sequenced_manifest
+
+
+def benchmark(rows=100000):
+    # Read & write throughput and peak memory on a synthetic manifest of the given number of rows
+    with tempfile.TemporaryDirectory() as directory:
+        manifest=os.path.join(directory,'manifest.csv')
+        sequenced=os.path.join(directory,'sequenced_manifest.csv')
+        with open(manifest,'w') as fhand:
+            for i in range(rows):
+                if i%2:
+                    fhand.write('RETURN,19.0010389181;72.0000474869;8.38625154198,Z{}\n'.format(i%3+1))
+                else:
+                    fhand.write('DELIVERY,B{},19.0009666461;71.9997245457;5.755246129\n'.format(i%3+1))
+
+        tracemalloc.start()
+        start=time.time()
+        count=sum(1 for _ in iter_manifest(manifest))
+        elapsed=time.time()-start
+        _,peak=tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('stream   {:>8} rows  {:>9.0f} rows/s  peak {:>8.1f} KiB'.format(count,count/elapsed,peak/1024.0))
+
+        tracemalloc.start()
+        start=time.time()
+        deliveries,returns=read_manifest(manifest)
+        index=index_by_id(deliveries+returns)
+        elapsed=time.time()-start
+        _,peak=tracemalloc.get_traced_memory()
+        print('load     {:>8} rows  {:>9.0f} rows/s  peak {:>8.1f} KiB'.format(len(index),len(index)/elapsed,peak/1024.0))
+
+        sequence=sorted(index,reverse=True)
+        start=time.time()
+        write_sequenced_manifest(sequenced,sequence,index)
+        elapsed=time.time()-start
+        tracemalloc.stop()
+        print('write    {:>8} rows  {:>9.0f} rows/s'.format(len(sequence),len(sequence)/elapsed))
+
+
+if __name__=="__main__":
+    benchmark()
@@ -4,45 +4,74 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_marker_detector.py
-Functions      range_finder_bottom_callback,gps_callback,setpoint_callback,check_proximity_setpoint,marker_detect_callback,get_coords_from_img,detect,main
+Functions      range_finder_bottom_callback,gps_callback,state_callback,setpoint_callback,check_proximity_setpoint,frame_wanted,marker_detect_callback,process_frame,get_coords_from_img,detect,main
 Global Variables     none
+
+The marker is found with Task_6_VD_2373_marker_tracker: a full frame search when it is not known yet,
+then the cascade only around the last detection, both at the sizes the marker can have from the bottom
+range finder's distance. ~roi_tracking:=false searches every frame in full (still at those sizes).
+
+Nothing is drawn on the frames unless ~debug_view is topic or disk (Task_6_VD_2373_debug_view), the
+annotated frames then go to /edrone/marker_detect/annotated or to a ring of files on disk.
+
+A frame is searched when the drone has been near /edrone/setpoint for 0.15 s (Task_6_VD_2373_waypoint),
+and the timing starts over with the next frame. Every detection is published on /edrone/center_lat_long once, as soon
+as it is made.
+
+With /state_source:=estimator the drone's position comes from /edrone/state instead of /edrone/gps.
+
+Given a Task_6_VD_2373_vision front end, the node takes its frames from it (only those frame_wanted()
+lets through) instead of subscribing to the camera itself.
 '''
 import cv2,os
-import numpy as np
-from matplotlib import pyplot as plt
-from cv_bridge import CvBridge, CvBridgeError
 
 import rospy
 from vitarana_drone.msg import *
 from sensor_msgs.msg import Image,LaserScan,NavSatFix
-from std_msgs.msg import Float32
+from Task_6_VD_2373_geodesy import load_origin_from_params
+
+from Task_6_VD_2373_marker_tracker import MarkerTracker
+from Task_6_VD_2373_debug_view import DebugView
+from Task_6_VD_2373_vision import image_view
+from Task_6_VD_2373_state_estimator import STATE_TOPIC, state_source
+from Task_6_VD_2373_waypoint import WaypointAcceptance
 
 class MarkerDetect():
 
-    def __init__(self):
+    def __init__(self, front_end=None):
 
-        rospy.init_node("marker_detect")
+        if front_end is None:
+            rospy.init_node("marker_detect")
+        load_origin_from_params()
 
         cc_path='/data/cascade.xml'
         abs_cc_path=os.path.dirname(__file__)+cc_path
         self.logo_cascade = cv2.CascadeClassifier(abs_cc_path)
+        self.tracker = MarkerTracker(self.logo_cascade, tracking=rospy.get_param("~roi_tracking", True))
+        self.debug_view = DebugView("/edrone/marker_detect/annotated")
         
         self.bottom_sensor_dist=None
 
         self.img=None
-        self.bridge = CvBridge()
        
-        self.iterations = 0
+        self.acceptance = WaypointAcceptance()
         self.target=[0,0,0]
         self.drone_position=[0,0,0]
         self.pub_center_pixels = center_x_y()
+        self.new_detection = False
         
         self.center_x_y = rospy.Publisher("/edrone/center_lat_long", center_x_y, queue_size=1)
       
-        rospy.Subscriber("/edrone/camera/image_raw", Image, self.marker_detect_callback) #Subscribing to the camera topic
+        if front_end is None:
+            rospy.Subscriber("/edrone/camera/image_raw", Image, self.marker_detect_callback) #Subscribing to the camera topic
+        else:
+            front_end.register("marker_detect", self.process_frame, self.frame_wanted)
         rospy.Subscriber("/edrone/range_finder_bottom",LaserScan,self.range_finder_bottom_callback)
         rospy.Subscriber("/edrone/setpoint",destination,self.setpoint_callback)
-        rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
+        if state_source() == "estimator":
+            rospy.Subscriber(STATE_TOPIC, drone_state, self.state_callback)
+        else:
+            rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
 
 
     def range_finder_bottom_callback(self,msg):
@@ -54,6 +83,10 @@ class MarkerDetect():
         self.drone_position[1] = msg.longitude
         self.drone_position[2] = msg.altitude
 
+    def state_callback(self, msg):
+        self.drone_position[0] = msg.lat
+        self.drone_position[1] = msg.long
+        self.drone_position[2] = msg.alt
 
 
     def setpoint_callback(self,msg):
@@ -62,52 +95,44 @@ class MarkerDetect():
         self.target[2] = msg.alt
         
     def check_proximity_setpoint(self,target):
-        if (
-            (
-                abs(self.drone_position[0] - target[0])
-                <= 0.0000018 #0.000004517
-            )
-            and (
-                abs(self.drone_position[1] - target[1])
-                <= 0.0000019 #0.0000047487
-            )
-            and (
-                abs(self.drone_position[2] - target[2])
-                <= 0.2
-            )
-        ):
-            if self.iterations>=5:
-                self.iterations=0
-                return True
-            else:
-                self.iterations+=1
-                return False
-        else:
-            self.iterations = 0
-            return False
+        # near the setpoint for 0.15 s (5 frames at 30 Hz), then again
+        return self.acceptance.accept(target,'marker',rospy.get_time(),self.drone_position)
 
 
-    def marker_detect_callback(self,msg):
+    def frame_wanted(self):
+        # frames are only searched near the setpoint
         if self.check_proximity_setpoint(self.target):
-            self.img = self.bridge.imgmsg_to_cv2(msg, "bgr8") # Converting the image to OpenCV standard image
-
-            gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
-            
-            logo = self.logo_cascade.detectMultiScale(gray, scaleFactor=1.05)
-            print(logo)
-            
-            for (x, y, w, h) in logo:
-                cv2.rectangle(self.img, (x, y), (x + w, y + h), (255, 255, 0), 2)
-            
-            plt.imshow(cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB))
-            
-            if len(logo)!=0:
-                self.get_coords_from_img(logo)
-                # plt.show()
-            else:
-                pass
-                # self.pub_center_pixels = center_x_y()            
-            
+            return True
+        if not self.acceptance.waiting('marker'):
+            # away from the setpoint, the marker is searched for in full once back
+            self.tracker.reset()
+        return False
+
+
+    def marker_detect_callback(self,msg):
+        if self.frame_wanted():
+            self.process_frame(image_view(msg, "bgr8")) # the message's buffer as an OpenCV image, not copied
+
+
+    def process_frame(self,img):
+        self.img = img
+
+        box = self.tracker.detect(self.img, self.bottom_sensor_dist)
+        logo = [box] if box is not None else []
+        rospy.logdebug('marker boxes %s',logo)
+        
+        if self.debug_view.enabled:
+            self.debug_view.show(self.img, logo)
+        
+        if len(logo)!=0:
+            self.get_coords_from_img(logo)
+            # published with the frame, so it is read with the pose the drone had when it was taken
+            self.detect()
+            # plt.show()
+        else:
+            pass
+            # self.pub_center_pixels = center_x_y()            
+        
 
     def get_coords_from_img(self,rect):
         
@@ -118,11 +143,16 @@ class MarkerDetect():
         self.pub_center_pixels.y=self.centre_y_pixel
 
         self.pub_center_pixels.square_size=(rect[0][2]+rect[0][3])/2
+        self.new_detection=True
         
     
     def detect(self):
-        print(self.pub_center_pixels)
-        self.center_x_y.publish(self.pub_center_pixels)
+        # every detection is published once, setpoint_control fuses each as a new measurement with the
+        # drone's pose when it gets it
+        if self.new_detection:
+            rospy.logdebug('marker at %s',self.pub_center_pixels)
+            self.center_x_y.publish(self.pub_center_pixels)
+            self.new_detection=False
 
     def reset(self):
         self.center_x_y.publish(center_x_y())
@@ -0,0 +1,244 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_marker_localizer.py
+Functions      rotation_matrix,MarkerLocalizer,benchmark,main
+Global Variables IMG_WIDTH,HFOV,FOCAL_LENGTH,CHI2_GATE
+
+
+Ground position of the landing marker from its detections, for setpoint_control.
+
+project() takes the centre of the marker's box (marker_detect's x & y, pixels from the top left, x
+along the drone's nose, y to its right) through a pinhole model of the downward camera:
+
+    ray             ((x - W/2)/f, -(y - W/2)/f, -1) in the drone's frame (x forward, y left, z up),
+                    rotated into the local frame (x north, y west, z up) by the IMU orientation
+    height          of the camera above the marker's surface: the bottom range finder's distance
+                    along the drone's z axis times cos(tilt), or GPS altitude - the marker's altitude
+                    when the two disagree by more than height_tolerance (the ranger sees another
+                    surface) or there is no range
+    ground point    drone position + the ray scaled down to that height
+
+with a covariance from the pixel (box quantisation), height, attitude & GPS errors. update() fuses the
+points with a Kalman filter of a static point: a point further than the CHI2_GATE (99 %) Mahalanobis
+distance from the estimate is rejected, and max_rejects rejections in a row restart the filter on the
+new point (the first lock was on something else). The estimate is converged once its standard
+deviation is below converged_sigma along every axis.
+
+Run this file for the accuracy & convergence time of this & of the pixel offsets setpoint_control used
+before, on random hovers over a marker with noisy attitude, GPS & range.
+
+'''
+
+import argparse
+import math
+import sys
+import numpy as np
+
+IMG_WIDTH = 400
+HFOV = 1.3962634
+FOCAL_LENGTH = (IMG_WIDTH/2)/math.tan(HFOV/2)
+CHI2_GATE = 9.21                    # 99 % of the chi-square distribution with 2 degrees of freedom
+
+
+def rotation_matrix(quaternion):
+    # drone to local frame rotation of an [x, y, z, w] orientation
+    x,y,z,w=quaternion
+    norm=x*x+y*y+z*z+w*w
+    if norm==0:
+        return np.eye(3)
+    s=2.0/norm
+    return np.array([[1-s*(y*y+z*z),s*(x*y-z*w),s*(x*z+y*w)],
+                     [s*(x*y+z*w),1-s*(x*x+z*z),s*(y*z-x*w)],
+                     [s*(x*z-y*w),s*(y*z+x*w),1-s*(x*x+y*y)]])
+
+
+class MarkerLocalizer():
+
+    def __init__(self,focal_length=FOCAL_LENGTH,img_width=IMG_WIDTH,pixel_sigma=1.0,range_sigma=0.05,attitude_sigma=0.01,
+                 gps_sigma=0.05,height_tolerance=1.0,converged_sigma=0.1,max_rejects=3):
+        self.focal_length=focal_length
+        self.center=img_width/2.0
+        self.pixel_sigma=pixel_sigma
+        self.range_sigma=range_sigma
+        self.attitude_sigma=attitude_sigma     # rad
+        self.gps_sigma=gps_sigma
+        self.height_tolerance=height_tolerance
+        self.converged_sigma=converged_sigma
+        self.max_rejects=max_rejects
+        self.reset()
+
+    def reset(self):
+        self.estimate=None                  # [x, y] (m, local frame)
+        self.covariance=None
+        self.updates=0
+        self.rejects=0
+
+    def project(self,pixel_x,pixel_y,position,orientation,marker_altitude,bottom_range=None):
+        # (ground point [x, y], covariance) of a detection, position [x, y, altitude] of the drone in the
+        # local frame, orientation an [x, y, z, w] quaternion
+        rotation=rotation_matrix(orientation)
+        ray=rotation.dot([(pixel_x-self.center)/self.focal_length,-(pixel_y-self.center)/self.focal_length,-1.0])
+        cos_tilt=rotation[2,2]
+        height=position[2]-marker_altitude
+        height_sigma=self.range_sigma+self.gps_sigma
+        if bottom_range is not None and 0<bottom_range<float('inf'):
+            range_height=bottom_range*cos_tilt
+            if abs(range_height-height)<=self.height_tolerance:
+                height,height_sigma=range_height,self.range_sigma
+        if ray[2]>=0 or height<=0:
+            return None,None
+        scale=height/-ray[2]
+        offset=ray[:2]*scale
+        # pixel, height & attitude errors along each axis, and GPS
+        variance=((scale*self.pixel_sigma/self.focal_length)**2
+                  +(offset*height_sigma/height)**2
+                  +(height*self.attitude_sigma/cos_tilt**2)**2
+                  +self.gps_sigma**2)
+        return np.array([position[0]+offset[0],position[1]+offset[1]]),np.diag(variance)
+
+    def update(self,point,covariance):
+        # fuses a ground point, returns False if it was rejected
+        if self.estimate is None:
+            self.estimate,self.covariance=np.array(point,dtype=float),np.array(covariance,dtype=float)
+            self.updates,self.rejects=1,0
+            return True
+        innovation=point-self.estimate
+        innovation_covariance=self.covariance+covariance
+        if innovation.dot(np.linalg.solve(innovation_covariance,innovation))>CHI2_GATE:
+            self.rejects+=1
+            if self.rejects>=self.max_rejects:
+                self.reset()
+                return self.update(point,covariance)
+            return False
+        gain=self.covariance.dot(np.linalg.inv(innovation_covariance))
+        self.estimate=self.estimate+gain.dot(innovation)
+        self.covariance=(np.eye(2)-gain).dot(self.covariance)
+        self.updates+=1
+        self.rejects=0
+        return True
+
+    def sigma(self):
+        # largest standard deviation of the estimate (m), inf before the first point
+        if self.covariance is None:
+            return float('inf')
+        return math.sqrt(np.linalg.eigvalsh(self.covariance)[-1])
+
+    @property
+    def converged(self):
+        return self.updates>=2 and self.sigma()<=self.converged_sigma
+
+
+def _quaternion(roll,pitch):
+    # as QuadrotorPlant.quaternion, roll about x then pitch about y
+    cr,sr=math.cos(roll/2),math.sin(roll/2)
+    cp,sp=math.cos(pitch/2),math.sin(pitch/2)
+    return [sr*cp,cr*sp,-sr*sp,cr*cp]
+
+
+def _detect(marker,position,orientation,marker_size=2.0):
+    # marker_detect's box centre of a marker at marker [x, y, z], None if out of view
+    rotation=rotation_matrix(orientation)
+    body=rotation.T.dot(np.subtract(marker,position))
+    if body[2]>=0:
+        return None
+    depth=-body[2]
+    center_x=IMG_WIDTH/2+body[0]*FOCAL_LENGTH/depth
+    center_y=IMG_WIDTH/2-body[1]*FOCAL_LENGTH/depth
+    if not (0<=center_x<=IMG_WIDTH and 0<=center_y<=IMG_WIDTH):
+        return None
+    # whole pixel box, as detectMultiScale's
+    size=int(marker_size*FOCAL_LENGTH/depth)
+    return int(center_x-size/2)+size/2.0,int(center_y-size/2)+size/2.0,size
+
+
+def _legacy_point(detection,position,delivery_altitude):
+    # center_lat_long before: offsets by half a box past 100 pixels, no attitude, depth from the
+    # manifest altitude
+    x,y,size=detection
+    x_center,y_center=x-IMG_WIDTH/2,y-IMG_WIDTH/2
+    x_pixel=x_center+size/2 if x_center>=100 else (x_center-size/2 if x_center<=-100 else x_center)
+    y_pixel=y_center+size/2 if y_center>=100 else (y_center-size/2 if y_center<=-100 else y_center)
+    depth=position[2]-delivery_altitude-1
+    return np.array([position[0]+x_pixel*depth/FOCAL_LENGTH,position[1]-y_pixel*depth/FOCAL_LENGTH])
+
+
+def benchmark(runs=500,detections=8,tilt_sigma=2.0,imu_sigma=0.3,gps_sigma=0.05,range_sigma=0.01,offset=3.0,seed=0,tolerance=0.25):
+    # hovers over a marker up to offset m off the search point: a detection a second, the drone flying
+    # to the latest marker setpoint in between (as setpoint_control does)
+    rng=np.random.RandomState(seed)
+    drone_height=0.31
+    print('{} runs, {} detections at 1 Hz, tilt {} deg, IMU {} deg, GPS {} m, range {} m (sigma), marker up to {} m off'.format(
+          runs,detections,tilt_sigma,imu_sigma,gps_sigma,range_sigma,offset))
+    print('{:28} {:>13} {:>11} {:>11} {:>17} {:>10}'.format('','error after 1','final mean','final p90','s to < {} m'.format(tolerance),'converged'))
+    results={}
+    for name in ('pixel offsets (before)','pinhole, one detection','pinhole, fused'):
+        rng.seed(seed)
+        first=[]
+        final=[]
+        settle=[]
+        converged=0
+        for _ in range(runs):
+            surface=rng.uniform(0,20)
+            marker=np.array([rng.uniform(-offset,offset),rng.uniform(-offset,offset),surface])
+            delivery_altitude=surface+drone_height
+            position=np.array([0.0,0.0,surface+rng.uniform(8,20)])
+            localizer=MarkerLocalizer(gps_sigma=gps_sigma,range_sigma=max(range_sigma,0.01))
+            setpoint=None
+            errors=[]
+            for k in range(detections):
+                roll,pitch=np.radians(rng.normal(0,tilt_sigma,2))
+                orientation=_quaternion(roll,pitch)
+                imu=_quaternion(*(np.array([roll,pitch])+np.radians(rng.normal(0,imu_sigma,2))))
+                measured=position+np.append(rng.normal(0,gps_sigma,2),rng.normal(0,gps_sigma))
+                detection=_detect(marker,position,orientation)
+                if detection is not None:
+                    bottom_range=(position[2]-surface)/math.cos(roll)/math.cos(pitch)+rng.normal(0,range_sigma)
+                    if name=='pixel offsets (before)':
+                        point=_legacy_point(detection,measured,delivery_altitude)
+                        # refined only between ~0.5 & ~2.2 m off the marker setpoint
+                        if setpoint is None or 0.5<=np.max(np.abs(point-setpoint))<=2.2:
+                            setpoint=point
+                    else:
+                        point,covariance=localizer.project(detection[0],detection[1],measured,imu,surface,bottom_range)
+                        if point is not None:
+                            if name=='pinhole, fused':
+                                localizer.update(point,covariance)
+                                setpoint=localizer.estimate
+                            else:
+                                setpoint=point
+                errors.append(np.hypot(*(setpoint-marker[:2])) if setpoint is not None else float('inf'))
+                if setpoint is not None:
+                    # flies to the setpoint & hovers there (up to 0.1 m off) by the next detection
+                    position[:2]=setpoint+rng.normal(0,0.05,2)
+            first.append(next((error for error in errors if error<float('inf')),float('inf')))
+            final.append(errors[-1])
+            within=[k for k in range(detections) if all(error<tolerance for error in errors[k:])]
+            settle.append(within[0]+1 if within else float('inf'))
+            converged+=localizer.converged
+        final=np.array(final)
+        settled=np.array(settle)
+        results[name]=final
+        print('{:28} {:13.2f} {:11.3f} {:11.3f} {:17} {:10}'.format(
+              name,np.median(first),final.mean(),np.percentile(final,90),
+              '{:.1f} ({:.0%})'.format(np.median(settled[np.isfinite(settled)]) if np.isfinite(settled).any() else float('nan'),np.isfinite(settled).mean()),
+              '{:.0%}'.format(converged/float(runs)) if name=='pinhole, fused' else '-'))
+    return results
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Accuracy & convergence time of the marker ground estimate')
+    parser.add_argument('--runs',type=int,default=500)
+    parser.add_argument('--detections',type=int,default=8)
+    parser.add_argument('--tilt',type=float,default=2.0,help='roll & pitch sigma at the detections (deg)')
+    parser.add_argument('--imu-sigma',type=float,default=0.3,help='error of the IMU roll & pitch (deg)')
+    parser.add_argument('--gps-sigma',type=float,default=0.05)
+    parser.add_argument('--offset',type=float,default=3.0,help='marker offset from the search point, up to (m)')
+    args=parser.parse_args(argv)
+    benchmark(args.runs,args.detections,args.tilt,args.imu_sigma,args.gps_sigma,offset=args.offset)
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_marker_tracker.py
+Functions      MarkerTracker,bag_sequences,image_sequence,benchmark,main
+Global Variables MARKER_SIZE,HFOV,CASCADE_PATH
+
+
+Landing marker detection for marker_detect: a full search to acquire the marker, then tracking in a
+region of interest around the last detection.
+
+    acquisition   the cascade over the whole frame
+    tracking      the cascade over the last box grown by a margin, which shrinks (down to min_margin)
+                  while the marker keeps being found; after max_misses frames without it, back to a
+                  full search
+
+Both only scan the window sizes the marker can have: with the height above the marker (the bottom
+range finder) the marker is MARKER_SIZE*focal_length/height pixels wide, and the cascade is given that
++-size_tolerance as minSize & maxSize; without a height, tracking keeps to the last box's size. The
+colour conversion is only done on the region that is searched. Boxes are (x, y, w, h) in pixels of the
+whole frame, as detectMultiScale returns them.
+
+Run this file for the per frame latency of the old full frame detectMultiScale(scaleFactor=1.05) & of
+the tracker on the camera frames of the recorded flights (Task_6_VD_2373_bag_replay renders them from
+the recorded poses), or on a directory of saved frames with --images.
+
+'''
+
+import argparse
+import glob
+import math
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+MARKER_SIZE = 2.0                   # side of the landing marker (m)
+HFOV = 1.3962634                    # horizontal field of view of the camera (rad)
+CASCADE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),'data','cascade.xml')
+
+
+class MarkerTracker():
+
+    def __init__(self,cascade=None,scale_factor=1.05,size_tolerance=0.35,margin=1.0,min_margin=0.5,shrink=0.7,
+                 max_misses=2,marker_size=MARKER_SIZE,hfov=HFOV,tracking=True):
+        self.cascade=cascade if cascade is not None else cv2.CascadeClassifier(CASCADE_PATH)
+        self.scale_factor=scale_factor
+        self.size_tolerance=size_tolerance
+        # margins around the last box, in box sizes
+        self.margin=margin
+        self.min_margin=min_margin
+        self.shrink=shrink
+        self.max_misses=max_misses
+        self.marker_size=marker_size
+        self.hfov=hfov
+        self.tracking=tracking
+        self.box=None
+        self.roi_margin=margin
+        self.misses=0
+        # searches of each kind, for the benchmark & the nodes' logs
+        self.full_searches=0
+        self.roi_searches=0
+
+    def reset(self):
+        # the next frame starts with a full search
+        self.box=None
+        self.roi_margin=self.margin
+        self.misses=0
+
+    def expected_size(self,width,height):
+        # side of the marker (pixels) in a frame width pixels wide, height m above it; None if unknown
+        if height is None or not 0<height<float('inf'):
+            return None
+        focal_length=(width/2.0)/math.tan(self.hfov/2)
+        return self.marker_size*focal_length/height
+
+    def _size_range(self,size,limit):
+        # (minSize, maxSize) of detectMultiScale for a marker ~size pixels wide, (0, 0)s for no limit
+        if size is None:
+            return (0,0),(0,0)
+        low=max(int(size*(1-self.size_tolerance)),1)
+        high=min(int(math.ceil(size*(1+self.size_tolerance))),limit)
+        if low>high:
+            return None
+        return (low,low),(high,high)
+
+    def _search(self,image,x0,y0,x1,y1,size):
+        # boxes found in image[y0:y1, x0:x1], in whole frame pixels
+        sizes=self._size_range(size,min(x1-x0,y1-y0))
+        if sizes is None:
+            return []
+        region=image[y0:y1,x0:x1]
+        gray=cv2.cvtColor(region,cv2.COLOR_BGR2GRAY) if region.ndim==3 else region
+        boxes=self.cascade.detectMultiScale(gray,scaleFactor=self.scale_factor,minSize=sizes[0],maxSize=sizes[1])
+        return [(int(x)+x0,int(y)+y0,int(w),int(h)) for x,y,w,h in boxes]
+
+    def detect(self,image,height=None):
+        # box of the marker in a BGR (or grayscale) frame, height m above the marker if known, or None
+        rows,cols=image.shape[:2]
+        size=self.expected_size(cols,height)
+        if self.tracking and self.box is not None:
+            x,y,w,h=self.box
+            margin=int(math.ceil(self.roi_margin*max(w,h)))
+            x0,y0=max(x-margin,0),max(y-margin,0)
+            x1,y1=min(x+w+margin,cols),min(y+h+margin,rows)
+            self.roi_searches+=1
+            boxes=self._search(image,x0,y0,x1,y1,size if size is not None else (w+h)/2.0)
+            if boxes:
+                # the one closest to the last detection
+                cx,cy=x+w/2.0,y+h/2.0
+                self.box=min(boxes,key=lambda b: (b[0]+b[2]/2.0-cx)**2+(b[1]+b[3]/2.0-cy)**2)
+                self.roi_margin=max(self.roi_margin*self.shrink,self.min_margin)
+                self.misses=0
+                return self.box
+            self.misses+=1
+            # the marker moved further than the region, look around more next time
+            self.roi_margin=self.margin
+            if self.misses<self.max_misses:
+                return None
+            self.reset()
+
+        self.full_searches+=1
+        boxes=self._search(image,0,0,cols,rows,size)
+        if not boxes:
+            self.box=None
+            return None
+        if size is not None:
+            box=min(boxes,key=lambda b: abs((b[2]+b[3])/2.0-size))
+        else:
+            box=boxes[0]
+        if self.tracking:
+            self.box=box
+            self.roi_margin=self.margin
+            self.misses=0
+        return box
+
+
+def bag_sequences(bag_paths=None,min_frames=5):
+    # [(name, [(BGR frame, height above the marker (m))])] of the recorded flights, one sequence per
+    # stretch of model states with a marker in view, as marker_detect would get them
+    import Task_6_VD_2373_bag_replay as bag_replay
+    from Task_6_VD_2373_bag_reader import BagReader
+
+    sequences=[]
+    for path in bag_paths or sorted(glob.glob(os.path.join(bag_replay.BAG_DIR,'*.bag'))):
+        states=[msg for _,msg,_ in BagReader(path).read_messages([bag_replay.MODEL_STATES_TOPIC]) if bag_replay.DRONE_MODEL in msg.name]
+        if not states:
+            continue
+        world=bag_replay.world_from_model_states(states[0])
+        frames=[]
+        for msg in states+[None]:
+            in_view=False
+            if msg is not None:
+                pose=msg.pose[msg.name.index(bag_replay.DRONE_MODEL)].position
+                x,y,z=pose.x,pose.y,pose.z+bag_replay.DRONE_HEIGHT
+                for mx,my,mz in world.markers:
+                    height=z-mz
+                    half=bag_replay.IMG_WIDTH/2.0
+                    if height>0.5 and abs(mx-x)*bag_replay.FOCAL_LENGTH/height<half and abs(my-y)*bag_replay.FOCAL_LENGTH/height<half:
+                        in_view=True
+                        break
+            if in_view:
+                frames.append((bag_replay.render_frame(world,(x,y,z)),height))
+            elif frames:
+                if len(frames)>=min_frames:
+                    sequences.append(('{} #{}'.format(os.path.basename(path),len(sequences)+1),frames))
+                frames=[]
+    return sequences
+
+
+def image_sequence(directory):
+    # [(name, [(BGR frame, None)])] of the .png/.jpg frames of a directory, in name order
+    paths=sorted(path for path in glob.glob(os.path.join(directory,'*')) if path.lower().endswith(('.png','.jpg','.jpeg')))
+    return [(os.path.basename(os.path.normpath(directory)),[(cv2.imread(path),None) for path in paths])]
+
+
+def _full_frame(cascade,image):
+    # marker_detect_callback's detection before the tracker
+    gray=cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+    return cascade.detectMultiScale(gray,scaleFactor=1.05)
+
+
+def benchmark(sequences,repeat=1):
+    cascade=cv2.CascadeClassifier(CASCADE_PATH)
+    clock=time.perf_counter
+    frames=sum(len(frames) for _,frames in sequences)
+    print('{} sequences, {} frames of {}'.format(len(sequences),frames,'x'.join(str(n) for n in sequences[0][1][0][0].shape[1::-1])))
+    print('{:32} {:>9} {:>9} {:>9} {:>9} {:>8} {:>9}'.format('per frame','mean ms','p50 ms','p90 ms','p99 ms','fps','detected'))
+    results={}
+    for name in ('full frame (before)','tracker','tracker, no height'):
+        latencies=[]
+        boxes=[]
+        tracker=MarkerTracker(cascade)
+        for _ in range(repeat):
+            for _,sequence in sequences:
+                tracker.reset()
+                for image,height in sequence:
+                    start=clock()
+                    if name=='full frame (before)':
+                        found=_full_frame(cascade,image)
+                        box=tuple(found[0]) if len(found) else None
+                    else:
+                        box=tracker.detect(image,height if name=='tracker' else None)
+                    latencies.append(clock()-start)
+                    boxes.append(box)
+        latencies=np.array(latencies)*1e3
+        results[name]=boxes
+        print('{:32} {:9.2f} {} {:8.0f} {:9.1%}'.format(name,latencies.mean(),' '.join('{:9.2f}'.format(v) for v in np.percentile(latencies,(50,90,99))),
+              1e3/latencies.mean(),sum(box is not None for box in boxes)/float(len(boxes))))
+        if name!='full frame (before)':
+            print('{:32} {} full searches, {} region searches'.format('',tracker.full_searches,tracker.roi_searches))
+
+    # where both found the marker, how far apart the centres are
+    reference=results['full frame (before)']
+    for name in ('tracker','tracker, no height'):
+        offsets=[math.hypot(a[0]+a[2]/2.0-b[0]-b[2]/2.0,a[1]+a[3]/2.0-b[1]-b[3]/2.0)
+                 for a,b in zip(results[name],reference) if a is not None and b is not None]
+        if offsets:
+            print('{}: centre {:.2f} px from the full frame detection on average ({:.2f} px max)'.format(name,np.mean(offsets),np.max(offsets)))
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Per frame latency of the marker detection, full frame & tracked')
+    parser.add_argument('bags',nargs='*',help='bags to take the camera frames from (default: all of bag_files/)')
+    parser.add_argument('--images',metavar='DIR',help='directory of saved frames to use instead of the bags')
+    parser.add_argument('--repeat',type=int,default=1)
+    args=parser.parse_args(argv)
+    sequences=image_sequence(args.images) if args.images else bag_sequences(args.bags)
+    if not sequences or not any(frames for _,frames in sequences):
+        parser.error('no frames with a marker in view')
+    benchmark(sequences,args.repeat)
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_mission.py
+Functions      Leg,compile_plan,MissionStateMachine,benchmark,main
+Global Variables MISSION_STATES,LEG_STATES
+
+
+The mission of setpoint_control as a state machine, over the legs of the manifest's sequence compiled once
+when the plan is set, instead of flags worked out from the setpoint queue on every loop.
+
+compile_plan() makes a deque of legs: a pickup & a drop for each parcel of the sequence & home at the end.
+setpoint_control pops the next one when a parcel is attached or let go, & the leg's kind gives the state
+it starts in. The states:
+
+    takeoff         up to 2 m over the start
+    to_pickup       a leg to over a pickup (the first one straight across, the others over the height map)
+    descend         down the pickup's column, 7 m at a time, its altitude taken from the bottom range
+    attach          held at the parcel until the gripper has it
+    to_drop         a leg to over a drop
+    marker_search   over a delivery, down to it & then up a metre at a time until the marker is localized
+    precision_drop  onto the marker (a delivery) or the return grid's cell (a return), & let go
+    home            the leg back to the start
+    done            held at the start
+
+MissionStateMachine calls the function of the state on every loop, & the enter & exit hooks of the states
+on a change. It counts the entries & the time (of its clock, rospy time in the nodes) of every state, so
+breakdown() is where the seconds of a sortie went.
+
+Run with --benchmark for the breakdown of simulated missions.
+'''
+
+import argparse
+import collections
+
+MISSION_STATES = ('takeoff','to_pickup','descend','attach','to_drop','marker_search','precision_drop','home','done')
+# state a leg starts in
+LEG_STATES = {'pickup':'to_pickup','drop':'to_drop','home':'home'}
+
+
+class Leg():
+    # One leg of the plan. kind is pickup, drop or home, target [lat, long, alt], instruction the parcel's
+    # DELIVERY or RETURN (None home), straight: flown straight across at the drone's altitude
+    __slots__ = ('kind','target','instruction','straight')
+
+    def __init__(self,kind,target,instruction=None,straight=False):
+        self.kind=kind
+        self.target=list(target)
+        self.instruction=instruction
+        self.straight=straight
+
+    def __repr__(self):
+        return 'Leg({}, {}, {}{})'.format(self.kind,self.target,self.instruction,', straight' if self.straight else '')
+
+
+def compile_plan(parcels_coords,parcels_delivery_coords,instructions,home):
+    # the legs of the sequence: the pickup & drop of every parcel, the first pickup (by the start) flown
+    # straight from the takeoff, then home
+    legs=collections.deque()
+    for i,(pickup,drop,instruction) in enumerate(zip(parcels_coords,parcels_delivery_coords,instructions)):
+        legs.append(Leg('pickup',pickup,instruction,i==0))
+        legs.append(Leg('drop',drop,instruction))
+    legs.append(Leg('home',home))
+    return legs
+
+
+class MissionStateMachine():
+
+    def __init__(self,clock,states=MISSION_STATES):
+        self.clock=clock
+        # state: (run, enter, exit)
+        self.handlers={state:(None,None,None) for state in states}
+        self.state=None
+        self.since=None
+        self.times=dict.fromkeys(states,0.0)
+        self.entries=dict.fromkeys(states,0)
+
+    def add(self,state,run,enter=None,exit=None):
+        self.handlers[state]=(run,enter,exit)
+
+    def go(self,state):
+        # leaves the state for state, the enter hook last so it may go on to another one
+        now=self.clock()
+        if self.state is not None:
+            self.times[self.state]+=now-self.since
+            exit=self.handlers[self.state][2]
+            if exit is not None:
+                exit()
+        self.state,self.since=state,now
+        self.entries[state]+=1
+        enter=self.handlers[state][1]
+        if enter is not None:
+            enter()
+
+    def run(self):
+        run=self.handlers[self.state][0]
+        if run is not None:
+            run()
+
+    def elapsed(self):
+        # time in the state so far
+        return self.clock()-self.since
+
+    def breakdown(self):
+        # state: time spent in it, the current one up to now
+        times=dict(self.times)
+        if self.state is not None:
+            times[self.state]+=self.elapsed()
+        return times
+
+
+def benchmark(manifest=None,missions=2,seed=0):
+    import os
+    import tempfile
+    import time
+    import numpy as np
+    from Task_6_VD_2373_monte_carlo import random_manifest
+    from Task_6_VD_2373_simulator import Simulator
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifests=[('original',manifest)]
+        for mission in range(missions):
+            path=os.path.join(directory,'manifest_{}.csv'.format(mission))
+            manifests.append(('random {}'.format(mission),random_manifest(path,np.random.RandomState(seed+mission))))
+        print('{:10} {:>10} {:>8} {:>8} {:>10}  {}'.format('manifest','status','sim s','parcels','loop us','s in state (entries)'))
+        for name,path in manifests:
+            sim=Simulator(path,seed=seed)
+            sc=sim.setpoint_control
+            setpoint_control=sc.setpoint_control
+            loop=[]
+
+            def timed():
+                start=time.perf_counter()
+                setpoint_control()
+                loop.append(time.perf_counter()-start)
+            sc.setpoint_control=timed
+            result=sim.run()
+            times=sc.mission.breakdown()
+            print('{:10} {:>10} {:8.1f} {:>8} {:10.1f}  {}'.format(name,result['status'],result['sim_time'],
+                  '{}/{}'.format(result['handled'],len(result['parcels'])),np.mean(loop)*1e6,
+                  ', '.join('{} {:.1f} ({})'.format(state,times[state],sc.mission.entries[state]) for state in MISSION_STATES)))
+
+
+def main():
+    parser=argparse.ArgumentParser(description='Mission state machine of setpoint_control')
+    parser.add_argument('--benchmark',action='store_true')
+    parser.add_argument('--manifest',default=None)
+    parser.add_argument('--missions',type=int,default=2,help='random manifests after the given one')
+    parser.add_argument('--seed',type=int,default=0)
+    args=parser.parse_args()
+    if args.benchmark:
+        benchmark(args.manifest,args.missions,args.seed)
+
+
+if __name__=="__main__":
+    main()
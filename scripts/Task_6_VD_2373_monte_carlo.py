@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_monte_carlo.py
+Functions      random_manifest,random_obstacles,make_missions,run_mission,evaluate,save_results,load_results,summarize,main
+Global Variables COLUMNS
+
+
+Batch Monte Carlo evaluation of the mission stack with the offline simulator (Task_6_VD_2373_simulator).
+
+Every mission gets its own random manifest (deliveries from random pickup stations to random buildings,
+returns from random buildings to random return stations), its own sensor noise seed and optionally random
+towers in the way. Missions are run on a process pool, and the results are collected into one column per
+metric, saved as a NumPy .npz file:
+
+    mission, seed, status, sim_time, wall_time, distance, parcels, handled, failed_pickups,
+    obstacle_events, callback_errors, placement_error_max, placement_error_mean
+
+status is complete, crashed, timeout or error (an exception in the stack, kept in reason). Aggregates are
+printed at the end of a run, or for a saved file with --summarize. --param sets a ROS param of the nodes
+for every mission, to compare configurations on the same missions (same --seed).
+
+    python Task_6_VD_2373_monte_carlo.py --missions 200 --output results.npz
+    python Task_6_VD_2373_monte_carlo.py --missions 200 --param position_controller/trajectory_mode:=steps
+
+'''
+
+import argparse
+import csv
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import numpy as np
+
+from Task_6_VD_2373_geodesy import lat_to_x,long_to_y,x_to_lat,y_to_long
+from Task_6_VD_2373_manifest import ManifestRecord,format_row,STATION_SPACING
+
+# (name, dtype) of the result columns
+COLUMNS = (('mission',np.int64),('seed',np.int64),('status','U8'),('sim_time',np.float64),('wall_time',np.float64),
+           ('distance',np.float64),('parcels',np.int64),('handled',np.int64),('failed_pickups',np.int64),
+           ('obstacle_events',np.int64),('callback_errors',np.int64),('placement_error_max',np.float64),('placement_error_mean',np.float64),
+           ('reason','U200'))
+
+# area the manifests are drawn from (the one of original.csv) & the start point of the setpoint control
+LAT_RANGE = (18.9988,19.00104)
+LONG_RANGE = (71.9993,72.00096)
+DROP_ALT_RANGE = (5.5,22.5)
+START_COORDS = (18.99988879058862,72.00021844012868,16.757980880739165)
+PICKUP_STATIONS = ['{}{}'.format(row,column) for row in 'ABC' for column in (1,2,3)]
+RETURN_STATIONS = ['{}{}'.format(row,column) for row in 'XYZ' for column in (1,2,3)]
+
+MIN_SPACING = 15.0          # between sampled buildings, and to the station grids (m)
+
+
+def _sample_points(rng,count,keep_clear,spacing=MIN_SPACING):
+    # count local [x, y] points in the area, spacing apart from each other & from keep_clear
+    x_range=(lat_to_x(LAT_RANGE[0]),lat_to_x(LAT_RANGE[1]))
+    y_range=sorted((long_to_y(LONG_RANGE[0]),long_to_y(LONG_RANGE[1])))
+    points=[]
+    for _ in range(1000*max(count,1)):
+        if len(points)==count:
+            break
+        point=[rng.uniform(*x_range),rng.uniform(*y_range)]
+        if all(math.hypot(point[0]-other[0],point[1]-other[1])>=spacing for other in list(keep_clear)+points):
+            points.append(point)
+    else:
+        if len(points)<count:
+            raise ValueError('could not place {} points {} m apart in the manifest area'.format(count,spacing))
+    return points
+
+
+def _station_area():
+    # local [x, y] of the start & a few points over the pickup & return grids
+    points=[[lat_to_x(START_COORDS[0]),long_to_y(START_COORDS[1])]]
+    for lat,long in ((18.9998102845,72.000142461),(18.9999367615,72.000142461)):
+        for i in range(3):
+            for j in range(3):
+                # north (x) along the letters, east (-y) along the numbers
+                points.append([lat_to_x(lat)+i*STATION_SPACING,long_to_y(long)-j*STATION_SPACING])
+    return points
+
+
+def random_manifest(path,rng,deliveries=9,returns=9):
+    # Writes a manifest of random deliveries & returns, each station used at most once
+    if deliveries>len(PICKUP_STATIONS) or returns>len(RETURN_STATIONS):
+        raise ValueError('at most {} deliveries & {} returns, one per station'.format(len(PICKUP_STATIONS),len(RETURN_STATIONS)))
+    points=_sample_points(rng,deliveries+returns,_station_area())
+    pickup_stations=rng.permutation(PICKUP_STATIONS)[:deliveries]
+    return_stations=rng.permutation(RETURN_STATIONS)[:returns]
+
+    records=[]
+    for i,(x,y) in enumerate(points):
+        coords=[x_to_lat(x),y_to_long(y),rng.uniform(*DROP_ALT_RANGE)]
+        if i<deliveries:
+            records.append(ManifestRecord(i+1,'DELIVERY',None,coords,str(pickup_stations[i])))
+        else:
+            records.append(ManifestRecord(i+1,'RETURN',coords,None,str(return_stations[i-deliveries])))
+    rng.shuffle(records)
+    with open(path,'w') as fhand:
+        writer=csv.writer(fhand)
+        for record in records:
+            writer.writerow(format_row(record))
+    return path
+
+
+def random_obstacles(rng,count,manifest_path,size=4.0,top_range=(20.0,40.0)):
+    # (x, y, size, top) towers clear of the buildings & stations of a manifest
+    from Task_6_VD_2373_manifest import read_manifest
+    deliveries,returns=read_manifest(manifest_path)
+    keep_clear=_station_area()
+    keep_clear+=[[lat_to_x(record.drop[0]),long_to_y(record.drop[1])] for record in deliveries]
+    keep_clear+=[[lat_to_x(record.pickup[0]),long_to_y(record.pickup[1])] for record in returns]
+    points=_sample_points(rng,count,keep_clear,spacing=size+6.0)
+    return [(x,y,size,rng.uniform(*top_range)) for x,y in points]
+
+
+def make_missions(count,seed=0,**options):
+    # Mission specs: one seed per mission, the other options are passed on to run_mission
+    seeds=np.random.RandomState(seed).randint(0,2**31-1,size=count)
+    return [dict(options,mission=i,seed=int(mission_seed)) for i,mission_seed in enumerate(seeds)]
+
+
+def run_mission(spec):
+    # Runs one mission in this process, returns a row of COLUMNS as a dict
+    from Task_6_VD_2373_simulator import simulate
+
+    rng=np.random.RandomState(spec['seed'])
+    row={'mission':spec['mission'],'seed':spec['seed'],'status':'error','sim_time':np.nan,'wall_time':np.nan,
+         'distance':np.nan,'parcels':spec.get('deliveries',9)+spec.get('returns',9),'handled':0,'failed_pickups':0,
+         'obstacle_events':0,'callback_errors':0,'placement_error_max':np.nan,'placement_error_mean':np.nan,'reason':''}
+    directory=tempfile.mkdtemp()
+    start=time.perf_counter()
+    try:
+        manifest=random_manifest(os.path.join(directory,'manifest.csv'),rng,spec.get('deliveries',9),spec.get('returns',9))
+        obstacles=random_obstacles(rng,spec.get('obstacles',0),manifest)
+        result=simulate(manifest,spec.get('max_time',3600.0),planner=spec.get('planner','pairing'),
+                        pairing_mode=spec.get('pairing_mode','optimal'),physics_dt=spec.get('physics_dt',0.001),
+                        marker_offset=spec.get('marker_offset',0.0),gps_noise=spec.get('gps_noise',0.0),
+                        seed=spec['seed'],obstacles=obstacles,params=spec.get('params'))
+        errors=[parcel['placement_error'] for parcel in result['parcels']]
+        row.update({key:result[key] for key in ('status','reason','sim_time','wall_time','distance','handled','failed_pickups','obstacle_events','callback_errors')})
+        row['placement_error_max']=max(errors)
+        row['placement_error_mean']=sum(errors)/len(errors)
+    except Exception:
+        # one broken mission should not take the batch down
+        row['wall_time']=time.perf_counter()-start
+        row['reason']=traceback.format_exc().strip().splitlines()[-1]
+    finally:
+        shutil.rmtree(directory,ignore_errors=True)
+    return row
+
+
+def evaluate(specs,processes=None,progress=True):
+    # Runs the missions on a process pool, returns {column: array} in mission order
+    rows=[]
+    start=time.time()
+    pool=multiprocessing.Pool(processes)
+    try:
+        for row in pool.imap_unordered(run_mission,specs):
+            rows.append(row)
+            if progress:
+                print('[{:>4}/{}] mission {:>4} {:<8} {:>7.1f} s sim {:>6.1f} s wall  ({:.0f} s elapsed)'.format(
+                    len(rows),len(specs),row['mission'],row['status'],row['sim_time'],row['wall_time'],time.time()-start))
+    finally:
+        pool.close()
+        pool.join()
+    rows.sort(key=lambda row: row['mission'])
+    return {name:np.array([row[name] for row in rows],dtype=dtype) for name,dtype in COLUMNS}
+
+
+def save_results(path,columns,**metadata):
+    # metadata (e.g. the evaluation options) is stored as 0-d arrays next to the columns
+    np.savez_compressed(path,**dict(columns,**{'meta_'+key:np.array(value) for key,value in metadata.items()}))
+
+
+def load_results(path):
+    with np.load(path) as data:
+        return {name:data[name] for name,_ in COLUMNS if name in data}
+
+
+def summarize(columns):
+    status=columns['status']
+    count=len(status)
+    print('{} missions: {}'.format(count,', '.join('{} {}'.format(np.count_nonzero(status==name),name)
+                                                  for name in ('complete','crashed','timeout','error'))))
+    if not count:
+        return
+    complete=status=='complete'
+    print('')
+    print('{:<28} {:>10} {:>10} {:>10} {:>10}'.format('','mean','median','p90','max'))
+    for label,values in (('sim time, complete (s)',columns['sim_time'][complete]),
+                         ('distance, complete (m)',columns['distance'][complete]),
+                         ('placement error max (m)',columns['placement_error_max'][complete]),
+                         ('failed pickups',columns['failed_pickups']),
+                         ('obstacle events',columns['obstacle_events']),
+                         ('callback errors',columns['callback_errors']),
+                         ('wall time (s)',columns['wall_time'])):
+        values=values[np.isfinite(values)]
+        if len(values):
+            print('{:<28} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(label,values.mean(),np.median(values),np.percentile(values,90),values.max()))
+    handled=columns['handled'].sum()
+    parcels=columns['parcels'].sum()
+    print('')
+    print('{} of {} parcels handled ({:.1f} %)'.format(handled,parcels,100.0*handled/parcels if parcels else 0.0))
+    for mission,reason in zip(columns['mission'][~complete],columns['reason'][~complete]):
+        print('  mission {:>4}: {}'.format(mission,reason))
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Monte Carlo evaluation of the mission stack on random manifests')
+    parser.add_argument('--missions',type=int,default=20)
+    parser.add_argument('--processes',type=int,default=None,help='pool size, all cores by default')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--deliveries',type=int,default=9)
+    parser.add_argument('--returns',type=int,default=9)
+    parser.add_argument('--obstacles',type=int,default=0,help='random towers per mission')
+    parser.add_argument('--gps-noise',type=float,default=0.0,help='standard deviation of the GPS noise (m)')
+    parser.add_argument('--marker-offset',type=float,default=0.0,help='largest marker offset from the manifest (m)')
+    parser.add_argument('--planner',default='pairing',choices=('pairing','route'))
+    parser.add_argument('--pairing-mode',default='optimal')
+    parser.add_argument('--max-time',type=float,default=3600.0,help='sim time limit of a mission (s)')
+    parser.add_argument('--physics-dt',type=float,default=0.001)
+    parser.add_argument('--param',action='append',default=[],metavar='NAME:=VALUE',
+                        help='ROS param for the nodes of every mission, as the simulator\'s --param (repeatable)')
+    parser.add_argument('--output',default='monte_carlo_results.npz')
+    parser.add_argument('--summarize',metavar='RESULTS',help='print the statistics of a saved results file & exit')
+    args=parser.parse_args(argv)
+
+    if args.summarize:
+        summarize(load_results(args.summarize))
+        return 0
+
+    options=dict(deliveries=args.deliveries,returns=args.returns,obstacles=args.obstacles,gps_noise=args.gps_noise,
+                 marker_offset=args.marker_offset,planner=args.planner,pairing_mode=args.pairing_mode,
+                 max_time=args.max_time,physics_dt=args.physics_dt)
+    from Task_6_VD_2373_simulator import parse_param
+    params=dict(parse_param(param) for param in args.param)
+    start=time.time()
+    columns=evaluate(make_missions(args.missions,args.seed,params=params,**options),args.processes)
+    elapsed=time.time()-start
+    save_results(args.output,columns,seed=args.seed,params=' '.join(args.param),**options)
+    print('')
+    summarize(columns)
+    print('')
+    print('{} missions in {:.0f} s ({:.0f} missions/hour), results in {}'.format(args.missions,elapsed,3600*args.missions/elapsed,args.output))
+    return 0
+
+
+if __name__=="__main__":
+    main()
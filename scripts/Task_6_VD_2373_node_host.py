@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_node_host.py
+Functions      LocalPublisher,NodeHost,start_nodes,main,benchmark
+Global Variables NODES
+
+
+The nodes of the drone in one process, with the messages between them handed over in the process.
+
+Run as a node (drone_stack, launch/task_6.launch single_process:=true) it constructs the node classes
+of NODES in this one interpreter, each inside NodeHost.node(name), which stands in for the parts of
+rospy the node sets itself up with:
+
+    init_node       only names the node: get_name() & the ~params resolve to /<node>/..., so the params
+                    of the separate nodes apply as they are
+    Publisher       the messages go straight to the subscribers in the process (copied once per publish,
+                    on the publisher's thread, no serialisation or socket), and to ROS only while something
+                    outside the process subscribes (Gazebo's propellers on /edrone/pwm, rosbag, rqt)
+    Subscriber      a topic published in the process is only taken from the process; every other topic
+                    (the sensors) gets one ROS subscription that the nodes of the process share
+
+The main loops run on rospy Timers, each on a thread of its own, at the rates of the separate nodes.
+~nodes (comma separated, default all of NODES) picks the nodes to host; the others can still run as
+separate nodes. A topic published both in & outside the process is only taken from the process.
+
+Run with --benchmark for the latency from the sensors to /edrone/pwm within one control tick, the CPU
+time per tick & the memory & start up time of the nodes as separate processes & hosted in one. The ROS
+transport between processes is modelled: a TCP connection over loopback per subscription, the message
+serialised on the publisher's side & deserialised on a receive thread of the subscriber, as rospy does.
+
+'''
+
+import argparse
+import collections
+import contextlib
+import copy
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+NODES = ('state_estimator','setpoint_control','obstacle','setpoint_selector','position_controller','attitude_controller','marker_detect','qr_detect')
+
+
+class LocalPublisher():
+
+    def __init__(self,host,name,data_class,**kwargs):
+        self.host=host
+        self.name=name
+        self.topic=host.topic(name,data_class)
+        self.topic['publishers']+=1
+        # for the subscribers outside the process
+        self.remote=host.rospy_attrs['Publisher'](name,data_class,**kwargs)
+
+    def publish(self,msg):
+        if self.remote.get_num_connections()>0:
+            self.remote.publish(msg)
+        self.host.deliver(self.topic,msg)
+
+    def get_num_connections(self):
+        return self.remote.get_num_connections()+len(self.topic['callbacks'])
+
+    def unregister(self):
+        self.topic['publishers']-=1
+        self.remote.unregister()
+
+
+class _LocalSubscriber():
+
+    def __init__(self,topic,entry):
+        self.topic=topic
+        self.entry=entry
+
+    def unregister(self):
+        if self.entry in self.topic['callbacks']:
+            self.topic['callbacks'].remove(self.entry)
+
+
+class NodeHost():
+    # rospy attributes replaced while a node is constructed
+    PATCHED = ('init_node','get_name','get_param','set_param','has_param','Publisher','Subscriber')
+
+    def __init__(self):
+        import rospy
+        self.rospy=rospy
+        self.rospy_attrs={name:getattr(rospy,name) for name in self.PATCHED}
+        self.topics=collections.OrderedDict()
+        self.remote_subscribers=[]
+        # messages handed over & callbacks that raised
+        self.delivered=0
+        self.errors=0
+
+    def topic(self,name,data_class):
+        if name not in self.topics:
+            self.topics[name]={'name':name,'data_class':data_class,'publishers':0,'callbacks':[]}
+        return self.topics[name]
+
+    @contextlib.contextmanager
+    def node(self,name):
+        # constructs a node inside: its rospy setup goes through the host
+        rospy=self.rospy
+        real=self.rospy_attrs
+        prefix='/{}/'.format(name)
+
+        def resolve(param):
+            return prefix+param[1:] if param.startswith('~') else param
+
+        def subscriber(topic,data_class,callback=None,callback_args=None,**kwargs):
+            entry=(callback,callback_args)
+            local=self.topic(topic,data_class)
+            local['callbacks'].append(entry)
+            return _LocalSubscriber(local,entry)
+
+        rospy.init_node=lambda node_name,*args,**kwargs: None
+        rospy.get_name=lambda: '/'+name
+        rospy.get_param=lambda param,*default: real['get_param'](resolve(param),*default)
+        rospy.set_param=lambda param,value: real['set_param'](resolve(param),value)
+        rospy.has_param=lambda param: real['has_param'](resolve(param))
+        rospy.Publisher=lambda topic,data_class,**kwargs: LocalPublisher(self,topic,data_class,**kwargs)
+        rospy.Subscriber=subscriber
+        try:
+            yield
+        finally:
+            for attr,value in real.items():
+                setattr(rospy,attr,value)
+
+    def connect(self):
+        # one ROS subscription for every topic the nodes take that none of them publishes
+        for topic in self.topics.values():
+            if topic['callbacks'] and not topic['publishers']:
+                self.remote_subscribers.append(self.rospy.Subscriber(topic['name'],topic['data_class'],self.fan_out,callback_args=topic))
+
+    def fan_out(self,msg,topic):
+        for callback,args in topic['callbacks']:
+            self._call(topic,callback,args,msg)
+
+    def deliver(self,topic,msg):
+        if not topic['callbacks']:
+            return
+        # the subscribers may keep the message, the publisher may change its own after
+        msg=copy.deepcopy(msg)
+        for callback,args in topic['callbacks']:
+            self._call(topic,callback,args,msg)
+
+    def _call(self,topic,callback,args,msg):
+        self.delivered+=1
+        try:
+            if args is None:
+                callback(msg)
+            else:
+                callback(msg,args)
+        except Exception as e:
+            # as rospy does, a failing callback is logged & the others carry on
+            self.errors+=1
+            self.rospy.logerr('bad callback on {}: {!r}'.format(topic['name'],e))
+
+
+def start_nodes(host,names=NODES,plan=True):
+    # constructs the nodes of names through host, returns ({name: node}, [(name, rate, loop body)]); with
+    # plan the setpoint control plans the manifest as its main() does
+    import rospy
+    from Task_6_VD_2373_state_estimator import StateEstimator,state_source
+    from Task_6_VD_2373_plan_cache import get_cached_set_point_sequence
+    nodes=collections.OrderedDict()
+    loops=[]
+    if 'state_estimator' in names and state_source()=='estimator':
+        with host.node('state_estimator'):
+            nodes['state_estimator']=StateEstimator()
+    if 'setpoint_control' in names:
+        from Task_6_VD_2373_setpoint_control import SetpointControl
+        with host.node('setpoint_control'):
+            sc=nodes['setpoint_control']=SetpointControl()
+            if plan:
+                sc.set_plan(*get_cached_set_point_sequence(
+                    rospy.get_param('~plan_cache',os.path.join(os.path.expanduser('~'),'.ros','Task_6_VD_2373_plans')),
+                    rospy.get_param('~pairing_mode','optimal'),rospy.get_param('~planner','pairing'),
+                    sc.start_coords,rospy.get_param('~route_time_budget',1.0)))
+        rospy.on_shutdown(sc.reset)
+        loops.append(('setpoint_control',50.0,sc.setpoint_control))
+    if 'obstacle' in names:
+        from Task_6_VD_2373_obstacle import Obstacle
+        with host.node('obstacle'):
+            obs=nodes['obstacle']=Obstacle()
+        rospy.on_shutdown(obs.reset)
+
+        def obstacle_loop():
+            if all(obs.drone_position):
+                obs.obs_avoid()
+            obs.setpoint_pub.publish(obs.pub_msg)
+        loops.append(('obstacle',50.0,obstacle_loop))
+    if 'setpoint_selector' in names:
+        from Task_6_VD_2373_setpoint_selector import Selector
+        with host.node('setpoint_selector'):
+            selector=nodes['setpoint_selector']=Selector()
+        loops.append(('setpoint_selector',50.0,selector.check))
+    if 'position_controller' in names:
+        from Task_6_VD_2373_position_controller import Edrone as PositionController
+        with host.node('position_controller'):
+            position=nodes['position_controller']=PositionController()
+
+        def position_loop():
+            if all(position.drone_position) and all(position.subscribed_target):
+                position.pid()
+        loops.append(('position_controller',50.0,position_loop))
+    if 'attitude_controller' in names:
+        from Task_6_VD_2373_attitude_controller import Edrone as AttitudeController
+        with host.node('attitude_controller'):
+            attitude=nodes['attitude_controller']=AttitudeController()
+        rospy.on_shutdown(attitude.reset)
+    if 'marker_detect' in names or 'qr_detect' in names:
+        # one camera subscription for both, as the vision node
+        from Task_6_VD_2373_vision import VisionFrontEnd
+        with host.node('vision'):
+            front_end=nodes['vision']=VisionFrontEnd()
+        if 'marker_detect' in names:
+            from Task_6_VD_2373_marker_detect import MarkerDetect
+            with host.node('marker_detect'):
+                marker=nodes['marker_detect']=MarkerDetect(front_end)
+            rospy.on_shutdown(marker.reset)
+            loops.append(('marker_detect',1.0,marker.detect))
+        if 'qr_detect' in names:
+            from Task_6_VD_2373_qr_detect import image_proc
+            with host.node('qr_detect'):
+                qr=nodes['qr_detect']=image_proc(front_end)
+            loops.append(('qr_detect',10.0,lambda: qr.qr_publisher.publish(qr.scanned_coords)))
+    host.connect()
+    return nodes,loops
+
+
+def main():
+    import rospy
+    rospy.init_node('drone_stack')
+    names=[name.strip() for name in rospy.get_param('~nodes',','.join(NODES)).split(',') if name.strip()]
+    unknown=set(names)-set(NODES)
+    if unknown:
+        raise ValueError('~nodes can only have {}, got {}'.format(', '.join(NODES),', '.join(sorted(unknown))))
+    host=NodeHost()
+    nodes,loops=start_nodes(host,names)
+    for _,rate,body in loops:
+        rospy.Timer(rospy.Duration(1.0/rate),lambda event,body=body: body())
+    rospy.loginfo('hosting {}'.format(', '.join(nodes)))
+    rospy.spin()
+
+
+# ----------------------------------------- benchmark --------------------------------------------------------
+
+_uint32 = struct.Struct('<I')
+
+
+def _serializer(cls,classes):
+    # write(msg, parts) appends the ROS serialisation of a generated message to parts, the counterpart of
+    # Task_6_VD_2373_bag_reader.deserializer
+    from Task_6_VD_2373_bag_reader import PRIMITIVE_FORMATS
+    package=cls._type.split('/')[0]
+    fields=[]
+    for name,field_type in zip(cls._fields,cls._slot_types):
+        base=field_type.split('[')[0]
+        if base=='Header':
+            base='std_msgs/Header'
+        elif base not in PRIMITIVE_FORMATS and base not in ('string','time','duration') and '/' not in base:
+            base=package+'/'+base
+        fields.append((name,base,'[' in field_type))
+
+    def write_value(base,value,parts):
+        if base in PRIMITIVE_FORMATS:
+            parts.append(struct.pack('<'+PRIMITIVE_FORMATS[base],value))
+        elif base=='string':
+            data=value.encode('utf-8')
+            parts.append(_uint32.pack(len(data))+data)
+        elif base in ('time','duration'):
+            secs=value.to_sec() if hasattr(value,'to_sec') else float(value)
+            parts.append(struct.pack('<II',int(secs),int(round((secs-int(secs))*1e9))))
+        else:
+            _serializer(classes[base],classes)(value,parts)
+
+    def write(msg,parts):
+        for name,base,array in fields:
+            value=getattr(msg,name)
+            if not array:
+                write_value(base,value,parts)
+            elif base in ('uint8','char'):
+                parts.append(_uint32.pack(len(value))+bytes(value))
+            elif base in PRIMITIVE_FORMATS:
+                parts.append(_uint32.pack(len(value))+struct.pack('<{}{}'.format(len(value),PRIMITIVE_FORMATS[base]),*value))
+            else:
+                parts.append(_uint32.pack(len(value)))
+                for item in value:
+                    write_value(base,item,parts)
+    return write
+
+
+class _TcpLink():
+    # a TCPROS connection between two processes as rospy makes it: the publisher serialises the message &
+    # writes it to a loopback TCP socket, the subscriber's receive thread reads & deserialises it & calls
+    # the callback
+
+    def __init__(self,callback,args,classes,counters):
+        self.callback=callback
+        self.args=args
+        self.classes=classes
+        self.counters=counters
+        self.write=None
+        self.read=None
+        listener=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1',0))
+        listener.listen(1)
+        self.sender=socket.create_connection(listener.getsockname())
+        self.sender.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        receiver,_=listener.accept()
+        listener.close()
+        self.thread=threading.Thread(target=self._receive,args=(receiver,))
+        self.thread.daemon=True
+        self.thread.start()
+
+    def send(self,msg,args=None):
+        from Task_6_VD_2373_bag_reader import deserializer
+        if self.write is None:
+            self.write=_serializer(type(msg),self.classes)
+            self.read=deserializer(type(msg),self.classes)
+        parts=[]
+        self.write(msg,parts)
+        data=b''.join(parts)
+        with self.counters['lock']:
+            self.counters['sent']+=1
+            self.counters['bytes']+=len(data)
+        self.sender.sendall(_uint32.pack(len(data))+data)
+
+    def _receive(self,receiver):
+        buffer=b''
+        while True:
+            chunk=receiver.recv(65536)
+            if not chunk:
+                return
+            buffer+=chunk
+            while len(buffer)>=4 and len(buffer)>=4+_uint32.unpack_from(buffer)[0]:
+                length=_uint32.unpack_from(buffer)[0]
+                msg=self.read(buffer,4)[0]
+                buffer=buffer[4+length:]
+                try:
+                    if self.args is None:
+                        self.callback(msg)
+                    else:
+                        self.callback(msg,self.args)
+                finally:
+                    with self.counters['lock']:
+                        self.counters['received']+=1
+
+    def close(self):
+        self.sender.close()
+
+
+_MEMORY = '''
+import resource,sys,time
+start=time.perf_counter()
+sys.argv=['node']
+import Task_6_VD_2373_ros_stand_in as ros_stand_in
+ros_stand_in.install()
+bus=ros_stand_in.activate(ros_stand_in.Bus({{'/state_source':'sensors'}}))
+import rospy
+from Task_6_VD_2373_node_host import NodeHost,start_nodes
+start_nodes(NodeHost(),{names!r},plan=False)
+print(time.perf_counter()-start,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def _process(names):
+    # (start up s, peak RSS MB) of a fresh interpreter running the nodes of names
+    output=subprocess.check_output([sys.executable,'-c',_MEMORY.format(names=tuple(names))],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    startup,rss=output.split()[-2:]
+    return float(startup),float(rss)/1024.0
+
+
+def _wait_idle(bus,counters,timeout=1.0):
+    # delivers the queued messages until every one sent over a link has been handled
+    deadline=time.perf_counter()+timeout
+    while True:
+        bus.deliver()
+        with counters['lock']:
+            idle=counters['received']==counters['sent']
+        if idle and not bus.queue:
+            return
+        if time.perf_counter()>deadline:
+            raise RuntimeError('messages lost on the links')
+        time.sleep(0)
+
+
+def _tick_chain(hosted,ticks):
+    # latencies (s) from the sensors to /edrone/pwm with the loops run back to back, CPU s per tick,
+    # messages & bytes over links per tick
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+
+    bus=ros_stand_in.activate(ros_stand_in.Bus({'/state_source':'sensors'}))
+    import rospy
+    from sensor_msgs.msg import Imu,LaserScan,NavSatFix
+    from vitarana_drone.msg import prop_speed
+    from Task_6_VD_2373_geodesy import x_to_lat,y_to_long
+
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+        rospy.init_node('gazebo')
+        gps_pub=rospy.Publisher('/edrone/gps',NavSatFix,queue_size=1)
+        imu_pub=rospy.Publisher('/edrone/imu/data',Imu,queue_size=1)
+        top_pub=rospy.Publisher('/edrone/range_finder_top',LaserScan,queue_size=1)
+        bottom_pub=rospy.Publisher('/edrone/range_finder_bottom',LaserScan,queue_size=1)
+        received=threading.Event()
+        rospy.Subscriber('/edrone/pwm',prop_speed,lambda msg: received.set())
+
+        if hosted:
+            nodes,_=start_nodes(NodeHost(),NODES,plan=False)
+        else:
+            # each node as it is constructed on its own
+            nodes,_=start_nodes(_SeparateHost(),NODES,plan=False)
+        sc=nodes['setpoint_control']
+        manifest=os.path.join(os.path.dirname(os.path.abspath(__file__)),'original.csv')
+        from Task_6_VD_2373_utils import get_set_point_sequence
+        with tempfile.TemporaryDirectory() as directory:
+            sc.set_plan(*get_set_point_sequence(
+                'optimal','pairing',sc.start_coords,1.0,manifest_path=manifest,
+                sequenced_manifest_path=os.path.join(directory,'sequenced_manifest.csv')))
+        nodes['qr_detect'].decoder.stop()
+
+    classes={cls._type:cls for kinds in ros_stand_in.MESSAGES.values() for kind in kinds.values() for cls in kind.values()}
+    counters={'lock':threading.Lock(),'sent':0,'received':0,'bytes':0}
+    links=[]
+    for topic,entries in bus.subscribers.items():
+        for i,(callback,args) in enumerate(entries):
+            link=_TcpLink(callback,args,classes,counters)
+            links.append(link)
+            entries[i]=(link.send,None)
+
+    gps,imu,top,bottom=NavSatFix(),Imu(),LaserScan(),LaserScan()
+    top.ranges=[float('inf')]*5
+    bottom.ranges=[0.3]
+    imu.orientation.w=1.0
+    obs=nodes['obstacle']
+    latencies=[]
+    cpu_start=time.process_time()
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+        for tick in range(ticks):
+            bus.time+=0.02
+            gps.latitude,gps.longitude,gps.altitude=x_to_lat(0.01*tick),y_to_long(0.0),0.31
+            start=time.perf_counter()
+            received.clear()
+            # the sensors, the loops back to back & the IMU the attitude controller runs on
+            for publisher,msg in ((gps_pub,gps),(top_pub,top),(bottom_pub,bottom)):
+                publisher.publish(msg)
+            _wait_idle(bus,counters)
+            sc.setpoint_control()
+            _wait_idle(bus,counters)
+            if all(obs.drone_position):
+                obs.obs_avoid()
+            obs.setpoint_pub.publish(obs.pub_msg)
+            _wait_idle(bus,counters)
+            nodes['setpoint_selector'].check()
+            _wait_idle(bus,counters)
+            position=nodes['position_controller']
+            if all(position.drone_position) and all(position.subscribed_target):
+                position.pid()
+            _wait_idle(bus,counters)
+            imu_pub.publish(imu)
+            _wait_idle(bus,counters)
+            if not received.wait(1.0):
+                raise RuntimeError('no /edrone/pwm after the IMU')
+            latencies.append(time.perf_counter()-start)
+    cpu=(time.process_time()-cpu_start)/ticks
+    for link in links:
+        link.close()
+    return np.array(latencies),cpu,counters['sent']/float(ticks),counters['bytes']/float(ticks),len(links)
+
+
+class _SeparateHost():
+    # start_nodes as the separate nodes set themselves up: straight on rospy
+
+    def node(self,name):
+        return contextlib.nullcontext()
+
+    def connect(self):
+        pass
+
+
+def benchmark(ticks=500,runs=3):
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+    print('control tick: sensors -> setpoint_control -> obstacle -> selector -> position -> IMU -> attitude -> /edrone/pwm')
+    print('{:28} {:>6} {:>11} {:>9} {:>12} {:>12} {:>11}'.format('{} ticks'.format(ticks),'links','latency ms','p90 ms','CPU ms/tick','msgs/tick','bytes/tick'))
+    for name,hosted in (('separate nodes',False),('one process',True)):
+        latencies,cpu,messages,data,links=_tick_chain(hosted,ticks)
+        latencies*=1e3
+        print('  {:26} {:6d} {:11.3f} {:9.3f} {:12.3f} {:12.1f} {:11.0f}'.format(name,links,latencies.mean(),np.percentile(latencies,90),cpu*1e3,messages,data))
+
+    print('start up, best of {}       processes   start up s   peak RSS MB'.format(runs))
+    separate=np.min([[_process((name,)) for name in NODES if name!='state_estimator'] for _ in range(runs)],axis=0)
+    hosted=np.min([_process([name for name in NODES if name!='state_estimator']) for _ in range(runs)],axis=0)
+    print('  {:26} {:11d} {:12.2f} {:13.1f}'.format('separate nodes',len(separate),separate[:,0].sum(),separate[:,1].sum()))
+    print('  {:26} {:11d} {:12.2f} {:13.1f}'.format('one process',1,hosted[0],hosted[1]))
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description='The nodes of the drone in one process')
+    parser.add_argument('--benchmark',action='store_true',help='latency, CPU & memory of separate & hosted nodes instead of running them')
+    parser.add_argument('--ticks',type=int,default=500)
+    # roslaunch adds __name:= & __log:= arguments
+    args=parser.parse_known_args()[0]
+    if args.benchmark:
+        benchmark(args.ticks)
+    else:
+        main()
@@ -6,16 +6,18 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharv Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_obstacle.py
-Functions       gps_callback,imu_callback,setpoint_callback,check_gripper,check_proximity,check_proximity_with_iter,check_lat_long_proximity,range_finder_top_callback,range_finder_bottom_callbackget_side_point,stop,obs_detected,obs_avoid,reset
+Functions       gps_callback,imu_callback,state_callback,setpoint_callback,gripper_state_callback,check_gripper,check_proximity,check_proximity_with_iter,check_lat_long_proximity,range_finder_top_callback,range_finder_bottom_callbackget_side_point,stop,obs_detected,obs_avoid,reset
 Global Variables None
 
 
 Node responsible for avoiding and publishing the setpoint to do so.
 
 This node publishes and subsribes the following topics:
-    PUBLICATIONS                SUBSCRIPTIONS                   SERVICES
-    /edrone/obstacle_setpoint   /edrone/range_finder_top        /edrone/activate_gripper
+    PUBLICATIONS                SUBSCRIPTIONS
+    /edrone/obstacle_setpoint   /edrone/range_finder_top
                                 /edrone/range_finder_bottom
+                                /edrone/gripper_state
+                                /edrone/gps & /edrone/imu/data (or /edrone/state with /state_source:=estimator)
 
 '''
 
@@ -26,10 +28,11 @@ import time
 import tf
 from vitarana_drone.msg import *
 from sensor_msgs.msg import Imu, NavSatFix,LaserScan
-from vitarana_drone.srv import Gripper
 
 # util functions
 from Task_6_VD_2373_utils import *
+from Task_6_VD_2373_state_estimator import STATE_TOPIC, state_source
+from Task_6_VD_2373_waypoint import WaypointAcceptance
 
 
 class Obstacle():
@@ -37,6 +40,7 @@ class Obstacle():
     def __init__(self):
 
         rospy.init_node('obstacle')
+        load_origin_from_params()
 
         self.obstacle_detected_bottom=False
         self.obstacle_detected_top=False
@@ -51,7 +55,8 @@ class Obstacle():
 
         self.go_up_counter=0
         self.setpoint=[0,0,0]
-        self.iterations=0
+        # the side point held for 1 s (avoid), the setpoint in sight within 2.5 m (lateral)
+        self.acceptance=WaypointAcceptance()
         
         self.avoiding=False
         self.pub_msg=destination()
@@ -69,12 +74,16 @@ class Obstacle():
         # Subscribers
         rospy.Subscriber("/edrone/range_finder_top",LaserScan,self.range_finder_top_callback)
         # rospy.Subscriber("/edrone/range_finder_bottom",LaserScan,self.range_finder_bottom_callback)
-        rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
+        if state_source()=="estimator":
+            rospy.Subscriber(STATE_TOPIC,drone_state,self.state_callback)
+        else:
+            rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
+            rospy.Subscriber("/edrone/imu/data", Imu, self.imu_callback)
         rospy.Subscriber("/edrone/setpoint",destination,self.setpoint_callback)
-        rospy.Subscriber("/edrone/imu/data", Imu, self.imu_callback)
 
-        # Services
-        self.gripper = rospy.ServiceProxy('/edrone/activate_gripper',Gripper())
+        # the gripper's state as gripper_service last published it, read instead of calling the service
+        self.gripper_state=gripper_state()
+        rospy.Subscriber("/edrone/gripper_state",gripper_state,self.gripper_state_callback)
 
 
     def gps_callback(self, msg):
@@ -102,89 +111,37 @@ class Obstacle():
             ]
         )
     
+    def state_callback(self,msg):
+        self.drone_position[0]=msg.lat
+        self.drone_position[1]=msg.long
+        self.drone_position[2]=msg.alt
+        self.drone_orientation_euler[0]=msg.pitch
+        self.drone_orientation_euler[1]=msg.roll
+        self.drone_orientation_euler[2]=msg.yaw
+
     def setpoint_callback(self,msg):
         self.subs_setpoint[0]=msg.lat
         self.subs_setpoint[1]=msg.long
         self.subs_setpoint[2]=msg.alt
 
+    def gripper_state_callback(self,msg):
+        self.gripper_state=msg
+
     def check_gripper(self):
-        try:
-            resp=self.gripper(True)
-            if str(resp).split(' ')[1] == 'True':
-                self.parcel_picked=True
-        except Exception as e:
-            print("check_gripper",e)
+        if self.gripper_state.attached_box:
+            self.parcel_picked=True
 
 
     def check_proximity(self,target,current=None):
-        
-        if current is None:
-            current = self.drone_position
-
-        if (
-            (
-                abs(current[0] - target[0])
-                <= 0.000004517/3 #0.000004517
-            )
-            and (
-                abs(current[1] - target[1])
-                <= 0.0000047487/3 #0.0000047487
-            )
-            and (
-                abs(current[2] - target[2])
-                <= 0.2
-            )
-        ):
-            return True
-        else:
-            return False
+        return self.acceptance.near(target,'avoid',current if current is not None else self.drone_position)
 
 
     def check_proximity_with_iter(self,target,current=None):
-        
-        if current is None:
-            current = self.drone_position
-
-        if (
-            (
-                abs(current[0] - target[0])
-                <= 0.000004517/3 #0.000004517
-            )
-            and (
-                abs(current[1] - target[1])
-                <= 0.0000047487/3 #0.0000047487
-            )
-            and (
-                abs(current[2] - target[2])
-                <= 0.2
-            )
-        ):
-            if self.iterations>=50:
-                return True
-            else:
-                self.iterations+=1
-                return False
-        else:
-            self.iterations = 0
-            return False
+        return self.acceptance.accept(target,'avoid',rospy.get_time(),current if current is not None else self.drone_position)
 
 
     def check_lat_long_proximity(self,target,current=None):
-        
-        if current is None:
-            current = self.drone_position
-
-        if (
-            (
-                abs(current[0] - target[0])<= 0.000004517*5 #0.000004517
-            )
-            and (
-                abs(current[1] - target[1])<= 0.0000047487*5 #0.0000047487
-            )
-        ):  
-            return True
-        else:
-            return False
+        return self.acceptance.near(target,'lateral',current if current is not None else self.drone_position)
 
 
     def range_finder_top_callback(self,msg):
@@ -289,7 +246,9 @@ class Obstacle():
 
 
     def obs_avoid(self):
-        if (self.drone_position[0]-self.last_point[0]>=0.00004517/4) or  (self.drone_position[1]-self.last_point[1]>=0.000047487/4) or  (self.drone_position[2]-self.last_point[2]>=0.1): 
+        # the last point catches up with the drone every 1.25 m it flies north or east (0.1 m up), get_side_point()
+        # steps aside from the line between them (y is west)
+        if (lat_to_x(self.drone_position[0])-lat_to_x(self.last_point[0])>=1.25) or  (long_to_y(self.last_point[1])-long_to_y(self.drone_position[1])>=1.25) or  (self.drone_position[2]-self.last_point[2]>=0.1): 
             self.last_point=list(self.drone_position)
 
         if self.obstacle_detected_top:
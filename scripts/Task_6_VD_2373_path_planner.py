@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_path_planner.py
+Functions      PathPlanner,path_length,climb_cruise_descend,benchmark,main
+Global Variables None
+
+
+Theta* over the height map (Task_6_VD_2373_height_map) for the legs of setpoint_control: the shortest
+path from the drone to above a pickup or a delivery that keeps clear of everything the map has.
+
+The map is made a grid of ~cell m columns, each with the lowest altitude it may be flown over at: the
+highest surface within radius of it + clearance, or a side hit within radius + side_extent of it +
+side_clearance. The columns within exempt_radius of the two ends are left out, those are the buildings taken
+off from & landed on. A path is made of level legs & climbs, flown no lower than min_altitude away from
+the two ends' columns, and only goes down in the goal's column: a descent on the way would be taken
+for a pickup by setpoint_control's queue. The states are (column, altitude) with the altitudes the map
+asks for above min_altitude, in steps of level_step m; the cost is the distance flown (level +
+vertical) & the heuristic the straight distance over + the height to go, which no path beats. Theta*
+lets a leg go straight from a state's parent at any angle when nothing is in the way at the higher
+of the two altitudes.
+
+Paths are cached by the columns of their ends & the altitudes in 1 m. The map only gets higher, so a
+cached path which is still clear is still the shortest one, it is checked against the map & reused.
+
+Run with --benchmark for the planning times on maps of increasing size & the distance flown against the
+climb, cruise & descend legs.
+'''
+
+import argparse
+import collections
+import heapq
+import math
+import time
+import numpy as np
+
+# 8 level moves of the grid
+MOVES = ((1,0),(-1,0),(0,1),(0,-1),(1,1),(1,-1),(-1,1),(-1,-1))
+
+
+class PathPlanner():
+
+    def __init__(self,height_map,cell=2.0,clearance=3.0,side_clearance=15.0,radius=1.0,side_extent=5.0,margin=30.0,exempt_radius=5.0,
+                 level_step=1.0,max_altitude=120.0,max_expansions=200000,cache_size=256):
+        self.height_map=height_map
+        # columns of whole map cells
+        self.ratio=max(int(round(cell/height_map.cell)),1)
+        self.cell=self.ratio*height_map.cell
+        self.clearance=clearance
+        self.side_clearance=side_clearance
+        self.radius=radius
+        self.side_extent=side_extent
+        self.margin=margin
+        self.exempt_radius=exempt_radius
+        self.level_step=level_step
+        self.max_altitude=max_altitude
+        self.max_expansions=max_expansions
+        self.cache=collections.OrderedDict()
+        self.cache_size=cache_size
+        self.hits=0
+        self.misses=0
+        # of the last search
+        self.expansions=0
+        # points along a line of each length, for clear()
+        self.fractions={}
+
+    def window(self,points):
+        # (column index of the corner, columns) of the grid around points [x, y]
+        points=np.asarray(points,dtype=float)[:,:2]
+        low=np.floor((points.min(0)-self.margin)/self.cell).astype(int)
+        high=np.floor((points.max(0)+self.margin)/self.cell).astype(int)+1
+        return low,high-low
+
+    def floors(self,low,shape,ends=()):
+        # lowest altitude each column of the window may be flown over at, -inf where nothing is known
+        layers=self.height_map.grid(int(low[0])*self.ratio,int(low[1])*self.ratio,int(shape[0])*self.ratio,int(shape[1])*self.ratio)
+        floor=np.full(shape,-np.inf)
+        # a side hit is grown by side_extent more, how far it goes on behind is not known either
+        for layer,clearance,radius in zip(layers,(self.side_clearance,self.clearance),(self.radius+self.side_extent,self.radius)):
+            grown=np.where(np.isnan(layer),-np.inf,layer+clearance).reshape(shape[0],self.ratio,shape[1],self.ratio).max(axis=(1,3))
+            reach=int(math.ceil(radius/self.cell))
+            # along x, then y
+            for axis in (0,1):
+                padded=np.pad(grown,[(reach,reach) if i==axis else (0,0) for i in (0,1)],mode='constant',constant_values=-np.inf)
+                for shift in range(2*reach+1):
+                    grown=np.maximum(grown,padded[shift:shift+shape[0]] if axis==0 else padded[:,shift:shift+shape[1]])
+            floor=np.maximum(floor,grown)
+        centres=(low+0.5+np.stack(np.meshgrid(np.arange(shape[0]),np.arange(shape[1]),indexing='ij'),-1))*self.cell
+        for end in ends:
+            floor[np.linalg.norm(centres-np.asarray(end[:2]),axis=-1)<=self.exempt_radius]=-np.inf
+        return floor
+
+    def levels(self,floor,altitudes,min_altitude):
+        # altitudes of the states: the ends', min_altitude & the floors above it in level_step steps
+        above=floor[(floor>min_altitude)&(floor<=self.max_altitude)]
+        steps=np.unique(np.ceil((above-min_altitude)/self.level_step-1e-9))
+        return sorted(set([min_altitude]+list(altitudes)+[float(min_altitude+step*self.level_step) for step in steps]))
+
+    def clear(self,floor,a,b,altitude):
+        # nothing over altitude on the straight line between columns a & b
+        # next columns are only checked at the two, as the search moves between them
+        steps=2*max(abs(b[0]-a[0]),abs(b[1]-a[1]))+1 if max(abs(b[0]-a[0]),abs(b[1]-a[1]))>1 else 2
+        fractions=self.fractions.get(steps)
+        if fractions is None:
+            fractions=self.fractions[steps]=np.linspace(0.0,1.0,steps)
+        x=np.rint(a[0]+(b[0]-a[0])*fractions).astype(int)
+        y=np.rint(a[1]+(b[1]-a[1])*fractions).astype(int)
+        if x.min()<0 or y.min()<0 or x.max()>=floor.shape[0] or y.max()>=floor.shape[1]:
+            return False
+        return bool(floor[x,y].max()<=altitude)
+
+    def visible(self,floor,levels,a,b,goal,min_altitude):
+        # whether the states a & b (column x, column y, level) are joined by a level leg with a climb
+        # before it or a descent in the goal column after it
+        if a[:2]==b[:2]:
+            return True
+        if levels[b[2]]<levels[a[2]] and b[:2]!=goal:
+            return False
+        altitude=max(levels[a[2]],levels[b[2]])
+        return altitude>=min_altitude and self.clear(floor,a,b,altitude)
+
+    def cost(self,levels,a,b):
+        return self.cell*math.hypot(b[0]-a[0],b[1]-a[1])+abs(levels[b[2]]-levels[a[2]])
+
+    def search(self,floor,levels,start,goal,min_altitude):
+        # Theta* from start to goal states, their list or None
+        ends=(start[:2],goal[:2])
+        def valid(state):
+            x,y,k=state
+            if not (0<=x<floor.shape[0] and 0<=y<floor.shape[1]) or levels[k]<floor[x,y]:
+                return False
+            return levels[k]>=min_altitude or (x,y) in ends
+        def heuristic(state):
+            return self.cost(levels,state,goal)
+        g={start:0.0}
+        parent={start:start}
+        closed=set()
+        heap=[(heuristic(start),0,start)]
+        count=1
+        self.expansions=0
+        while heap:
+            _,_,state=heapq.heappop(heap)
+            if state in closed:
+                continue
+            if state==goal:
+                path=[state]
+                while path[-1]!=start:
+                    path.append(parent[path[-1]])
+                return path[::-1]
+            closed.add(state)
+            self.expansions+=1
+            if self.expansions>self.max_expansions:
+                return None
+            x,y,k=state
+            neighbours=[(x+dx,y+dy,k) for dx,dy in MOVES]
+            if k+1<len(levels):
+                neighbours.append((x,y,k+1))
+            if k>0 and (x,y)==goal[:2]:
+                neighbours.append((x,y,k-1))
+            for neighbour in neighbours:
+                # the next column is clear if it is valid, the floors are grown by the drone's radius
+                if neighbour in closed or not valid(neighbour):
+                    continue
+                # straight from the parent if nothing is in the way
+                before=parent[state]
+                if before!=state and self.visible(floor,levels,before,neighbour,goal[:2],min_altitude):
+                    via,cost=before,g[before]+self.cost(levels,before,neighbour)
+                else:
+                    via,cost=state,g[state]+self.cost(levels,state,neighbour)
+                if cost<g.get(neighbour,float('inf')):
+                    g[neighbour]=cost
+                    parent[neighbour]=via
+                    heapq.heappush(heap,(cost+heuristic(neighbour),count,neighbour))
+                    count+=1
+        return None
+
+    def waypoints(self,states,low,levels,start,goal):
+        # [x, y, altitude] of the states, with the corners of the climbs & descents, ends as given
+        def centre(state):
+            if state[:2]==states[0][:2]:
+                return list(start[:2])
+            if state[:2]==states[-1][:2]:
+                return list(goal[:2])
+            return [float((low[0]+state[0]+0.5)*self.cell),float((low[1]+state[1]+0.5)*self.cell)]
+        points=[centre(states[0])+[levels[states[0][2]]]]
+        for a,b in zip(states,states[1:]):
+            altitude=max(levels[a[2]],levels[b[2]])
+            for point in (centre(a)+[altitude],centre(b)+[altitude],centre(b)+[levels[b[2]]]):
+                if point!=points[-1]:
+                    points.append(point)
+        # one setpoint for each straight climb, level legs are kept as searched (a longer one is not checked)
+        merged=points[:2]
+        for point in points[2:]:
+            a,b=merged[-2],merged[-1]
+            if a[:2]==b[:2]==point[:2] and (b[2]-a[2])*(point[2]-b[2])>0:
+                merged[-1]=point
+            else:
+                merged.append(point)
+        merged[0],merged[-1]=list(start),list(goal)
+        return merged
+
+    def reuse(self,cached,start,goal,min_altitude):
+        # a cached path with the ends & min_altitude asked for now, the altitudes over it as planned
+        path,old_start,old_goal,old_altitude=cached
+        points=[list(start)]
+        for point in path[1:-1]:
+            xy=start[:2] if point[:2]==old_start[:2] else goal[:2] if point[:2]==old_goal[:2] else point[:2]
+            points.append(list(xy)+[min_altitude if point[2]==old_altitude else max(point[2],min_altitude)])
+        return points+[list(goal)]
+
+    def still_clear(self,floor,low,path,min_altitude):
+        # the legs of a cached path, cells taken from its points
+        cells=[tuple(int(i) for i in np.floor(np.asarray(point[:2])/self.cell).astype(int)-low) for point in path]
+        for a,b,point,after in zip(cells,cells[1:],path,path[1:]):
+            if a!=b and (point[2]!=after[2] or point[2]<min_altitude or not self.clear(floor,a,b,point[2])):
+                return False
+        return True
+
+    def plan(self,start,goal,min_altitude=None):
+        # [[x, y, altitude], ...] from start to goal [x, y, altitude] in the local frame, no lower than
+        # min_altitude (the higher end by default) but at the two ends, None if there is no way
+        start,goal=[float(i) for i in start[:3]],[float(i) for i in goal[:3]]
+        if min_altitude is None:
+            min_altitude=max(start[2],goal[2])
+        low,shape=self.window([start,goal])
+        floor=self.floors(low,shape,(start,goal))
+        a=tuple(int(i) for i in np.floor(np.asarray(start[:2])/self.cell).astype(int)-low)
+        b=tuple(int(i) for i in np.floor(np.asarray(goal[:2])/self.cell).astype(int)-low)
+        key=(a[0]+low[0],a[1]+low[1],b[0]+low[0],b[1]+low[1],round(start[2]),round(goal[2]),round(min_altitude))
+        cached=self.cache.get(key)
+        if cached is not None:
+            path=self.reuse(cached,start,goal,min_altitude)
+            if self.still_clear(floor,low,path,min_altitude):
+                self.cache.move_to_end(key)
+                self.hits+=1
+                return path
+        self.misses+=1
+        levels=self.levels(floor,(start[2],goal[2]),min_altitude)
+        states=self.search(floor,levels,(a[0],a[1],levels.index(start[2])),(b[0],b[1],levels.index(goal[2])),min_altitude)
+        if states is None:
+            return None
+        path=self.waypoints(states,low,levels,start,goal)
+        self.cache[key]=(path,start,goal,min_altitude)
+        if len(self.cache)>self.cache_size:
+            self.cache.popitem(last=False)
+        return path
+
+
+def path_length(path):
+    # distance flown along the points, level & vertical
+    return sum(math.hypot(b[0]-a[0],b[1]-a[1])+abs(b[2]-a[2]) for a,b in zip(path,path[1:]))
+
+
+def climb_cruise_descend(height_map,start,goal,min_altitude,clearance=3.0,side_clearance=15.0):
+    # setpoint_control's leg without the planner: up over what the map has within 2 m of the straight
+    # line, over & down
+    height,side_only=height_map.max_height(start,goal)
+    cruise=min_altitude if math.isnan(height) else max(min_altitude,height+(side_clearance if side_only else clearance))
+    return [list(start),[start[0],start[1],cruise],[goal[0],goal[1],cruise],list(goal)]
+
+
+def benchmark(sizes=(100,200,400,800),legs=20,density=1.0/3000,seed=0):
+    from Task_6_VD_2373_height_map import HeightMap
+    print('{:>7} {:>7} {:>6} {:>8} {:>10} {:>10} {:>6} {:>10} {:>8} {:>10} {:>8}'.format('map m','towers','legs','no path',
+          'plan ms','cached ms','hits','expanded','ccd m','planned m','shorter'))
+    for size in sizes:
+        rng=np.random.RandomState(seed)
+        height_map=HeightMap(origin=(19.0,72.0))
+        towers=int(density*size*size)
+        # square towers 4 to 12 m wide, up to 60 m high, seen from above
+        for x,y,width,top in zip(rng.uniform(0,size,towers),rng.uniform(0,size,towers),rng.uniform(4,12,towers),rng.uniform(15,60,towers)):
+            for cx in np.arange(x-width/2,x+width/2,height_map.cell):
+                for cy in np.arange(y-width/2,y+width/2,height_map.cell):
+                    height_map.add(1,cx,cy,top)
+        # kept as far off the towers as setpoint_control keeps it
+        planner=PathPlanner(height_map,radius=10.0)
+        ends=[]
+        while len(ends)<legs:
+            start,goal=rng.uniform(0,size,2),rng.uniform(0,size,2)
+            if np.linalg.norm(goal-start)<size/2:
+                continue
+            # ends on the ground, out of the towers' standoff
+            if any(height_map.max_height(end,end,15.0)[0]>0 for end in (start,goal)):
+                continue
+            ends.append(([start[0],start[1],1.0],[goal[0],goal[1],1.0]))
+        cold,warm,expanded,ccd,planned=[],[],[],[],[]
+        for start,goal in ends:
+            tick=time.perf_counter()
+            path=planner.plan(start,goal,9.0)
+            cold.append(time.perf_counter()-tick)
+            expanded.append(planner.expansions)
+            if path is None:
+                continue
+            tick=time.perf_counter()
+            planner.plan(start,goal,9.0)
+            warm.append(time.perf_counter()-tick)
+            # both flown down to the goal from 8 m over it
+            planned.append(path_length(path))
+            ccd.append(path_length(climb_cruise_descend(height_map,start,goal,9.0)))
+        planned,ccd=np.array(planned),np.array(ccd)
+        print('{:7d} {:7d} {:6d} {:8d} {:10.1f} {:10.2f} {:6d} {:10.0f} {:8.1f} {:10.1f} {:7.0f}%'.format(size,towers,legs,
+              legs-len(planned),1e3*np.mean(cold),1e3*np.mean(warm),planner.hits,np.mean(expanded),np.mean(ccd),
+              np.mean(planned),100*np.mean(planned<ccd-1e-6)))
+
+def main():
+    parser=argparse.ArgumentParser(description='Theta* legs over the height map')
+    parser.add_argument('--benchmark',action='store_true')
+    parser.add_argument('--legs',type=int,default=20,help='legs per map')
+    parser.add_argument('--seed',type=int,default=0)
+    args=parser.parse_args()
+    if args.benchmark:
+        benchmark(legs=args.legs,seed=args.seed)
+
+
+if __name__=="__main__":
+    main()
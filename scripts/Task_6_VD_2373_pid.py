@@ -0,0 +1,340 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_pid.py
+Functions      PID,QuadrotorPlant,step_response,benchmark
+Global Variables None
+
+
+Multi-axis PID controller shared by the position & attitude controllers.
+
+All axes are updated in one pass over per-axis lists that are allocated once (the object uses
+__slots__), and the output list is reused between ticks. Setpoints & measurements can be any
+sequences (lists, tuples, NumPy arrays). Unlike the old controllers, which assumed a fixed 0.060 s
+sample time while running at 50 Hz, dt is measured from a clock on every update (rospy.get_time in
+the nodes, so it follows sim time).
+
+    output = Kp*e + integral(Ki*e dt) - Kd*scale*d(measurement)/dt,   e = scale*(setpoint - measurement)
+
+- the derivative acts on the measurement, so setpoint steps give no derivative kick; when the setpoint
+  moves at a known rate (a trajectory), update() takes it as setpoint_rate and the derivative acts on
+  scale*(setpoint_rate - d(measurement)/dt), the derivative of the error without the kick
+- update() also takes a feedforward per axis, added to the output before the clamp & the anti-windup
+  check (the tilt a trajectory's acceleration needs, so that it is not left to the tracking error)
+- given a measurement_rate (a velocity estimate, Task_6_VD_2373_state_estimator) the derivative takes it
+  instead of differencing the measurement
+- the integral term is clamped to +-integral_limit, and is not integrated further while the output is
+  saturated in the same direction (anti-windup)
+- the output is clamped to [output_min, output_max]
+- gains can be changed between updates (gain scheduling) without a bump, as the integral is kept as
+  the accumulated Ki*e*dt
+
+Run this file for the update cost per tick and step responses against QuadrotorPlant.
+
+'''
+
+import math
+import time
+import tracemalloc
+import numpy as np
+
+from Task_6_VD_2373_geodesy import x_to_lat,y_to_long
+
+INF = float('inf')
+
+
+class PID():
+    __slots__ = ('Kp','Ki','Kd','error_scale','output_min','output_max','integral_limit','sample_time','max_dt',
+                 'clock','axes','error','i_term','output','last_measurement','last_time','dt')
+
+    def __init__(self,Kp,Ki,Kd,output_min=-INF,output_max=INF,integral_limit=INF,error_scale=1.0,sample_time=0.02,max_dt=0.1,clock=time.time):
+        self.axes=range(len(Kp))
+        self.Kp=[0.0 for _ in self.axes]
+        self.Ki=[0.0 for _ in self.axes]
+        self.Kd=[0.0 for _ in self.axes]
+        self.output_min=[0.0 for _ in self.axes]
+        self.output_max=[0.0 for _ in self.axes]
+        self.integral_limit=[0.0 for _ in self.axes]
+        self.error_scale=[0.0 for _ in self.axes]
+        self.set_gains(Kp,Ki,Kd)
+        self.set_limits(output_min,output_max,integral_limit)
+        self._fill(self.error_scale,error_scale)
+
+        # dt used for the first update, and the largest dt allowed (e.g. after the sim was paused)
+        self.sample_time=sample_time
+        self.max_dt=max_dt
+        self.clock=clock
+
+        self.error=[0.0 for _ in self.axes]
+        self.i_term=[0.0 for _ in self.axes]
+        self.output=[0.0 for _ in self.axes]
+        self.last_measurement=[0.0 for _ in self.axes]
+        self.last_time=None
+        self.dt=sample_time
+
+    def _fill(self,values,new_values):
+        # copies per axis values (or one value for every axis) into the existing list
+        if hasattr(new_values,'__len__'):
+            values[:]=[float(value) for value in new_values]
+        else:
+            values[:]=[float(new_values) for _ in self.axes]
+
+    def set_gains(self,Kp=None,Ki=None,Kd=None):
+        if Kp is not None:
+            self._fill(self.Kp,Kp)
+        if Ki is not None:
+            self._fill(self.Ki,Ki)
+        if Kd is not None:
+            self._fill(self.Kd,Kd)
+
+    def set_limits(self,output_min=None,output_max=None,integral_limit=None):
+        if output_min is not None:
+            self._fill(self.output_min,output_min)
+        if output_max is not None:
+            self._fill(self.output_max,output_max)
+        if integral_limit is not None:
+            self._fill(self.integral_limit,integral_limit)
+
+    def reset(self):
+        for i in self.axes:
+            self.i_term[i]=0.0
+            self.output[i]=0.0
+        self.last_time=None
+
+    def update(self,setpoint,measurement,now=None,setpoint_rate=None,feedforward=None,measurement_rate=None):
+        # Returns the output list, which is reused by the next update (copy it to keep it)
+        if now is None:
+            now=self.clock()
+        if self.last_time is None:
+            dt=self.sample_time
+            self.last_measurement[:]=measurement
+        else:
+            dt=now-self.last_time
+            if dt<=0:
+                # clock did not move (sim paused or two updates in one sim step), hold the output
+                return self.output
+            if dt>self.max_dt:
+                dt=self.max_dt
+        self.last_time=now
+        self.dt=dt
+
+        error=self.error
+        i_term=self.i_term
+        output=self.output
+        last_measurement=self.last_measurement
+        for i in self.axes:
+            scale=self.error_scale[i]
+            error[i]=e=(setpoint[i]-measurement[i])*scale
+
+            # derivative on measurement
+            if measurement_rate is None:
+                d_term=self.Kd[i]*scale*(last_measurement[i]-measurement[i])/dt
+            else:
+                d_term=-self.Kd[i]*scale*measurement_rate[i]
+            if setpoint_rate is not None:
+                d_term+=self.Kd[i]*scale*setpoint_rate[i]
+            last_measurement[i]=measurement[i]
+
+            # integrate unless the output is saturated & the error would push it further out
+            unclamped=self.Kp[i]*e+d_term
+            if feedforward is not None:
+                unclamped+=feedforward[i]
+            increment=self.Ki[i]*e*dt
+            candidate=unclamped+i_term[i]+increment
+            if not ((candidate>self.output_max[i] and increment>0) or (candidate<self.output_min[i] and increment<0)):
+                i_term[i]+=increment
+            limit=self.integral_limit[i]
+            if i_term[i]>limit:
+                i_term[i]=limit
+            elif i_term[i]<-limit:
+                i_term[i]=-limit
+
+            unclamped+=i_term[i]
+            if unclamped>self.output_max[i]:
+                output[i]=self.output_max[i]
+            elif unclamped<self.output_min[i]:
+                output[i]=self.output_min[i]
+            else:
+                output[i]=unclamped
+        return output
+
+
+class _LegacyPID():
+    # The per-axis list arithmetic the controllers used before, with the fixed 0.060 s sample time.
+    # integral_dt is 0.060 for the position controller & 1 for the attitude controller (which left it out).
+    # Only kept as the baseline of the benchmark & step responses below.
+
+    def __init__(self,Kp,Ki,Kd,output_min,output_max,error_scale,integral_dt):
+        self.Kp=list(Kp)
+        self.Ki=list(Ki)
+        self.Kd=list(Kd)
+        self.min_value=list(output_min)
+        self.max_value=list(output_max)
+        self.error_scale=list(error_scale)
+        self.integral_dt=integral_dt
+        self.sample_time=0.060
+        self.error=[0.0,0.0,0.0]
+        self.prev_error=[0.0,0.0,0.0]
+        self.error_sum=[0.0,0.0,0.0]
+        self.output=[0.0,0.0,0.0]
+
+    def update(self,setpoint,measurement,now=None):
+        for i in range(3):
+            self.error[i]=(setpoint[i]-measurement[i])*self.error_scale[i]
+            self.error_sum[i]=self.error_sum[i]+self.error[i]
+            out=(self.Kp[i]*self.error[i]
+                 +self.Ki[i]*self.error_sum[i]*self.integral_dt
+                 +self.Kd[i]*(self.error[i]-self.prev_error[i])/self.sample_time)
+            self.prev_error[i]=self.error[i]
+            self.output[i]=min(max(out,self.min_value[i]),self.max_value[i])
+        return self.output
+
+
+class QuadrotorPlant():
+    # Rigid body model of the eDrone for testing the controllers without Gazebo. Uses the model's mass,
+    # inertia & prop layout and the propulsion plugin's force of pwm/146.28 N per prop. The plugin applies
+    # no yaw torque, so yaw stays 0; drag is left out. State is in the local frame (x north, y west,
+    # z up, m) as plain floats, as one step is only a handful of operations.
+
+    MASS = 1.42
+    INERTIA = (0.08666,0.08666,0.16666)
+    ARM = 0.46
+    PWM_PER_NEWTON = 146.28
+    GRAVITY = 9.80665
+
+    def __init__(self,position=(0.0,0.0,10.0)):
+        self.position=[float(value) for value in position]
+        self.velocity=[0.0,0.0,0.0]
+        self.angles=[0.0,0.0]          # [about x, about y] (rad)
+        self.rates=[0.0,0.0]
+        self.thrust_accel=0.0          # thrust / mass of the last step, what the accelerometer reads in flight
+
+    def step(self,pwm,dt):
+        force=[min(max(value,0.0),1024.0)/self.PWM_PER_NEWTON for value in pwm]
+        thrust=force[0]+force[1]+force[2]+force[3]
+        # props at (+x,+y), (+x,-y), (-x,-y), (-x,+y)
+        torque_x=self.ARM*(force[0]-force[1]-force[2]+force[3])
+        torque_y=self.ARM*(-force[0]-force[1]+force[2]+force[3])
+        self.rates[0]+=torque_x/self.INERTIA[0]*dt
+        self.rates[1]+=torque_y/self.INERTIA[1]*dt
+        self.angles[0]+=self.rates[0]*dt
+        self.angles[1]+=self.rates[1]*dt
+
+        phi,theta=self.angles
+        self.thrust_accel=thrust_accel=thrust/self.MASS
+        velocity=self.velocity
+        velocity[0]+=thrust_accel*math.sin(theta)*math.cos(phi)*dt
+        velocity[1]+=-thrust_accel*math.sin(phi)*dt
+        velocity[2]+=(thrust_accel*math.cos(theta)*math.cos(phi)-self.GRAVITY)*dt
+        self.position[0]+=velocity[0]*dt
+        self.position[1]+=velocity[1]*dt
+        self.position[2]+=velocity[2]*dt
+
+    def gps(self):
+        return [x_to_lat(self.position[0]),y_to_long(self.position[1]),self.position[2]]
+
+    def euler_deg(self):
+        # the way the attitude controller reads it, [rotation about y, rotation about x, yaw]
+        return [math.degrees(self.angles[1]),math.degrees(self.angles[0]),0.0]
+
+    def quaternion(self):
+        # [x, y, z, w] of roll (about x) then pitch (about y), as the IMU reports it
+        cr,sr=math.cos(self.angles[0]/2),math.sin(self.angles[0]/2)
+        cp,sp=math.cos(self.angles[1]/2),math.sin(self.angles[1]/2)
+        return [sr*cp,cr*sp,-sr*sp,cr*cp]
+
+
+def _make_controllers(legacy):
+    # Gains of the position (near setpoint tuning) & attitude controllers
+    if legacy:
+        position=_LegacyPID([210,210,1000],[0,0,-0.138],[1500,1500,2500],[-225,-225,-500],[225,225,500],[100000,100000,1],0.060)
+        attitude=_LegacyPID([4.2,4.2,400],[0.2,0.2,0],[4.5,4.5,0],[-INF]*3,[INF]*3,[1,1,1],1.0)
+    else:
+        position=PID([210,210,1000],[0,0,-0.414],[500,500,2500/3.0],[-225,-225,-500],[225,225,500],
+                     integral_limit=[0,0,50],error_scale=[100000,100000,1])
+        attitude=PID([4.2,4.2,400],[10,10,0],[1.5,1.5,0],integral_limit=[100,100,0])
+    return position,attitude
+
+
+def step_response(step=(0.0,0.0,2.0),duration=10.0,period=0.02,jitter=0.0,legacy=False,seed=0,physics_dt=0.001):
+    # Flies the position & attitude controllers in cascade against QuadrotorPlant from hover at 10 m to
+    # hover at 10 m + step (local x, y, z in m). Ticks are period +- jitter (uniform) apart.
+    # Returns (times, distance to the target (m) along the step direction).
+    rng=np.random.RandomState(seed)
+    plant=QuadrotorPlant()
+    position_pid,attitude_pid=_make_controllers(legacy)
+    target=QuadrotorPlant(np.add(plant.position,step)).gps()
+    step_norm=np.linalg.norm(step)
+    direction=np.array(step)/step_norm
+
+    times=[]
+    remaining=[]
+    t=0.0
+    while t<duration:
+        rpt=position_pid.update(target,plant.gps(),t)
+        setpoint_cmd=[1500+rpt[0],1500+rpt[1],1500]
+        throttle=(1500+rpt[2])*1.024-1024
+        setpoint_euler=[cmd*0.02-30 for cmd in setpoint_cmd]
+        out_roll,out_pitch,out_yaw=attitude_pid.update(setpoint_euler,plant.euler_deg(),t)
+        pwm=np.clip([throttle-out_roll+out_pitch-out_yaw,
+                     throttle-out_roll-out_pitch+out_yaw,
+                     throttle+out_roll-out_pitch-out_yaw,
+                     throttle+out_roll+out_pitch+out_yaw],0,1024)
+
+        tick=period+(rng.uniform(-jitter,jitter) if jitter else 0.0)
+        for _ in range(int(round(tick/physics_dt))):
+            plant.step(pwm,physics_dt)
+        t+=tick
+        times.append(t)
+        remaining.append(step_norm-np.dot(np.subtract(plant.position,[0,0,10.0]),direction))
+    return np.array(times),np.array(remaining)
+
+
+def _step_metrics(times,remaining,step_norm,band=0.05):
+    # rise time (10 -> 90 %), overshoot (%), settling time into +-band*step, final error (m)
+    progress=1-remaining/step_norm
+    rise_start=times[np.argmax(progress>=0.1)] if (progress>=0.1).any() else np.nan
+    rise_end=times[np.argmax(progress>=0.9)] if (progress>=0.9).any() else np.nan
+    outside=np.nonzero(np.abs(remaining)>band*step_norm)[0]
+    settling=times[outside[-1]+1] if len(outside) and outside[-1]+1<len(times) else (times[0] if not len(outside) else np.nan)
+    return rise_end-rise_start,100*max(0.0,-remaining.min()/step_norm),settling,abs(remaining[-1])
+
+
+def benchmark(ticks=100000):
+    # Cost of one 3 axis update, with the setpoint/measurement as preallocated arrays & as lists
+    setpoint=np.array([19.0000451704,72.0000474870,12.0])
+    measurement=np.array([19.0,72.0,10.0])
+    setpoint_list=setpoint.tolist()
+    measurement_list=measurement.tolist()
+    print('{:<14} {:>12} {:>16}'.format('update','us / tick','KiB allocated'))
+    for name,legacy,sp,meas in (('PID, lists',False,setpoint_list,measurement_list),
+                                ('PID, arrays',False,setpoint,measurement),
+                                ('old list PID',True,setpoint_list,measurement_list)):
+        pid,_=_make_controllers(legacy)
+        now=0.0
+        start=time.perf_counter()
+        for _ in range(ticks):
+            now+=0.02
+            pid.update(sp,meas,now)
+        elapsed=time.perf_counter()-start
+
+        tracemalloc.start()
+        for _ in range(1000):
+            now+=0.02
+            pid.update(sp,meas,now)
+        _,peak=tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{:<14} {:>12.2f} {:>16.2f}'.format(name,1e6*elapsed/ticks,peak/1024.0))
+
+    print('')
+    print('{:<34} {:>10} {:>14} {:>13} {:>15}'.format('step response','rise (s)','overshoot (%)','settle (s)','final err (m)'))
+    for label,step in (('altitude +2 m',(0,0,2.0)),('north +2 m',(2.0,0,0)),('east +2 m',(0,-2.0,0))):
+        for controller,legacy,jitter in (('old',True,0.0),('new',False,0.0),('new, +-6 ms jitter',False,0.006),('old, +-6 ms jitter',True,0.006)):
+            times,remaining=step_response(step,jitter=jitter,legacy=legacy)
+            rise,overshoot,settling,final=_step_metrics(times,remaining,np.linalg.norm(step))
+            print('{:<34} {:>10.2f} {:>14.1f} {:>13.2f} {:>15.3f}'.format('{} ({})'.format(label,controller),rise,overshoot,settling,final))
+
+
+if __name__=="__main__":
+    benchmark()
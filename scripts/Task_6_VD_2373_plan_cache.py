@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_plan_cache.py
+Functions      plan_key,save_plan,load_plan,get_cached_set_point_sequence,benchmark,main
+Global Variables PLAN_VERSION,PLANNER_MODULES,PARCEL_TYPES,MAX_ENTRIES
+
+
+The sequence get_set_point_sequence() plans for a manifest, kept on disk so a node started again on the
+same manifest flies at once instead of reading, resolving & scheduling it all over.
+
+An entry is keyed by the SHA-256 of what the plan depends on: the manifest's bytes, PLAN_VERSION, the
+source of the PLANNER_MODULES (a change to the stations or the scheduler plans again), the origin of
+the local frame (the stations are placed in metres from it) & the planner's parameters. The start is
+only part of the key with planner='route', rounded to ~1 m, as the pairing planner does not use it &
+the start is the first GPS fix.
+
+Each entry is two files in the cache directory:
+
+    <key>.npy   the plan, float64 [parcels, 7]: pickup lat, long, alt, drop lat, long, alt & the index of
+                the parcel's type in PARCEL_TYPES, loaded memory mapped
+    <key>.csv   the sequenced manifest it was planned with, copied to the sequenced manifest's path when
+                that is not the same already
+
+A missing or unreadable entry is planned again & written over. Only the MAX_ENTRIES last used are kept.
+The route planner's plan is kept as it first came out of its time budget.
+
+Run with --benchmark for the time to a plan planning (cold) against loading it (warm).
+'''
+
+import argparse
+import filecmp
+import hashlib
+import os
+import shutil
+import numpy as np
+
+from Task_6_VD_2373_geodesy import get_frame
+from Task_6_VD_2373_manifest import get_manifest_paths
+from Task_6_VD_2373_utils import get_set_point_sequence
+
+# bumped when the entries' format changes
+PLAN_VERSION = 1
+# the modules a plan comes out of
+PLANNER_MODULES = ('Task_6_VD_2373_utils.py','Task_6_VD_2373_manifest.py','Task_6_VD_2373_scheduler.py',
+                   'Task_6_VD_2373_route_optimizer.py','Task_6_VD_2373_geodesy.py')
+PARCEL_TYPES = ('DELIVERY','RETURN')
+MAX_ENTRIES = 32
+
+_source_digest = None
+
+
+def _planner_source_digest():
+    # digest of the PLANNER_MODULES' source, read once per process
+    global _source_digest
+    if _source_digest is None:
+        digest=hashlib.sha256()
+        directory=os.path.dirname(os.path.abspath(__file__))
+        for name in PLANNER_MODULES:
+            with open(os.path.join(directory,name),'rb') as fhand:
+                digest.update(fhand.read())
+        _source_digest=digest.hexdigest()
+    return _source_digest
+
+
+def plan_key(manifest_path,pairing_mode='optimal',planner='pairing',start_coords=None,time_budget=1.0):
+    digest=hashlib.sha256()
+    with open(manifest_path,'rb') as fhand:
+        for block in iter(lambda: fhand.read(1<<20),b''):
+            digest.update(block)
+    start=None
+    if planner=='route' and start_coords is not None:
+        start=tuple(round(float(coord),5) for coord in start_coords[:2])
+    frame=get_frame()
+    digest.update(repr((PLAN_VERSION,_planner_source_digest(),frame.origin_lat,frame.origin_long,pairing_mode,planner,start,float(time_budget))).encode())
+    return digest.hexdigest()
+
+
+def save_plan(directory,key,plan,sequenced_manifest_path):
+    parcels_coords,parcels_delivery_coords,instructions=plan
+    rows=np.zeros((len(instructions),7))
+    if len(instructions):
+        rows[:,0:3]=parcels_coords
+        rows[:,3:6]=parcels_delivery_coords
+        rows[:,6]=[PARCEL_TYPES.index(instruction) for instruction in instructions]
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path=os.path.join(directory,key)
+    # written next to the entry first, so one is never left half written
+    np.save(path+'.tmp.npy',rows)
+    shutil.copyfile(sequenced_manifest_path,path+'.tmp.csv')
+    os.replace(path+'.tmp.csv',path+'.csv')
+    os.replace(path+'.tmp.npy',path+'.npy')
+    # the entries last used (loading one touches it) are kept
+    entries=sorted((name for name in os.listdir(directory) if name.endswith('.npy') and not name.endswith('.tmp.npy')),
+                   key=lambda name: os.path.getmtime(os.path.join(directory,name)),reverse=True)
+    for name in entries[MAX_ENTRIES:]:
+        for stale in (name,name[:-4]+'.csv'):
+            try:
+                os.remove(os.path.join(directory,stale))
+            except OSError:
+                pass
+
+
+def load_plan(directory,key,sequenced_manifest_path=None):
+    # the plan of key, None if there is none, ValueError if the entry is not a plan; the sequenced manifest
+    # it was planned with is copied to sequenced_manifest_path
+    path=os.path.join(directory,key)
+    if not (os.path.exists(path+'.npy') and os.path.exists(path+'.csv')):
+        return None
+    rows=np.load(path+'.npy',mmap_mode='r')
+    if rows.ndim!=2 or rows.shape[1]!=7 or not np.all(np.isfinite(rows)) or not np.all(np.isin(rows[:,6],range(len(PARCEL_TYPES)))):
+        raise ValueError('{}.npy is not a plan'.format(path))
+    plan=(rows[:,0:3].tolist(),rows[:,3:6].tolist(),[PARCEL_TYPES[int(kind)] for kind in rows[:,6]])
+    if sequenced_manifest_path is not None and not (os.path.exists(sequenced_manifest_path) and
+                                                    filecmp.cmp(path+'.csv',sequenced_manifest_path,shallow=False)):
+        shutil.copyfile(path+'.csv',sequenced_manifest_path)
+    os.utime(path+'.npy')
+    return plan
+
+
+def get_cached_set_point_sequence(cache_dir,pairing_mode='optimal',planner='pairing',start_coords=None,time_budget=1.0,manifest_path=None,sequenced_manifest_path=None):
+    # get_set_point_sequence() through the cache in cache_dir ('' or None: planned every time)
+    if not cache_dir:
+        return get_set_point_sequence(pairing_mode,planner,start_coords,time_budget,manifest_path,sequenced_manifest_path)
+    default_manifest_path,default_sequenced_manifest_path=get_manifest_paths()
+    manifest_path=manifest_path or default_manifest_path
+    sequenced_manifest_path=sequenced_manifest_path or default_sequenced_manifest_path
+    key=plan_key(manifest_path,pairing_mode,planner,start_coords,time_budget)
+    try:
+        plan=load_plan(cache_dir,key,sequenced_manifest_path)
+    except (ValueError,OSError):
+        plan=None
+    if plan is None:
+        plan=get_set_point_sequence(pairing_mode,planner,start_coords,time_budget,manifest_path,sequenced_manifest_path)
+        save_plan(cache_dir,key,plan,sequenced_manifest_path)
+    return plan
+
+
+def benchmark(sizes=(9,100,1000),seed=0,time_budget=1.0,runs=5):
+    global _source_digest
+    import tempfile
+    import time
+    import csv
+    from Task_6_VD_2373_scheduler import random_manifest
+    from Task_6_VD_2373_manifest import format_row
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifests=[('original',os.path.join(os.path.dirname(os.path.abspath(__file__)),'original.csv'))]
+        for n in sizes:
+            # n deliveries & n returns, written with their stations (A1 & X1)
+            dels,rets=random_manifest(n,seed)
+            path=os.path.join(directory,'random_{}.csv'.format(n))
+            with open(path,'w') as fhand:
+                writer=csv.writer(fhand)
+                for record in dels+rets:
+                    writer.writerow(format_row(record))
+            manifests.append(('random {}'.format(n),path))
+        sequenced=os.path.join(directory,'sequenced_manifest.csv')
+        print('{:12} {:>8} {:>9} {:>10} {:>10} {:>9}'.format('manifest','parcels','planner','cold ms','warm ms','speedup'))
+        for name,path in manifests:
+            for planner in ('pairing','route'):
+                cache=tempfile.mkdtemp(dir=directory)
+                # as a node started again, the planner modules' source digested on every start
+                _source_digest=None
+                start=time.perf_counter()
+                cold=get_cached_set_point_sequence(cache,'optimal',planner,None,time_budget,path,sequenced)
+                cold_ms=(time.perf_counter()-start)*1e3
+                warm_ms=0.0
+                for _ in range(runs):
+                    _source_digest=None
+                    start=time.perf_counter()
+                    warm=get_cached_set_point_sequence(cache,'optimal',planner,None,time_budget,path,sequenced)
+                    warm_ms+=(time.perf_counter()-start)/runs*1e3
+                assert warm==cold
+                print('{:12} {:8d} {:>9} {:10.2f} {:10.3f} {:8.0f}x'.format(name,len(cold[2]),planner,cold_ms,warm_ms,cold_ms/warm_ms))
+
+
+def main():
+    parser=argparse.ArgumentParser(description='Plan cache of the manifest sequence')
+    parser.add_argument('--benchmark',action='store_true')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--time-budget',type=float,default=1.0,help='of the route planner (s)')
+    args=parser.parse_known_args()[0]
+    if args.benchmark:
+        benchmark(seed=args.seed,time_budget=args.time_budget)
+
+
+if __name__=="__main__":
+    main()
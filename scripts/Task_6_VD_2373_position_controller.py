@@ -5,13 +5,21 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_position_controller.py
-Functions      gps_callback,setpoint_callback,create_next_linear_setpoints,check_proximity,pid
-Global Variables None
+Functions      gps_callback,state_callback,take_pending_setpoint,setpoint_callback,start_trajectory,create_next_linear_setpoints,check_proximity,use_gains,pid
+Global Variables STEP_LENGTH
 
 PID position controller for the drone
+Every new setpoint starts a trajectory from the drone's position (Task_6_VD_2373_trajectory), which the pid
+tracks with its velocity fed to the derivative & its acceleration fed forward as tilt. ~trajectory_mode is
+trapezoidal (default) or min_jerk, limited by ~max_speed & ~max_accel (horizontal, m/s & m/s^2) and
+~max_vertical_speed & ~max_vertical_accel.
+A setpoint within ~retarget_distance (m) of the current one only moves the end of the leg.
+~trajectory_mode:=steps brings back the old fixed steps of STEP_LENGTH m.
+With /state_source:=estimator the position & velocity come from /edrone/state (Task_6_VD_2373_state_estimator)
+instead of /edrone/gps, and the pid's derivative takes the estimated velocity.
 This node publishes and subsribes the following topics:
         PUBLICATIONS            SUBSCRIPTIONS
-        /drone_command          /edrone/gps
+        /drone_command          /edrone/gps (or /edrone/state)
                                 /edrone/setpoint
 
 '''
@@ -24,6 +32,11 @@ import math
 
 # util functions
 from Task_6_VD_2373_utils import *
+from Task_6_VD_2373_pid import PID
+from Task_6_VD_2373_trajectory import Trajectory, TRAJECTORY_MODES
+from Task_6_VD_2373_geodesy import get_frame, load_origin_from_params
+from Task_6_VD_2373_state_estimator import STATE_TOPIC, state_source
+from Task_6_VD_2373_waypoint import WaypointAcceptance
 
 # from pid_tune.msg import PidTune
 from sensor_msgs.msg import Imu, NavSatFix,LaserScan
@@ -31,6 +44,9 @@ from std_msgs.msg import Float32
 from vitarana_drone.msg import *
 from vitarana_drone.srv import Gripper
 
+# length (m) of the steps of ~trajectory_mode:=steps along the longer axis (1.9 times 5 m)
+STEP_LENGTH = 9.5
+
 
 class Edrone:
     """docstring for Edrone"""
@@ -38,9 +54,12 @@ class Edrone:
     def __init__(self):
         
         rospy.init_node("position_controller")  # initializing ros node with name position_controller
+        load_origin_from_params()
        
         # The latitude, longitude and altitude of the drone
         self.drone_position = [0.0, 0.0, 0.0]
+        # its rate of change (deg/s of lat & long, m/s) from the state estimator, None with the GPS
+        self.drone_rate = None
 
         # Format for drone_command
         self.cmd_drone = edrone_cmd()
@@ -54,9 +73,11 @@ class Edrone:
         # self.Kp = [ 65, 65, 1000]
         # self.Ki = [0, 0, -0.138]
         # self.Kd = [ 550, 550, 2300 ]       
+        # Gains are for the real dt of the PID; the old ones assumed a 0.060 s sample time while the loop
+        # ran at 50 Hz, so to keep the same response Kd is the old value / 3 and Ki the old value * 3.
         self.Kp = [10*19, 10*19,1000]
-        self.Ki = [0, 0, -0.138]
-        self.Kd = [100*15, 100*15, 2300]
+        self.Ki = [0, 0, -0.414]
+        self.Kd = [500, 500, 766.7]
 
         # -----------------------Add other required variables for pid here ----------------------------------------------
         self.target=[0,0,0]
@@ -67,25 +88,42 @@ class Edrone:
         self.rp_queue_max_length=0
         self.setpoint_changed=False
         self.created_next_setpoints=False
-        self.error = [0.0, 0.0, 0.0]
-        self.prev_error = [0.0, 0.0, 0.0]
-        self.error_sum = [0.0, 0.0, 0.0]
-        self.error_diff = [0.0, 0.0, 0.0]
-
         self.rpt = [0.0, 0.0, 0.0]
+        self.acceptance = WaypointAcceptance()
 
         # self.scaling_factor=0.0000451704
-        self.min_lat_limit =  0.0000451704 * 1.9
-        self.min_long_limit = 0.000047487  * 1.9
+        # the steps in degrees, of the origin loaded above
+        frame = get_frame()
+        self.min_lat_limit = STEP_LENGTH/frame.metres_per_deg_lat
+        self.min_long_limit = STEP_LENGTH/frame.metres_per_deg_long
         
         # minimum and maximum values for roll, pitch and throttle
         self.min_value = [1375, 1375, 1000]
         self.max_value = [1625, 1625, 2000]
 
-        # Sample time in which pid is run. The stimulation step time is 50 ms
-        self.sample_time = 0.060  # in seconds
+        # roll & pitch errors are in 1e-5 deg of lat/long, dt is measured in sim time
+        self.position_pid = PID(self.Kp, self.Ki, self.Kd,
+                                [value-1500 for value in self.min_value], [value-1500 for value in self.max_value],
+                                integral_limit=[0, 0, 50], error_scale=[100000, 100000, 1], clock=rospy.get_time)
+        # the gains of the short distances to start with, pid() switches between them & those of the long ones
+        self.near_gains = None
+        self.use_gains(True)
         # self.obs_tuning=False
 
+        self.trajectory_mode = rospy.get_param("~trajectory_mode", "trapezoidal")
+        if self.trajectory_mode not in TRAJECTORY_MODES:
+            raise ValueError("~trajectory_mode must be one of {}, got {}".format(", ".join(TRAJECTORY_MODES), self.trajectory_mode))
+        self.max_speed = rospy.get_param("~max_speed", 6.0)
+        self.max_accel = rospy.get_param("~max_accel", 0.7)
+        self.max_vertical_speed = rospy.get_param("~max_vertical_speed", 3.0)
+        self.max_vertical_accel = rospy.get_param("~max_vertical_accel", 2.0)
+        self.retarget_distance = rospy.get_param("~retarget_distance", 1.0)
+        self.trajectory = None
+        self.pending_setpoint = None
+        # roll/pitch command (rc units of 0.02 degrees) that tilts the drone for 1 m/s^2
+        self.rc_per_accel = math.degrees(1/9.80665)/0.02
+        self.feedforward = [0.0, 0.0, 0.0]
+
 
         #  ROS Publishers
         self.cmd_pub = rospy.Publisher("/drone_command", edrone_cmd, queue_size=1)
@@ -96,7 +134,11 @@ class Edrone:
         # self.zero_pub = rospy.Publisher("/zero", Float32, queue_size=1)        
 
         # ROS Subscribers
-        rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
+        if state_source() == "estimator":
+            self.drone_rate = [0.0, 0.0, 0.0]
+            rospy.Subscriber(STATE_TOPIC, drone_state, self.state_callback)
+        else:
+            rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
         rospy.Subscriber("/edrone/setpoint",destination,self.setpoint_callback)
         # rospy.Subscriber("/edrone/range_finder_top",LaserScan,self.range_finder_top_callback)
 
@@ -106,9 +148,30 @@ class Edrone:
             self.drone_position[0] = msg.latitude
             self.drone_position[1] = msg.longitude
             self.drone_position[2] = msg.altitude
+            self.take_pending_setpoint()
+
+    def state_callback(self, msg):
+        self.drone_position[0] = msg.lat
+        self.drone_position[1] = msg.long
+        self.drone_position[2] = msg.alt
+        # local velocity (x north, y west) to lat & long
+        frame = get_frame()
+        self.drone_rate[0] = msg.velocity.x/frame.metres_per_deg_lat
+        self.drone_rate[1] = -msg.velocity.y/frame.metres_per_deg_long
+        self.drone_rate[2] = msg.velocity.z
+        self.take_pending_setpoint()
+
+    def take_pending_setpoint(self):
+        if self.pending_setpoint is not None and all(self.drone_position):
+            msg, self.pending_setpoint = self.pending_setpoint, None
+            self.setpoint_callback(msg)
 
     def setpoint_callback(self,msg):
-        if msg.lat!=0 and msg.long!=0 and msg.alt!=0 and all(self.drone_position):
+        if not all(self.drone_position):
+            # the selector publishes on change only, so the setpoint is kept until the position is known
+            self.pending_setpoint = msg
+            return
+        if msg.lat!=0 and msg.long!=0 and msg.alt!=0:
             if (self.subscribed_target[0] != msg.lat or self.subscribed_target[1] != msg.long or self.subscribed_target[2] != msg.alt) :
                 # print('setpoint_changed')
                 self.subscribed_target[0] = msg.lat
@@ -117,7 +180,10 @@ class Edrone:
                 self.obs = msg.obstacle_detected
                 self.roll_setpoint_queue=[]
                 self.pitch_setpoint_queue=[]
-                self.create_next_linear_setpoints()
+                if self.trajectory_mode == "steps":
+                    self.create_next_linear_setpoints()
+                else:
+                    self.start_trajectory()
 
             else:
                 self.setpoint_changed=False
@@ -130,6 +196,17 @@ class Edrone:
 
             self.target[2]=self.subscribed_target[2]        
 
+    # trajectory from where the drone is to the subscribed target, starting now
+    def start_trajectory(self):
+        if self.trajectory is not None and self.trajectory.distance_to(self.subscribed_target) < self.retarget_distance:
+            # small corrections (marker search, centring) move the end of the current leg instead of
+            # restarting it from rest every time, which would keep the reference where the drone is
+            start, start_time = self.trajectory.start, self.trajectory.start_time
+        else:
+            start, start_time = self.drone_position, rospy.get_time()
+        self.trajectory = Trajectory(start, self.subscribed_target, start_time, self.trajectory_mode,
+                                     self.max_speed, self.max_accel, self.max_vertical_speed, self.max_vertical_accel)
+
     # method to break down long distance travels into ~5/10 meter travels in both roll and pitch direction        
     def create_next_linear_setpoints(self):      
         
@@ -168,99 +245,89 @@ class Edrone:
         self.created_next_setpoints=True    
     
     def check_proximity(self):
-
-        if( len(self.roll_setpoint_queue)>0 and abs(self.drone_position[0] - self.roll_setpoint_queue[0])<= 0.000004517): #0.000004517
+        # a step is done near it along its axis (Task_6_VD_2373_waypoint's step)
+        if( len(self.roll_setpoint_queue)>0 and self.acceptance.near([self.roll_setpoint_queue[0], self.drone_position[1]], 'step', self.drone_position)):
             self.roll_setpoint_queue.pop(0)
 
-        if( len(self.pitch_setpoint_queue)>0 and abs(self.drone_position[1] - self.pitch_setpoint_queue[0])<= 0.0000047487): #0.000004517
+        if( len(self.pitch_setpoint_queue)>0 and self.acceptance.near([self.drone_position[0], self.pitch_setpoint_queue[0]], 'step', self.drone_position)):
             self.pitch_setpoint_queue.pop(0)
 
 
-    def pid(self,):
-
-        if len(self.roll_setpoint_queue)!=0:
-            self.target[0]=self.roll_setpoint_queue[0]
-        else:
-            self.target[0]=self.subscribed_target[0]
-
-        if len(self.pitch_setpoint_queue)!=0:
-            self.target[1]=self.pitch_setpoint_queue[0]
-        else:
-            self.target[1]=self.subscribed_target[1]
-
-
-        if ((len(self.roll_setpoint_queue)<=1 and len(self.pitch_setpoint_queue)<=1 ) or (self.rp_queue_max_length-len(self.roll_setpoint_queue)<1)) or self.obs:
+    def use_gains(self, near):
+        # the gains & limits of the short (near) or the long distances, given to the PID when they switch
+        if near == self.near_gains:
+            return
+        self.near_gains = near
+        if near:
             # More slow & stable Tuning for smaller distances
             # self.Kp = [18, 18,1000]
             # self.Ki = [0, 0, -0.138]
             # self.Kd = [500, 500, 2300]
             self.Kp = [10*21, 10*21,1000]
-            self.Ki = [0, 0, -0.138]
-            self.Kd = [100*15, 100*15, 2500]
+            self.Ki = [0, 0, -0.414]
+            self.Kd = [500, 500, 833.3]
             self.min_value = [1275, 1275, 1000]
             self.max_value = [1725, 1725, 2000]
         else:
             # Faster better uning for larger distances            
             self.Kp = [ 165, 165, 1000]
-            self.Ki = [0, 0, -0.138]
-            self.Kd = [ 600, 600, 2300 ]
+            self.Ki = [0, 0, -0.414]
+            self.Kd = [ 200, 200, 766.7 ]
             self.min_value = [1275, 1275, 1000]
             self.max_value = [1725, 1725, 2000]
             # if self.obs:
-            #     print("OBSTACLE!") 
-
-        self.check_proximity()
-
-        self.error[0] = ( self.target[0] - self.drone_position[0] )*100000
-        self.error[1] = ( self.target[1] - self.drone_position[1] )*100000
-        self.error[2] = ( self.target[2] - self.drone_position[2] )
-
-        self.error_sum[0] = self.error_sum[0] + self.error[0]
-        self.error_diff[0] = (self.error[0] - self.prev_error[0])
-        self.error_sum[1] = self.error_sum[1] + self.error[1]
-        self.error_diff[1] = (self.error[1] - self.prev_error[1])
-        self.error_sum[2] = self.error_sum[2] + self.error[2]
-        self.error_diff[2] = (self.error[2] - self.prev_error[2])
-
-
-        # Calculating pid values
-        self.rpt[0] = (
-            (self.Kp[0] * self.error[0])
-            + (self.Ki[0] * self.error_sum[0]) * self.sample_time
-            + (self.Kd[0] * (self.error_diff[0]) / self.sample_time)
-        )
-        self.rpt[1] = (
-            (self.Kp[1] * self.error[1])
-            + (self.Ki[1] * self.error_sum[1]) * self.sample_time
-            + (self.Kd[1] * (self.error_diff[1]) / self.sample_time)
-        )
-        self.rpt[2] = (
-            (self.Kp[2] * self.error[2])
-            + (self.Ki[2] * self.error_sum[2]) * self.sample_time
-            + (self.Kd[2] * (self.error_diff[2]) / self.sample_time)
-        )
-
-        # Changing the previous error values
-        self.prev_error[0] = self.error[0]
-        self.prev_error[1] = self.error[1]
-        self.prev_error[2] = self.error[2]
+            #     print("OBSTACLE!")
+
+        self.position_pid.set_gains(self.Kp, self.Ki, self.Kd)
+        self.position_pid.set_limits([value-1500 for value in self.min_value], [value-1500 for value in self.max_value])
+
+    def pid(self,):
 
+        if self.trajectory_mode == "steps":
+            if len(self.roll_setpoint_queue)!=0:
+                self.target[0]=self.roll_setpoint_queue[0]
+            else:
+                self.target[0]=self.subscribed_target[0]
+
+            if len(self.pitch_setpoint_queue)!=0:
+                self.target[1]=self.pitch_setpoint_queue[0]
+            else:
+                self.target[1]=self.subscribed_target[1]
+            velocity = None
+            feedforward = None
+            near_target = (len(self.roll_setpoint_queue)<=1 and len(self.pitch_setpoint_queue)<=1 ) or (self.rp_queue_max_length-len(self.roll_setpoint_queue)<1)
+        else:
+            if self.trajectory is None:
+                self.start_trajectory()
+            now = rospy.get_time()
+            reference, velocity, acceleration = self.trajectory.sample(now)
+            self.target[0] = reference[0]
+            self.target[1] = reference[1]
+            self.target[2] = reference[2]
+            # tilt for the acceleration of the reference, the throttle's integral takes care of the climbs
+            frame = get_frame()
+            self.feedforward[0] = acceleration[0]*frame.metres_per_deg_lat*self.rc_per_accel
+            self.feedforward[1] = acceleration[1]*frame.metres_per_deg_long*self.rc_per_accel
+            feedforward = self.feedforward
+            # with the velocity fed forward the derivative only damps the tracking error, the well damped
+            # gains of the short distances keep the drone on the reference all along the leg
+            near_target = True
+
+        self.use_gains(bool(near_target or self.obs))
+
+        if self.trajectory_mode == "steps":
+            self.check_proximity()
+
+        # along a trajectory the derivative damps the velocity error rather than the velocity
+        self.rpt = self.position_pid.update(self.target, self.drone_position, setpoint_rate=velocity, feedforward=feedforward,
+                                            measurement_rate=self.drone_rate)
+
+        # the pid output is already limited to [min_value, max_value] - 1500
         self.cmd_drone.rcRoll = 1500 + self.rpt[0]
         self.cmd_drone.rcPitch = 1500 + self.rpt[1]
         self.cmd_drone.rcYaw = 1500
         self.cmd_drone.rcThrottle = 1500 + self.rpt[2]
 
-        # limiting the values
-        self.cmd_drone.rcRoll = limit_value(
-            self.cmd_drone.rcRoll, self.min_value[0], self.max_value[0]
-        )
-        self.cmd_drone.rcPitch = limit_value(
-            self.cmd_drone.rcPitch, self.min_value[1], self.max_value[1]
-        )
-        self.cmd_drone.rcThrottle = limit_value(
-            self.cmd_drone.rcThrottle, self.min_value[2], self.max_value[2]
-        )
-
         self.cmd_pub.publish(self.cmd_drone)
 
         # self.throttle_pub.publish(self.error[2])
@@ -269,7 +336,8 @@ class Edrone:
         # self.zero_pub.publish(0)
 
 
-        if (self.drone_position[0]-self.last_point[0]>=0.000001) or (self.drone_position[1]-self.last_point[1]>=0.000001) or  (self.drone_position[2]-self.last_point[2]>=0.02): 
+        frame = get_frame()
+        if ((self.drone_position[0]-self.last_point[0])*frame.metres_per_deg_lat>=0.1) or ((self.drone_position[1]-self.last_point[1])*frame.metres_per_deg_long>=0.1) or  (self.drone_position[2]-self.last_point[2]>=0.02): 
             self.last_point=list(self.drone_position)
 
 
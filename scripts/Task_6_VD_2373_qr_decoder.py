@@ -0,0 +1,256 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_qr_decoder.py
+Functions      gray_image,pyzbar_decode,opencv_decode,QRDecoder,qr_frames,benchmark,main
+Global Variables None
+
+
+QR decoding of the camera frames for qr_detect, off the subscriber's thread.
+
+The camera callback only hands the frame (a Task_6_VD_2373_vision.image_view of the message, not a
+copy) to submit(): it is kept as the single pending frame (a newer one replaces it, counted as
+dropped) and a worker thread decodes it:
+
+    conversion      gray_image converts it to an 8 bit grayscale image (cv2.cvtColor), the format
+                    zbar takes
+    decode rate     at most rate decodes per second (0 for every frame the worker can take)
+    confirmation    a decoded text is the result once it was read confirmations times in a row,
+                    then the worker stops decoding and submit() ignores frames until reset()
+
+parse turns a decoded text into the result (ValueError for a text that is not one, which is skipped)
+and on_result is called with it from the worker thread.
+
+Run this file for the decode throughput & the memory allocated per frame of the old float64 conversion
+& of this one, and for the frames the pipeline decodes before it is confirmed.
+
+'''
+
+import argparse
+import sys
+import threading
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+_detector = []
+
+
+def gray_image(image):
+    # 8 bit grayscale image of a BGR, BGRA or (returned as it is) grayscale frame
+    if image.ndim==2:
+        return image
+    return cv2.cvtColor(image,cv2.COLOR_BGRA2GRAY if image.shape[2]==4 else cv2.COLOR_BGR2GRAY)
+
+
+def pyzbar_decode(gray):
+    # texts of the codes zbar finds in a grayscale image
+    from pyzbar.pyzbar import decode
+    return [symbol.data.decode('utf-8','replace') for symbol in decode(gray)]
+
+
+def opencv_decode(gray):
+    # texts of the QR codes OpenCV finds in a grayscale image (when libzbar is not installed)
+    if not _detector:
+        _detector.append(cv2.QRCodeDetector())
+    text=_detector[0].detectAndDecode(gray)[0]
+    return [text] if text else []
+
+
+class QRDecoder():
+
+    def __init__(self,decode=pyzbar_decode,parse=None,on_result=None,rate=0.0,confirmations=3,convert=gray_image):
+        self.decode=decode
+        self.parse=parse
+        self.on_result=on_result
+        self.period=1.0/rate if rate>0 else 0.0
+        self.confirmations=confirmations
+        self.convert=convert
+        self.condition=threading.Condition()
+        self.thread=None
+        self.running=False
+        self.pending=None
+        # frames submitted, decoded & replaced before they were decoded
+        self.submitted=0
+        self.decoded=0
+        self.dropped=0
+        self.reset()
+
+    def reset(self):
+        # forget the result, the next frames are decoded again
+        with self.condition:
+            self.result=None
+            self.candidate=None
+            self.reads=0
+            self.pending=None
+            self.condition.notify()
+
+    def start(self):
+        self.running=True
+        self.thread=threading.Thread(target=self._run,name='qr_decoder')
+        self.thread.daemon=True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.running=False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread=None
+
+    def submit(self,frame):
+        # from the subscriber's thread, never waits on a decode
+        with self.condition:
+            if self.result is not None:
+                return
+            self.submitted+=1
+            if self.pending is not None:
+                self.dropped+=1
+            self.pending=frame
+            self.condition.notify()
+
+    def _run(self):
+        next_decode=0.0
+        while True:
+            with self.condition:
+                while self.running and (self.pending is None or self.result is not None):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                wait=next_decode-time.time()
+                if wait>0:
+                    # rate limited, frames arriving meanwhile replace the pending one
+                    self.condition.wait(wait)
+                    continue
+                frame,self.pending=self.pending,None
+            next_decode=time.time()+self.period
+            self.process(frame)
+
+    def process(self,frame):
+        # decodes a frame, returns the result if it got confirmed with it
+        texts=self.decode(self.convert(frame))
+        value=None
+        for text in texts:
+            try:
+                value=self.parse(text) if self.parse is not None else text
+                break
+            except ValueError:
+                continue
+        with self.condition:
+            self.decoded+=1
+            if value is None:
+                return None
+            if value==self.candidate:
+                self.reads+=1
+            else:
+                self.candidate,self.reads=value,1
+            if self.reads<self.confirmations:
+                return None
+            self.result=value
+            self.pending=None
+        if self.on_result is not None:
+            self.on_result(value)
+        return value
+
+
+def qr_frames(text,count=30,width=400,height=400,seed=0):
+    # camera messages (bgr8) of a QR code of text at random places & sizes on a noisy floor
+    from sensor_msgs.msg import Image
+    rng=np.random.RandomState(seed)
+    code=cv2.QRCodeEncoder.create().encode(text)
+    msgs=[]
+    for _ in range(count):
+        floor=rng.normal(120,25,(height,width)).clip(0,255).astype(np.uint8)
+        side=int(rng.uniform(0.3,0.5)*min(width,height))
+        qr=cv2.resize(code,(side,side),interpolation=cv2.INTER_NEAREST)
+        x,y=rng.randint(0,width-side),rng.randint(0,height-side)
+        floor[y:y+side,x:x+side]=qr
+        image=cv2.cvtColor(floor,cv2.COLOR_GRAY2BGR)
+        msg=Image()
+        msg.height,msg.width,msg.encoding,msg.is_bigendian,msg.step=height,width,'bgr8',0,width*3
+        msg.data=image.tobytes()
+        msgs.append(msg)
+    return msgs
+
+
+def _old_convert(msg):
+    # image_callback's conversion before: imgmsg_to_cv2 & a float64 dot product
+    image=np.frombuffer(msg.data,np.uint8).reshape(msg.height,msg.width,3)
+    return np.dot(image[...,:3],[0.2989,0.5870,0.1140])
+
+
+def benchmark(frames=200,camera_rate=30.0,rates=(0.0,5.0),confirmations=3):
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+    from Task_6_VD_2373_vision import image_view
+    text='19.0007046575,71.9998955286,22.1599967919'
+    msgs=qr_frames(text)
+    try:
+        pyzbar_decode(np.zeros((8,8),np.uint8))
+        decode,decoder_name=pyzbar_decode,'pyzbar'
+    except ImportError:
+        decode,decoder_name=opencv_decode,'OpenCV (libzbar is not installed)'
+
+    def as_uint8(image):
+        # pyzbar casts a float image to uint8 itself, the other decoders need it done
+        return image if decode is pyzbar_decode else image.astype(np.uint8)
+
+    print('decoder: {}, {} frames of {}x{}'.format(decoder_name,frames,msgs[0].width,msgs[0].height))
+    print('{:34} {:>9} {:>10} {:>14} {:>9}'.format('synchronous, every frame','frames/s','convert ms','alloc KB/frame','read'))
+    tracemalloc.start()
+    for name,convert in (('float64 dot (before)',lambda msg: as_uint8(_old_convert(msg))),('uint8 cvtColor',lambda msg: gray_image(image_view(msg)))):
+        convert_time=decode_time=0.0
+        peak=0
+        reads=0
+        for i in range(frames):
+            msg=msgs[i%len(msgs)]
+            tracemalloc.reset_peak()
+            base=tracemalloc.get_traced_memory()[0]
+            start=time.perf_counter()
+            gray=convert(msg)
+            converted=time.perf_counter()
+            texts=decode(gray)
+            decode_time+=time.perf_counter()-converted
+            convert_time+=converted-start
+            peak+=tracemalloc.get_traced_memory()[1]-base
+            reads+=text in texts
+            del gray
+        print('  {:32} {:9.1f} {:10.3f} {:14.1f} {:9.1%}'.format(name,frames/(convert_time+decode_time),convert_time*1e3/frames,
+                                                                 peak/1024.0/frames,reads/float(frames)))
+    tracemalloc.stop()
+
+    # the node's pipeline, frames arriving at the camera rate
+    print('pipeline at {:.0f} Hz, {} confirmations {:>13} {:>9} {:>9} {:>11} {:>9}'.format(camera_rate,confirmations,'callback us','decoded','dropped','ignored','result s'))
+    for rate in rates:
+        results=[]
+        decoder=QRDecoder(decode,parse=lambda text: tuple(map(float,text.split(','))),on_result=lambda value: results.append(time.time()),
+                          rate=rate,confirmations=confirmations).start()
+        callbacks=[]
+        start=time.time()
+        for i in range(frames):
+            tick=time.perf_counter()
+            decoder.submit(image_view(msgs[i%len(msgs)]))
+            callbacks.append(time.perf_counter()-tick)
+            time.sleep(max(start+(i+1)/camera_rate-time.time(),0))
+        decoder.stop()
+        print('  {:44} {:11.1f} {:9d} {:9d} {:11d} {:>9}'.format('decode rate '+('every frame' if rate==0 else '{:.0f} Hz'.format(rate)),
+              np.mean(callbacks)*1e6,decoder.decoded,decoder.dropped,frames-decoder.submitted,
+              '{:.2f}'.format(results[0]-start) if results else '-'))
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Throughput & memory per frame of the QR decoding')
+    parser.add_argument('--frames',type=int,default=200)
+    parser.add_argument('--camera-rate',type=float,default=30.0)
+    parser.add_argument('--confirmations',type=int,default=3)
+    args=parser.parse_args(argv)
+    benchmark(args.frames,args.camera_rate,confirmations=args.confirmations)
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
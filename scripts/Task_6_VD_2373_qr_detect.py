@@ -5,9 +5,17 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_qr_detect.py
-Functions      rgb2gray,image_callback
+Functions      parse_coordinates,image_callback,qr_callback
 Global Variables    None
 
+The frames are decoded by Task_6_VD_2373_qr_decoder on a worker thread, the camera callback only hands
+them over. ~decode_rate limits the decodes per second (0 for as many as the worker can do) and the
+coordinates are taken once the same ones were read ~confirmations times in a row; the camera frames are
+not decoded after that.
+
+Given a Task_6_VD_2373_vision front end, the node takes its frames from it (only while nothing is
+confirmed) instead of subscribing to the camera itself.
+
 '''
 
 '''
@@ -17,52 +25,47 @@ Use this code snippet in your code or you can also continue adding your code in
 '''
 
 
-import cv2
-import numpy as np
-from pyzbar.pyzbar import decode
-from cv_bridge import CvBridge, CvBridgeError
-
 import rospy
 from vitarana_drone.msg import *
 from sensor_msgs.msg import Image
 
+from Task_6_VD_2373_qr_decoder import QRDecoder
+from Task_6_VD_2373_vision import image_view
+
 class image_proc():
 
 	# Initialise everything
-	def __init__(self):
+	def __init__(self, front_end=None):
 
-		rospy.init_node('scanned_barcode') #Initialise rosnode
+		if front_end is None:
+			rospy.init_node('scanned_barcode') #Initialise rosnode
 		self.scanned_coords= qr_scanner()
-		self.img = np.empty([]) # This will contain your image frame from camera
-		self.bridge = CvBridge()
 		self.qr_publisher=rospy.Publisher("/edrone/qr_scanner",qr_scanner,queue_size=1)
-		rospy.Subscriber("/edrone/camera/image_raw", Image, self.image_callback) #Subscribing to the camera topic
+		self.decoder=QRDecoder(parse=self.parse_coordinates,on_result=self.qr_callback,
+			rate=rospy.get_param("~decode_rate",0.0),confirmations=rospy.get_param("~confirmations",3)).start()
+		rospy.on_shutdown(self.decoder.stop)
+		if front_end is None:
+			rospy.Subscriber("/edrone/camera/image_raw", Image, self.image_callback) #Subscribing to the camera topic
+		else:
+			front_end.register('qr_detect', self.decoder.submit, lambda: self.decoder.result is None)
 
-	def rgb2gray(self,rgb):
-	    return np.dot(rgb[...,:3], [0.2989, 0.5870, 0.1140])
+	def parse_coordinates(self,text):
+		# "lat,long,alt" of a scanned code, ValueError for anything else
+		coords=list(map(float,text.split(',')))
+		if len(coords)!=3:
+			raise ValueError('expected lat,long,alt, got {}'.format(text))
+		return tuple(coords)
 
 	# Callback function of amera topic
 	def image_callback(self, data):
-		
-		try:
-			self.img = self.bridge.imgmsg_to_cv2(data, "bgr8") # Converting the image to OpenCV standard image
-			self.img = self.rgb2gray(self.img)
-			out=decode(self.img)
-			if len(out)!=0:
-				print(out)
-				try:
-					self.destination_setpoint=map(float,out[0][0].split(','))
-					print(self.destination_setpoint)
-					self.destination_setpoint=list(self.destination_setpoint)
-					self.scanned_coords.lat_x=self.destination_setpoint[0]
-					self.scanned_coords.long_y=self.destination_setpoint[1]
-					self.scanned_coords.alt_z=self.destination_setpoint[2]
-				except Exception as e:
-					print(e)
-					
-		except CvBridgeError as e:
-			print(e)
-			return
+		self.decoder.submit(image_view(data)) # the message's buffer as an OpenCV image, not copied
+
+	# Called from the decoder's thread once the coordinates are confirmed
+	def qr_callback(self, coords):
+		print(coords)
+		self.scanned_coords.lat_x=coords[0]
+		self.scanned_coords.long_y=coords[1]
+		self.scanned_coords.alt_z=coords[2]
 
 def main():
 	image_proc_obj = image_proc()
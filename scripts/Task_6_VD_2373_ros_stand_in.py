@@ -0,0 +1,643 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_ros_stand_in.py
+Functions      parse_definition,make_message_class,make_service_classes,load_messages,Bus,CvBridge,install,activate,euler_from_quaternion,quaternion_from_euler
+Global Variables MESSAGES
+
+
+In-process stand-in for the parts of rospy, tf and the message packages that the nodes use, so the
+nodes can be run without ROS (see Task_6_VD_2373_simulator.py).
+
+install() puts rospy, tf, tf.transformations, cv_bridge, std_msgs, geometry_msgs, sensor_msgs,
+gazebo_msgs, gazebo_ros_link_attacher (srv) and vitarana_drone (msg & srv) modules into sys.modules; it has to run before any node module is imported.
+The rospy module forwards to the active Bus, which holds the topics, services, params, timers and the
+clock:
+
+- publish() copies the message and queues it, Bus.deliver() hands the queue to the subscribers; an
+  exception in a subscriber callback is logged & counted in Bus.callback_errors, like rospy does
+- the last message of a latched topic (Publisher(..., latch=True)) is queued again for every Subscriber
+  made after it was published
+- services are called synchronously
+- time only moves when the owner of the bus sets Bus.time, and Bus.run_timers() fires rospy.Timers
+- Rate.sleep() & spin() are not supported, the owner of the bus calls the nodes' loop bodies itself
+
+Message classes are generated from the msg/ & srv/ definitions of this package, and from trimmed
+copies of the std_msgs, geometry_msgs, sensor_msgs, gazebo_msgs & gazebo_ros_link_attacher definitions
+below.
+
+'''
+
+import collections
+import math
+import os
+import sys
+import types
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Message definitions of other packages, only the fields the nodes & the simulator use
+EXTERNAL_MESSAGES = collections.OrderedDict([
+    ('std_msgs',collections.OrderedDict([
+        ('Header','uint32 seq\ntime stamp\nstring frame_id'),
+        ('Bool','bool data'),
+        ('Float32','float32 data'),
+        ('Float64','float64 data'),
+        ('Int32','int32 data'),
+        ('String','string data'),
+    ])),
+    ('geometry_msgs',collections.OrderedDict([
+        ('Point','float64 x\nfloat64 y\nfloat64 z'),
+        ('Vector3','float64 x\nfloat64 y\nfloat64 z'),
+        ('Quaternion','float64 x\nfloat64 y\nfloat64 z\nfloat64 w'),
+        ('Pose','Point position\nQuaternion orientation'),
+        ('Twist','Vector3 linear\nVector3 angular'),
+    ])),
+    ('sensor_msgs',collections.OrderedDict([
+        ('NavSatFix','std_msgs/Header header\nfloat64 latitude\nfloat64 longitude\nfloat64 altitude'),
+        ('Imu','std_msgs/Header header\ngeometry_msgs/Quaternion orientation\n'
+               'geometry_msgs/Vector3 angular_velocity\ngeometry_msgs/Vector3 linear_acceleration'),
+        ('LaserScan','std_msgs/Header header\nfloat32 angle_min\nfloat32 angle_max\nfloat32 angle_increment\n'
+                     'float32 time_increment\nfloat32 scan_time\nfloat32 range_min\nfloat32 range_max\n'
+                     'float32[] ranges\nfloat32[] intensities'),
+        ('Image','std_msgs/Header header\nuint32 height\nuint32 width\nstring encoding\nuint8 is_bigendian\n'
+                 'uint32 step\nuint8[] data'),
+    ])),
+    ('gazebo_msgs',collections.OrderedDict([
+        ('ModelStates','string[] name\ngeometry_msgs/Pose[] pose\ngeometry_msgs/Twist[] twist'),
+    ])),
+])
+
+# Service definitions of other packages, for gripper_service.py
+EXTERNAL_SERVICES = collections.OrderedDict([
+    ('gazebo_ros_link_attacher',collections.OrderedDict([
+        ('Attach','string model_name_1\nstring link_name_1\nstring model_name_2\nstring link_name_2\n---\nbool ok'),
+    ])),
+])
+
+PRIMITIVE_DEFAULTS = {
+    'bool':False,'byte':0,'char':0,'int8':0,'uint8':0,'int16':0,'uint16':0,'int32':0,'uint32':0,
+    'int64':0,'uint64':0,'float32':0.0,'float64':0.0,'string':'','time':0.0,'duration':0.0,
+}
+
+
+def parse_definition(text):
+    # [(type, name)] of the fields of a .msg definition, comments & constants skipped
+    fields=[]
+    for line in text.splitlines():
+        line=line.split('#')[0].strip()
+        if not line or '=' in line:
+            continue
+        field_type,name=line.split()[:2]
+        fields.append((field_type,name))
+    return fields
+
+
+class Message(object):
+    __slots__ = ()
+    _type = ''
+    _fields = ()
+    _defaults = ()
+
+    def __init__(self,*args,**kwargs):
+        for name,default in zip(self._fields,self._defaults):
+            setattr(self,name,default())
+        for name,value in zip(self._fields,args):
+            setattr(self,name,value)
+        for name,value in kwargs.items():
+            setattr(self,name,value)
+
+    def _copy(self):
+        copy=object.__new__(type(self))
+        for name in self._fields:
+            value=getattr(self,name)
+            if isinstance(value,Message):
+                value=value._copy()
+            elif isinstance(value,list):
+                value=list(value)
+            setattr(copy,name,value)
+        return copy
+
+    def _lines(self,indent=''):
+        lines=[]
+        for name in self._fields:
+            value=getattr(self,name)
+            if isinstance(value,Message):
+                lines.append('{}{}:'.format(indent,name))
+                lines.extend(value._lines(indent+'  '))
+            else:
+                lines.append('{}{}: {}'.format(indent,name,value))
+        return lines
+
+    def __str__(self):
+        # same layout as genpy's, which the nodes parse (e.g. "result: True")
+        return '\n'.join(self._lines())
+
+    __repr__ = __str__
+
+    def __eq__(self,other):
+        return type(self) is type(other) and all(getattr(self,name)==getattr(other,name) for name in self._fields)
+
+    def __ne__(self,other):
+        return not self==other
+
+    __hash__ = None
+
+
+def _default_factory(field_type,package,classes):
+    base=field_type.split('[')[0]
+    if '[' in field_type:
+        size=field_type.split('[')[1].rstrip(']')
+        if size:
+            element=_default_factory(base,package,classes)
+            return lambda: [element() for _ in range(int(size))]
+        return list
+    if base in PRIMITIVE_DEFAULTS:
+        value=PRIMITIVE_DEFAULTS[base]
+        return lambda: value
+    if base=='Header':
+        base='std_msgs/Header'
+    if '/' not in base:
+        base=package+'/'+base
+    return classes[base]
+
+
+def make_message_class(package,name,definition,classes):
+    fields=parse_definition(definition)
+    cls=type(name,(Message,),{
+        '__slots__':tuple(field_name for _,field_name in fields),
+        '_type':package+'/'+name,
+        '_fields':tuple(field_name for _,field_name in fields),
+        '_slot_types':tuple(field_type for field_type,_ in fields),
+        '_defaults':tuple(_default_factory(field_type,package,classes) for field_type,_ in fields),
+    })
+    classes[cls._type]=cls
+    return cls
+
+
+class ServiceType(object):
+    # Instances are passed around as the service type, as in rospy.ServiceProxy(name, Gripper())
+    _type = ''
+    _request_class = None
+    _response_class = None
+
+
+def load_messages(package_dir=PACKAGE_DIR,package='vitarana_drone'):
+    # {package: {'msg': {name: class}, 'srv': {name: class}}} for the external & this package's definitions
+    classes={}
+    messages=collections.OrderedDict()
+    for external_package,definitions in EXTERNAL_MESSAGES.items():
+        messages[external_package]={'msg':collections.OrderedDict(),'srv':collections.OrderedDict()}
+        for name,definition in definitions.items():
+            messages[external_package]['msg'][name]=make_message_class(external_package,name,definition,classes)
+    for external_package,definitions in EXTERNAL_SERVICES.items():
+        messages.setdefault(external_package,{'msg':collections.OrderedDict(),'srv':collections.OrderedDict()})
+        for name,definition in definitions.items():
+            messages[external_package]['srv'].update(make_service_classes(external_package,name,definition,classes))
+
+    messages[package]={'msg':collections.OrderedDict(),'srv':collections.OrderedDict()}
+    msg_dir=os.path.join(package_dir,'msg')
+    for filename in sorted(os.listdir(msg_dir)):
+        if filename.endswith('.msg'):
+            with open(os.path.join(msg_dir,filename)) as fhand:
+                name=filename[:-4]
+                messages[package]['msg'][name]=make_message_class(package,name,fhand.read(),classes)
+
+    srv_dir=os.path.join(package_dir,'srv')
+    for filename in sorted(os.listdir(srv_dir)):
+        if filename.endswith('.srv'):
+            with open(os.path.join(srv_dir,filename)) as fhand:
+                messages[package]['srv'].update(make_service_classes(package,filename[:-4],fhand.read(),classes))
+    return messages
+
+
+def make_service_classes(package,name,definition,classes):
+    # {name: service type, name+'Request': class, name+'Response': class} of a .srv definition
+    request,response=definition.split('---')
+    request_class=make_message_class(package,name+'Request',request,classes)
+    response_class=make_message_class(package,name+'Response',response,classes)
+    service=type(name,(ServiceType,),{'_type':package+'/'+name,'_request_class':request_class,'_response_class':response_class})
+    return collections.OrderedDict([(name,service),(name+'Request',request_class),(name+'Response',response_class)])
+
+
+def euler_from_quaternion(quaternion,axes='sxyz'):
+    # tf.transformations.euler_from_quaternion for the static xyz axes the nodes use
+    if axes!='sxyz':
+        raise NotImplementedError('only sxyz axes are supported, got {}'.format(axes))
+    x,y,z,w=quaternion
+    roll=math.atan2(2*(w*x+y*z),1-2*(x*x+y*y))
+    pitch=math.asin(max(-1.0,min(1.0,2*(w*y-z*x))))
+    yaw=math.atan2(2*(w*z+x*y),1-2*(y*y+z*z))
+    return roll,pitch,yaw
+
+
+def quaternion_from_euler(ai,aj,ak,axes='sxyz'):
+    if axes!='sxyz':
+        raise NotImplementedError('only sxyz axes are supported, got {}'.format(axes))
+    cr,sr=math.cos(ai/2),math.sin(ai/2)
+    cp,sp=math.cos(aj/2),math.sin(aj/2)
+    cy,sy=math.cos(ak/2),math.sin(ak/2)
+    return [sr*cp*cy-cr*sp*sy,cr*sp*cy+sr*cp*sy,cr*cp*sy-sr*sp*cy,cr*cp*cy+sr*sp*sy]
+
+
+class Bus():
+
+    def __init__(self,params=None,log=None):
+        self.time=0.0
+        self.params=dict(params or {})
+        self.subscribers=collections.defaultdict(list)
+        self.services={}
+        self.queue=collections.deque()
+        # last message of every latched topic
+        self.latched={}
+        self.timers=[]
+        self.shutdown_hooks=[]
+        self.node_name=None
+        self.published=collections.Counter()
+        self.callback_errors=collections.Counter()
+        self.is_shutdown=False
+        self.log=log
+
+    def resolve(self,name,node_name=None):
+        node_name=node_name or self.node_name or ''
+        if name.startswith('~'):
+            return '/{}/{}'.format(node_name,name[1:])
+        if not name.startswith('/'):
+            return '/'+name
+        return name
+
+    def publish(self,topic,msg,latch=False):
+        # queued for all the topic's subscribers (None) at the time it is delivered
+        msg=msg._copy()
+        self.queue.append((topic,msg,None))
+        self.published[topic]+=1
+        if latch:
+            self.latched[topic]=msg
+
+    def subscribe(self,topic,entry):
+        # a (callback, args) entry, handed the topic's latched message as a late subscriber is
+        self.subscribers[topic].append(entry)
+        if topic in self.latched:
+            self.queue.append((topic,self.latched[topic],[entry]))
+
+    def deliver(self,limit=100000):
+        # Hands the queued messages (and whatever the callbacks publish meanwhile) to the subscribers
+        delivered=0
+        while self.queue:
+            topic,msg,entries=self.queue.popleft()
+            for callback,args in (self.subscribers[topic] if entries is None else entries):
+                try:
+                    if args is None:
+                        callback(msg)
+                    else:
+                        callback(msg,args)
+                except Exception as e:
+                    # as rospy does, a failing callback is logged & the node carries on
+                    self.callback_errors[topic]+=1
+                    if self.log is not None:
+                        self.log('error','bus','bad callback on {}: {!r}'.format(topic,e))
+            delivered+=1
+            if delivered>=limit:
+                raise RuntimeError('more than {} messages in one delivery, a publish loop?'.format(limit))
+        return delivered
+
+    def run_timers(self):
+        for timer in list(self.timers):
+            while not timer.stopped and timer.next_time<=self.time+1e-9:
+                timer.fire(self.time)
+
+    def shutdown(self,reason=''):
+        if not self.is_shutdown:
+            self.is_shutdown=True
+            for hook in self.shutdown_hooks:
+                hook()
+
+
+_bus=None
+_unset=object()
+
+
+def activate(bus):
+    # Makes bus the one the rospy stand-in forwards to
+    global _bus
+    _bus=bus
+    return bus
+
+
+def _active_bus():
+    if _bus is None:
+        raise RuntimeError('no active Bus, call activate() first')
+    return _bus
+
+
+class ROSException(Exception):
+    pass
+
+
+class ROSInterruptException(ROSException):
+    pass
+
+
+class ServiceException(ROSException):
+    pass
+
+
+class Time(object):
+    __slots__ = ('secs','nsecs')
+
+    def __init__(self,secs=0,nsecs=0):
+        total=secs+nsecs*1e-9
+        self.secs=int(math.floor(total))
+        self.nsecs=int(round((total-self.secs)*1e9))
+
+    @classmethod
+    def now(cls):
+        return cls(_active_bus().time)
+
+    @classmethod
+    def from_sec(cls,secs):
+        return cls(secs)
+
+    def to_sec(self):
+        return self.secs+self.nsecs*1e-9
+
+
+class Duration(Time):
+    pass
+
+
+class TimerEvent(object):
+    __slots__ = ('current_real','current_expected','last_real')
+
+    def __init__(self,current_real,current_expected,last_real):
+        self.current_real=current_real
+        self.current_expected=current_expected
+        self.last_real=last_real
+
+
+class Timer(object):
+
+    def __init__(self,period,callback,oneshot=False):
+        self.period=period.to_sec() if isinstance(period,Time) else float(period)
+        self.callback=callback
+        self.oneshot=oneshot
+        self.stopped=False
+        self.bus=_active_bus()
+        self.next_time=self.bus.time+self.period
+        self.last_time=None
+        self.bus.timers.append(self)
+
+    def fire(self,now):
+        event=TimerEvent(Time(now),Time(self.next_time),Time(self.last_time) if self.last_time is not None else None)
+        self.last_time=now
+        self.next_time+=self.period
+        if self.oneshot:
+            self.shutdown()
+        self.callback(event)
+
+    def shutdown(self):
+        self.stopped=True
+        if self in self.bus.timers:
+            self.bus.timers.remove(self)
+
+
+class Publisher(object):
+
+    def __init__(self,name,data_class,queue_size=None,latch=False,**kwargs):
+        self.bus=_active_bus()
+        self.name=self.bus.resolve(name)
+        self.data_class=data_class
+        self.latch=latch
+
+    def publish(self,*args,**kwargs):
+        if len(args)==1 and not kwargs and isinstance(args[0],Message):
+            msg=args[0]
+        else:
+            msg=self.data_class(*args,**kwargs)
+        self.bus.publish(self.name,msg,self.latch)
+
+    def get_num_connections(self):
+        return len(self.bus.subscribers[self.name])
+
+    def unregister(self):
+        pass
+
+
+class Subscriber(object):
+
+    def __init__(self,name,data_class,callback=None,callback_args=None,queue_size=None,**kwargs):
+        self.bus=_active_bus()
+        self.name=self.bus.resolve(name)
+        self.entry=(callback,callback_args)
+        self.bus.subscribe(self.name,self.entry)
+
+    def unregister(self):
+        if self.entry in self.bus.subscribers[self.name]:
+            self.bus.subscribers[self.name].remove(self.entry)
+
+
+def _service_class(service_class):
+    return service_class if isinstance(service_class,type) else type(service_class)
+
+
+class Service(object):
+
+    def __init__(self,name,service_class,handler,**kwargs):
+        self.bus=_active_bus()
+        self.name=self.bus.resolve(name)
+        self.service_class=_service_class(service_class)
+        self.handler=handler
+        self.bus.services[self.name]=self
+
+    def call(self,request):
+        response=self.handler(request)
+        if not isinstance(response,Message):
+            response=self.service_class._response_class(response)
+        return response
+
+    def shutdown(self,reason=''):
+        self.bus.services.pop(self.name,None)
+
+
+class ServiceProxy(object):
+
+    def __init__(self,name,service_class,persistent=False,**kwargs):
+        self.bus=_active_bus()
+        self.name=self.bus.resolve(name)
+        self.service_class=_service_class(service_class)
+
+    def __call__(self,*args,**kwargs):
+        return self.call(*args,**kwargs)
+
+    def call(self,*args,**kwargs):
+        if len(args)==1 and not kwargs and isinstance(args[0],self.service_class._request_class):
+            request=args[0]
+        else:
+            request=self.service_class._request_class(*args,**kwargs)
+        if self.name not in self.bus.services:
+            raise ServiceException('service [{}] unavailable'.format(self.name))
+        return self.bus.services[self.name].call(request._copy())
+
+    def wait_for_service(self,timeout=None):
+        if self.name not in self.bus.services:
+            raise ROSException('service [{}] is not registered, nothing can register it while waiting'.format(self.name))
+
+    def close(self):
+        pass
+
+
+class Rate(object):
+
+    def __init__(self,hz):
+        self.period=1.0/hz
+
+    def sleep(self):
+        raise RuntimeError('Rate.sleep() is not supported by the stand-in, tick the node from the simulator')
+
+
+def _make_rospy():
+    rospy=types.ModuleType('rospy')
+    rospy.__doc__='rospy stand-in, see Task_6_VD_2373_ros_stand_in'
+
+    def init_node(name,anonymous=False,**kwargs):
+        _active_bus().node_name=name.lstrip('/')
+
+    def get_name():
+        return '/'+(_active_bus().node_name or 'unnamed')
+
+    def get_param(name,default=_unset):
+        bus=_active_bus()
+        key=bus.resolve(name)
+        if key in bus.params:
+            return bus.params[key]
+        if default is _unset:
+            raise KeyError(key)
+        return default
+
+    def set_param(name,value):
+        bus=_active_bus()
+        bus.params[bus.resolve(name)]=value
+
+    def has_param(name):
+        bus=_active_bus()
+        return bus.resolve(name) in bus.params
+
+    def wait_for_service(name,timeout=None):
+        bus=_active_bus()
+        if bus.resolve(name) not in bus.services:
+            raise ROSException('service [{}] is not registered, nothing can register it while waiting'.format(bus.resolve(name)))
+
+    def get_time():
+        return _active_bus().time
+
+    def get_rostime():
+        return Time(_active_bus().time)
+
+    def is_shutdown():
+        return _active_bus().is_shutdown
+
+    def on_shutdown(hook):
+        _active_bus().shutdown_hooks.append(hook)
+
+    def signal_shutdown(reason=''):
+        _active_bus().shutdown(reason)
+
+    def spin():
+        raise RuntimeError('spin() is not supported by the stand-in, tick the node from the simulator')
+
+    def myargv(argv=None):
+        return list(sys.argv if argv is None else argv)
+
+    def _logger(level):
+        def log(msg,*args):
+            bus=_active_bus()
+            if bus.log is not None:
+                bus.log(level,get_name(),msg%args if args else msg)
+        return log
+
+    for name,value in (('init_node',init_node),('get_name',get_name),('get_param',get_param),('set_param',set_param),
+                       ('has_param',has_param),('wait_for_service',wait_for_service),('get_time',get_time),
+                       ('get_rostime',get_rostime),('is_shutdown',is_shutdown),('on_shutdown',on_shutdown),
+                       ('signal_shutdown',signal_shutdown),('spin',spin),('myargv',myargv),
+                       ('Publisher',Publisher),('Subscriber',Subscriber),('Service',Service),('ServiceProxy',ServiceProxy),
+                       ('Timer',Timer),('TimerEvent',TimerEvent),('Rate',Rate),('Time',Time),('Duration',Duration),
+                       ('ROSException',ROSException),('ROSInterruptException',ROSInterruptException),
+                       ('ServiceException',ServiceException),
+                       ('logdebug',_logger('debug')),('loginfo',_logger('info')),('logwarn',_logger('warn')),
+                       ('logerr',_logger('error')),('logfatal',_logger('fatal'))):
+        setattr(rospy,name,value)
+    rospy.core=types.SimpleNamespace(is_initialized=lambda: _bus is not None and _bus.node_name is not None)
+    return rospy
+
+
+class CvBridgeError(TypeError):
+    pass
+
+
+class CvBridge(object):
+    # cv_bridge.CvBridge for the 8 bit encodings of the Gazebo camera, images are numpy arrays as in OpenCV
+    channels = {'bgr8':3,'rgb8':3,'mono8':1,'bgra8':4,'rgba8':4}
+
+    def imgmsg_to_cv2(self,img_msg,desired_encoding='passthrough'):
+        import numpy as np
+        if img_msg.encoding not in self.channels:
+            raise CvBridgeError('unsupported encoding {}'.format(img_msg.encoding))
+        channels=self.channels[img_msg.encoding]
+        img=np.frombuffer(img_msg.data,np.uint8).reshape(img_msg.height,img_msg.step)[:,:img_msg.width*channels]
+        img=img.reshape(img_msg.height,img_msg.width,channels) if channels>1 else img.reshape(img_msg.height,img_msg.width)
+        if desired_encoding in ('passthrough',img_msg.encoding):
+            return img
+        if {desired_encoding,img_msg.encoding}=={'bgr8','rgb8'}:
+            return img[:,:,::-1]
+        raise CvBridgeError('cannot convert {} to {}'.format(img_msg.encoding,desired_encoding))
+
+    def cv2_to_imgmsg(self,cvim,encoding='passthrough'):
+        import numpy as np
+        cvim=np.ascontiguousarray(cvim,dtype=np.uint8)
+        if encoding=='passthrough':
+            encoding='mono8' if cvim.ndim==2 else 'bgr8'
+        img_msg=MESSAGES['sensor_msgs']['msg']['Image']()
+        img_msg.height,img_msg.width=cvim.shape[:2]
+        img_msg.encoding=encoding
+        img_msg.step=cvim.shape[1]*(cvim.shape[2] if cvim.ndim==3 else 1)
+        img_msg.data=cvim.tobytes()
+        return img_msg
+
+
+MESSAGES=None
+
+
+def install():
+    # Puts the stand-in modules into sys.modules (once), returns the generated message classes
+    global MESSAGES
+    if MESSAGES is not None:
+        return MESSAGES
+    MESSAGES=load_messages()
+
+    sys.modules['rospy']=_make_rospy()
+
+    tf=types.ModuleType('tf')
+    transformations=types.ModuleType('tf.transformations')
+    transformations.euler_from_quaternion=euler_from_quaternion
+    transformations.quaternion_from_euler=quaternion_from_euler
+    tf.transformations=transformations
+    sys.modules['tf']=tf
+    sys.modules['tf.transformations']=transformations
+
+    cv_bridge=types.ModuleType('cv_bridge')
+    cv_bridge.CvBridge=CvBridge
+    cv_bridge.CvBridgeError=CvBridgeError
+    sys.modules['cv_bridge']=cv_bridge
+
+    for package,kinds in MESSAGES.items():
+        package_module=types.ModuleType(package)
+        sys.modules[package]=package_module
+        for kind,classes in kinds.items():
+            module=types.ModuleType('{}.{}'.format(package,kind))
+            for name,cls in classes.items():
+                setattr(module,name,cls)
+            module.__all__=list(classes)
+            setattr(package_module,kind,module)
+            sys.modules[module.__name__]=module
+    return MESSAGES
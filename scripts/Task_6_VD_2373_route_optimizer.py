@@ -0,0 +1,173 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_route_optimizer.py
+Functions      calc_deadhead_matrix,get_route_cost,nearest_neighbour_route,two_opt,or_opt,optimize_route,get_route_sequence,benchmark
+Global Variables None
+
+
+Orders the whole manifest as one multi-stop route.
+
+The gripper holds one parcel at a time, so every parcel is a fixed pickup -> drop leg and the only
+freedom is the order of the legs. The cost of an order is the deadhead (empty) flight from one leg's
+drop point to the next leg's pickup point, plus the flight out of and back to the start point. This is
+an asymmetric TSP over the legs, with node 0 standing in for the start point:
+
+    cost[0][j]  start -> pickup of leg j
+    cost[i][j]  drop of leg i -> pickup of leg j
+    cost[i][0]  drop of leg i -> start
+
+A nearest neighbour route is improved with 2-opt and Or-opt moves until no move helps or the time
+budget runs out. Moves are scanned in a fixed order, so the result is reproducible for a given budget.
+
+'''
+
+import time
+import numpy as np
+
+from Task_6_VD_2373_geodesy import get_dist,pairwise_dist
+from Task_6_VD_2373_scheduler import get_paired_sequence,get_flight_distance,random_manifest
+
+
+def calc_deadhead_matrix(parcels,start=None):
+    # (n+1)x(n+1) matrix of empty flight distances (m) between the legs, node 0 is the start point
+    pickups=[parcel.pickup for parcel in parcels]
+    drops=[parcel.drop for parcel in parcels]
+
+    cost=np.zeros((len(parcels)+1,len(parcels)+1))
+    cost[1:,1:]=pairwise_dist(drops,pickups)
+
+    # without a start point the route is open, the first pickup & last drop are free
+    if start is not None:
+        cost[0,1:]=pairwise_dist([start],pickups)[0]
+        cost[1:,0]=pairwise_dist(drops,[start])[:,0]
+    return cost
+
+
+def get_route_cost(cost,route):
+    # Deadhead distance of flying the legs in route (1-based leg nodes) from & back to node 0
+    path=np.concatenate(([0],route,[0])).astype(int)
+    return cost[path[:-1],path[1:]].sum()
+
+
+def nearest_neighbour_route(cost):
+    # Greedy construction, always flying to the closest pickup from the current drop point
+    n=cost.shape[0]-1
+    visited=np.zeros(n+1,dtype=bool)
+    visited[0]=True
+    route=[]
+    node=0
+    for _ in range(n):
+        row=np.where(visited,np.inf,cost[node])
+        node=int(np.argmin(row))
+        visited[node]=True
+        route.append(node)
+    return route
+
+
+def two_opt(cost,route,deadline):
+    # Reverse route segments while it shortens the route. Reversing a segment flips the direction of
+    # every leg-to-leg hop inside it, so (unlike the symmetric case) the inner hops are re-costed too,
+    # using prefix sums of the forward and backward hop costs along the current path.
+    path=np.concatenate(([0],route,[0])).astype(int)
+    n=len(route)
+    improved=True
+    while improved and time.time()<deadline:
+        improved=False
+        for i in range(1,n):
+            fwd=np.concatenate(([0],np.cumsum(cost[path[:-1],path[1:]])))
+            bwd=np.concatenate(([0],np.cumsum(cost[path[1:],path[:-1]])))
+            j=np.arange(i+1,n+1)
+            delta=(cost[path[i-1],path[j]]+cost[path[i],path[j+1]]
+                   -cost[path[i-1],path[i]]-cost[path[j],path[j+1]]
+                   +(bwd[j]-bwd[i])-(fwd[j]-fwd[i]))
+            best=int(np.argmin(delta))
+            if delta[best]<-1e-9:
+                path[i:j[best]+1]=path[i:j[best]+1][::-1].copy()
+                improved=True
+            if time.time()>=deadline:
+                break
+    return [int(node) for node in path[1:-1]]
+
+
+def or_opt(cost,route,deadline,max_segment=3):
+    # Move runs of 1..max_segment consecutive legs to the best other place in the route
+    path=list(np.concatenate(([0],route,[0])).astype(int))
+    improved=True
+    while improved and time.time()<deadline:
+        improved=False
+        for seg_len in range(1,max_segment+1):
+            i=1
+            while i+seg_len<=len(path)-1:
+                first,last=path[i],path[i+seg_len-1]
+                prev,nxt=path[i-1],path[i+seg_len]
+                removal_gain=cost[prev,first]+cost[last,nxt]-cost[prev,nxt]
+
+                rest=np.array(path[:i]+path[i+seg_len:])
+                insert_cost=cost[rest[:-1],first]+cost[last,rest[1:]]-cost[rest[:-1],rest[1:]]
+                k=int(np.argmin(insert_cost))
+                if insert_cost[k]<removal_gain-1e-9:
+                    segment=path[i:i+seg_len]
+                    path=list(rest[:k+1])+segment+list(rest[k+1:])
+                    improved=True
+                i+=1
+                if time.time()>=deadline:
+                    return [int(node) for node in path[1:-1]]
+    return [int(node) for node in path[1:-1]]
+
+
+def optimize_route(parcels,start=None,time_budget=1.0,initial=None):
+    # Order (indices into parcels) in which to fly the parcels, minimising the deadhead distance.
+    # The search starts from the cheaper of the nearest neighbour route and initial (if given).
+    if len(parcels)<2:
+        return list(range(len(parcels)))
+
+    deadline=time.time()+time_budget
+    cost=calc_deadhead_matrix(parcels,start)
+    route=nearest_neighbour_route(cost)
+    best=get_route_cost(cost,route)
+    if initial is not None:
+        initial=[i+1 for i in initial]
+        if get_route_cost(cost,initial)<best:
+            route=initial
+            best=get_route_cost(cost,route)
+    while time.time()<deadline:
+        route=two_opt(cost,route,deadline)
+        route=or_opt(cost,route,deadline)
+        route_cost=get_route_cost(cost,route)
+        if route_cost>=best-1e-9:
+            break
+        best=route_cost
+    return [node-1 for node in route]
+
+
+def get_route_sequence(deliveries,returns,start=None,time_budget=1.0):
+    # Same flight-ordered parcel list get_paired_sequence gives, but from the route optimizer,
+    # which is seeded with the paired sequence so it never does worse than it
+    parcels=deliveries+returns
+    position={id(parcel):i for i,parcel in enumerate(parcels)}
+    paired=[position[id(parcel)] for parcel in get_paired_sequence(list(deliveries),list(returns))]
+    return [parcels[i] for i in optimize_route(parcels,start,time_budget,paired)]
+
+
+def benchmark(sizes=(5,10,25,50,100,250),seeds=(0,1,2),time_budget=2.0):
+    # Total path length (m) of the pairing heuristic vs the route optimizer on synthetic manifests.
+    # The loaded pickup -> drop legs are flown either way, so the saving is also shown on the deadhead part.
+    start=[18.99988879058862,72.00021844012868,16.757980880739165]
+    print('{:>5} {:>5} {:>14} {:>14} {:>14} {:>14} {:>8} {:>9}'.format(
+        'n','seed','heuristic (m)','route (m)','deadhead h (m)','deadhead r (m)','saved','time (s)'))
+    for n in sizes:
+        for seed in seeds:
+            dels,rets=random_manifest(n,seed)
+            loaded=sum(get_dist(parcel.pickup,parcel.drop) for parcel in dels+rets)
+            heuristic=get_flight_distance(get_paired_sequence(list(dels),list(rets)),start,start)
+            t=time.time()
+            route=get_flight_distance(get_route_sequence(dels,rets,start,time_budget),start,start)
+            elapsed=time.time()-t
+            print('{:>5} {:>5} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.1f} {:>7.1f}% {:>9.2f}'.format(
+                2*n,seed,heuristic,route,heuristic-loaded,route-loaded,100*(heuristic-route)/(heuristic-loaded),elapsed))
+
+
+if __name__=="__main__":
+    benchmark()
@@ -3,53 +3,117 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_scheduler.py
-Functions      get_dist,x_to_lat,y_to_long,lat_to_x,long_to_y,calc_ret_del_distances,get_schedule_from_pairs,schedule
+Functions      calc_ret_del_distances,pair_greedy,pair_optimal,get_schedule_from_pairs,schedule,get_paired_sequence,get_flight_distance,random_manifest,benchmark
 Global Variables None
 
 '''
 
 # from Task_4_VD_2373_utils import *
-import math
+import heapq
 from pprint import pprint
+import time
 import numpy as np
 
-def x_to_lat(input_x):
-    return input_x/110692.0702932625 + 19
-
-
-def y_to_long(input_y):
-    return -input_y/(105292.0089353767 )+ 72
-
-
-def lat_to_x(input_latitude):
-    return 110692.0702932625 * (input_latitude - 19)
-
-
-def long_to_y(input_longitude):
-    return -105292.0089353767 * (input_longitude - 72)
-
-def get_dist(coord1,coord2):
-
-    x1=lat_to_x(coord1[0])
-    x2=lat_to_x(coord2[0])
-
-    y1=long_to_y(coord1[1])
-    y2=long_to_y(coord2[1])
-
-    z1=coord1[2]
-    z2=coord2[2]
-
-    return math.sqrt((x2-x1)**2+(y2-y1)**2+(z2-z1)**2)
+from Task_6_VD_2373_geodesy import get_dist,pairwise_dist,get_frame
+from Task_6_VD_2373_manifest import ManifestRecord,STATION_SPACING
 
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
 
 def calc_ret_del_distances(rets,dels):
-    rets_dist_from_dels=[] 
-    for ret in rets:
-        rets_dist_from_dels.append([])
-        for deli in dels:
-            rets_dist_from_dels[rets.index(ret)].append(get_dist(ret['from'],deli['to']))
-    
-    return rets_dist_from_dels
+    # distance of every return pickup point from every delivery drop point, shape (len(rets),len(dels))
+    return pairwise_dist([ret.pickup for ret in rets],[deli.drop for deli in dels])
+
+
+def pair_greedy(rets_dist_from_dels):
+    # Repeatedly pair up the globally closest (ri,dj) whose row & column are both still free.
+    # Equivalent to the old "find min, delete row & column" loop without copying the matrix every pair.
+    n_pairs=min(rets_dist_from_dels.shape)
+    del_used=np.zeros(rets_dist_from_dels.shape[1],dtype=bool)
+    ret_idx=[]
+    del_idx=[]
+
+    # heap of (closest free delivery distance, ret, del) per return, entries go stale as deliveries get
+    # used and are refreshed lazily when popped; ties resolve row-major just like np.argwhere did
+    closest=rets_dist_from_dels.argmin(axis=1) if n_pairs else []
+    heap=[(rets_dist_from_dels[r,c],r,c) for r,c in enumerate(closest)]
+    heapq.heapify(heap)
+    while len(ret_idx)<n_pairs:
+        dist,r,c=heapq.heappop(heap)
+        if del_used[c]:
+            row=np.where(del_used,np.inf,rets_dist_from_dels[r])
+            c=int(np.argmin(row))
+            heapq.heappush(heap,(row[c],r,c))
+            continue
+        del_used[c]=True
+        ret_idx.append(int(r))
+        del_idx.append(int(c))
+
+    return ret_idx,del_idx
+
+
+def _hungarian(cost):
+    # Shortest augmenting path Hungarian algorithm, O(n^2 m) with the inner scans vectorised.
+    # Expects n_rows <= n_cols, returns (row_idx, col_idx) of the min-cost assignment.
+    n,m=cost.shape
+    u=np.zeros(n+1)
+    v=np.zeros(m+1)
+    p=np.zeros(m+1,dtype=int)    # p[j] -> row (1-based) assigned to column j
+    way=np.zeros(m+1,dtype=int)
+
+    for i in range(1,n+1):
+        p[0]=i
+        j0=0
+        minv=np.full(m+1,np.inf)
+        used=np.zeros(m+1,dtype=bool)
+        while True:
+            used[j0]=True
+            i0=p[j0]
+            cur=cost[i0-1]-u[i0]-v[1:]
+            free=~used[1:]
+            better=free & (cur<minv[1:])
+            minv[1:][better]=cur[better]
+            way[1:][better]=j0
+            masked=np.where(free,minv[1:],np.inf)
+            j1=int(np.argmin(masked))+1
+            delta=masked[j1-1]
+            u[p[used]]+=delta
+            v[used]-=delta
+            minv[~used]-=delta
+            j0=j1
+            if p[j0]==0:
+                break
+        while j0:
+            j1=way[j0]
+            p[j0]=p[j1]
+            j0=j1
+
+    cols=np.nonzero(p[1:])[0]
+    rows=p[1:][cols]-1
+    order=np.argsort(rows)
+    return rows[order],cols[order]
+
+
+def pair_optimal(rets_dist_from_dels):
+    # Pairing which minimises the total return<->delivery distance (rectangular assignment problem)
+    if rets_dist_from_dels.size==0:
+        return [],[]
+    if linear_sum_assignment is not None:
+        ret_idx,del_idx=linear_sum_assignment(rets_dist_from_dels)
+    elif rets_dist_from_dels.shape[0]<=rets_dist_from_dels.shape[1]:
+        ret_idx,del_idx=_hungarian(rets_dist_from_dels)
+    else:
+        del_idx,ret_idx=_hungarian(rets_dist_from_dels.T)
+        order=np.argsort(ret_idx)
+        ret_idx,del_idx=ret_idx[order],del_idx[order]
+
+    return [int(r) for r in ret_idx],[int(d) for d in del_idx]
+
+
+PAIRING_MODES={'greedy':pair_greedy,'optimal':pair_optimal}
+
 
 def get_schedule_from_pairs(sorted_pairs,remainder_del_rets=None):
 
@@ -69,65 +133,111 @@ def get_schedule_from_pairs(sorted_pairs,remainder_del_rets=None):
     return scheduled_ret,scheduled_del,instructions
 
 
-def schedule(rets,dels):
+def schedule(rets,dels,mode='optimal'):
+    # Pairs up returns & deliveries ('optimal' or 'greedy', see PAIRING_MODES).
+    # Paired entries are removed from rets & dels, the unpaired remainder is left in them for the caller.
 
     rets_dist_from_dels=calc_ret_del_distances(rets,dels)
-    rets_dist_from_dels=np.array(rets_dist_from_dels)
+    ret_idx,del_idx=PAIRING_MODES[mode](rets_dist_from_dels)
 
     pairs = []
-    pair_id = 1
-
-    while rets_dist_from_dels.shape[0]!=1 and rets_dist_from_dels.shape[1]!=1:
-        # Find global min distance minimum in rets_dist_from_dels
-
-        min_dist_index=np.argwhere(rets_dist_from_dels == np.min(rets_dist_from_dels))
-        # print(min_dist_index)
-        min_dist=rets_dist_from_dels[min_dist_index[0][0]][min_dist_index[0][1]]
-        # print(min_dist)
-        # pair up the ri & dj corresponding to this global min distance
-        pairs.append({'ret':rets[min_dist_index[0][0]],'del':dels[min_dist_index[0][1]],'pair_id':pair_id})
-        # print("VERIFIED DIST: ", get_dist(pairs[-1]['ret']['from'],pairs[-1]['del']['to']))
-        pair_id+=1
-        
-        # remove the ri row & di column.
-        rets_dist_from_dels=np.delete(rets_dist_from_dels,min_dist_index[0][0],0)
-        rets_dist_from_dels=np.delete(rets_dist_from_dels,min_dist_index[0][1],1)
-        del rets[min_dist_index[0][0]]
-        del dels[min_dist_index[0][1]]
-
-        # Repeat untill all are paired
-
-
-    if rets_dist_from_dels.shape[0]==1 or rets_dist_from_dels.shape[1]==1:
-        pairs.append({'ret':rets[0],'del':dels[0]})
-        # print("VERIFIED DIST: ", get_dist(pairs[-1]['ret']['from'],pairs[-1]['del']['to']))
-        
-        # remove the ri row & di column.
-        # rets_dist_from_dels=np.delete(rets_dist_from_dels,0,0)
-        rets_dist_from_dels=np.delete(rets_dist_from_dels,0,1)
-        del rets[0]
-        del dels[0]
-        # pprint(rets_dist_from_dels)
+    for pair_id,(r,d) in enumerate(zip(ret_idx,del_idx)):
+        pairs.append({'ret':rets[r],'del':dels[d],'pair_id':pair_id+1})
+
+    # remove the paired ri & dj, keeping the order of what is left
+    paired_rets=set(ret_idx)
+    paired_dels=set(del_idx)
+    rets[:]=[ret for i,ret in enumerate(rets) if i not in paired_rets]
+    dels[:]=[deli for i,deli in enumerate(dels) if i not in paired_dels]
 
     # now, finally, sort all distances : ri + dj + ridj ;
 
     # nearest ones first:
-    # sorted_pairs=sorted(pairs,reverse=True,key=lambda i: (get_dist(i['ret']['from'],i['ret']['to'])+get_dist(i['del']['from'],i['del']['to'])+get_dist(i['ret']['from'],i['del']['to'])))
+    # sorted_pairs=sorted(pairs,reverse=True,key=lambda i: (get_dist(i['ret'].pickup,i['ret'].drop)+get_dist(i['del'].pickup,i['del'].drop)+get_dist(i['ret'].pickup,i['del'].drop)))
     
     #farthest ones first
-    # sorted_pairs=sorted(pairs,reverse=True,key=lambda i: (get_dist(i['ret']['from'],i['ret']['to'])+get_dist(i['del']['from'],i['del']['to'])+get_dist(i['ret']['from'],i['del']['to'])))
+    # sorted_pairs=sorted(pairs,reverse=True,key=lambda i: (get_dist(i['ret'].pickup,i['ret'].drop)+get_dist(i['del'].pickup,i['del'].drop)+get_dist(i['ret'].pickup,i['del'].drop)))
     
     #farthest ones with higher cost first -- increases middle timings, thus not ideal
-    # sorted_pairs=sorted(pairs,reverse=True,key=lambda i: (get_dist(i['ret']['from'],i['ret']['to'])+get_dist(i['del']['from'],i['del']['to'])))
+    # sorted_pairs=sorted(pairs,reverse=True,key=lambda i: (get_dist(i['ret'].pickup,i['ret'].drop)+get_dist(i['del'].pickup,i['del'].drop)))
     
     #Penalise those orders with high intermediate distance 
-    sorted_pairs=sorted(pairs,key=lambda i: (get_dist(i['ret']['from'],i['del']['to'])/(get_dist(i['ret']['from'],i['ret']['to'])+get_dist(i['del']['from'],i['del']['to']))))
+    sorted_pairs=sorted(pairs,key=lambda i: (get_dist(i['ret'].pickup,i['del'].drop)/(get_dist(i['ret'].pickup,i['ret'].drop)+get_dist(i['del'].pickup,i['del'].drop))))
     
     # dist=[]    
     # for i in sorted_pairs:
-    #     dist.append(get_dist(i['ret']['from'],i['ret']['to'])+get_dist(i['del']['from'],i['del']['to']))
+    #     dist.append(get_dist(i['ret'].pickup,i['ret'].drop)+get_dist(i['del'].pickup,i['del'].drop))
     #     print('dist:',dist[-1])
     # print(sum(dist))
 
     scheduled_ret,scheduled_del,instructions=get_schedule_from_pairs(sorted_pairs)            
     return scheduled_ret,scheduled_del,instructions
+
+
+def get_paired_sequence(deliveries,returns,mode='optimal'):
+    # Flight order of the parcels: paired (delivery, return) legs first, then whatever could not be paired
+    returns=sorted(returns, key = lambda i: get_dist(i.pickup,i.drop))
+    deliveries=sorted(deliveries, key = lambda i: get_dist(i.pickup,i.drop))
+
+    scheduled_ret,scheduled_del,_ = schedule(returns,deliveries,mode)
+    scheduled_ret+=returns
+    scheduled_del+=deliveries
+
+    sequence=[]
+    for i in range(max(len(scheduled_del),len(scheduled_ret))):
+        if i<len(scheduled_del):
+            sequence.append(scheduled_del[i])
+        if i<len(scheduled_ret):
+            sequence.append(scheduled_ret[i])
+    return sequence
+
+
+def get_flight_distance(sequence,start=None,end=None):
+    # Total distance (m) flown to carry out the parcels in sequence one at a time, from start & to end if given
+    dist=0
+    position=start
+    for parcel in sequence:
+        if position is not None:
+            dist+=get_dist(position,parcel.pickup)
+        dist+=get_dist(parcel.pickup,parcel.drop)
+        position=parcel.drop
+    if end is not None and position is not None:
+        dist+=get_dist(position,end)
+    return dist
+
+
+def random_manifest(n,seed=0):
+    # Synthetic manifest of n deliveries & n returns around the arena, station codes already resolved
+    rng=np.random.RandomState(seed)
+    pickup_grid=[18.9998102845,72.000142461,16.557981]
+    return_grid=[18.9999367615,72.000142461,16.757981]
+    delta_lat=STATION_SPACING/get_frame().metres_per_deg_lat
+    delta_long=STATION_SPACING/get_frame().metres_per_deg_long
+    deliveries=[]
+    returns=[]
+    for i in range(n):
+        station=[pickup_grid[0]+delta_lat*rng.randint(3),pickup_grid[1]+delta_long*rng.randint(3),pickup_grid[2]]
+        drop=[19+rng.uniform(-0.001,0.001),72+rng.uniform(-0.001,0.001),rng.uniform(5,25)]
+        deliveries.append(ManifestRecord(2*i+1,'DELIVERY',station,drop,'A1'))
+        station=[return_grid[0]+delta_lat*rng.randint(3),return_grid[1]+delta_long*rng.randint(3),return_grid[2]]
+        pickup=[19+rng.uniform(-0.001,0.001),72+rng.uniform(-0.001,0.001),rng.uniform(5,25)]
+        returns.append(ManifestRecord(2*i+2,'RETURN',pickup,station,'X1'))
+    return deliveries,returns
+
+
+def benchmark(sizes=(10,50,100,500,1000,5000),modes=('greedy','optimal')):
+    # Wall time of schedule() & total flight distance of the resulting sequence for each pairing mode
+    print('{:>6} {:>8} {:>10} {:>14}'.format('n','mode','time (s)','distance (m)'))
+    for n in sizes:
+        for mode in modes:
+            dels,rets=random_manifest(n)
+            start=time.time()
+            sequence=get_paired_sequence(dels,rets,mode)
+            elapsed=time.time()-start
+            print('{:>6} {:>8} {:>10.3f} {:>14.1f}'.format(n,mode,elapsed,get_flight_distance(sequence)))
+
+
+if __name__=="__main__":
+    if linear_sum_assignment is None:
+        print('scipy not found, optimal mode uses the built-in Hungarian solver')
+    benchmark()
@@ -6,43 +6,90 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_Setpoint_Control.py
-Functions      gps_callback,range_finder_bottom_callback,check_lat_long_proximity,setpoint_control,drop,leave_parcel,check_proximity_with_iter,search_delivery_marker,reset,setpoint_control,add_setpoint_to_queue
+Functions      gps_callback,gripper_state_callback,request_gripper,check_gripper_request,check_gripper,parcel_attached,range_finder_bottom_callback,range_finder_top_callback,local_position,load_height_map,save_height_map,cruise_altitude,add_leg,plan_leg,imu_callback,state_callback,center_lat_long,check_lat_long_proximity,waypoint_kind,follow_queue,set_plan,next_leg,takeoff,enter_to_pickup,to_pickup,enter_descend,descend,descend_from,enter_attach,attach,enter_to_drop,to_drop,enter_marker_search,search_delivery_marker,enter_precision_drop,precision_drop,exit_precision_drop,enter_home,home,enter_done,drop,leave_parcel,check_proximity_with_iter,reset,setpoint_control,add_setpoint_to_queue,service_round_trip,benchmark
 Global Variables None
 
 
 Node which publishes the setpoints to go to (if no obstacle is detected )
 Controls setpoint of all pickups and drops too.
 
+The mission is a state machine (Task_6_VD_2373_mission) over the legs of the manifest's sequence, compiled
+by set_plan(): takeoff, to_pickup, descend, attach, to_drop, marker_search, precision_drop, home & done,
+each with its function run on every loop of setpoint_control() & its enter/exit hooks. The states lead
+the drone through the setpoint queue, a deque the legs are added to.
+
 This node publishes and subsribes the following topics:
-    PUBLICATIONS               SUBSCRIPTIONS                SERVICES
-    /edrone/setpoint_control   /edrone/gps                  /edrone/activate_gripper
+    PUBLICATIONS               SUBSCRIPTIONS
+    /edrone/setpoint_control   /edrone/gps
     /edrone/marker_data        /edrone/center_lat_long
+    /edrone/gripper_request    /edrone/gripper_state
+                               /edrone/range_finder_bottom
+                               /edrone/range_finder_top
+                               /edrone/imu/data
+                               (/edrone/state instead of the GPS & IMU with /state_source:=estimator)
+
+The delivery marker's position is estimated from marker_detect's detections by
+Task_6_VD_2373_marker_localizer (camera model, attitude & bottom range, detections fused with a
+Kalman filter); every fused detection moves the marker setpoint to the estimate.
+
+The range finders build a height map (Task_6_VD_2373_height_map), loaded from ~map_path at start and
+saved there on shutdown. The legs to a pickup, a delivery & home are planned over the map by
+Task_6_VD_2373_path_planner (Theta*, ~leg_planner:=theta_star): at 8 m over the higher end, around
+what the map has in the way, ~map_standoff m off it, or ~map_clearance m over it (~map_side_clearance m
+over what was only hit from the side), whichever is shorter. With ~leg_planner:=climb (or no path found) a leg is flown straight,
+at the height over the highest surface the map has within 2 m of it if that is above the 8 m.
+
+The sequence of the manifest is planned once & kept in ~plan_cache (Task_6_VD_2373_plan_cache), keyed by
+the manifest & the planner's parameters, so a node started again on the same manifest does not plan it
+over.
+
+Waypoints are accepted by Task_6_VD_2373_waypoint in metres & seconds: the points of a leg that go on
+sideways are flown through (transit), pickups, drops & the points the drone goes up or down from are
+held for 0.4 s. ~waypoint_acceptance:=stop holds every waypoint.
+
+The gripper is read from the latched /edrone/gripper_state of gripper_service.py and asked to attach or
+let go on /edrone/gripper_request, without waiting: a request is done when a state that has handled it
+comes in (its requests count is past the one seen when asking), a pickup goes on from there.
+
+Run with --benchmark for the loop time of a simulated mission against the gripper service calls the
+node made before.
 
 
 '''
 
+import argparse
+import sys
+if __name__ == "__main__" and "--benchmark" in sys.argv:
+    # the benchmark flies the stack on the rospy stand-in
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
 import rospy
-import time,os,math
+import time,os,math,collections
 from vitarana_drone.msg import *
 from std_msgs.msg import *
-from sensor_msgs.msg import NavSatFix,LaserScan
-from vitarana_drone.srv import Gripper
+from sensor_msgs.msg import NavSatFix,LaserScan,Imu
 
 # util functions
 from Task_6_VD_2373_utils import *
+from Task_6_VD_2373_marker_localizer import MarkerLocalizer,rotation_matrix
+from Task_6_VD_2373_height_map import HeightMap
+from Task_6_VD_2373_path_planner import PathPlanner
+from Task_6_VD_2373_geodesy import get_frame
+from Task_6_VD_2373_state_estimator import STATE_TOPIC,state_source
+from Task_6_VD_2373_waypoint import WaypointAcceptance
+from Task_6_VD_2373_mission import MissionStateMachine,LEG_STATES,compile_plan
+from Task_6_VD_2373_plan_cache import get_cached_set_point_sequence
 
 # Marker Detection
-import cv2
-import numpy as np
 from std_msgs.msg import Float32
 from sensor_msgs.msg import Image
-from matplotlib import pyplot as plt
 
 class SetpointControl():
 
     def __init__(self):
 
         rospy.init_node('setpoint_control')
+        load_origin_from_params()
 
 
         self.drone_position=[0,0,0]
@@ -53,20 +100,19 @@ class SetpointControl():
         # self.start_coords=[19.0,72.0,8.44099749139]#[18.99988879058862, 72.00021844012868, 16.757980880739165]
         # self.parcels_delivery_coords=[[19.0007030405,71.9999429002,22.1600026799],[18.9993676146,71.9999999999,10.65496],[19.0004681325,72.0000949773,16.660019864],]
         # self.parcels_coords=[[18.9999864489,71.9999430161,8.44099749139-0.1],[18.9999864489+0.000013552,71.9999430161+0.000014245,8.44099749139-0.1],[18.9999864489+2*0.000013552,71.9999430161,8.44099749139-0.1],[19.0,72.0,8.44099749139]]
-        self.instructions=['DELIVERY','DELIVERY','DELIVERY']
         
         self.start_coords= [18.99988879058862, 72.00021844012868, 16.757980880739165]
-        self.setpoint_queue=[[self.start_coords[0],self.start_coords[1],self.start_coords[2]+2]]
-        self.parcels_delivery_coords=[]
-        self.parcels_coords=[]#[[18.9999864489,71.9999430161,8.44099749139],[18.9999864489+0.000013552,71.9999430161+0.000014245,8.44099749139],[18.9999864489+2*0.000013552,71.9999430161,8.44099749139],[19.0,72.0,8.44099749139]]
-        
-        self.delivered=[]   # includes the ongoing setpoint too
-        self.picked_up=[]   # includes the ongoing setpoint too
-        self.instructions=[]
+        self.setpoint_queue=collections.deque([[self.start_coords[0],self.start_coords[1],self.start_coords[2]+2]])
+        # the legs left (None until set_plan) & the one flown
+        self.legs=None
+        self.leg=None
         
         
-        self.proximity_iterations=0
-        self.lat_long_proximity_iterations=0
+        # metric: the lateral points of a leg are flown through, stop: every waypoint is held
+        self.waypoint_acceptance=rospy.get_param('~waypoint_acceptance','metric')
+        if self.waypoint_acceptance not in ('metric','stop'):
+            raise ValueError('~waypoint_acceptance must be metric or stop, got {}'.format(self.waypoint_acceptance))
+        self.acceptance=WaypointAcceptance()
         self.bottom_sensor_dist=None
 
         # Task 1 final point
@@ -82,53 +128,71 @@ class SetpointControl():
         # [[18.9993675932, 72.0000569892, 10.7+17],[18.9990965928,72.0000664814,10.75+10],[18.9990965925, 71.9999050292, 22.2+10]]
         # [[19.0007046580, 71.9998955286, 24.6600061035167],[19.0007046575, 71.9998955286, 22],[19.0007046575, 71.9998955286, 25.6600061035167],[19.0006046575, 71.9998955286, 25.6600061035167]]
 
-        self.parcel_picked=False
-        self.picking_parcel=False
-
-        self.marker_setpoints=[]
+        # the pickup as the bottom range has it & the drop's setpoint, moved by the marker's estimate
+        self.pickup=None
+        self.drop_setpoint=None
         self.setpoint=list(self.setpoint_queue[0])
-        self.iterations=0
         self.dest_msg=destination()
-        cc_path='/data/cascade.xml'
-        abs_cc_path=os.path.dirname(__file__)+cc_path
-        self.logo_cascade = cv2.CascadeClassifier(abs_cc_path)
 
         self.pub_marker_data=MarkerData()
-        self.marker_detected=False
 
         # QR scanned setpoints
         self.scanned_destination_setpoint=[0,0,0]
         self.destination_set = False
-        self.go_to_marker=False
-        self.marker_point=-1   #activate from 0
-        self.popped=False
         self.pub_marker_data.marker_id=3
-        self.publish=True
         self.last_spq_popped=None
         self.checked_return_pickup_point=False
 
+        self.mission=MissionStateMachine(rospy.get_time)
+        self.mission.add('takeoff',self.takeoff)
+        self.mission.add('to_pickup',self.to_pickup,self.enter_to_pickup)
+        self.mission.add('descend',self.descend,self.enter_descend)
+        self.mission.add('attach',self.attach,self.enter_attach)
+        self.mission.add('to_drop',self.to_drop,self.enter_to_drop)
+        self.mission.add('marker_search',self.search_delivery_marker,self.enter_marker_search)
+        self.mission.add('precision_drop',self.precision_drop,self.enter_precision_drop,self.exit_precision_drop)
+        self.mission.add('home',self.home,self.enter_home)
+        self.mission.add('done',None,self.enter_done)
+        self.mission.go('takeoff')
+
         #  ROS Publishers
         self.setpoint_pub = rospy.Publisher("/edrone/setpoint_control", destination, queue_size=2)
         self.marker_data=rospy.Publisher("/edrone/marker_data", MarkerData, queue_size=1)
 
 
         # ROS Subscribers
-        rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
+        if state_source()=="estimator":
+            rospy.Subscriber(STATE_TOPIC,drone_state,self.state_callback)
+        else:
+            rospy.Subscriber("/edrone/gps", NavSatFix, self.gps_callback)
+            rospy.Subscriber("/edrone/imu/data",Imu,self.imu_callback)
         rospy.Subscriber("/edrone/center_lat_long", center_x_y, self.center_lat_long)
         rospy.Subscriber("/edrone/range_finder_bottom",LaserScan,self.range_finder_bottom_callback)
+        rospy.Subscriber("/edrone/range_finder_top",LaserScan,self.range_finder_top_callback)
 
         # rospy.Subscriber("/edrone/camera/image_raw", Image, self.image_callback) #Subscribing to the camera topic
 
         # rospy.Subscriber("/edrone/qr_scanner",qr_scanner,self.qr_callback)
-        rospy.wait_for_service('/edrone/activate_gripper')
-        self.gripper = rospy.ServiceProxy('/edrone/activate_gripper',Gripper(),persistent=True)
+        # the gripper as gripper_service last published it, asked for without waiting on an answer
+        self.gripper_state=gripper_state()
+        self.gripper_pending=None
+        rospy.Subscriber("/edrone/gripper_state",gripper_state,self.gripper_state_callback)
+        self.gripper_pub=rospy.Publisher("/edrone/gripper_request",Bool,queue_size=1)
 
         # Marker Detection
-        self.img_width=400
-        self.hfov_rad=1.3962634
-        self.focal_length = (self.img_width/2)/math.tan(self.hfov_rad/2)
-        self.prev_maker_data = center_x_y()
-        self.searching_marker=False
+        self.orientation=[0,0,0,1]
+        self.marker_localizer=MarkerLocalizer()
+
+        # what the range finders have seen, kept between sorties in ~map_path ('' for none)
+        self.map_path=rospy.get_param('~map_path',os.path.join(os.path.expanduser('~'),'.ros','Task_6_VD_2373_height_map.npz'))
+        self.map_clearance=rospy.get_param('~map_clearance',3.0)
+        self.map_side_clearance=rospy.get_param('~map_side_clearance',15.0)
+        self.height_map=self.load_height_map()
+        # theta_star: legs planned over the map, climb: straight over what it has on the way
+        self.leg_planner=rospy.get_param('~leg_planner','theta_star')
+        # kept out of reach of the obstacle node's 10 m, which steps aside from what its beams see
+        self.map_standoff=rospy.get_param('~map_standoff',10.0)
+        self.path_planner=PathPlanner(self.height_map,clearance=self.map_clearance,side_clearance=self.map_side_clearance,radius=self.map_standoff)
 
     # Callback to set current drone location
     def gps_callback(self, msg):
@@ -156,312 +220,297 @@ class SetpointControl():
     def range_finder_bottom_callback(self,msg):
 
         self.bottom_sensor_dist=msg.ranges[0]
+        if all(self.drone_position):
+            self.height_map.update_bottom(self.local_position(),rotation_matrix(self.orientation),msg.ranges[0],msg.range_min,msg.range_max)
+
+    def range_finder_top_callback(self,msg):
+        if all(self.drone_position):
+            self.height_map.update_top(self.local_position(),rotation_matrix(self.orientation),msg.ranges,
+                                       msg.angle_min,msg.angle_increment,msg.range_min,msg.range_max)
 
     
+    def imu_callback(self,msg):
+        self.orientation[0] = msg.orientation.x
+        self.orientation[1] = msg.orientation.y
+        self.orientation[2] = msg.orientation.z
+        self.orientation[3] = msg.orientation.w
+
+    def state_callback(self,msg):
+        self.drone_position[0] = msg.lat
+        self.drone_position[1] = msg.long
+        self.drone_position[2] = msg.alt
+        self.orientation[0] = msg.orientation.x
+        self.orientation[1] = msg.orientation.y
+        self.orientation[2] = msg.orientation.z
+        self.orientation[3] = msg.orientation.w
+
+    def local_position(self):
+        return [lat_to_x(self.drone_position[0]),long_to_y(self.drone_position[1]),self.drone_position[2]]
+
+    def load_height_map(self):
+        if self.map_path and os.path.exists(self.map_path):
+            frame=get_frame()
+            try:
+                return HeightMap.load(self.map_path,(frame.origin_lat,frame.origin_long))
+            except ValueError as e:
+                rospy.logwarn('starting a new height map: {}'.format(e))
+        return HeightMap()
+
+    def save_height_map(self):
+        if self.map_path:
+            self.height_map.save(self.map_path)
+
+    def cruise_altitude(self,start,end,altitude):
+        # altitude, or higher to clear what the height map has along the leg
+        height,side_only=self.height_map.max_height([lat_to_x(start[0]),long_to_y(start[1])],[lat_to_x(end[0]),long_to_y(end[1])])
+        if math.isnan(height):
+            return altitude
+        return max(altitude,height+(self.map_side_clearance if side_only else self.map_clearance))
+
     def center_lat_long(self,msg):
         # Marker detection should only work if drone near vicinity of the setpoint
         print("CENTER LAT LONG:",msg)
-        if self.prev_maker_data.x!=msg.x and self.prev_maker_data.y!=msg.y:
-            if self.searching_marker:
-                # The following are deduced as best fitted keeping in mind the parallax effect & numerous trials
-                x_center = msg.x - (self.img_width / 2 )
-                y_center = msg.y - (self.img_width / 2 )
-                if x_center >= 100:
-                    setpoint_x_pixel = (x_center + (msg.square_size/2))
-                elif x_center <= -100:
-                    setpoint_x_pixel = (x_center - (msg.square_size/2))
-                else:
-                    setpoint_x_pixel = x_center #- (msg.square_size/2)
-                
-                if y_center >= 100:
-                    setpoint_y_pixel = (y_center + (msg.square_size/2))
-                elif y_center <= -100:
-                    setpoint_y_pixel = (y_center - (msg.square_size/2))
-                else:
-                    setpoint_y_pixel = y_center #- (msg.square_size/2)
-                    
-
-                # setpoint_y_pixel = (y_center + (msg.square_size/2)) if y_center >= 0 else (y_center - (msg.square_size/2)) 
-                
-                print(setpoint_x_pixel)
-                print(setpoint_y_pixel)
-                                                # -msg.square_size                                                 
-                marker_x_m = setpoint_x_pixel * (self.drone_position[2]-self.delivered[-1][2]-1)/self.focal_length # + 0.5# - 1 from self.delivered[-1][2] is done coz while reading, I have added 1 so as to maintain a buffer height from the marker 
-                marker_y_m = - (setpoint_y_pixel * (self.drone_position[2]-self.delivered[-1][2]-1)/self.focal_length ) #+0.25  # the "-" is dependent on yaw angle i.e. orientation of drone w.r.t. 3d world
-                # marker_x_m = setpoint_x_pixel * (self.bottom_sensor_dist-1)/self.focal_length # + 0.5# - 1 from self.delivered[-1][2] is done coz while reading, I have added 1 so as to maintain a buffer height from the marker 
-                # marker_y_m = - (setpoint_y_pixel * (self.bottom_sensor_dist-1)/self.focal_length ) #+0.25  # the "-" is dependent on yaw angle i.e. orientation of drone w.r.t. 3d world
-
-                lat_x = x_to_lat(marker_x_m + lat_to_x(self.drone_position[0]))#+9.03e-6/2 
-                long_y = y_to_long(marker_y_m + long_to_y(self.drone_position[1]))#+ 0.0000047487/2
-
-                marker_setpoint= [lat_x,long_y,self.delivered[-1][2]+1]
-                print(self.marker_setpoints)
-                
-                # if marker_setpoint is near setpoint_queue, only then add the point marker_queue
-                # if abs(marker_setpoint[0]-self.setpoint_queue[0])
-                try:
-
-                    if (abs(marker_setpoint[0]-self.marker_setpoints[self.marker_point][0])>=0.000004517
-                        and (abs(marker_setpoint[0]-self.marker_setpoints[self.marker_point][0])<=0.00002 
-                        and abs(marker_setpoint[1]-self.marker_setpoints[self.marker_point][1])<=0.00002) 
-                        and abs(marker_setpoint[1]-self.marker_setpoints[self.marker_point][1])>=0.0000047487):
-                        self.marker_setpoints[self.marker_point]=marker_setpoint
-                        # print("updated marker_detected point")
-                        self.go_to_marker=True
-                    elif abs(marker_setpoint[0]-self.marker_setpoints[self.marker_point][0])>=0.00002 and abs(marker_setpoint[1]-self.marker_setpoints[self.marker_point][1])>=0.00002:
-                        self.marker_setpoints.append(marker_setpoint)
-                        # print("ADDED marker_detected point")
-                        self.marker_point+=1
-                        self.go_to_marker=True
-                        self.last_spq_popped=self.setpoint_queue.pop(0) # pop the marker searching setpoints 
-                except:
-                    self.marker_setpoints.append(marker_setpoint)
-                    self.go_to_marker=True
-                    self.marker_point+=1
-                    self.last_spq_popped=self.setpoint_queue.pop(0) # pop the marker searching setpoints 
-
-                self.pub_marker_data.err_x_m = lat_to_x(self.drone_position[0])+marker_x_m
-                self.pub_marker_data.err_y_m = long_to_y(self.drone_position[1])+marker_y_m
-        else:
-            # print("no_new_msg",msg)
-            self.prev_maker_data=msg
+        # marker_detect publishes every detection once, zeros are no detection, fused over a delivery only
+        if msg.x==0 or msg.y==0 or self.mission.state not in ('marker_search','precision_drop') or self.leg.instruction!='DELIVERY':
+            return
+        # the pixel through the camera model, with the attitude & the bottom range finder, onto the marker's surface
+        position=[lat_to_x(self.drone_position[0]),long_to_y(self.drone_position[1]),self.drone_position[2]]
+        point,covariance=self.marker_localizer.project(msg.x,msg.y,position,self.orientation,self.leg.target[2]-self.drone_height,self.bottom_sensor_dist)
+        if point is None or not self.marker_localizer.update(point,covariance):
+            return
+        marker_x,marker_y=self.marker_localizer.estimate
+        rospy.logdebug('marker estimate %.3f %.3f m, sigma %.3f m, converged %s',marker_x,marker_y,self.marker_localizer.sigma(),self.marker_localizer.converged)
 
-    def check_lat_long_proximity(self,target,current=None):
-        
-        if current is None:
-            current = self.drone_position
-
-        if (
-            (
-                abs(current[0] - target[0])<= 0.000004517/4 #0.000004517
-            )
-            and (
-                abs(current[1] - target[1])<= 0.0000047487/4 #0.0000047487
-            )
-        ):  
+        if self.mission.state=='precision_drop':
+            # refined, at the altitude it is flown at (drop() lowers it)
+            self.drop_setpoint[0]=x_to_lat(marker_x)
+            self.drop_setpoint[1]=y_to_long(marker_y)
+
+        self.pub_marker_data.err_x_m = marker_x
+        self.pub_marker_data.err_y_m = marker_y
+
+    def check_lat_long_proximity(self,target,current=None,kind='hold'):
+        return self.acceptance.errors(target,current)[0]<=self.acceptance.kinds[kind][0]
+
+
+    def check_proximity_with_iter(self,target,current=None,kind='hold',key=None):
+        # target held for the dwell of its kind
+        return self.acceptance.accept(target,kind,rospy.get_time(),current,key)
+
+
+    def check_proximity(self,target,current=None,kind='hold'):
+        return self.acceptance.near(target,kind,current)
+
+
+    def waypoint_kind(self):
+        # kind of the head of the queue: a point of a leg going on sideways, or held
+        queue=self.setpoint_queue
+        if self.waypoint_acceptance=='metric' and len(queue)>1 and self.acceptance.errors(queue[1],queue[0])[0]>self.acceptance.kinds['hold'][0]:
+            return 'transit'
+        return 'hold'
+
+    def follow_queue(self):
+        # the head of the queue popped once accepted, True when the queue is done
+        queue=self.setpoint_queue
+        if not queue:
             return True
-        else:
+        if not self.check_proximity_with_iter(queue[0],kind=self.waypoint_kind()):
             return False
+        popped=self.last_spq_popped=queue.popleft()
+        if queue and abs(queue[0][2]-popped[2])>=0.1 and popped[0]!=queue[0][0] and popped[1]!=queue[0][1]:
+            # a move both across & up or down is flown as a climb then across, or across then down
+            if self.drone_position[2]>queue[0][2]:
+                queue.appendleft([queue[0][0],queue[0][1],self.drone_position[2]])
+            else:
+                queue.appendleft([self.drone_position[0],self.drone_position[1],queue[0][2]])
+        return not queue
 
+    # ------------------------------------------- mission states -------------------------------------------
 
-    def check_proximity_with_iter(self,target,current=None):
-        
-        if current is None:
-            current = self.drone_position
-
-        if (
-            (
-                abs(current[0] - target[0])
-                <= 0.000004517/4 #0.000004517
-            )
-            and (
-                abs(current[1] - target[1])
-                <= 0.0000047487/4 #0.0000047487
-            )
-            and (
-                abs(current[2] - target[2])
-                <= 0.2
-            )
-        ):
-            if self.proximity_iterations>=20:
-                self.popped=False
-                self.check_gripper()
-                self.proximity_iterations=0
-                return True
+    def set_plan(self,parcels_coords,parcels_delivery_coords,instructions):
+        # the legs of the manifest's sequence (get_set_point_sequence), flown from the takeoff on
+        self.legs=compile_plan(parcels_coords,parcels_delivery_coords,instructions,self.start_coords)
+
+    def next_leg(self):
+        self.leg=self.legs.popleft() if self.legs else None
+        self.mission.go(LEG_STATES[self.leg.kind] if self.leg is not None else 'done')
+
+    def takeoff(self):
+        # up over the start, on to the plan once there is one
+        if self.legs is not None and self.follow_queue():
+            self.next_leg()
+
+    def enter_to_pickup(self):
+        target=self.leg.target
+        if self.leg.straight:
+            self.add_setpoint_to_queue([target[0],target[1],self.drone_position[2]])
+        else:
+            self.add_leg(target,max(target[2],self.drone_position[2])+8)
+
+    def to_pickup(self):
+        if self.follow_queue():
+            self.mission.go('descend')
+
+    def enter_descend(self):
+        self.pickup=list(self.leg.target)
+        self.checked_return_pickup_point=False
+        self.descend_from(self.last_spq_popped)
+
+    def descend(self):
+        if self.follow_queue():
+            self.descend_from(self.last_spq_popped)
+
+    def descend_from(self,point):
+        # the next point down from point over the pickup, or the pickup once within 3 m of it
+        if (not self.checked_return_pickup_point) and self.check_lat_long_proximity(point) and self.bottom_sensor_dist<float('inf'):
+            # out of the range finder's reach (over a cruise altitude) the pickup is checked further down
+            if (self.bottom_sensor_dist-(point[2]-self.pickup[2])>=0):
+                self.pickup[2]= self.drone_position[2]-self.bottom_sensor_dist+0.31
             else:
-                self.proximity_iterations+=1
-                return False
+                self.checked_return_pickup_point= True
+        if (point[2]-self.pickup[2])>3:
+            # down by 7 m, but not past 1 m above the pickup (a 7 m step from < 7 m above would end in the roof)
+            self.setpoint_queue.append([self.pickup[0],self.pickup[1],max(point[2]-7,self.pickup[2]+1)])
         else:
-            self.iterations = 0
-            return False
+            self.mission.go('attach')
 
+    def enter_attach(self):
+        self.setpoint_queue.append(self.pickup)
 
-    def check_proximity(self,target,current=None):
-        
-        if current is None:
-            current = self.drone_position
-
-        if (
-            (
-                abs(current[0] - target[0])
-                <= 0.000004517/4 #0.000004517
-            )
-            and (
-                abs(current[1] - target[1])
-                <= 0.0000047487/4 #0.0000047487
-            )
-            and (
-                abs(current[2] - target[2])
-                <= 0.2
-            )
-        ):           
-            return True
+    def attach(self):
+        # the gripper asked for the parcel at every dwell over it, until it has it
+        if self.check_proximity_with_iter(self.pickup,kind='pickup'):
+            self.check_gripper()
+
+    def enter_to_drop(self):
+        target=self.leg.target
+        self.add_leg(target,max(target[2],self.drone_position[2])+8)
+
+    def to_drop(self):
+        # a delivery's marker is looked for from over it, a return is let go at the end of the leg
+        if self.leg.instruction=='DELIVERY' and self.check_lat_long_proximity(self.leg.target):
+            self.mission.go('marker_search')
+        elif self.follow_queue():
+            self.mission.go('marker_search' if self.leg.instruction=='DELIVERY' else 'precision_drop')
+
+    def enter_marker_search(self):
+        self.setpoint_queue.append(list(self.leg.target))
+
+    def search_delivery_marker(self):
+        # down to the delivery & then up a metre at every point reached, until the marker is localized
+        if self.marker_localizer.estimate is not None:
+            self.mission.go('precision_drop')
+        elif self.follow_queue():
+            self.setpoint_queue.append([self.leg.target[0],self.leg.target[1],self.drone_position[2]+1])
+
+    def enter_precision_drop(self):
+        self.setpoint_queue.clear()
+        if self.leg.instruction=='DELIVERY':
+            marker_x,marker_y=self.marker_localizer.estimate
+            self.drop_setpoint=[x_to_lat(marker_x),y_to_long(marker_y),self.leg.target[2]+1]
         else:
-            return False
+            self.drop_setpoint=list(self.leg.target)
+        self.setpoint_queue.append(self.drop_setpoint)
+
+    def precision_drop(self):
+        if self.check_proximity_with_iter(self.drop_setpoint,kind='drop'):
+            self.drop()
+
+    def exit_precision_drop(self):
+        self.marker_localizer.reset()
+
+    def enter_home(self):
+        if not self.check_lat_long_proximity(self.start_coords):
+            # home as a leg too, a straight line at the start's altitude is along the ground
+            self.add_leg(self.start_coords,max(self.start_coords[2],self.drone_position[2])+8)
+        self.add_setpoint_to_queue(list(self.start_coords))
+
+    def home(self):
+        if self.follow_queue():
+            self.mission.go('done')
+
+    def enter_done(self):
+        self.setpoint_queue.append(list(self.start_coords))
 
     def leave_parcel(self):
         print("Dropped parcel")
-        for i in range(15):
-            resp=self.gripper(False)
-        print(resp)
+        self.request_gripper(False)
         print(self.drone_position)
-        self.go_to_marker=False
-        self.parcel_picked=False
-        self.searching_marker=False
-        self.checked_return_pickup_point=False
-        instruction_status=self.instructions[0]
-        self.instructions.pop(0)
-        if instruction_status=='DELIVERY':      #since for return deliveries. setpoints of setpoint_queue is used while dropping the parcel
-            self.setpoint_queue=[]
+        self.setpoint_queue.clear()
+        self.next_leg()
 
 
     def drop(self):
-        
-        if self.instructions[0]=='DELIVERY' and( abs(self.delivered[-1][2]+1-self.marker_setpoints[self.marker_point][2])<=0.05):
-            self.marker_setpoints.insert(self.marker_point,[self.marker_setpoints[self.marker_point][0],self.marker_setpoints[self.marker_point][1],self.marker_setpoints[self.marker_point][2]-self.bottom_sensor_dist+0.05+self.drone_height])
-            self.marker_setpoints.pop(self.marker_point+1)
+        # a delivery is lowered onto its marker with the bottom range first
+        if self.leg.instruction=='DELIVERY' and( abs(self.leg.target[2]+1-self.drop_setpoint[2])<=0.05):
+            self.drop_setpoint[2]+=-self.bottom_sensor_dist+0.05+self.drone_height
         else:
            self.leave_parcel()
 
 
-    def check_gripper(self):
-        try:
-            resp = self.gripper(True)
-            if str(resp).split(' ')[1] == 'True':
-                self.picking_parcel=False
-                self.parcel_picked=True
-                if not self.popped:
-                    self.popped=True
-                    self.last_spq_popped=self.setpoint_queue.pop(0)
-                    self.setpoint=list(self.setpoint_queue[0])
-            else:
-                self.parcel_picked=False
-                self.popped=False
-        except Exception as e:
-            print('ERROR IN check_gripper',e)
-
-
-    def search_delivery_marker(self):
-        
-        if len(self.setpoint_queue)==0:
-            self.setpoint_queue.insert(0,[self.delivered[-1][0],self.delivered[-1][1],self.drone_position[2]+1]) 
-        
-        elif len(self.setpoint_queue)>0 and self.check_proximity_with_iter(self.setpoint_queue[0]):
-            self.last_spq_popped=self.setpoint_queue.pop(0)
-            self.setpoint_queue.insert(0,[self.delivered[-1][0],self.delivered[-1][1],self.drone_position[2]+1]) 
-        self.searching_marker=True
+    def gripper_state_callback(self,msg):
+        self.gripper_state=msg
 
-    def check_setpoint_queue(self):
-        try:
-            if len(self.setpoint_queue)==0 or self.check_proximity(self.setpoint_queue[0]):
-                # GOING TO PICKUP POINT
-                if not self.parcel_picked and len(self.parcels_coords)>0:
-                    if len(self.picked_up)>0 and (self.picked_up[-1] not in self.setpoint_queue) and len(self.setpoint_queue)==0 :
-
-                        if self.parcels_coords[0][2]>self.drone_position[2]:
-                            self.add_setpoint_to_queue(list([self.drone_position[0],self.drone_position[1],self.parcels_coords[0][2]+8]))
-                            self.add_setpoint_to_queue(list([self.parcels_coords[0][0],self.parcels_coords[0][1],self.parcels_coords[0][2]+8]))
-                        else:
-                            self.add_setpoint_to_queue(list([self.drone_position[0],self.drone_position[1],self.drone_position[2]+8]))
-                            self.add_setpoint_to_queue(list([self.parcels_coords[0][0],self.parcels_coords[0][1],self.drone_position[2]+8]))
-                        self.add_setpoint_to_queue(list(self.parcels_coords[0]))
-                        self.picked_up.append(list(self.parcels_coords[0]))
-                        self.parcels_coords.pop(0)
-                        # print("len(self.parcels_coords)",len(self.parcels_coords))
-                    elif len(self.picked_up)==0:
-                        # print("Going to 1st pickup point")
-                        self.add_setpoint_to_queue(list(self.parcels_coords[0]))
-                        self.picked_up.append(list(self.parcels_coords[0]))
-                        self.parcels_coords.pop(0)
-                
-                # GOING TO DELIVERY POINT
-                elif self.parcel_picked and len(self.parcels_delivery_coords)>0 and len(self.picked_up)==len(self.delivered)+1:
-                    if self.parcels_delivery_coords[0][2]>self.drone_position[2]:
-                        # print("deliver to higher coord")
-                        self.add_setpoint_to_queue(list([self.drone_position[0],self.drone_position[1],self.parcels_delivery_coords[0][2]+8]))
-                        self.add_setpoint_to_queue(list([self.parcels_delivery_coords[0][0],self.parcels_delivery_coords[0][1],self.parcels_delivery_coords[0][2]+8]))
-                    else:
-                        # print("deliver to lower coord")
-                        self.add_setpoint_to_queue(list([self.drone_position[0],self.drone_position[1],self.drone_position[2]+8]))
-                        self.add_setpoint_to_queue(list([self.parcels_delivery_coords[0][0],self.parcels_delivery_coords[0][1],self.drone_position[2]+8]))
-                    self.add_setpoint_to_queue(list(self.parcels_delivery_coords[0]))
-                    self.delivered.append(list(self.parcels_delivery_coords[0]))
-                    self.parcels_delivery_coords.pop(0)
-                elif  not self.parcel_picked and len(self.parcels_delivery_coords)==0 and len(self.delivered)==len(self.picked_up):
-                    self.add_setpoint_to_queue(list(self.start_coords))
-                else:
-                    # Wandering
-                   pass
-
-
-            if len(self.setpoint_queue)>0 and self.check_proximity_with_iter(self.setpoint_queue[0]):
-
-                if len(self.setpoint_queue)>1 and abs(self.setpoint_queue[1][2] - self.drone_position[2])>=0.1 and (self.setpoint_queue[0][0]!=self.setpoint_queue[1][0] and self.setpoint_queue[0][1]!=self.setpoint_queue[1][1]):
-
-                    if self.drone_position[2]>self.setpoint_queue[1][2]:
-                        self.setpoint_queue.insert(0,[self.setpoint_queue[1][0],self.setpoint_queue[1][1],self.drone_position[2]])
-                    else:
-                        self.setpoint_queue.insert(0,[self.drone_position[0],self.drone_position[1],self.setpoint_queue[1][2]])
-
-                    self.last_spq_popped=self.setpoint_queue.pop(1)
-
-                elif not self.picking_parcel :
-                    if len(self.setpoint_queue)>1 and self.check_lat_long_proximity(self.setpoint_queue[0],self.setpoint_queue[1]) and self.setpoint_queue[0][2]>self.setpoint_queue[1][2] and not self.parcel_picked:
-                        if (not self.checked_return_pickup_point) and self.check_lat_long_proximity(self.setpoint_queue[0]):
-                            if (self.bottom_sensor_dist-(self.setpoint_queue[0][2]-self.setpoint_queue[1][2])>=0):
-                                self.setpoint_queue[1][2]= self.drone_position[2]-self.bottom_sensor_dist+0.31
-                            else:
-                                self.checked_return_pickup_point= True
-
-                        if (self.setpoint_queue[0][2]-self.setpoint_queue[1][2])>3:
-                            self.setpoint_queue.insert(1,[self.setpoint_queue[0][0],self.setpoint_queue[0][1],self.setpoint_queue[0][2]-7])
-                        else:
-                            self.picking_parcel=True
-
-                    else:
-                        self.picking_parcel=False
-
-
-                    if self.check_proximity(self.setpoint_queue[0]):
-                        self.last_spq_popped=self.setpoint_queue.pop(0)
+    def request_gripper(self,activate):
+        # True: attach the pickable parcel, False: let go, answered on /edrone/gripper_state
+        self.gripper_pending=(activate,self.gripper_state.requests)
+        self.gripper_pub.publish(Bool(activate))
 
-            try:
-                if self.parcel_picked and self.check_lat_long_proximity(self.delivered[-1]) and not self.go_to_marker and self.instructions[0]=='DELIVERY':
-                    self.search_delivery_marker()
-                elif self.parcel_picked and self.check_proximity_with_iter(self.delivered[-1]) and not self.go_to_marker and self.instructions[0]=='RETURN':
-                    self.drop()
-                elif self.parcel_picked and self.check_lat_long_proximity(self.delivered[-1]) and not self.go_to_marker and self.instructions[0]=='RETURN':
-                    if self.check_proximity_with_iter(self.last_spq_popped):
-                        self.setpoint_queue.insert(0,[self.setpoint_queue[0][0],self.setpoint_queue[0][1],self.setpoint_queue[0][2]-7])
-
-            except Exception as e:
-                print("SEARCHING MARKER ERROR",e)
-
-            
-            try:
-                self.setpoint=list(self.setpoint_queue[0])
-            except:
-                print("CANT ASSIGN EMPTY SETPOINT QUEUE")
-                self.publish=False
-            self.publish=True
-        except Exception as e:
-            print("ERROR IN POPPING",e)
-            self.publish=False
-
-
-    def check_marker_queue(self):
+    def check_gripper_request(self):
+        # the answer to the last request, once the gripper state has one
+        if self.gripper_pending is None or self.gripper_state.requests<=self.gripper_pending[1]:
+            return
+        activate,_=self.gripper_pending
+        self.gripper_pending=None
+        if activate and self.gripper_state.attached_box:
+            self.parcel_attached()
+        elif not activate and self.gripper_state.attached_box:
+            # not let go yet, asked again
+            self.request_gripper(False)
 
-        try:
-            if self.check_proximity_with_iter(self.marker_setpoints[self.marker_point]):
-                # self.marker_setpoints.pop(0)
-                self.drop()
-            self.setpoint=list(self.marker_setpoints[self.marker_point])
-            self.publish=True
-        except:
-            print("NO MARKER SETPOINTS")
-            self.setpoint=list(self.drone_position)
-            self.publish=False
-            
+    def check_gripper(self):
+        # the pickable parcel asked for, unless one is attached or being let go
+        releasing=self.gripper_pending is not None and not self.gripper_pending[0]
+        if self.gripper_state.attached_box and not releasing:
+            self.parcel_attached()
+        elif not releasing:
+            self.request_gripper(True)
+
+    def parcel_attached(self):
+        if self.mission.state=='attach':
+            self.setpoint_queue.clear()
+            self.next_leg()
+
+
+    def plan_leg(self,target,altitude):
+        # [lat, long, alt] setpoints of the planned path to altitude over target, None if there is none
+        path=self.path_planner.plan(self.local_position(),[lat_to_x(target[0]),long_to_y(target[1]),altitude],altitude)
+        if path is None:
+            return None
+        setpoints=[]
+        for x,y,alt in path[1:]:
+            # the ends' columns as given, not through the local frame & back
+            if [x,y]==path[0][:2]:
+                setpoints.append([self.drone_position[0],self.drone_position[1],alt])
+            elif [x,y]==path[-1][:2]:
+                setpoints.append([target[0],target[1],alt])
+            else:
+                setpoints.append([x_to_lat(x),y_to_long(y),alt])
+        return setpoints
+
+    def add_leg(self, target, altitude):
+        # up & over to above target, at altitude or higher to clear what the height map has on the way (the
+        # way down is the mission states')
+        if self.leg_planner=='theta_star':
+            setpoints=self.plan_leg(target,altitude)
+            if setpoints is not None:
+                for setpoint in setpoints:
+                    self.add_setpoint_to_queue(setpoint)
+                return
+            rospy.logwarn('no path planned to {}, flying over'.format(target))
+        cruise=self.cruise_altitude(self.drone_position,target,altitude)
+        self.add_setpoint_to_queue([self.drone_position[0],self.drone_position[1],cruise])
+        self.add_setpoint_to_queue([target[0],target[1],cruise])
 
     def add_setpoint_to_queue(self, setpoint):
         if len(self.setpoint_queue):
@@ -473,35 +522,115 @@ class SetpointControl():
 
     def setpoint_control(self):
         
+        self.acceptance.update(self.drone_position,rospy.get_time())
+        self.check_gripper_request()
+        self.mission.run()
+        if self.setpoint_queue:
+            self.setpoint=list(self.setpoint_queue[0])
         pub_msg=destination()
-        if self.go_to_marker and len(self.marker_setpoints)>0:
-            self.check_marker_queue()
-            pub_msg.lat=self.marker_setpoints[self.marker_point][0]
-            pub_msg.long=self.marker_setpoints[self.marker_point][1]
-            pub_msg.alt=self.marker_setpoints[self.marker_point][2]
-
-        else:
-            self.check_setpoint_queue()
-            pub_msg.lat=self.setpoint[0]
-            pub_msg.long=self.setpoint[1]
-            pub_msg.alt=self.setpoint[2]
+        pub_msg.lat=self.setpoint[0]
+        pub_msg.long=self.setpoint[1]
+        pub_msg.alt=self.setpoint[2]
 
         self.dest_msg=pub_msg
-        if self.publish:
-            self.setpoint_pub.publish(pub_msg)
+        self.setpoint_pub.publish(pub_msg)
 
 
     def reset(self):
         self.setpoint_pub.publish(destination())
-
+        self.save_height_map()
+        times=self.mission.breakdown()
+        rospy.loginfo('time in the mission states: '+', '.join('{} {:.1f} s'.format(state,times[state]) for state in times if self.mission.entries[state]))
+
+
+
+def service_round_trip(calls=2000):
+    # (s) a blocking request/response over loopback TCP, on one connection & on a new one per call as a
+    # rospy.ServiceProxy without persistent=True makes them
+    import socket,threading
+    server=socket.socket()
+    server.bind(('127.0.0.1',0))
+    server.listen(8)
+
+    def serve():
+        while True:
+            connection,_=server.accept()
+            with connection:
+                while connection.recv(64):
+                    connection.sendall(b'\x01'*9)
+    threading.Thread(target=serve,daemon=True).start()
+    address=server.getsockname()
+
+    def call(connection):
+        connection.sendall(b'\x01'*9)
+        connection.recv(64)
+    connection=socket.create_connection(address)
+    connection.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    start=time.perf_counter()
+    for _ in range(calls):
+        call(connection)
+    persistent=(time.perf_counter()-start)/calls
+    connection.close()
+    start=time.perf_counter()
+    for _ in range(calls//10):
+        with socket.create_connection(address) as connection:
+            call(connection)
+    return persistent,(time.perf_counter()-start)/(calls//10)
+
+
+def benchmark(manifest=None):
+    # the 50 Hz loop of setpoint_control in a simulated mission, & the service calls the nodes made before
+    # /edrone/gripper_state: one per check_gripper & 15 per leave_parcel here, one per bottom range in obstacle
+    import numpy as np
+    from Task_6_VD_2373_simulator import Simulator
+    sim=Simulator(manifest)
+    sc,obs=sim.setpoint_control,sim.obstacle
+    loop,calls=[],{'check_gripper':0,'leave_parcel':0,'obstacle':0}
+
+    def counted(name,function):
+        def wrapper(*args):
+            calls[name]+=1
+            return function(*args)
+        return wrapper
+    sc.check_gripper=counted('check_gripper',sc.check_gripper)
+    sc.leave_parcel=counted('leave_parcel',sc.leave_parcel)
+    obs.check_gripper=counted('obstacle',obs.check_gripper)
+    setpoint_control=sc.setpoint_control
+
+    def timed():
+        start=time.perf_counter()
+        setpoint_control()
+        loop.append(time.perf_counter()-start)
+    sc.setpoint_control=timed
+    result=sim.run()
+    persistent,connect=service_round_trip()
+    loop=np.array(loop)
+    sim_time=result['sim_time']
+    rpcs=calls['check_gripper']+15*calls['leave_parcel']
+    print('{} after {:.1f} s of sim time, {} loops of setpoint_control'.format(result['status'],sim_time,len(loop)))
+    print('gripper requests published {}, gripper states received {}'.format(
+          sim.bus.published['/edrone/gripper_request'],sim.bus.published['/edrone/gripper_state']))
+    print('service calls before: setpoint_control {} ({:.2f}/s), obstacle {} ({:.1f}/s)'.format(
+          rpcs,rpcs/sim_time,calls['obstacle'],calls['obstacle']/sim_time))
+    print('loopback service round trip {:.1f} us persistent, {:.1f} us connecting per call'.format(persistent*1e6,connect*1e6))
+    print('{:34} {:>12} {:>12} {:>12}'.format('setpoint_control loop','mean us','max us','blocked s'))
+    print('{:34} {:12.1f} {:12.1f} {:12.3f}'.format('gripper state',loop.mean()*1e6,loop.max()*1e6,0.0))
+    for name,rtt in (('service, persistent',persistent),('service, connecting',connect)):
+        print('{:34} {:12.1f} {:12.1f} {:12.3f}'.format(name,loop.mean()*1e6+rpcs*rtt/len(loop)*1e6,
+              loop.max()*1e6+15*rtt*1e6,rpcs*rtt))
 
 
 def main():
 
     delivery_control = SetpointControl()
     
-    # delivery_control.setpoint_queue
-    delivery_control.parcels_coords,delivery_control.parcels_delivery_coords,delivery_control.instructions=get_set_point_sequence()
+    # delivery_control.setpoint_queue, planned once per manifest & kept in ~plan_cache ('' for none)
+    delivery_control.set_plan(*get_cached_set_point_sequence(
+        rospy.get_param('~plan_cache',os.path.join(os.path.expanduser('~'),'.ros','Task_6_VD_2373_plans')),
+        rospy.get_param('~pairing_mode','optimal'),
+        rospy.get_param('~planner','pairing'),
+        delivery_control.start_coords,
+        rospy.get_param('~route_time_budget',1.0)))
 
     r = rospy.Rate(50)
     counter = 0
@@ -511,4 +640,11 @@ def main():
         r.sleep()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser=argparse.ArgumentParser(description='Setpoints of the pickups, deliveries & returns of the manifest')
+    parser.add_argument('--benchmark',action='store_true',help='loop time of a simulated mission instead of running the node')
+    parser.add_argument('--manifest',default=None)
+    args=parser.parse_known_args()[0]
+    if args.benchmark:
+        benchmark(args.manifest)
+    else:
+        main()
\ No newline at end of file
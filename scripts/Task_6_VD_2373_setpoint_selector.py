@@ -4,65 +4,185 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename       Task_6_VD_2373_setpoint_selector.py
-Functions      check,obstacle_setpoint_callback,setpoint_control_callback
-Global Variables None
+Functions      Source,source_callback,obstacle_setpoint_callback,setpoint_control_callback,arbitrate,publish,check,benchmark
+Global Variables SOURCES
 
+Arbitrates the setpoint of the drone between its sources, in the order of ~priority (highest first):
 
+    emergency_land      /edrone/emergency_setpoint    while its last setpoint is newer than ~source_timeout s
+    manual              /edrone/manual_setpoint       while its last setpoint is newer than ~source_timeout s
+    obstacle            /edrone/obstacle_setpoint     while obstacle_detected is set
+    mission             /edrone/setpoint_control      always
+
+An all zero setpoint releases emergency_land & manual at once.
+
+/edrone/setpoint is published when the arbitration is made (on a source's message, or in check() when
+a source times out) and the chosen setpoint differs from the last one published. The setpoint is also
+published again after ~keep_alive s without a change (0: never again). The arbitration latency, wall
+time from the source's message arriving to its setpoint going out (s), is on
+/edrone/setpoint_selector/latency while subscribed and in the latency list of the node.
+
+Run with --benchmark for the /edrone/setpoint traffic of a simulated mission against the 50 Hz
+republishing selector.
 '''
-import rospy
-import math
+import argparse
+import sys
 import time
+if __name__ == "__main__" and "--benchmark" in sys.argv:
+    # the benchmark flies the stack on the rospy stand-in
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+import rospy
 from vitarana_drone.msg import *
-from sensor_msgs.msg import Imu, NavSatFix,LaserScan
-from vitarana_drone.srv import Gripper
+from std_msgs.msg import Float32
+
+# (name, topic, timeout) by default priority, sources with a timeout are active while fresh
+SOURCES = (('emergency_land','/edrone/emergency_setpoint',True),
+           ('manual','/edrone/manual_setpoint',True),
+           ('obstacle','/edrone/obstacle_setpoint',False),
+           ('mission','/edrone/setpoint_control',False))
+
+
+class Source():
+    __slots__ = ('name','timeout','msg','received','arrived')
+
+    def __init__(self,name,timeout):
+        self.name=name
+        self.timeout=timeout
+        self.msg=destination()
+        # rospy time & wall time the last message came in
+        self.received=None
+        self.arrived=None
+
 
 class Selector():
     def __init__(self):
 
         rospy.init_node('setpoint_selector')
 
-        self.obs_msg = destination()
+        names=[name for name,_,_ in SOURCES]
+        priority=[name.strip() for name in rospy.get_param('~priority',','.join(names)).split(',')]
+        if sorted(priority)!=sorted(names):
+            raise ValueError('~priority must order all of {}, got {}'.format(', '.join(names),', '.join(priority)))
+        self.source_timeout = rospy.get_param('~source_timeout',1.0)
+        self.keep_alive = rospy.get_param('~keep_alive',1.0)
+
+        topics={name:(topic,timeout) for name,topic,timeout in SOURCES}
+        self.sources=[Source(name,topics[name][1]) for name in priority]
+        self.by_name={source.name:source for source in self.sources}
+
+        self.pub_msg = None
+        self.published_at = None
+        self.selected = None
+        # arbitration latencies (s) of the changes published
+        self.latency = []
+        self.published = 0
 
-        self.setpoint_control_msg = destination()
-                
         self.setpoint_pub = rospy.Publisher("/edrone/setpoint", destination, queue_size=2)
+        self.latency_pub = rospy.Publisher("/edrone/setpoint_selector/latency", Float32, queue_size=10)
+
+        for source in self.sources:
+            rospy.Subscriber(topics[source.name][0],destination,self.source_callback,callback_args=source)
 
-        rospy.Subscriber("/edrone/obstacle_setpoint",destination,self.obstacle_setpoint_callback)
-        rospy.Subscriber("/edrone/setpoint_control",destination,self.setpoint_control_callback)
 
+    # the two sources the selector started with
+    @property
+    def obs_msg(self):
+        return self.by_name['obstacle'].msg
+
+    @property
+    def setpoint_control_msg(self):
+        return self.by_name['mission'].msg
 
     def obstacle_setpoint_callback(self,msg):
 
-        self.obs_msg = msg
+        self.source_callback(msg,self.by_name['obstacle'])
 
 
     def setpoint_control_callback(self,msg):
-        
-        self.setpoint_control_msg = msg 
+
+        self.source_callback(msg,self.by_name['mission'])
+
+
+    def source_callback(self,msg,source):
+        source.msg=msg
+        source.received=rospy.get_time()
+        source.arrived=time.perf_counter()
+        self.arbitrate()
+
+
+    def active(self,source,now):
+        if source.name=='mission':
+            return True
+        if source.received is None:
+            return False
+        if not source.timeout:
+            return source.msg.obstacle_detected
+        return (now-source.received<=self.source_timeout
+                and (source.msg.lat!=0 or source.msg.long!=0 or source.msg.alt!=0))
+
+
+    def arbitrate(self):
+        # publishes the setpoint of the highest priority active source if it changed
+        now=rospy.get_time()
+        for source in self.sources:
+            if self.active(source,now):
+                break
+        msg=source.msg
+        if (self.pub_msg is None or msg.lat!=self.pub_msg.lat or msg.long!=self.pub_msg.long
+                or msg.alt!=self.pub_msg.alt or msg.obstacle_detected!=self.pub_msg.obstacle_detected):
+            self.selected=source.name
+            self.publish(msg,now)
+            if source.arrived is not None:
+                self.latency.append(time.perf_counter()-source.arrived)
+                if self.latency_pub.get_num_connections()>0:
+                    self.latency_pub.publish(Float32(self.latency[-1]))
+
+
+    def publish(self,msg,now):
+        self.pub_msg=msg
+        self.published_at=now
+        self.published+=1
+        self.setpoint_pub.publish(msg)
 
 
     def check(self):
-        
-        pub_msg=destination()
-        
-        if self.obs_msg.obstacle_detected:
-            # Avoiding obs
-            pub_msg = self.obs_msg
-            
-        else:
-            # Going to setpoint
-            pub_msg = self.setpoint_control_msg
-
-        self.setpoint_pub.publish(pub_msg)
+        # sources timing out & the keep alive, run by the main loop
+        self.arbitrate()
+        now=rospy.get_time()
+        if self.keep_alive>0 and now-self.published_at>=self.keep_alive:
+            self.publish(self.pub_msg,now)
+
+
+def benchmark(manifest=None):
+    import numpy as np
+    from Task_6_VD_2373_simulator import Simulator
+    print('{:26} {:>10} {:>16} {:>10} {:>12}'.format('selector','sim s','/edrone/setpoint','callbacks','latency ms'))
+    for name,keep_alive in (('50 Hz republish',1e-9),('on change',1.0),('on change, no keep alive',0.0)):
+        sim=Simulator(manifest,params={'/setpoint_selector/keep_alive':keep_alive})
+        result=sim.run()
+        messages=sim.bus.published['/edrone/setpoint']
+        # every subscriber in the stack (not the simulator's own) handles each message
+        callbacks=messages*(len(sim.bus.subscribers['/edrone/setpoint'])-1)
+        print('{:26} {:10.1f} {:16d} {:10d} {:12.4f}{}'.format(name,result['sim_time'],messages,callbacks,
+              1e3*np.mean(sim.selector.latency),'' if result['status']=='complete' else ' '+result['status']))
+
 
 def main():
 
     selector_obj=Selector()
-    r = rospy.Rate(50)  # rate in Hz 
-    
+    r = rospy.Rate(50)  # rate in Hz
+
     while not rospy.is_shutdown():
         selector_obj.check()
         r.sleep()
 
 if __name__ == "__main__":
-    main()
+    parser=argparse.ArgumentParser(description='Setpoint arbitration between the sources of the drone')
+    parser.add_argument('--benchmark',action='store_true',help='setpoint traffic of a simulated mission instead of running the node')
+    parser.add_argument('--manifest',default=None)
+    args=parser.parse_known_args()[0]
+    if args.benchmark:
+        benchmark(args.manifest)
+    else:
+        main()
@@ -0,0 +1,653 @@
+#!/usr/bin/env python
+
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_simulator.py
+Functions      build_world,Simulator,simulate,parse_param,main
+Global Variables DRONE_HEIGHT,MARKER_SIZE
+
+
+Offline closed-loop simulator of the whole control stack, without ROS or Gazebo.
+
+SetpointControl, Obstacle, Selector and both Edrone controllers are constructed as they are in the
+nodes, but against the in-process rospy stand-in (Task_6_VD_2373_ros_stand_in), and fly
+QuadrotorPlant (Task_6_VD_2373_pid) through a box world built from the manifest:
+
+- a pad under the start point, every pickup station & every return drop station
+- a 6 x 6 m building under every delivery, with the 2 x 2 m landing marker on its roof (optionally
+  offset from the manifest coordinates), and one under every return pickup
+- pads & roofs are placed so the drone rests at the manifest altitude (GPS altitude - DRONE_HEIGHT)
+
+Sensors are published at the rates of the Gazebo models: /edrone/gps & /edrone/imu/data at 60 Hz,
+/edrone/range_finder_top (5 beams, ray cast against the boxes) & /edrone/range_finder_bottom at 20 Hz,
+with the rangers' 0.01 m noise and optional GPS noise. The IMU's accelerometer reads the thrust along the
+drone's z axis (there is no drag). With /state_source:=estimator (--param state_source:=estimator) the
+state estimator node runs too and the nodes read its /edrone/state. With --hosted the nodes pass their
+messages in the process, as they do hosted by Task_6_VD_2373_node_host, rather than over the bus.
+/edrone/activate_gripper & /edrone/gripper_request have the semantics of gripper_service.py (a parcel can be gripped within 0.1 m
+horizontally while the drone rests on it, and released anywhere, landing on the surface below; it drops
+out of the gripper's reach, so it cannot be gripped again until the drone has flown off it). The
+marker camera is geometric: marker_detect's gating (near /edrone/setpoint for more than 5 frames at
+30 Hz) is reproduced, and the cascade's bounding box is replaced by the pinhole projection of the
+marker through the drone's attitude, published on /edrone/center_lat_long as soon as it is made
+(each detection once) like marker_detect does. The camera & the bottom range finder are fixed to the drone, the range
+is along its z axis.
+
+The nodes' main loop bodies are run every 20 ms of sim time, the attitude controller is driven by the
+IMU messages. The plant is integrated with a fixed step in between. A run stops when all parcels have
+been handled and the drone is back on the start pad, on a crash (hitting a building or tilting over)
+or at max_time, and returns sim time to complete, wall time, distance flown, failed pickups (grip
+attempts that missed a waiting parcel), obstacle events (avoidance manoeuvres started by the obstacle
+node), callback errors (exceptions in subscriber callbacks, which rospy logs & carries on after) & per
+parcel placement errors.
+
+    python Task_6_VD_2373_simulator.py --manifest original.csv --planner route
+
+'''
+
+import argparse
+import contextlib
+import heapq
+import math
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+import Task_6_VD_2373_ros_stand_in as ros_stand_in
+
+# the stand-in has to be in sys.modules before the nodes (& rospy) are imported
+ros_stand_in.install()
+
+import rospy
+from sensor_msgs.msg import Imu, NavSatFix, LaserScan
+from std_msgs.msg import Bool
+from vitarana_drone.msg import center_x_y, destination, gripper_state, prop_speed
+from vitarana_drone.srv import Gripper, GripperResponse
+
+from Task_6_VD_2373_geodesy import lat_to_x,long_to_y,x_to_lat,y_to_long
+from Task_6_VD_2373_manifest import read_manifest
+from Task_6_VD_2373_marker_localizer import rotation_matrix
+from Task_6_VD_2373_utils import resolve_stations,get_set_point_sequence
+from Task_6_VD_2373_pid import QuadrotorPlant
+from Task_6_VD_2373_waypoint import WaypointAcceptance
+
+DRONE_HEIGHT = 0.31         # GPS altitude of the drone above the surface it rests on (m)
+MARKER_SIZE = 2.0           # side of the landing marker (m)
+PAD_SIZE = 1.2              # side of the station pads (m)
+BUILDING_SIZE = 6.0         # side of the buildings under deliveries & return pickups (m)
+GRIP_DISTANCE = 0.1         # gripper_service's horizontal pick up tolerance (m)
+GRIP_HEIGHT = 0.2           # highest the drone may be above resting on the parcel to grip it (m)
+
+IMG_WIDTH = 400
+HFOV = 1.3962634
+FOCAL_LENGTH = (IMG_WIDTH/2)/math.tan(HFOV/2)
+
+# world directions (x north, y west) of the 5 beams of range_finder_top at yaw 0
+TOP_BEAMS = ((0.0,1.0),(1.0,0.0),(0.0,-1.0),(-1.0,0.0),(0.0,1.0))
+RANGE_MIN = 0.06
+RANGE_MAX = 25.0
+RANGE_NOISE = 0.01
+
+MAX_TILT = math.radians(60)
+MAX_STEP_UP = 0.5
+
+
+class Parcel():
+    __slots__ = ('id','type','position','surface','target','attached','released_at','under_drone')
+
+    def __init__(self,id,type,position,surface,target):
+        self.id=id
+        self.type=type
+        self.position=list(position)        # local [x, y] (m)
+        self.surface=surface                # top of what it rests on (m)
+        self.target=list(target)            # local [x, y] it has to be left at (m)
+        self.attached=False
+        self.released_at=None
+        self.under_drone=False              # released & the drone has not left it yet
+
+
+class World():
+    # Boxes standing on the ground (altitude 0), as [x_min, x_max, y_min, y_max, top] rows in the local frame
+
+    def __init__(self):
+        self.boxes=np.zeros((0,5))
+        self.box_names=[]
+        self.parcels=[]
+        self.markers=[]                     # local [x, y, z] of the marker centres
+
+    def add_box(self,x,y,size,top,name):
+        half=size/2.0
+        self.boxes=np.vstack([self.boxes,[x-half,x+half,y-half,y+half,top]])
+        self.box_names.append(name)
+
+    def surface_height(self,x,y):
+        boxes=self.boxes
+        inside=(boxes[:,0]<=x)&(x<=boxes[:,1])&(boxes[:,2]<=y)&(y<=boxes[:,3])
+        return float(boxes[inside,4].max()) if inside.any() else 0.0
+
+    def ray_cast(self,x,y,z,direction,max_range=RANGE_MAX):
+        # Distance along a horizontal ray to the first box side higher than z (slab test), or inf
+        boxes=self.boxes[self.boxes[:,4]>z]
+        if not len(boxes):
+            return float('inf')
+        with np.errstate(divide='ignore',invalid='ignore'):
+            tx=np.divide(np.subtract(boxes[:,0:2],x),direction[0])
+            ty=np.divide(np.subtract(boxes[:,2:4],y),direction[1])
+        if direction[0]==0:
+            tx=np.where((boxes[:,0:1]<=x)&(x<=boxes[:,1:2]),np.array([[-np.inf,np.inf]]),np.nan)
+        if direction[1]==0:
+            ty=np.where((boxes[:,2:3]<=y)&(y<=boxes[:,3:4]),np.array([[-np.inf,np.inf]]),np.nan)
+        near=np.maximum(tx.min(axis=1),ty.min(axis=1))
+        far=np.minimum(tx.max(axis=1),ty.max(axis=1))
+        hit=(near<=far)&(near>=0)&np.isfinite(near)
+        if not hit.any():
+            return float('inf')
+        distance=float(near[hit].min())
+        return distance if distance<=max_range else float('inf')
+
+
+def _local(coords):
+    return [lat_to_x(coords[0]),long_to_y(coords[1]),coords[2]]
+
+
+def build_world(deliveries,returns,start_coords,marker_offset=0.0,seed=0,obstacles=()):
+    # World for manifest records with resolved stations. Markers are moved from the delivery coordinates
+    # by up to marker_offset (m) in x & y; obstacles are extra (x, y, size, top) boxes.
+    rng=np.random.RandomState(seed)
+    world=World()
+    start=_local(start_coords)
+    world.add_box(start[0],start[1],PAD_SIZE,start[2]-DRONE_HEIGHT,'start')
+
+    for delivery in deliveries:
+        pickup=_local(delivery.pickup)
+        drop=_local(delivery.drop)
+        world.add_box(pickup[0],pickup[1],PAD_SIZE,pickup[2]-DRONE_HEIGHT,'pad {}'.format(delivery.station))
+        world.add_box(drop[0],drop[1],BUILDING_SIZE,drop[2],'delivery {}'.format(delivery.id))
+        marker=[drop[0]+rng.uniform(-marker_offset,marker_offset),drop[1]+rng.uniform(-marker_offset,marker_offset),drop[2]]
+        world.markers.append(marker)
+        world.parcels.append(Parcel(delivery.id,delivery.type,pickup[:2],pickup[2]-DRONE_HEIGHT,marker[:2]))
+
+    for return_coord in returns:
+        pickup=_local(return_coord.pickup)
+        drop=_local(return_coord.drop)
+        world.add_box(pickup[0],pickup[1],BUILDING_SIZE,pickup[2]-DRONE_HEIGHT,'return {}'.format(return_coord.id))
+        world.add_box(drop[0],drop[1],PAD_SIZE,drop[2]-DRONE_HEIGHT,'pad {}'.format(return_coord.station))
+        world.parcels.append(Parcel(return_coord.id,return_coord.type,pickup[:2],pickup[2]-DRONE_HEIGHT,drop[:2]))
+
+    for x,y,size,top in obstacles:
+        world.add_box(x,y,size,top,'obstacle')
+    return world
+
+
+class MarkerCamera():
+    # Stand-in for the camera & marker_detect: same gating & publishing, geometric detection
+
+    def __init__(self,simulator):
+        self.sim=simulator
+        self.acceptance=WaypointAcceptance()
+        self.target=[0,0,0]
+        self.pub_center_pixels=center_x_y()
+        self.new_detection=False
+        self.center_x_y=rospy.Publisher('/edrone/center_lat_long',center_x_y,queue_size=1)
+        rospy.Subscriber('/edrone/setpoint',destination,self.setpoint_callback)
+
+    def setpoint_callback(self,msg):
+        self.target=[msg.lat,msg.long,msg.alt]
+
+    def check_proximity_setpoint(self):
+        # marker_detect's check_proximity_setpoint
+        return self.acceptance.accept(self.target,'marker',self.sim.time,self.sim.gps)
+
+    def frame(self):
+        if not self.check_proximity_setpoint():
+            return
+        x,y,z=self.sim.plant.position
+        markers=[marker for marker in self.sim.world.markers if marker[2]<z]
+        if not markers:
+            return
+        marker=min(markers,key=lambda m: (m[0]-x)**2+(m[1]-y)**2)
+        # marker in the drone's frame (x forward, y left, z up); image x is forward & image y to the right
+        body=rotation_matrix(self.sim.plant.quaternion()).T.dot([marker[0]-x,marker[1]-y,marker[2]-z])
+        depth=-body[2]
+        if depth<=0:
+            return
+        center_x=IMG_WIDTH/2+body[0]*FOCAL_LENGTH/depth
+        center_y=IMG_WIDTH/2-body[1]*FOCAL_LENGTH/depth
+        if not (0<=center_x<=IMG_WIDTH and 0<=center_y<=IMG_WIDTH):
+            return
+        # bounding box in whole pixels, like detectMultiScale's
+        size=int(MARKER_SIZE*FOCAL_LENGTH/depth)
+        self.pub_center_pixels.x=int(center_x-size/2)+size/2
+        self.pub_center_pixels.y=int(center_y-size/2)+size/2
+        self.pub_center_pixels.square_size=size
+        self.new_detection=True
+        self.detect()
+
+    def detect(self):
+        if self.new_detection:
+            self.center_x_y.publish(self.pub_center_pixels)
+            self.new_detection=False
+
+
+class Simulator():
+
+    def __init__(self,manifest_path=None,planner='pairing',pairing_mode='optimal',route_time_budget=1.0,
+                 physics_dt=0.001,marker_offset=0.0,gps_noise=0.0,seed=0,obstacles=(),params=None,verbose=False,hosted=False,
+                 sequenced_manifest_path=None):
+        from Task_6_VD_2373_manifest import get_manifest_paths
+        self.manifest_path=manifest_path or get_manifest_paths([])[0]
+        # the sequenced manifest goes to a directory of the run's own (removed when run() ends) unless given a path
+        self.directory=None
+        if sequenced_manifest_path is None:
+            self.directory=tempfile.TemporaryDirectory()
+            sequenced_manifest_path=os.path.join(self.directory.name,'sequenced_manifest.csv')
+        self.sequenced_manifest_path=sequenced_manifest_path
+        self.physics_dt=physics_dt
+        self.gps_noise=gps_noise
+        self.rng=np.random.RandomState(seed)
+        self.verbose=verbose
+        self.status='running'
+        self.reason=''
+        self.time=0.0
+        self.distance=0.0
+        self.pwm=[0.0,0.0,0.0,0.0]
+        self.failed_pickups=0
+        self.failed_parcel=None
+        self.obstacle_events=0
+        self.resting=False
+        self.avoiding=False
+
+        # runs do not share a height map unless given one
+        params=dict({'/setpoint_control/map_path':''},**(params or {}))
+        self.bus=ros_stand_in.activate(ros_stand_in.Bus(params,log=self._log if verbose else None))
+        with self._output():
+            self._start_nodes(planner,pairing_mode,route_time_budget,hosted)
+
+        deliveries,returns=resolve_stations(*read_manifest(self.manifest_path))
+        self.world=build_world(deliveries,returns,self.setpoint_control.start_coords,marker_offset,seed,obstacles)
+        self.plant=QuadrotorPlant(_local(self.setpoint_control.start_coords))
+        self.gps=self.plant.gps()
+        self.last_gps_position=list(self.plant.position)
+        self._update_surface()
+
+    def _log(self,level,node,msg):
+        sys.stderr.write('[{}] [{:.3f}] {}: {}\n'.format(level,self.bus.time,node,msg))
+
+    @contextlib.contextmanager
+    def _output(self):
+        # the nodes print on every tick, which is only wanted in verbose runs
+        if self.verbose:
+            yield
+            return
+        with open(os.devnull,'w') as devnull,contextlib.redirect_stdout(devnull):
+            yield
+
+    def _start_nodes(self,planner,pairing_mode,route_time_budget,hosted):
+        rospy.init_node('simulator')
+        rospy.Service('/edrone/activate_gripper',Gripper,self.gripper_callback)
+        # /edrone/gripper_request messages handled & the last (attached, pickable) state published
+        self.gripper_requests=0
+        self.gripper_published=None
+        self.gripper_state_pub=rospy.Publisher('/edrone/gripper_state',gripper_state,queue_size=1,latch=True)
+        rospy.Subscriber('/edrone/gripper_request',Bool,self.gripper_request_callback)
+        rospy.Subscriber('/edrone/pwm',prop_speed,self.pwm_callback)
+        self.gps_pub=rospy.Publisher('/edrone/gps',NavSatFix,queue_size=1)
+        self.imu_pub=rospy.Publisher('/edrone/imu/data',Imu,queue_size=1)
+        self.top_pub=rospy.Publisher('/edrone/range_finder_top',LaserScan,queue_size=1)
+        self.bottom_pub=rospy.Publisher('/edrone/range_finder_bottom',LaserScan,queue_size=1)
+        self.camera=MarkerCamera(self)
+
+        # nodes are imported here, so they pick up the stand-in
+        from Task_6_VD_2373_state_estimator import StateEstimator,state_source
+        from Task_6_VD_2373_attitude_controller import Edrone as AttitudeController
+        from Task_6_VD_2373_position_controller import Edrone as PositionController
+        from Task_6_VD_2373_setpoint_selector import Selector
+        from Task_6_VD_2373_obstacle import Obstacle
+        from Task_6_VD_2373_setpoint_control import SetpointControl
+        from Task_6_VD_2373_node_host import NodeHost
+
+        # hosted, the nodes pass their messages in the process as in Task_6_VD_2373_node_host
+        host=NodeHost() if hosted else None
+        node=host.node if hosted else lambda name: contextlib.nullcontext()
+        # the nodes read the estimator's state rather than the sensors with /state_source:=estimator
+        self.estimator=None
+        if state_source()=='estimator':
+            with node('state_estimator'):
+                self.estimator=StateEstimator()
+        with node('attitude_controller'):
+            self.attitude=AttitudeController()
+        with node('position_controller'):
+            self.position=PositionController()
+        with node('setpoint_selector'):
+            self.selector=Selector()
+        with node('obstacle'):
+            self.obstacle=Obstacle()
+        with node('setpoint_control'):
+            self.setpoint_control=SetpointControl()
+        if hosted:
+            host.connect()
+        self.host=host
+        # as in the setpoint control's main(), with the manifest paths of this run
+        sc=self.setpoint_control
+        sc.set_plan(*get_set_point_sequence(
+            pairing_mode,planner,sc.start_coords,route_time_budget,
+            manifest_path=self.manifest_path,sequenced_manifest_path=self.sequenced_manifest_path))
+
+        self.top_scan=self._laser_scan(-math.pi,math.pi,5)
+        self.bottom_scan=self._laser_scan(0.0,0.0,1)
+        self.gps_msg=NavSatFix()
+        self.imu_msg=Imu()
+
+    def _laser_scan(self,angle_min,angle_max,beams):
+        scan=LaserScan()
+        scan.angle_min=angle_min
+        scan.angle_max=angle_max
+        scan.angle_increment=(angle_max-angle_min)/max(beams-1,1)
+        scan.range_min=RANGE_MIN
+        scan.range_max=RANGE_MAX
+        scan.ranges=[float('inf')]*beams
+        return scan
+
+    # ----------------------------------------- plant ----------------------------------------------------------
+
+    def pwm_callback(self,msg):
+        self.pwm=[msg.prop1,msg.prop2,msg.prop3,msg.prop4]
+
+    def _update_surface(self):
+        x,y=self.plant.position[0],self.plant.position[1]
+        self.surface=self.world.surface_height(x,y)
+        self.surface_xy=(x,y)
+
+    def _advance(self,until):
+        # Integrates the plant up to the given sim time, resting it on whatever is below
+        plant=self.plant
+        position=plant.position
+        while self.time<until-1e-9 and self.status=='running':
+            dt=min(self.physics_dt,until-self.time)
+            plant.step(self.pwm,dt)
+            self.time+=dt
+            self.resting=False
+
+            if abs(position[0]-self.surface_xy[0])+abs(position[1]-self.surface_xy[1])>0.02:
+                self._update_surface()
+            floor=self.surface+DRONE_HEIGHT
+            if position[2]<floor:
+                if floor-position[2]>MAX_STEP_UP:
+                    self._crash('flew into a building at {:.1f}, {:.1f}, {:.1f} m'.format(*position))
+                    return
+                # resting on the surface
+                self.resting=True
+                position[2]=floor
+                plant.velocity[:]=[0.0,0.0,max(plant.velocity[2],0.0)]
+                plant.angles[:]=[0.0,0.0]
+                plant.rates[:]=[0.0,0.0]
+            elif abs(plant.angles[0])>MAX_TILT or abs(plant.angles[1])>MAX_TILT:
+                self._crash('tilted over at {:.1f}, {:.1f}, {:.1f} m'.format(*position))
+                return
+
+        for parcel in self.world.parcels:
+            if parcel.attached:
+                parcel.position[:]=position[:2]
+
+    def _crash(self,reason):
+        self.status='crashed'
+        self.reason=reason
+
+    # ----------------------------------------- sensors --------------------------------------------------------
+
+    def publish_gps(self):
+        position=self.plant.position
+        if self.gps_noise:
+            self.gps=[x_to_lat(position[0]+float(self.rng.normal(0.0,self.gps_noise))),
+                      y_to_long(position[1]+float(self.rng.normal(0.0,self.gps_noise))),
+                      position[2]+float(self.rng.normal(0.0,self.gps_noise))]
+        else:
+            self.gps=self.plant.gps()
+        self.distance+=math.sqrt(sum((position[i]-self.last_gps_position[i])**2 for i in range(3)))
+        self.last_gps_position[:]=position
+        for parcel in self.world.parcels:
+            if parcel.under_drone and abs(parcel.position[0]-position[0])+abs(parcel.position[1]-position[1])>1.0:
+                parcel.under_drone=False
+        msg=self.gps_msg
+        msg.header.stamp=self.time
+        msg.latitude,msg.longitude,msg.altitude=self.gps
+        self.gps_pub.publish(msg)
+
+    def publish_imu(self):
+        msg=self.imu_msg
+        msg.header.stamp=self.time
+        msg.orientation.x,msg.orientation.y,msg.orientation.z,msg.orientation.w=self.plant.quaternion()
+        msg.angular_velocity.x,msg.angular_velocity.y=self.plant.rates
+        # the thrust along the drone's z axis, or what holds it up when it rests on something
+        msg.linear_acceleration.z=max(self.plant.thrust_accel,self.plant.GRAVITY) if self.resting else self.plant.thrust_accel
+        self.imu_pub.publish(msg)
+
+    def _range(self,distance):
+        if not RANGE_MIN<=distance<=RANGE_MAX:
+            return float('inf')
+        return distance+float(self.rng.normal(0.0,RANGE_NOISE))
+
+    def publish_range_finders(self):
+        x,y,z=self.plant.position
+        self.top_scan.header.stamp=self.time
+        self.top_scan.ranges=[self._range(self.world.ray_cast(x,y,z,beam)) for beam in TOP_BEAMS]
+        self.top_pub.publish(self.top_scan)
+        self.bottom_scan.header.stamp=self.time
+        # along the drone's z axis, to the (flat) surface below
+        self.bottom_scan.ranges=[self._range((z-self.surface)/max(math.cos(self.plant.angles[0])*math.cos(self.plant.angles[1]),0.1))]
+        self.bottom_pub.publish(self.bottom_scan)
+
+    # ----------------------------------------- gripper --------------------------------------------------------
+
+    def _pickable(self):
+        x,y,z=self.plant.position
+        for parcel in self.world.parcels:
+            if parcel.attached:
+                return parcel
+        for parcel in self.world.parcels:
+            if (not parcel.under_drone and abs(parcel.position[0]-x)<GRIP_DISTANCE and abs(parcel.position[1]-y)<GRIP_DISTANCE
+                    and 0<=z-(parcel.surface+DRONE_HEIGHT)<=GRIP_HEIGHT):
+                return parcel
+        return None
+
+    def gripper_callback(self,req):
+        attached=self._grip(req.activate_gripper)
+        self.publish_gripper_state()
+        return GripperResponse(attached)
+
+    def gripper_request_callback(self,msg):
+        self.gripper_requests+=1
+        self._grip(msg.data)
+        self.publish_gripper_state(True)
+
+    def _grip(self,activate):
+        # gripper_service.py: attach/detach the pickable parcel, True only when attached
+        parcel=self._pickable()
+        if parcel is None:
+            if activate:
+                self._count_failed_pickup()
+            return False
+        if activate:
+            parcel.attached=True
+            self.failed_parcel=None
+            return True
+        if parcel.attached:
+            parcel.attached=False
+            parcel.position[:]=self.plant.position[:2]
+            parcel.surface=self.world.surface_height(*parcel.position)
+            parcel.released_at=self.time
+            parcel.under_drone=True
+        return False
+
+    def publish_gripper_state(self,answer=False):
+        # /edrone/gripper_state of gripper_service.py, when it changed or as the answer to a request
+        parcel=self._pickable()
+        attached=str(parcel.id) if parcel is not None and parcel.attached else ''
+        pickable=str(parcel.id) if parcel is not None and not parcel.attached else ''
+        state=(attached,pickable)
+        if answer or state!=self.gripper_published:
+            self.gripper_published=state
+            self.gripper_state_pub.publish(gripper_state(rospy.get_rostime(),attached,bool(pickable),pickable,self.gripper_requests))
+
+    def _count_failed_pickup(self):
+        # a grip attempt that missed a parcel waiting to be picked up, counted once per parcel until it is picked
+        x,y,z=self.plant.position
+        for parcel in self.world.parcels:
+            if (parcel.released_at is None and not parcel.under_drone and math.hypot(parcel.position[0]-x,parcel.position[1]-y)<0.5
+                    and z-(parcel.surface+DRONE_HEIGHT)<0.5):
+                if parcel is not self.failed_parcel:
+                    self.failed_parcel=parcel
+                    self.failed_pickups+=1
+                return
+
+    # ----------------------------------------- nodes ----------------------------------------------------------
+
+    def tick_nodes(self):
+        # bodies of the main loops of the 50 Hz nodes
+        bus=self.bus
+        self.setpoint_control.setpoint_control()
+        bus.deliver()
+
+        obs=self.obstacle
+        if all(obs.drone_position):
+            obs.obs_avoid()
+        obs.setpoint_pub.publish(obs.pub_msg)
+        bus.deliver()
+        if obs.pub_msg.obstacle_detected and not self.avoiding:
+            self.obstacle_events+=1
+        self.avoiding=obs.pub_msg.obstacle_detected
+
+        self.selector.check()
+        bus.deliver()
+
+        if all(self.position.drone_position) and all(self.position.subscribed_target):
+            self.position.pid()
+        bus.deliver()
+        self.check_done()
+
+    def check_done(self):
+        sc=self.setpoint_control
+        # the home leg is the last, so none left is every parcel let go
+        if sc.legs is not None and not sc.legs and not any(parcel.attached for parcel in self.world.parcels) and sc.check_proximity(sc.start_coords):
+            self.status='complete'
+
+    # ----------------------------------------- run ------------------------------------------------------------
+
+    def run(self,max_time=3600.0):
+        ros_stand_in.activate(self.bus)
+        events=((1/60.0,self.publish_gps),(1/60.0,self.publish_imu),(1/20.0,self.publish_range_finders),
+                (1/30.0,self.camera.frame),(1.0,self.camera.detect),(1/50.0,self.tick_nodes),(0.1,self.publish_gripper_state))
+        # (time, event, count) with time = count * period, so the events do not drift
+        queue=[(period,i,1) for i,(period,_) in enumerate(events)]
+        heapq.heapify(queue)
+
+        wall_start=time.perf_counter()
+        try:
+            with self._output():
+                while self.status=='running':
+                    event_time,i,count=heapq.heappop(queue)
+                    if event_time>max_time:
+                        self.status='timeout'
+                        self.reason='not done after {:.0f} s'.format(max_time)
+                        break
+                    self._advance(event_time)
+                    if self.status!='running':
+                        break
+                    self.bus.time=event_time
+                    events[i][1]()
+                    self.bus.deliver()
+                    self.bus.run_timers()
+                    self.bus.deliver()
+                    heapq.heappush(queue,(events[i][0]*(count+1),i,count+1))
+        finally:
+            if self.directory is not None:
+                self.directory.cleanup()
+        wall_time=time.perf_counter()-wall_start
+        return self.result(wall_time)
+
+    def result(self,wall_time):
+        parcels=[]
+        for parcel in self.world.parcels:
+            parcels.append({
+                'id':parcel.id,
+                'type':parcel.type,
+                'released_at':parcel.released_at,
+                'placement_error':math.hypot(parcel.position[0]-parcel.target[0],parcel.position[1]-parcel.target[1]),
+            })
+        return {
+            'status':self.status,
+            'reason':self.reason,
+            'sim_time':self.time,
+            'wall_time':wall_time,
+            'realtime_factor':self.time/wall_time if wall_time>0 else float('inf'),
+            'distance':self.distance,
+            'failed_pickups':self.failed_pickups,
+            'obstacle_events':self.obstacle_events,
+            'callback_errors':sum(self.bus.callback_errors.values())+(self.host.errors if self.host else 0),
+            'parcels':parcels,
+            'handled':sum(parcel['released_at'] is not None for parcel in parcels),
+        }
+
+
+def simulate(manifest_path=None,max_time=3600.0,**kwargs):
+    # One run of the stack on a manifest, see Simulator for the keyword arguments
+    return Simulator(manifest_path,**kwargs).run(max_time)
+
+
+def print_result(result):
+    print('{} after {:.1f} s of sim time in {:.1f} s ({:.1f}x real time), {:.0f} m flown{}'.format(
+        result['status'],result['sim_time'],result['wall_time'],result['realtime_factor'],result['distance'],
+        ': '+result['reason'] if result['reason'] else ''))
+    print('{} failed pickups, {} obstacle events, {} callback errors'.format(result['failed_pickups'],result['obstacle_events'],result['callback_errors']))
+    print('{:>4} {:<9} {:>12} {:>14}'.format('id','type','released (s)','error (m)'))
+    for parcel in result['parcels']:
+        print('{:>4} {:<9} {:>12} {:>14.2f}'.format(parcel['id'],parcel['type'],
+              '{:.1f}'.format(parcel['released_at']) if parcel['released_at'] is not None else '-',parcel['placement_error']))
+
+
+def parse_param(text):
+    # ("/node/name", value) of a roslaunch style name:=value, the value as YAML scalars read
+    name,value=text.split(':=',1)
+    if not name.startswith('/'):
+        name='/'+name
+    for cast in (int,float):
+        try:
+            return name,cast(value)
+        except ValueError:
+            pass
+    if value.lower() in ('true','false'):
+        return name,value.lower()=='true'
+    return name,value
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Fly a manifest with the control stack, without ROS/Gazebo')
+    parser.add_argument('--manifest',default=None)
+    parser.add_argument('--planner',default='pairing',choices=('pairing','route'))
+    parser.add_argument('--pairing-mode',default='optimal')
+    parser.add_argument('--route-time-budget',type=float,default=1.0)
+    parser.add_argument('--max-time',type=float,default=3600.0,help='sim time limit (s)')
+    parser.add_argument('--physics-dt',type=float,default=0.001)
+    parser.add_argument('--marker-offset',type=float,default=0.0,help='largest marker offset from the manifest (m)')
+    parser.add_argument('--gps-noise',type=float,default=0.0,help='standard deviation of the GPS noise (m)')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--param',action='append',default=[],metavar='NAME:=VALUE',
+                        help='ROS param for the nodes, e.g. position_controller/trajectory_mode:=steps (repeatable)')
+    parser.add_argument('--verbose',action='store_true',help='show the nodes\' output')
+    parser.add_argument('--hosted',action='store_true',help='the nodes in one process as with Task_6_VD_2373_node_host')
+    args=parser.parse_args(argv)
+
+    result=simulate(args.manifest,args.max_time,planner=args.planner,pairing_mode=args.pairing_mode,
+                    route_time_budget=args.route_time_budget,physics_dt=args.physics_dt,
+                    marker_offset=args.marker_offset,gps_noise=args.gps_noise,seed=args.seed,
+                    params=dict(parse_param(param) for param in args.param),verbose=args.verbose,hosted=args.hosted)
+    print_result(result)
+    return 0 if result['status']=='complete' else 1
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_state_estimator.py
+Functions      state_source,DroneStateFilter,StateEstimator,benchmark,main
+Global Variables STATE_TOPIC,STATE_SOURCES,GRAVITY,RANGE_GATE
+
+
+One estimate of the drone's state for every node, instead of each node reading the GPS & the IMU.
+
+DroneStateFilter is a Kalman filter in the local frame (x north, y west, z up, m) of
+
+    state           position, velocity & the altitude of the surface under the drone
+    prediction      constant velocity, or the IMU's accelerometer (rotated into the local frame by the
+                    IMU orientation, gravity taken out) as the acceleration when the IMU has one
+    GPS             position, with gps_sigma & altitude_sigma
+    bottom range    the height above the surface, the range along the drone's z axis times cos(tilt);
+                    a range further than the RANGE_GATE (99 %) from the prediction is a new surface
+                    (a roof's edge, a parcel) and restarts the surface's altitude from it
+
+The attitude is the IMU's, converted to roll, pitch & yaw once here. The models are linear in the
+local frame with the attitude given, so this is the EKF's update without the linearisation.
+
+Run as a node (state_estimator), it publishes vitarana_drone/drone_state on /edrone/state at ~rate
+(default 100 Hz, predicted to the time it is published). The nodes read it instead of /edrone/gps &
+/edrone/imu/data with the /state_source:=estimator param (default sensors, the raw topics); the
+position controller's derivative then takes the estimated velocity instead of differencing the GPS.
+~gps_sigma, ~altitude_sigma, ~range_sigma (m), ~accel_sigma (accelerometer noise), ~manoeuvre_sigma
+(acceleration when there is no accelerometer, m/s^2) & ~ground_sigma (m/sqrt(s)) tune the filter.
+
+Run with --benchmark for the position & velocity errors, the velocity noise & lag of the GPS as the
+controllers used it and of the filter, on the flights in bag_files/ with added GPS noise.
+
+'''
+
+import argparse
+import glob
+import math
+import os
+import threading
+import time
+import numpy as np
+
+from Task_6_VD_2373_marker_localizer import rotation_matrix
+
+STATE_TOPIC = '/edrone/state'
+STATE_SOURCES = ('sensors','estimator')
+GRAVITY = 9.80665
+RANGE_GATE = 6.63                   # 99 % of the chi-square distribution with 1 degree of freedom
+
+
+def state_source():
+    # /state_source param: 'sensors' (the GPS & IMU topics) or 'estimator' (STATE_TOPIC)
+    import rospy
+    source=rospy.get_param('/state_source','sensors')
+    if source not in STATE_SOURCES:
+        raise ValueError('/state_source must be one of {}, got {}'.format(', '.join(STATE_SOURCES),source))
+    return source
+
+
+class DroneStateFilter():
+
+    def __init__(self,gps_sigma=0.05,altitude_sigma=0.05,range_sigma=0.01,accel_sigma=0.3,manoeuvre_sigma=3.0,ground_sigma=0.02):
+        self.gps_variance=np.array([gps_sigma**2,gps_sigma**2,altitude_sigma**2])
+        self.range_variance=range_sigma**2
+        self.accel_variance=accel_sigma**2
+        self.manoeuvre_variance=manoeuvre_sigma**2
+        self.ground_variance=ground_sigma**2
+        # measurement matrices of the GPS & of the height above the surface
+        self.gps_matrix=np.eye(3,7)
+        self.range_matrix=np.array([[0.0,0.0,1.0,0.0,0.0,0.0,-1.0]])
+        self.transition=np.eye(7)
+        self.reset()
+
+    def reset(self):
+        self.state=np.zeros(7)          # x, y, z, vx, vy, vz & the surface's altitude
+        self.covariance=np.eye(7)
+        self.time=None
+        self.ground_known=False
+        self.rotation=np.eye(3)
+        self.orientation=(0.0,0.0,0.0,1.0)
+        self.euler=(0.0,0.0,0.0)
+        self.acceleration=np.zeros(3)
+        self.accelerometer=False
+        # new surfaces under the drone
+        self.surfaces=0
+
+    @property
+    def initialised(self):
+        return self.time is not None
+
+    def predict(self,now):
+        if self.time is None or now<=self.time:
+            return
+        dt=now-self.time
+        self.time=now
+        state=self.state
+        state[0:3]+=state[3:6]*dt+0.5*self.acceleration*dt*dt
+        state[3:6]+=self.acceleration*dt
+        transition=self.transition
+        transition[0,3]=transition[1,4]=transition[2,5]=dt
+        covariance=transition.dot(self.covariance).dot(transition.T)
+        # white acceleration noise on every axis, a random walk of the surface
+        q=self.accel_variance if self.accelerometer else self.manoeuvre_variance
+        for i in range(3):
+            covariance[i,i]+=q*dt**4/4
+            covariance[i,i+3]+=q*dt**3/2
+            covariance[i+3,i]+=q*dt**3/2
+            covariance[i+3,i+3]+=q*dt*dt
+        covariance[6,6]+=self.ground_variance*dt
+        self.covariance=covariance
+
+    def _update(self,matrix,measurement,variance,gate=None):
+        # Kalman update, False if the innovation is outside the gate
+        innovation=measurement-matrix.dot(self.state)
+        ph=self.covariance.dot(matrix.T)
+        innovation_covariance=matrix.dot(ph)+np.diag(variance)
+        inverse=np.linalg.inv(innovation_covariance)
+        if gate is not None and innovation.dot(inverse).dot(innovation)>gate:
+            return False
+        gain=ph.dot(inverse)
+        self.state+=gain.dot(innovation)
+        covariance=self.covariance-gain.dot(ph.T)
+        self.covariance=(covariance+covariance.T)/2
+        return True
+
+    def update_gps(self,position,now):
+        # position [x, y, altitude] (m, local frame)
+        if self.time is None:
+            self.state[0:3]=position
+            self.covariance=np.diag(np.concatenate((self.gps_variance,[1.0,1.0,1.0,1e4])))
+            self.time=now
+            return True
+        self.predict(now)
+        return self._update(self.gps_matrix,np.asarray(position,dtype=float),self.gps_variance)
+
+    def update_imu(self,orientation,specific_force=None,now=None):
+        # orientation an [x, y, z, w] quaternion, specific_force the accelerometer's [x, y, z] (m/s^2, in
+        # the drone's frame) or None/zeros without one
+        if now is not None:
+            # the previous acceleration up to now
+            self.predict(now)
+        self.orientation=tuple(orientation)
+        rotation=self.rotation=rotation_matrix(orientation)
+        self.euler=(math.atan2(rotation[2,1],rotation[2,2]),-math.asin(max(-1.0,min(1.0,rotation[2,0]))),math.atan2(rotation[1,0],rotation[0,0]))
+        self.accelerometer=specific_force is not None and any(specific_force)
+        if self.accelerometer:
+            self.acceleration=rotation.dot(specific_force)
+            self.acceleration[2]-=GRAVITY
+        else:
+            self.acceleration=np.zeros(3)
+
+    def update_range(self,distance,now):
+        # bottom range finder's distance along the drone's z axis, False if it saw a new surface
+        cos_tilt=self.rotation[2,2]
+        if self.time is None or not 0<distance<float('inf') or cos_tilt<0.5:
+            return True
+        self.predict(now)
+        height=distance*cos_tilt
+        variance=self.range_variance*cos_tilt*cos_tilt
+        if self.ground_known and self._update(self.range_matrix,np.array([height]),[variance],RANGE_GATE):
+            return True
+        # surface = altitude - height, correlated with the altitude's estimate
+        covariance=self.covariance
+        self.state[6]=self.state[2]-height
+        covariance[6,:]=covariance[2,:]
+        covariance[:,6]=covariance[:,2]
+        covariance[6,6]=covariance[2,2]+variance
+        self.surfaces+=self.ground_known
+        self.ground_known=True
+        return False
+
+    @property
+    def position(self):
+        return self.state[0:3]
+
+    @property
+    def velocity(self):
+        return self.state[3:6]
+
+    @property
+    def height(self):
+        # above the surface under the drone, inf until the bottom range finder saw it
+        return self.state[2]-self.state[6] if self.ground_known else float('inf')
+
+
+class StateEstimator():
+
+    def __init__(self):
+        import rospy
+        from sensor_msgs.msg import Imu,LaserScan,NavSatFix
+        from vitarana_drone.msg import drone_state
+        from Task_6_VD_2373_geodesy import load_origin_from_params
+
+        rospy.init_node('state_estimator')
+        load_origin_from_params()
+        self.filter=DroneStateFilter(rospy.get_param('~gps_sigma',0.05),rospy.get_param('~altitude_sigma',0.05),
+                                     rospy.get_param('~range_sigma',0.01),rospy.get_param('~accel_sigma',0.3),
+                                     rospy.get_param('~manoeuvre_sigma',3.0),rospy.get_param('~ground_sigma',0.02))
+        self.rate=rospy.get_param('~rate',100.0)
+        if self.rate<=0:
+            raise ValueError('~rate must be > 0, got {}'.format(self.rate))
+        self.imu=False
+        self.last_publish=None
+        self.force=[0.0,0.0,0.0]
+        self.state_msg=drone_state()
+        # the callbacks & the publishing timer run on their own threads, the filter is taken by one at a time
+        self.lock=threading.Lock()
+
+        self.state_pub=rospy.Publisher(STATE_TOPIC,drone_state,queue_size=1)
+        rospy.Subscriber('/edrone/gps',NavSatFix,self.gps_callback)
+        rospy.Subscriber('/edrone/imu/data',Imu,self.imu_callback)
+        rospy.Subscriber('/edrone/range_finder_bottom',LaserScan,self.range_finder_bottom_callback)
+        rospy.Timer(rospy.Duration(1.0/self.rate),self.publish_state)
+
+    def gps_callback(self,msg):
+        import rospy
+        from Task_6_VD_2373_geodesy import lat_to_x,long_to_y
+        position=[lat_to_x(msg.latitude),long_to_y(msg.longitude),msg.altitude]
+        with self.lock:
+            self.filter.update_gps(position,rospy.get_time())
+
+    def imu_callback(self,msg):
+        import rospy
+        orientation=msg.orientation
+        acceleration=msg.linear_acceleration
+        with self.lock:
+            self.force[0],self.force[1],self.force[2]=acceleration.x,acceleration.y,acceleration.z
+            self.filter.update_imu((orientation.x,orientation.y,orientation.z,orientation.w),self.force,rospy.get_time())
+            self.imu=True
+
+    def range_finder_bottom_callback(self,msg):
+        import rospy
+        with self.lock:
+            self.filter.update_range(msg.ranges[0],rospy.get_time())
+
+    def publish_state(self,event=None):
+        import rospy
+        from Task_6_VD_2373_geodesy import x_to_lat,y_to_long
+        stamp=rospy.get_rostime()
+        now=stamp.to_sec()
+        msg=self.state_msg
+        with self.lock:
+            if not (self.imu and self.filter.initialised) or now==self.last_publish:
+                return
+            self.last_publish=now
+            state=self.filter
+            state.predict(now)
+            x,y,z=state.position
+            msg.velocity.x,msg.velocity.y,msg.velocity.z=state.velocity
+            msg.roll,msg.pitch,msg.yaw=state.euler
+            msg.orientation.x,msg.orientation.y,msg.orientation.z,msg.orientation.w=state.orientation
+            msg.height=state.height
+        msg.header.stamp=stamp
+        msg.lat,msg.long,msg.alt=x_to_lat(x),y_to_long(y),z
+        self.state_pub.publish(msg)
+
+
+def _flight(path,gps_sigma,accel_sigma,range_sigma,seed):
+    # recorded truth (times, positions, velocities) & the sensor events [(time, kind, value)] of a bag:
+    # the recorded GPS (or the pose's when the bag has none) with gps_sigma noise, the IMU from the pose
+    # with the accelerometer from the recorded velocity, the bottom range from the landing stations
+    from Task_6_VD_2373_bag_reader import BagReader
+    from Task_6_VD_2373_bag_replay import world_from_model_states,GPS_TOPIC,MODEL_STATES_TOPIC,DRONE_MODEL
+    from Task_6_VD_2373_geodesy import lat_to_x,long_to_y
+    from Task_6_VD_2373_simulator import DRONE_HEIGHT,RANGE_MAX,RANGE_MIN
+
+    rng=np.random.RandomState(seed)
+    bag=BagReader(path)
+    times,positions,velocities,orientations,gps=[],[],[],[],[]
+    world=None
+    for topic,msg,t in bag.read_messages([GPS_TOPIC,MODEL_STATES_TOPIC]):
+        if topic==GPS_TOPIC:
+            gps.append((t,[lat_to_x(msg.latitude),long_to_y(msg.longitude),msg.altitude]))
+        elif DRONE_MODEL in msg.name:
+            world=world or world_from_model_states(msg)
+            index=msg.name.index(DRONE_MODEL)
+            pose,twist=msg.pose[index],msg.twist[index]
+            times.append(t)
+            positions.append([pose.position.x,pose.position.y,pose.position.z+DRONE_HEIGHT])
+            velocities.append([twist.linear.x,twist.linear.y,twist.linear.z])
+            orientations.append([pose.orientation.x,pose.orientation.y,pose.orientation.z,pose.orientation.w])
+    times,positions,velocities=np.array(times),np.array(positions),np.array(velocities)
+    if not gps:
+        gps=list(zip(times,positions.tolist()))
+    accelerations=np.gradient(velocities,times,axis=0)
+
+    events=[(t,0,np.add(position,rng.normal(0,gps_sigma,3))) for t,position in gps]
+    for t,position,acceleration,orientation in zip(times,positions,accelerations,orientations):
+        rotation=rotation_matrix(orientation)
+        force=rotation.T.dot(acceleration+[0.0,0.0,GRAVITY])+rng.normal(0,accel_sigma,3)
+        events.append((t,1,(orientation,force)))
+        distance=(position[2]-world.surface_height(position[0],position[1]))/max(rotation[2,2],0.1)+rng.normal(0,range_sigma)
+        events.append((t,2,distance if RANGE_MIN<=distance<=RANGE_MAX else float('inf')))
+    events.sort(key=lambda event: (event[0],event[1]))
+    return times,positions,velocities,events
+
+
+def _errors(ticks,estimates,times,truth,max_lag=1.0,step=0.01):
+    # RMS error, and the lag (s) that fits the estimates best with the RMS error at it
+    actual=np.column_stack([np.interp(ticks,times,truth[:,axis]) for axis in range(3)])
+    rms=math.sqrt(np.mean(np.sum((estimates-actual)**2,axis=1)))
+    best=(float('inf'),0.0)
+    for lag in np.arange(0.0,max_lag+step/2,step):
+        lagged=np.column_stack([np.interp(ticks-lag,times,truth[:,axis]) for axis in range(3)])
+        best=min(best,(math.sqrt(np.mean(np.sum((estimates-lagged)**2,axis=1))),lag))
+    return rms,best[1],best[0]
+
+
+def benchmark(bags=None,gps_sigmas=(0.0,0.05,0.2),rate=100.0,accel_sigma=0.1,range_sigma=0.01,settle=2.0,seed=0):
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+    from Task_6_VD_2373_bag_replay import BAG_DIR
+    bags=bags or sorted(glob.glob(os.path.join(BAG_DIR,'*.bag')))
+    print('state at {:.0f} Hz, accelerometer noise {} m/s^2, range noise {} m, the first {} s left out'.format(rate,accel_sigma,range_sigma,settle))
+    print('{:44} {:>10} {:>10} {:>11} {:>10} {:>12}'.format('','pos RMS m','vel RMS','vel noise','vel lag s','us / update'))
+    for path in bags:
+        for gps_sigma in gps_sigmas:
+            times,positions,velocities,events=_flight(path,gps_sigma,accel_sigma,range_sigma,seed)
+            ticks=np.arange(times[0]+settle,times[-1],1.0/rate)
+            print('{} GPS {:.1f} Hz, sigma {} m'.format(os.path.basename(path),(sum(kind==0 for _,kind,_ in events)-1)/(times[-1]-times[0]),gps_sigma))
+            for name in ('GPS, differenced (before)','filter, without accelerometer','filter'):
+                estimator=DroneStateFilter(gps_sigma=max(gps_sigma,0.01),altitude_sigma=max(gps_sigma,0.01),range_sigma=range_sigma,accel_sigma=max(accel_sigma,0.05))
+                fixes=[]
+                estimates=np.zeros((len(ticks),2,3))
+                updates=0
+                elapsed=0.0
+                i=0
+                for k,tick in enumerate(ticks):
+                    while i<len(events) and events[i][0]<=tick:
+                        t,kind,value=events[i]
+                        i+=1
+                        start=time.perf_counter()
+                        if kind==0:
+                            fixes.append((t,value))
+                            estimator.update_gps(value,t)
+                        elif kind==1:
+                            estimator.update_imu(value[0],value[1] if name=='filter' else None,t)
+                        else:
+                            estimator.update_range(value,t)
+                        elapsed+=time.perf_counter()-start
+                        updates+=1
+                    if name=='GPS, differenced (before)':
+                        # the latest fix, and the difference of the last two as the pid's derivative takes it
+                        (t0,p0),(t1,p1)=fixes[-2],fixes[-1]
+                        estimates[k]=p1,(np.subtract(p1,p0))/(t1-t0)
+                    else:
+                        start=time.perf_counter()
+                        estimator.predict(tick)
+                        elapsed+=time.perf_counter()-start
+                        estimates[k]=estimator.position,estimator.velocity
+                position_rms=_errors(ticks,estimates[:,0],times,positions)[0]
+                velocity_rms,lag,noise=_errors(ticks,estimates[:,1],times,velocities)
+                print('  {:42} {:10.3f} {:10.3f} {:11.3f} {:10.2f} {:>12}'.format(name,position_rms,velocity_rms,noise,lag,
+                      '-' if name.startswith('GPS') else '{:.1f}'.format(elapsed*1e6/(updates+len(ticks)))))
+
+
+def main():
+    import rospy
+    StateEstimator()
+    rospy.spin()
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description='Drone state from the GPS, the IMU & the bottom range finder')
+    parser.add_argument('--benchmark',action='store_true',help='errors, noise & lag on the bags instead of running the node')
+    parser.add_argument('--bag',action='append',default=[],help='bag to benchmark on (repeatable, default all in bag_files/)')
+    parser.add_argument('--gps-sigma',type=float,action='append',default=[],help='GPS noise added (m, repeatable, default 0, 0.05 & 0.2)')
+    parser.add_argument('--rate',type=float,default=100.0)
+    # roslaunch adds __name:= & __log:= arguments
+    args=parser.parse_known_args()[0]
+    if args.benchmark:
+        benchmark(args.bag,args.gps_sigma or (0.0,0.05,0.2),args.rate)
+    else:
+        main()
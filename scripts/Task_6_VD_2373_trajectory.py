@@ -0,0 +1,244 @@
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_trajectory.py
+Functions      TrapezoidalProfile,MinimumJerkProfile,Trajectory,fly_leg,benchmark
+Global Variables TRAJECTORY_MODES
+
+
+Time parameterised trajectories between two setpoints, for the position controller.
+
+A Trajectory is the straight line from where the drone is to the new setpoint, with the distance
+along it given by a velocity profile that starts & ends at rest:
+
+    trapezoidal   constant acceleration up to max_speed, cruise, constant deceleration (a triangle
+                  when the leg is too short to reach max_speed)
+    min_jerk      s = d*(10*r^3 - 15*r^4 + 6*r^5), r = t/T, with T the shortest time that keeps the
+                  peak speed (1.875*d/T) & acceleration (5.77*d/T^2) within the limits
+
+Limits are in metres, max_speed & max_accel for the horizontal component of the motion and
+max_vertical_speed & max_vertical_accel for the vertical one (the attitude controller only tilts the
+drone ~4.5 degrees, ~0.77 m/s^2, while the throttle has a lot more authority). The samples are the
+position [lat, long, alt] and its first & second time derivatives, so the controller can use them as
+they are.
+sample() is a handful of multiplications whatever the length of the leg.
+
+Run this file for the time to target of the trajectories & of the old fixed steps, flown by the
+position & attitude controllers against the simulator's plant.
+
+'''
+
+import math
+import sys
+import time
+
+from Task_6_VD_2373_geodesy import lat_to_x,long_to_y
+
+# 'steps' is the controller's old scheme of fixed ~9.5 m steps, kept for comparison
+TRAJECTORY_MODES = ('trapezoidal','min_jerk','steps')
+
+
+class TrapezoidalProfile():
+    # distance, speed & acceleration along a leg at t, from rest to rest
+    __slots__ = ('distance','max_accel','peak_speed','t_accel','t_cruise','duration')
+
+    def __init__(self,distance,max_speed,max_accel):
+        self.distance=distance
+        self.max_accel=max_accel
+        if distance*max_accel>=max_speed*max_speed:
+            self.peak_speed=max_speed
+        else:
+            # triangle, max_speed is never reached
+            self.peak_speed=math.sqrt(distance*max_accel)
+        self.t_accel=self.peak_speed/max_accel if max_accel>0 else 0.0
+        self.t_cruise=(distance-self.peak_speed*self.t_accel)/self.peak_speed if self.peak_speed>0 else 0.0
+        self.duration=2*self.t_accel+self.t_cruise
+
+    def sample(self,t):
+        if t<=0:
+            return 0.0,0.0,0.0
+        if t>=self.duration:
+            return self.distance,0.0,0.0
+        if t<self.t_accel:
+            return 0.5*self.max_accel*t*t,self.max_accel*t,self.max_accel
+        accel_distance=0.5*self.peak_speed*self.t_accel
+        if t<self.t_accel+self.t_cruise:
+            return accel_distance+self.peak_speed*(t-self.t_accel),self.peak_speed,0.0
+        left=self.duration-t
+        return self.distance-0.5*self.max_accel*left*left,self.max_accel*left,-self.max_accel
+
+
+class MinimumJerkProfile():
+    # distance, speed & acceleration along a leg at t, from rest to rest with the least jerk
+    __slots__ = ('distance','duration')
+
+    PEAK_SPEED = 1.875                  # * distance / duration
+    PEAK_ACCEL = 10/math.sqrt(3)        # * distance / duration^2
+
+    def __init__(self,distance,max_speed,max_accel):
+        self.distance=distance
+        self.duration=max(self.PEAK_SPEED*distance/max_speed,math.sqrt(self.PEAK_ACCEL*distance/max_accel)) if distance>0 else 0.0
+
+    def sample(self,t):
+        if t<=0:
+            return 0.0,0.0,0.0
+        if t>=self.duration:
+            return self.distance,0.0,0.0
+        r=t/self.duration
+        r3=r*r*r
+        return (self.distance*r3*(10-15*r+6*r*r),self.distance*30*r*r*(1-2*r+r*r)/self.duration,
+                self.distance*60*r*(1-3*r+2*r*r)/(self.duration*self.duration))
+
+
+PROFILES = {'trapezoidal':TrapezoidalProfile,'min_jerk':MinimumJerkProfile}
+
+
+class Trajectory():
+    # Straight leg from start to end ([lat, long, alt]) starting at start_time (s)
+    __slots__ = ('start','end','start_time','profile','direction','position','velocity','acceleration')
+
+    def __init__(self,start,end,start_time,mode='trapezoidal',max_speed=6.0,max_accel=0.7,max_vertical_speed=3.0,max_vertical_accel=2.0):
+        self.start=[float(value) for value in start]
+        self.end=[float(value) for value in end]
+        self.start_time=start_time
+        dx=lat_to_x(self.end[0])-lat_to_x(self.start[0])
+        dy=long_to_y(self.end[1])-long_to_y(self.start[1])
+        dz=self.end[2]-self.start[2]
+        horizontal=math.sqrt(dx*dx+dy*dy)
+        length=math.sqrt(dx*dx+dy*dy+dz*dz)
+        # limits along the leg, so that neither the horizontal nor the vertical component exceeds its own
+        speed=accel=float('inf')
+        if horizontal>0:
+            speed=max_speed*length/horizontal
+            accel=max_accel*length/horizontal
+        if dz!=0:
+            speed=min(speed,max_vertical_speed*length/abs(dz))
+            accel=min(accel,max_vertical_accel*length/abs(dz))
+        if length==0:
+            speed,accel=max_speed,max_accel
+        self.profile=PROFILES[mode](length,speed,accel)
+        # [lat, long, alt] per metre along the leg
+        if length>0:
+            self.direction=[(self.end[i]-self.start[i])/length for i in range(3)]
+        else:
+            self.direction=[0.0,0.0,0.0]
+        self.position=list(self.end)
+        self.velocity=[0.0,0.0,0.0]
+        self.acceleration=[0.0,0.0,0.0]
+
+    @property
+    def duration(self):
+        return self.profile.duration
+
+    @property
+    def end_time(self):
+        return self.start_time+self.profile.duration
+
+    def distance_to(self,point):
+        # metres from the end of the leg to point ([lat, long, alt])
+        dx=lat_to_x(point[0])-lat_to_x(self.end[0])
+        dy=long_to_y(point[1])-long_to_y(self.end[1])
+        dz=point[2]-self.end[2]
+        return math.sqrt(dx*dx+dy*dy+dz*dz)
+
+    def done(self,now):
+        return now>=self.start_time+self.profile.duration
+
+    def sample(self,now):
+        # ([lat, long, alt], [dlat/dt, dlong/dt, dalt/dt], [d2lat/dt2, d2long/dt2, d2alt/dt2]) at now;
+        # the lists are reused by the next sample
+        distance,speed,accel=self.profile.sample(now-self.start_time)
+        direction=self.direction
+        position=self.position
+        velocity=self.velocity
+        acceleration=self.acceleration
+        for i in range(3):
+            position[i]=self.start[i]+direction[i]*distance
+            velocity[i]=direction[i]*speed
+            acceleration[i]=direction[i]*accel
+        return position,velocity,acceleration
+
+
+def fly_leg(offset,mode,duration=120.0,params=None,physics_dt=0.002,start=(0.0,0.0,10.0)):
+    # Flies the position & attitude controller nodes against the simulator's plant from hover at start
+    # (local, m) to start + offset with ~trajectory_mode mode. Returns the time the drone is first within
+    # the setpoint control's proximity of the target (a hold waypoint, 0.125 m horizontally & 0.2 m in
+    # altitude), or None.
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+    import rospy
+    from sensor_msgs.msg import Imu, NavSatFix
+    from vitarana_drone.msg import destination, prop_speed
+    from Task_6_VD_2373_pid import QuadrotorPlant
+    from Task_6_VD_2373_waypoint import WaypointAcceptance
+
+    all_params={'/position_controller/trajectory_mode':mode}
+    all_params.update(params or {})
+    bus=ros_stand_in.activate(ros_stand_in.Bus(params=all_params))
+    from Task_6_VD_2373_attitude_controller import Edrone as AttitudeController
+    from Task_6_VD_2373_position_controller import Edrone as PositionController
+    rospy.init_node('leg')
+    pwm=[0.0,0.0,0.0,0.0]
+
+    def pwm_callback(msg):
+        pwm[:]=[msg.prop1,msg.prop2,msg.prop3,msg.prop4]
+    rospy.Subscriber('/edrone/pwm',prop_speed,pwm_callback)
+    gps_pub=rospy.Publisher('/edrone/gps',NavSatFix,queue_size=1)
+    imu_pub=rospy.Publisher('/edrone/imu/data',Imu,queue_size=1)
+    setpoint_pub=rospy.Publisher('/edrone/setpoint',destination,queue_size=1)
+    attitude=AttitudeController()
+    position=PositionController()
+
+    plant=QuadrotorPlant(start)
+    target=QuadrotorPlant([start[i]+offset[i] for i in range(3)]).gps()
+    setpoint=destination()
+    setpoint.lat,setpoint.long,setpoint.alt=target
+    acceptance=WaypointAcceptance()
+    gps=NavSatFix()
+    imu=Imu()
+    with open('/dev/null','w') as devnull:
+        stdout,sys.stdout=sys.stdout,devnull
+        try:
+            ticks=int(round(duration*60))
+            for tick in range(1,ticks+1):
+                # sensors at 60 Hz, the position controller's loop & the setpoint at 50 Hz in between
+                now=tick/60.0
+                while bus.time<now-1e-9:
+                    step=min(physics_dt,now-bus.time)
+                    plant.step(pwm,step)
+                    bus.time+=step
+                    if int(round(bus.time*1000))%20==0:
+                        setpoint_pub.publish(setpoint)
+                        bus.deliver()
+                        if all(position.drone_position) and all(position.subscribed_target):
+                            position.pid()
+                        bus.deliver()
+                gps.latitude,gps.longitude,gps.altitude=plant.gps()
+                gps_pub.publish(gps)
+                imu.orientation.x,imu.orientation.y,imu.orientation.z,imu.orientation.w=plant.quaternion()
+                imu_pub.publish(imu)
+                bus.deliver()
+                current=gps.latitude,gps.longitude,gps.altitude
+                if acceptance.near(target,'hold',current):
+                    return now
+        finally:
+            sys.stdout=stdout
+    return None
+
+
+def benchmark(distances=(5.0,10.0,20.0,40.0,80.0),modes=TRAJECTORY_MODES):
+    print('time to target of a leg north-west at constant altitude (s), first within the setpoint control\'s proximity')
+    print('{:>12} {}'.format('leg (m)',' '.join('{:>12}'.format(mode) for mode in modes)))
+    wall_start=time.perf_counter()
+    for distance in distances:
+        offset=(distance/math.sqrt(2),distance/math.sqrt(2),0.0)
+        times=[fly_leg(offset,mode,duration=30+distance) for mode in modes]
+        print('{:>12.0f} {}'.format(distance,' '.join('{:>12}'.format('{:.1f}'.format(t) if t is not None else '-') for t in times)))
+    print('climb 10 m   {}'.format(' '.join('{:>12}'.format('{:.1f}'.format(t) if t is not None else '-')
+                                             for t in (fly_leg((0.0,0.0,10.0),mode,duration=60) for mode in modes))))
+    print('({:.0f} s wall)'.format(time.perf_counter()-wall_start))
+
+
+if __name__=="__main__":
+    benchmark()
@@ -4,32 +4,17 @@ Team ID        VD#2373
 Theme          Vitarana Drone
 Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
 Filename    Task_6_VD_2373_utils.py
-Functions    x_to_lat,y_to_long,long_to_y,lat_to_x,limit_value,write_schedule_to_csv,read_manifest_data,get_dist,get_set_point_sequence
+Functions    limit_value,read_manifest_data,resolve_stations,get_set_point_sequence
 Global Variables    None    
 
 '''
 
-import csv
-import math 
 from pprint import pprint
-import copy
-from Task_6_VD_2373_scheduler import schedule
-
-
-def x_to_lat(input_x):
-    return input_x/110692.0702932625 + 19
-
-
-def y_to_long(input_y):
-    return -input_y/(105292.0089353767 )+ 72
-
-
-def lat_to_x(input_latitude):
-    return 110692.0702932625 * (input_latitude - 19)
-
-
-def long_to_y(input_longitude):
-    return -105292.0089353767 * (input_longitude - 72)
+# geodesy helpers are re-exported for the nodes
+from Task_6_VD_2373_geodesy import x_to_lat,y_to_long,lat_to_x,long_to_y,get_dist,load_origin_from_params,get_frame
+from Task_6_VD_2373_manifest import read_manifest,index_by_id,write_sequenced_manifest,get_manifest_paths,STATION_SPACING
+from Task_6_VD_2373_scheduler import get_paired_sequence
+from Task_6_VD_2373_route_optimizer import get_route_sequence
 
 
 def limit_value(current, min, max):
@@ -40,111 +25,63 @@ def limit_value(current, min, max):
     else:
         return current
 
-def write_schedule_to_csv(scheduled_ret,scheduled_del,orig_returns,orig_deliveries):
-
-    with open('/home/atharva/catkin_ws/src/vitarana_drone/scripts/sequenced_manifest.csv','w') as fhand:
-        writer = csv.writer(fhand)
-        for i in range(max(len(scheduled_ret),len(scheduled_del))):
-            if i<len(scheduled_del):
-                deli = (filter(lambda orig_del: scheduled_del[i]['id'] == orig_del['id'], orig_deliveries))
-                writer.writerow([deli[0]['type'],deli[0]['from'],"{};{};{}".format(deli[0]['to'][0],deli[0]['to'][1],deli[0]['to'][2])])
-            if i<len(scheduled_ret):
-                ret = (filter(lambda orig_ret: scheduled_ret[i]['id'] == orig_ret['id'], orig_returns))
-                writer.writerow([ret[0]['type'],"{};{};{}".format(ret[0]['from'][0],ret[0]['from'][1],ret[0]['from'][2]),ret[0]['to']])
-            # pprint(ret)
-            # pprint(deli)
-
-
-    return
-
-def read_manifest_data():
-    deliveries=[]
-    returns=[]
-    idx=0
-    with open('/home/atharva/catkin_ws/src/vitarana_drone/scripts/original.csv') as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        for row in csv_reader:
-            idx+=1
-            if row[0]=='DELIVERY':
-                coords=row[2].split(';')                                                          
-                deliveries.append({'id':idx,'type':'DELIVERY','from':row[1],'to':[float(coords[0]),float(coords[1]),float(coords[2])]})
-
-            else:
-                coords=row[1].split(';')
-                returns.append({'id':idx,'type':'RETURN','to':row[2],'from':[float(coords[0]),float(coords[1]),float(coords[2])]})
-    # print(returns)                
-    return deliveries,returns
-
-        #     delivery_control.parcels_delivery_coords.append([float(row[1]),float(row[2]),float(row[3])+1]) # 1m height buffer 
-def get_dist(coord1,coord2):
+def read_manifest_data(manifest_path=None):
+    if manifest_path is None:
+        manifest_path,_ = get_manifest_paths()
+    return read_manifest(manifest_path)
 
-    x1=lat_to_x(coord1[0])
-    x2=lat_to_x(coord2[0])
+def resolve_stations(deliveries,returns):
+    # Sets the pickup of deliveries & the drop of returns from their station codes (A/B/C pickup grid,
+    # X/Y/Z return grid, numbered along the longitude), in place
 
-    y1=long_to_y(coord1[1])
-    y2=long_to_y(coord2[1])
-
-    z1=coord1[2]
-    z2=coord2[2]
-
-    return math.sqrt((x2-x1)**2+(y2-y1)**2+(z2-z1)**2)
-
-def get_set_point_sequence():             
-    
     # defining the constants                 
     A1 = [18.9998102845,72.000142461,16.757981 - 0.2] #extra 0.2 downward for pickup attachment
     X1 = [18.9999367615,72.000142461,16.757981]
-    delta_lat = 0.000013552 
-    delta_long = 0.000014245
-
-    deliveries,returns = read_manifest_data()
-    orig_deliveries = copy.deepcopy(deliveries)
-    orig_returns =  copy.deepcopy(returns)
+    # STATION_SPACING m in degrees at the origin
+    delta_lat = STATION_SPACING/get_frame().metres_per_deg_lat
+    delta_long = STATION_SPACING/get_frame().metres_per_deg_long
 
     for delivery in deliveries:
-        if delivery['from'][0] == 'A':
-            delivery['from'] = [A1[0] , A1[1]+delta_long*(int(delivery['from'][1])-1) , A1[2]]
-        elif delivery['from'][0] == 'B':
-            delivery['from'] = [A1[0]+(delta_lat), A1[1]+delta_long*(int(delivery['from'][1])-1) , A1[2]]
-        elif delivery['from'][0] == 'C':
-            delivery['from'] = [A1[0]+2*(delta_lat), A1[1]+delta_long*(int(delivery['from'][1])-1), A1[2]]
-        delivery['from_to_dist'] = get_dist(delivery['from'],delivery['to'])
+        if delivery.station[0] == 'A':
+            delivery.pickup = [A1[0] , A1[1]+delta_long*(int(delivery.station[1:])-1) , A1[2]]
+        elif delivery.station[0] == 'B':
+            delivery.pickup = [A1[0]+(delta_lat), A1[1]+delta_long*(int(delivery.station[1:])-1) , A1[2]]
+        elif delivery.station[0] == 'C':
+            delivery.pickup = [A1[0]+2*(delta_lat), A1[1]+delta_long*(int(delivery.station[1:])-1), A1[2]]
+        else:
+            raise ValueError('manifest line {}: unknown pickup station {}'.format(delivery.id,delivery.station))
 
     for return_coord in returns:
-        if return_coord['to'][0]=='X':
-            return_coord['to']=[X1[0], X1[1]+delta_long*(int(return_coord['to'][1])-1)  , X1[2]]
-        elif return_coord['to'][0]=='Y':
-            return_coord['to']=[X1[0]+(delta_lat), X1[1]+delta_long*(int(return_coord['to'][1])-1)  , X1[2]]
-        elif return_coord['to'][0]=='Z':
-            return_coord['to']=[X1[0] +2*(delta_lat), X1[1]+delta_long*(int(return_coord['to'][1])-1) , X1[2]]
-        return_coord['from_to_dist']=get_dist(return_coord['from'],return_coord['to'])
-
-
-    parcels_delivery_coords=[]
-    parcels_coords=[]
-
-    returns=sorted(returns, key = lambda i: i['from_to_dist'])
-    deliveries=sorted(deliveries, key = lambda i: i['from_to_dist'])
+        if return_coord.station[0]=='X':
+            return_coord.drop=[X1[0], X1[1]+delta_long*(int(return_coord.station[1:])-1)  , X1[2]]
+        elif return_coord.station[0]=='Y':
+            return_coord.drop=[X1[0]+(delta_lat), X1[1]+delta_long*(int(return_coord.station[1:])-1)  , X1[2]]
+        elif return_coord.station[0]=='Z':
+            return_coord.drop=[X1[0] +2*(delta_lat), X1[1]+delta_long*(int(return_coord.station[1:])-1) , X1[2]]
+        else:
+            raise ValueError('manifest line {}: unknown return station {}'.format(return_coord.id,return_coord.station))
+    return deliveries,returns
 
-    scheduled_ret,scheduled_del,instructions = schedule(returns,deliveries)
+        #     delivery_control.parcels_delivery_coords.append([float(row[1]),float(row[2]),float(row[3])+1]) # 1m height buffer 
+def get_set_point_sequence(pairing_mode='optimal',planner='pairing',start_coords=None,time_budget=1.0,manifest_path=None,sequenced_manifest_path=None):
+    # planner='pairing' flies paired (delivery, return) legs, planner='route' orders all the legs with the
+    # route optimizer, flying out of & back to start_coords if given.
+    # Manifest paths not given are taken from the command line / ROS params, see get_manifest_paths.
 
-    for re in returns:
-        scheduled_ret.append(re)
-        del re
-    for deli in deliveries:
-        scheduled_del.append(deli)
-        del deli
+    default_manifest_path,default_sequenced_manifest_path = get_manifest_paths()
+    deliveries,returns = resolve_stations(*read_manifest_data(manifest_path or default_manifest_path))
 
+    if planner=='route':
+        sequence = get_route_sequence(deliveries,returns,start_coords,time_budget)
+    else:
+        sequence = get_paired_sequence(deliveries,returns,pairing_mode)
 
-    write_schedule_to_csv(scheduled_ret,scheduled_del,orig_returns,orig_deliveries)
+    write_sequenced_manifest(sequenced_manifest_path or default_sequenced_manifest_path,
+                             [parcel.id for parcel in sequence],index_by_id(deliveries+returns))
 
-    for i in range(max(len(scheduled_del),len(scheduled_ret))):
-        if i<len(scheduled_del):
-            parcels_coords.append(scheduled_del[i]['from'])
-            parcels_delivery_coords.append(scheduled_del[i]['to'])
-        if i<len(scheduled_ret):
-            parcels_coords.append(scheduled_ret[i]['from'])
-            parcels_delivery_coords.append(scheduled_ret[i]['to'])
+    parcels_coords=[parcel.pickup for parcel in sequence]
+    parcels_delivery_coords=[parcel.drop for parcel in sequence]
+    instructions=[parcel.type for parcel in sequence]
 
     # pprint(parcels_coords)
     # pprint(parcels_delivery_coords)
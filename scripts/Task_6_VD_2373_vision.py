@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_vision.py
+Functions      image_view,Processor,VisionFrontEnd,main,benchmark
+Global Variables CHANNELS,CAMERA_TOPIC
+
+
+One subscription to the camera for the vision nodes.
+
+image_view() gives the frame of a sensor_msgs/Image as a numpy array over the message's own buffer
+(read only, nothing copied). A VisionFrontEnd subscribes to the camera once and hands each frame to
+the registered processors, each with an enabled predicate asked every frame, so e.g. marker_detect
+only gets frames near the setpoint; no view is made for a frame no processor wants.
+
+Run as a node (vision), it runs marker_detect & qr_detect in this one process on a single camera
+subscription; their private params (~roi_tracking, ~debug_view, ~decode_rate, ...) are then the
+vision node's. Run with --benchmark for the bytes copied per frame (each subscription gets its own
+deserialised copy of the frame, the views add none) & the latency from the camera publishing a frame
+to the processors being done, with the two nodes subscribed separately & through the front end.
+
+'''
+
+import argparse
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+CHANNELS = {'bgr8':3,'rgb8':3,'bgra8':4,'rgba8':4,'mono8':1}
+CAMERA_TOPIC = '/edrone/camera/image_raw'
+
+
+def image_view(msg,encoding='bgr8'):
+    # frame of a sensor_msgs/Image as a numpy array over msg.data in encoding ('passthrough' for the
+    # message's); bgr8 <-> rgb8 is a reversed channel view, to or from mono8 & 4 channels a copy
+    channels=CHANNELS.get(msg.encoding)
+    if channels is None:
+        raise ValueError('unsupported encoding {}'.format(msg.encoding))
+    image=np.frombuffer(msg.data,np.uint8).reshape(msg.height,msg.step)[:,:msg.width*channels]
+    image=image.reshape(msg.height,msg.width,channels) if channels>1 else image
+    if encoding in ('passthrough',msg.encoding):
+        return image
+    if {encoding,msg.encoding}=={'bgr8','rgb8'}:
+        return image[:,:,::-1]
+    code='COLOR_{}2{}'.format(msg.encoding[:-1].upper().replace('MONO','GRAY'),encoding[:-1].upper().replace('MONO','GRAY'))
+    if not hasattr(cv2,code):
+        raise ValueError('cannot convert {} to {}'.format(msg.encoding,encoding))
+    return cv2.cvtColor(image,getattr(cv2,code))
+
+
+class Processor():
+    __slots__ = ('name','process','enabled','frames')
+
+    def __init__(self,name,process,enabled=None):
+        self.name=name
+        self.process=process
+        self.enabled=enabled
+        self.frames=0
+
+
+class VisionFrontEnd():
+
+    def __init__(self,topic=CAMERA_TOPIC,encoding='bgr8'):
+        import rospy
+        from sensor_msgs.msg import Image
+        self.encoding=encoding
+        self.processors=[]
+        # frames received & frames no processor wanted
+        self.frames=0
+        self.skipped=0
+        rospy.Subscriber(topic,Image,self.image_callback)
+
+    def register(self,name,process,enabled=None):
+        # process(image) gets the frames for which enabled() (if given) is true, in registration order
+        processor=Processor(name,process,enabled)
+        self.processors.append(processor)
+        return processor
+
+    def image_callback(self,msg):
+        self.frames+=1
+        image=None
+        for processor in self.processors:
+            if processor.enabled is not None and not processor.enabled():
+                continue
+            if image is None:
+                image=image_view(msg,self.encoding)
+            processor.process(image)
+            processor.frames+=1
+        if image is None:
+            self.skipped+=1
+
+
+def main():
+    import rospy
+    from Task_6_VD_2373_marker_detect import MarkerDetect
+    from Task_6_VD_2373_qr_detect import image_proc
+
+    rospy.init_node('vision')
+    front_end=VisionFrontEnd()
+    marker=MarkerDetect(front_end)
+    qr=image_proc(front_end)
+    rospy.on_shutdown(marker.reset)
+    # the main loops of the two nodes
+    rospy.Timer(rospy.Duration(1.0),lambda event: marker.detect())
+    rospy.Timer(rospy.Duration(0.1),lambda event: qr.qr_publisher.publish(qr.scanned_coords))
+    rospy.spin()
+
+
+def _transported(callback,copied):
+    # each subscription deserialises its own copy of the message, as a TCPROS connection does; the
+    # bytes are added up in copied[0]
+    def deliver(msg):
+        copy=msg._copy()
+        copy.data=bytes(memoryview(msg.data))
+        copied[0]+=len(copy.data)
+        callback(copy)
+    return deliver
+
+
+def benchmark(frames=200):
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+    import rospy
+    from sensor_msgs.msg import Image
+    from vitarana_drone.msg import center_x_y
+    import Task_6_VD_2373_bag_replay as bag_replay
+    from Task_6_VD_2373_waypoint import WAYPOINT_KINDS
+    from Task_6_VD_2373_simulator import World,BUILDING_SIZE
+
+    world=World()
+    world.add_box(0.0,0.0,BUILDING_SIZE,10.0,'station')
+    world.markers.append([0.0,0.0,10.0])
+    rng=np.random.RandomState(0)
+    bridge=ros_stand_in.CvBridge()
+    msgs=[bridge.cv2_to_imgmsg(bag_replay.render_frame(world,(rng.uniform(-2,2),rng.uniform(-2,2),22.0)),'bgr8') for _ in range(20)]
+    frame_bytes=len(msgs[0].data)
+
+    print('{} frames of {}x{} bgr8 ({} KB), marker_detect near the setpoint & qr_detect not confirmed'.format(frames,msgs[0].width,msgs[0].height,frame_bytes//1024))
+    print('{:34} {:>13} {:>15} {:>11} {:>9} {:>11}'.format('','subscriptions','KB copied/frame','latency ms','p90 ms','detections'))
+    for name in ('separate nodes (before)','front end'):
+        bus=ros_stand_in.Bus()
+        ros_stand_in.activate(bus)
+        from Task_6_VD_2373_marker_detect import MarkerDetect
+        from Task_6_VD_2373_qr_detect import image_proc
+        if name=='front end':
+            rospy.init_node('vision')
+            front_end=VisionFrontEnd()
+            marker=MarkerDetect(front_end)
+            qr=image_proc(front_end)
+        else:
+            marker=MarkerDetect()
+            qr=image_proc()
+        # decoding is on the decoder's thread either way, only the hand over is measured
+        qr.decoder.stop()
+        subscriptions=bus.subscribers[CAMERA_TOPIC]
+        copied=[0]
+        subscriptions[:]=[(_transported(callback,copied),args) for callback,args in subscriptions]
+        publisher=rospy.Publisher(CAMERA_TOPIC,Image,queue_size=1)
+        marker.bottom_sensor_dist=12.0
+        detections=[0]
+
+        def detected(msg):
+            detections[0]+=1
+        rospy.Subscriber('/edrone/center_lat_long',center_x_y,detected)
+
+        latencies=[]
+        with open(os.devnull,'w') as devnull:
+            stdout,sys.stdout=sys.stdout,devnull
+            try:
+                for i in range(frames):
+                    # the drone (at [0, 0, 0] as its setpoint) held there for the marker dwell & a frame at
+                    # 30 Hz, so marker_detect takes every frame
+                    marker.frame_wanted()
+                    bus.time+=WAYPOINT_KINDS['marker'][2]+1/30.0
+                    start=time.perf_counter()
+                    publisher.publish(msgs[i%len(msgs)])
+                    bus.deliver()
+                    latencies.append(time.perf_counter()-start)
+            finally:
+                sys.stdout=stdout
+        assert detections[0],'no frame was processed by marker_detect with {}'.format(name)
+        latencies=np.array(latencies)*1e3
+        print('  {:32} {:13d} {:15.1f} {:11.2f} {:9.2f} {:11d}'.format(name,len(subscriptions),copied[0]/1024.0/frames,
+                                                                       latencies.mean(),np.percentile(latencies,90),detections[0]))
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description='The vision nodes on one camera subscription')
+    parser.add_argument('--benchmark',action='store_true',help='bytes copied & latency per frame instead of running the node')
+    parser.add_argument('--frames',type=int,default=200)
+    # roslaunch adds __name:= & __log:= arguments
+    args=parser.parse_known_args()[0]
+    if args.benchmark:
+        benchmark(args.frames)
+    else:
+        main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+'''
+Team ID        VD#2373
+Theme          Vitarana Drone
+Author List    Atharva Chandak, Srujan Deolasse, Naitik Khandelwal, Ayush Agrawal
+Filename       Task_6_VD_2373_waypoint.py
+Functions      WaypointAcceptance,benchmark,main
+Global Variables WAYPOINT_KINDS,HYSTERESIS,LEAD_TIME
+
+
+When the drone has reached a waypoint, for setpoint_control, obstacle, marker_detect & the position
+controller's steps, in metres & seconds
+of the time given (rospy time in the nodes, so sim time in the simulator), whatever the rate of the loop
+asking. Each kind of waypoint has its tolerances:
+
+    transit     a point of a leg the drone flies on from: 0.5 m horizontally, 0.3 m vertically, no dwell,
+                and up to another 0.5 m horizontally (0.3 m vertically) while closing in on it, the
+                distance it closes in LEAD_TIME s
+    hold        a point the drone goes up or down from, within 0.125 m & 0.2 m for 0.4 s
+    pickup      over a parcel, within 0.125 m & 0.2 m for 0.4 s (the gripper takes 0.1 m)
+    drop        at a delivery or a return drop, within 0.125 m & 0.2 m for 0.4 s
+    marker      marker_detect's setpoint, within 0.2 m & 0.2 m for 0.15 s (5 frames at 30 Hz)
+    avoid       the obstacle node's side point, within 0.167 m & 0.2 m for 1 s
+    lateral     the obstacle node's setpoint in sight, within 2.5 m horizontally
+    step        a step of the position controller's ~trajectory_mode:=steps, within 0.5 m along its axis
+
+near() is within the tolerances now. accept() is with the dwell: the time of the waypoint starts when the
+drone gets within the tolerances and only stops when it gets out of HYSTERESIS times them, so noise on the
+edge does not start it over. A waypoint accepted starts over too, and so does one that moves by more than
+its tolerances (a marker estimate moving by a few mm keeps its time).
+
+Run with --benchmark for the hover time of simulated missions, stopping at every waypoint (the nodes'
+iteration counts turned to seconds, setpoint_control ~waypoint_acceptance:=stop) against the transit points
+flown through.
+'''
+
+import argparse
+import math
+
+from Task_6_VD_2373_geodesy import get_frame
+
+# kind: (horizontal m, vertical m, dwell s, early acceptance while closing in)
+WAYPOINT_KINDS = {
+    'transit':(0.5,0.3,0.0,True),
+    'hold':(0.125,0.2,0.4,False),
+    'pickup':(0.125,0.2,0.4,False),
+    'drop':(0.125,0.2,0.4,False),
+    'marker':(0.2,0.2,0.15,False),
+    'avoid':(0.5/3,0.2,1.0,False),
+    'lateral':(2.5,float('inf'),0.0,False),
+    'step':(0.5,float('inf'),0.0,False),
+}
+# a waypoint's time stops when the drone is HYSTERESIS times its tolerances off
+HYSTERESIS = 1.5
+# transit points are taken this much (s) of closing speed early, at most their tolerances early
+LEAD_TIME = 1.0
+
+
+class WaypointAcceptance():
+
+    def __init__(self,kinds=None,hysteresis=HYSTERESIS,lead_time=LEAD_TIME,velocity_period=0.1,forget=1.0):
+        self.kinds=dict(WAYPOINT_KINDS)
+        self.kinds.update(kinds or {})
+        self.hysteresis=hysteresis
+        self.lead_time=lead_time
+        self.velocity_period=velocity_period
+        self.forget=forget
+        # last [lat, long, alt] given to update(), its local velocity [x, y, z] (m/s)
+        self.position=None
+        self.velocity=[0.0,0.0,0.0]
+        self.sample=None
+        # key (the kind by default): [time it got within the tolerances, time last asked, target]
+        self.timers={}
+
+    def update(self,position,now):
+        # the drone's position at now, the velocity over velocity_period s
+        self.position=list(position)
+        if self.sample is None or now<self.sample[1]:
+            self.sample=(list(position),now)
+        elif now-self.sample[1]>=self.velocity_period:
+            offset=self.offset(position,self.sample[0])
+            self.velocity=[value/(now-self.sample[1]) for value in offset]
+            self.sample=(list(position),now)
+
+    def offset(self,target,position=None):
+        # [x, y, z] (m) from position (the last update()'s by default) to target
+        position=self.position if position is None else position
+        frame=get_frame()
+        return [(target[0]-position[0])*frame.metres_per_deg_lat,(position[1]-target[1])*frame.metres_per_deg_long,
+                target[2]-position[2] if len(target)>2 and len(position)>2 else 0.0]
+
+    def errors(self,target,position=None):
+        # (horizontal, vertical) distance (m) to target
+        x,y,z=self.offset(target,position)
+        return math.hypot(x,y),abs(z)
+
+    def near(self,target,kind,position=None):
+        horizontal,vertical=self.errors(target,position)
+        tolerance=self.kinds[kind]
+        return horizontal<=tolerance[0] and vertical<=tolerance[1]
+
+    def accept(self,target,kind,now,position=None,key=None):
+        # whether the drone has been at target for the dwell of its kind, timed under key, which starts over
+        # when the target moves by more than the tolerances (a marker's estimate moving a little does not)
+        horizontal_tolerance,vertical_tolerance,dwell,early=self.kinds[kind]
+        x,y,z=self.offset(target,position)
+        horizontal,vertical=math.hypot(x,y),abs(z)
+        if early and position is None:
+            # the closing speeds, the velocity's components towards the target
+            closing=max((x*self.velocity[0]+y*self.velocity[1])/horizontal,0.0) if horizontal>0 else 0.0
+            vertical_closing=max(math.copysign(self.velocity[2],z),0.0)
+            horizontal_tolerance+=min(self.lead_time*closing,horizontal_tolerance)
+            vertical_tolerance+=min(self.lead_time*vertical_closing,vertical_tolerance)
+        for stale in [stale for stale,timer in self.timers.items() if now-timer[1]>self.forget or now<timer[1]]:
+            del self.timers[stale]
+        key=kind if key is None else key
+        timer=self.timers.get(key)
+        if timer is not None:
+            moved_horizontal,moved_vertical=self.errors(target,timer[2])
+            if moved_horizontal>self.kinds[kind][0] or moved_vertical>self.kinds[kind][1]:
+                timer=None
+        scale=1.0 if timer is None else self.hysteresis
+        if horizontal>horizontal_tolerance*scale or vertical>vertical_tolerance*scale:
+            self.timers.pop(key,None)
+            return False
+        if timer is None:
+            timer=self.timers[key]=[now,now,None]
+        timer[1]=now
+        timer[2]=list(target)
+        if now-timer[0]>=dwell:
+            del self.timers[key]
+            return True
+        return False
+
+    def waiting(self,key):
+        # whether the dwell timed under key has started
+        return key in self.timers
+
+    def reset(self):
+        self.timers.clear()
+
+
+def benchmark(manifest=None,missions=2,seed=0):
+    import os
+    import tempfile
+    import numpy as np
+    from Task_6_VD_2373_monte_carlo import random_manifest
+    from Task_6_VD_2373_simulator import Simulator,DRONE_HEIGHT
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifests=[('original',manifest)]
+        for mission in range(missions):
+            path=os.path.join(directory,'manifest_{}.csv'.format(mission))
+            manifests.append(('random {}'.format(mission),random_manifest(path,np.random.RandomState(seed+mission))))
+        print('{:10} {:10} {:>10} {:>8} {:>8} {:>13} {:>16}'.format('manifest','waypoints','status','sim s','hover s','hover/parcel s','failed pickups'))
+        for name,path in manifests:
+            for mode in ('stop','metric'):
+                sim=Simulator(path,seed=seed,params={'/setpoint_control/waypoint_acceptance':mode})
+                tick_nodes=sim.tick_nodes
+                hover=[0.0]
+
+                def tick():
+                    # airborne & slower than 0.2 m/s
+                    if np.linalg.norm(sim.plant.velocity)<0.2 and sim.plant.position[2]-sim.surface>DRONE_HEIGHT+0.2:
+                        hover[0]+=1/50.0
+                    tick_nodes()
+                sim.tick_nodes=tick
+                result=sim.run()
+                print('{:10} {:10} {:>10} {:8.1f} {:8.1f} {:13.1f} {:16d}'.format(name,mode,result['status'],result['sim_time'],hover[0],
+                      hover[0]/max(result['handled'],1),result['failed_pickups']))
+
+
+def main():
+    parser=argparse.ArgumentParser(description='Waypoint acceptance of the nodes')
+    parser.add_argument('--benchmark',action='store_true')
+    parser.add_argument('--manifest',default=None)
+    parser.add_argument('--missions',type=int,default=2,help='random manifests after the given one')
+    parser.add_argument('--seed',type=int,default=0)
+    args=parser.parse_args()
+    if args.benchmark:
+        benchmark(args.manifest,args.missions,args.seed)
+
+
+if __name__=="__main__":
+    main()
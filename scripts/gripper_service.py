@@ -1,10 +1,25 @@
 #! /usr/bin/env python
 
+import argparse
+import math
+import sys
+if __name__ == "__main__" and "--benchmark" in sys.argv:
+    # the benchmark runs the gripper on the rospy stand-in
+    import Task_6_VD_2373_ros_stand_in as ros_stand_in
+    ros_stand_in.install()
+import numpy as np
 import rospy
 from gazebo_msgs.msg import ModelStates
 from gazebo_ros_link_attacher.srv import Attach, AttachRequest, AttachResponse
 from vitarana_drone.srv import Gripper, GripperResponse, GripperRequest
-from std_msgs.msg import String
+from vitarana_drone.msg import gripper_state
+from std_msgs.msg import String, Bool
+
+# a parcel is pickable within PICK_DISTANCE (m) of the drone in x & y, over PICK_HEIGHT (m) above it
+PICK_DISTANCE = 0.1
+PICK_HEIGHT = 0.105
+# side of the grid cells the parcels are kept in (m)
+GRID_CELL = 1.0
 
 
 class edrone_gripper():
@@ -19,10 +34,24 @@ class edrone_gripper():
         self._attach_srv_d = rospy.ServiceProxy('/link_attacher_node/detach', Attach)
         self._attach_srv_d.wait_for_service()
         self.model_state_msg = ModelStates()
-        self.box_model_name_list = ['parcel_box_0', 'parcel_box_1', 'parcel_box_2', 'parcel_box_3', 'parcel_box_4', 'parcel_box_5', 'parcel_box_6', 'parcel_box_7', 'parcel_box_8', 'parcel_box_9', 'parcel_box_10', 'parcel_box_11', 'parcel_box_12', 'parcel_box_13', 'parcel_box_14', 'parcel_box_15', 'parcel_box_16', 'parcel_box_17']
-        self.drone_model_name = 'edrone'
+        # the parcels are the models named with ~box_prefix
+        self.box_prefix = rospy.get_param('~box_prefix', 'parcel_box_')
+        self.drone_model_name = rospy.get_param('~drone_model_name', 'edrone')
+        # (name list, name: index, parcel names, their indices), made again when the name list changes
+        self.models = ([], {}, [], np.zeros(0, np.int64))
+        # (poses, parcel positions, (cell x, cell y): parcels in it), made again from the poses of a new
+        # message when a check needs them
+        self.grid = (None, [], {})
+        # the box attached ('' for none), /edrone/gripper_request messages handled & the last state published
+        self.attached_box = ''
+        self.requests = 0
+        self.state = None
         rospy.Subscriber('/gazebo/model_states_throttle', ModelStates, self.model_state_callback)
         self.check_pub = rospy.Publisher('/edrone/gripper_check', String, queue_size=1)
+        # the nodes read the gripper from here & ask for it on /edrone/gripper_request (True: attach,
+        # False: detach) instead of calling the service
+        self.state_pub = rospy.Publisher('/edrone/gripper_state', gripper_state, queue_size=1, latch=True)
+        rospy.Subscriber('/edrone/gripper_request', Bool, self.request_callback)
         self.gripper_service = rospy.Service('/edrone/activate_gripper', Gripper, self.callback_service_on_request)
 
     # Destructor
@@ -30,28 +59,72 @@ class edrone_gripper():
         rospy.loginfo('\033[94m' + " >>> Gripper Del." + '\033[0m')
 
     def model_state_callback(self, msg):
+        if msg.name != self.models[0]:
+            self.index_models(msg.name)
         self.model_state_msg.name = msg.name
         self.model_state_msg.pose = msg.pose
         self.model_state_msg.twist = msg.twist
 
+    def index_models(self, names):
+        index = {name: i for i, name in enumerate(names)}
+        box_names = [name for name in names if name.startswith(self.box_prefix)]
+        self.models = (list(names), index, box_names, np.array([index[name] for name in box_names], np.int64))
+
+    def update_grid(self, poses, box_indices):
+        if poses is self.grid[0]:
+            return self.grid
+        positions = np.array([(poses[i].position.x, poses[i].position.y, poses[i].position.z) for i in box_indices], dtype=float).reshape(-1, 3)
+        # the parcels of each (x, y) cell, in the order of the list
+        cells = np.floor(positions[:, :2] / GRID_CELL).astype(np.int64)
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        keys, starts = np.unique(cells[order], axis=0, return_index=True)
+        order, ends = order.tolist(), starts[1:].tolist() + [len(order)]
+        grid = {(cx, cy): order[start:end] for (cx, cy), start, end in zip(keys.tolist(), starts.tolist(), ends)}
+        self.grid = (poses, positions.tolist(), grid)
+        return self.grid
+
     def callback_service_on_request(self, req):
+        result = self.grip(req.activate_gripper)
+        self.publish_state()
+        return GripperResponse(result)
+
+    def request_callback(self, msg):
+        self.requests += 1
+        self.grip(msg.data)
+        self.publish_state(True)
+
+    def grip(self, activate):
+        # attaches the pickable box or detaches it, True only when attached
         pickable, box_name = self.check()
-        rospy.loginfo('\033[94m' + " >>> Gripper Activate: {}".format(req.activate_gripper) + '\033[0m')
+        rospy.loginfo('\033[94m' + " >>> Gripper Activate: {}".format(activate) + '\033[0m')
         rospy.loginfo('\033[94m' + " >>> Gripper Flag Pickable: {}".format(str(pickable)) + '\033[0m')
         if pickable:
-            if(req.activate_gripper is True):
+            if(activate is True):
                 self.activate_gripper(box_name)
-                return GripperResponse(True)
+                self.attached_box = box_name
+                return True
             else:
                 self.deactivate_gripper(box_name)
-                return GripperResponse(False)
-        else:
-            return GripperResponse(False)
+                self.attached_box = ''
+                return False
+        elif activate is False and self.attached_box:
+            # a box swinging off the pick up distance is let go too
+            self.deactivate_gripper(self.attached_box)
+            self.attached_box = ''
+        return False
+
+    def publish_state(self, answer=False, check=None):
+        # /edrone/gripper_state when it changed, or as the answer to a request
+        pickable, box_name = check or self.check()
+        state = (self.attached_box, pickable, box_name if pickable else '')
+        if answer or self.state is None or state != self.state:
+            self.state = state
+            self.state_pub.publish(gripper_state(rospy.get_rostime(), self.attached_box, pickable, state[2], self.requests))
 
     def activate_gripper(self, model_name_2):
         rospy.loginfo("Attach request received")
         req = AttachRequest()
-        req.model_name_1 = 'edrone'
+        req.model_name_1 = self.drone_model_name
         req.link_name_1 = 'base_frame'
         req.model_name_2 = model_name_2
         req.link_name_2 = 'link'
@@ -60,53 +133,113 @@ class edrone_gripper():
     def deactivate_gripper(self, model_name_2):
         rospy.loginfo("Detach request received")
         req = AttachRequest()
-        req.model_name_1 = 'edrone'
+        req.model_name_1 = self.drone_model_name
         req.link_name_1 = 'base_frame'
         req.model_name_2 = model_name_2
         req.link_name_2 = 'link'
         self._attach_srv_d.call(req)
 
     def check(self):
-        try:
-            drone_index = self.model_state_msg.name.index(self.drone_model_name)
-            dr_0 = self.model_state_msg.pose[drone_index].position.x
-            dr_1 = self.model_state_msg.pose[drone_index].position.y
-            dr_2 = self.model_state_msg.pose[drone_index].position.z
-        except Exception as err:
-            drone_index = -1
-        pickable = False
-        box_name = "None"
-        if drone_index != -1:
-            for box_model_name in self.box_model_name_list:
-                try:
-                    box_index = self.model_state_msg.name.index(box_model_name)
-                    bx_0 = self.model_state_msg.pose[box_index].position.x
-                    bx_1 = self.model_state_msg.pose[box_index].position.y
-                    bx_2 = self.model_state_msg.pose[box_index].position.z
-                except Exception as err:
-                    box_index = -1
-                if(box_index != -1):
-                    if(abs(dr_0 - bx_0) < 0.1 and abs(dr_1 - bx_1) < 0.1 and (bx_2 - dr_2) > 0.105):
-                        pickable = True
-                        box_name = box_model_name
-                        break
-        return pickable, box_name
+        # the names, index & poses of one message, the callback may replace them meanwhile
+        names, index, box_names, box_indices = self.models
+        poses = self.model_state_msg.pose
+        drone_index = index.get(self.drone_model_name, -1)
+        if drone_index == -1 or drone_index >= len(poses) or len(poses) != len(names):
+            return False, "None"
+        drone = poses[drone_index].position
+        _, positions, grid = self.update_grid(poses, box_indices)
+        # the parcels of the cells within PICK_DISTANCE of the drone
+        near = set()
+        for x in set([drone.x - PICK_DISTANCE, drone.x + PICK_DISTANCE]):
+            for y in set([drone.y - PICK_DISTANCE, drone.y + PICK_DISTANCE]):
+                near.update(grid.get((int(math.floor(x / GRID_CELL)), int(math.floor(y / GRID_CELL))), ()))
+        # the first parcel of the list, as when the parcels were walked in order
+        for i in sorted(near):
+            bx_0, bx_1, bx_2 = positions[i]
+            if(abs(drone.x - bx_0) < PICK_DISTANCE and abs(drone.y - bx_1) < PICK_DISTANCE and (bx_2 - drone.z) > PICK_HEIGHT):
+                return True, box_names[i]
+        return False, "None"
 
     def publish_check(self, pickable_flag):
         self.check_pub.publish(str(pickable_flag))
 
 
+def benchmark(counts=(18, 500, 5000), calls=200, seed=0):
+    import time
+    from Task_6_VD_2373_ros_stand_in import Bus, activate
+    from geometry_msgs.msg import Pose
+
+    def list_walk(gripper, box_model_name_list):
+        # check() as it was, the parcel list walked with name.index() for each
+        msg = gripper.model_state_msg
+        drone_index = msg.name.index(gripper.drone_model_name)
+        dr = msg.pose[drone_index].position
+        for box_model_name in box_model_name_list:
+            try:
+                bx = msg.pose[msg.name.index(box_model_name)].position
+            except ValueError:
+                continue
+            if(abs(dr.x - bx.x) < 0.1 and abs(dr.y - bx.y) < 0.1 and (bx.z - dr.z) > 0.105):
+                return True, box_model_name
+        return False, "None"
+
+    def timed(function, *args):
+        start = time.perf_counter()
+        for _ in range(calls):
+            result = function(*args)
+        return (time.perf_counter() - start) / calls * 1e3, result
+
+    activate(Bus())
+    for name in ('/link_attacher_node/attach', '/link_attacher_node/detach'):
+        rospy.Service(name, Attach, lambda req: AttachResponse(True))
+    gripper = edrone_gripper()
+    rng = np.random.RandomState(seed)
+    print('{:>8} {:>14} {:>14} {:>16} {:>14}'.format('parcels', 'list walk ms', 'indexed ms', 'new poses ms', 'new names ms'))
+    for count in counts:
+        # parcels about 10 m apart, a building for every 4 parcels & the drone under the last parcel,
+        # which the list walk gets to last as it does when no parcel is under the drone
+        side = np.sqrt(count) * 10
+        names = ['building_{}'.format(i) for i in range(count // 4)] + ['parcel_box_{}'.format(i) for i in range(count)] + ['edrone']
+        rng.shuffle(names)
+        msg = ModelStates(name=names, pose=[Pose() for _ in names])
+        for pose in msg.pose:
+            pose.position.x, pose.position.y, pose.position.z = rng.uniform(0, side), rng.uniform(0, side), rng.uniform(0, 10)
+        box = msg.pose[names.index('parcel_box_{}'.format(count - 1))].position
+        drone = msg.pose[names.index('edrone')].position
+        drone.x, drone.y, drone.z = box.x + 0.05, box.y - 0.05, box.z - 0.2
+        gripper.model_state_callback(msg)
+        walk, expected = timed(list_walk, gripper, ['parcel_box_{}'.format(i) for i in range(count)])
+        indexed, result = timed(gripper.check)
+        assert result == expected == (True, 'parcel_box_{}'.format(count - 1)), (result, expected)
+
+        def new_poses():
+            gripper.model_state_callback(ModelStates(name=msg.name, pose=list(msg.pose)))
+            return gripper.check()
+
+        def new_names():
+            gripper.models = ([], {}, [], np.zeros(0, np.int64))
+            return new_poses()
+        print('{:8d} {:14.3f} {:14.3f} {:16.3f} {:14.3f}'.format(count, walk, indexed, timed(new_poses)[0], timed(new_names)[0]))
+
+
 def main():
     eDrone_gripper = edrone_gripper()
     r = rospy.Rate(10)
     while not rospy.is_shutdown():
         try:
-            pickable, _ = eDrone_gripper.check()
-            eDrone_gripper.publish_check(pickable)
+            check = eDrone_gripper.check()
+            eDrone_gripper.publish_check(check[0])
+            eDrone_gripper.publish_state(check=check)
             r.sleep()
         except rospy.ROSInterruptException:
             rospy.logerr("Shtdown Req")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Gripper service of the drone')
+    parser.add_argument('--benchmark', action='store_true', help='check() latency for 18, 500 & 5000 parcels instead of running the node')
+    args = parser.parse_known_args()[0]
+    if args.benchmark:
+        benchmark()
+    else:
+        main()